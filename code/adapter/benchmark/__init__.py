@@ -0,0 +1 @@
+"""The benchmark of the recommender on synthetic data of a given scale."""
@@ -0,0 +1,46 @@
+"""The constants for the benchmark"""
+
+MAX_LENGTH_NAME = 40
+"""The maximum length of the name of the users and items."""
+
+MAX_LENGTH_VALUES = 200
+"""The maximum length of the comma separated attribute/group values."""
+
+DEFAULT_DENSITY = 0.05
+"""The default ratio of the user-item pairs that interact"""
+
+DEFAULT_RULE_COUNT = 2
+"""The default number of item similarity rules (item attributes)"""
+
+DEFAULT_CLUSTER_SET_COUNT = 1
+"""The default number of user cluster sets (user groups)"""
+
+DEFAULT_BIAS_COUNT = 2
+"""The default number of biases, alternately for items and users"""
+
+ATTRIBUTE_VALUE_COUNT = 10
+"""The number of different values of each item attribute"""
+
+GROUP_COUNT = 5
+"""The number of groups in each user cluster set"""
+
+POPULAR_LIMIT = 2
+"""The minimal number of interactions for a user/item to be biased"""
+
+SAMPLE_SIZE = 50
+"""The default number of the timed predictions and recommendation lists"""
+
+RECOMMENDATION_COUNT = 10
+"""The length of the timed recommendation lists"""
+
+TEST_RATIO = 0.2
+"""The ratio of the interactions selected to the evaluation pairs"""
+
+SUCCESS_LIMIT = 0.5
+"""The limit above which the pair is considered successful."""
+
+EXPECTED_EXPECTANCY_INTERACTS = 1.0
+"""The expected expectancy for the interacting pairs."""
+
+DEFAULT_RANDOM_SEED = 1
+"""The seed of the data generator, the same seed gives the same data"""
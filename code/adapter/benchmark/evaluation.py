@@ -0,0 +1,18 @@
+"""The evaluator of the benchmark recommender"""
+
+from unresyst.recommender.evaluation import BaseEvaluator
+from unresyst.recommender.metrics import rmse, precision_recall
+
+from models import InteractionEvalPair
+
+class BenchmarkEvaluator(BaseEvaluator):
+    """The evaluator of the benchmark recommender"""
+
+    EvaluationPairModel = InteractionEvalPair
+    """The model - pairs"""
+
+    prediction_metric = rmse
+    """The metric"""
+
+    recommendation_metric = precision_recall
+    """The other metric"""
@@ -0,0 +1,102 @@
+"""The generator of the synthetic benchmark data."""
+
+import random
+
+from unresyst.models.bulk import BulkInserter
+
+from models import User, Item, Interaction, InteractionEvalPair
+from constants import *
+
+def _get_values(rng, count, value_count, prefix):
+    """Get the comma separated random values.
+
+    @type rng: random.Random
+    @param rng: the random generator
+
+    @type count: int
+    @param count: the number of values
+
+    @type value_count: int
+    @param value_count: the number of different values at each position
+
+    @type prefix: str
+    @param prefix: the prefix of each value
+
+    @rtype: str
+    @return: the values separated by commas
+    """
+    return ','.join(['%s%d' % (prefix, rng.randrange(value_count)) \
+                        for i in xrange(count)])
+
+
+def generate_data(user_count, item_count, density=DEFAULT_DENSITY,
+        rule_count=DEFAULT_RULE_COUNT, cluster_set_count=DEFAULT_CLUSTER_SET_COUNT,
+        seed=DEFAULT_RANDOM_SEED):
+    """Replace the benchmark data by new random data.
+
+    Each user interacts with a random number of items, on average
+    density * item_count. The items have rule_count attributes, each with
+    ATTRIBUTE_VALUE_COUNT values, the users have cluster_set_count groups, each
+    of GROUP_COUNT values.
+
+    @type user_count: int
+    @param user_count: the number of users
+
+    @type item_count: int
+    @param item_count: the number of items
+
+    @type density: float
+    @param density: the ratio of the user-item pairs that interact
+
+    @type rule_count: int
+    @param rule_count: the number of the item attributes
+
+    @type cluster_set_count: int
+    @param cluster_set_count: the number of the user groups
+
+    @type seed: int
+    @param seed: the seed of the random generator
+    """
+    rng = random.Random(seed)
+
+    # delete the old data
+    InteractionEvalPair.objects.all().delete()
+    Interaction.objects.all().delete()
+    User.objects.all().delete()
+    Item.objects.all().delete()
+
+    inserter = BulkInserter(model=User)
+
+    for i in xrange(user_count):
+        inserter.add(User(
+            name='user_%d' % i,
+            groups=_get_values(rng, cluster_set_count, GROUP_COUNT, 'group')))
+
+    inserter.flush()
+
+    inserter = BulkInserter(model=Item)
+
+    for i in xrange(item_count):
+        inserter.add(Item(
+            name='item_%d' % i,
+            attributes=_get_values(rng, rule_count, ATTRIBUTE_VALUE_COUNT, 'value')))
+
+    inserter.flush()
+
+    user_ids = list(User.objects.order_by('pk').values_list('pk', flat=True))
+    item_ids = list(Item.objects.order_by('pk').values_list('pk', flat=True))
+
+    # the maximal number of interactions of a user, the average is the half
+    max_count = min(item_count, int(round(2 * density * item_count)))
+
+    inserter = BulkInserter(model=Interaction)
+
+    for user_id in user_ids:
+
+        for item_id in rng.sample(item_ids, rng.randint(0, max_count)):
+            inserter.add(Interaction(user_id=user_id, item_id=item_id))
+
+    inserter.flush()
+
+    print "    %d users, %d items and %d interactions generated" % \
+        (user_count, item_count, inserter.count)
@@ -0,0 +1 @@
+"""The benchmark commands."""
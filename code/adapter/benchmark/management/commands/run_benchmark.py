@@ -0,0 +1,70 @@
+"""The run_benchmark command: measure the recommender on synthetic data
+at several scales and write the results to a JSON file.
+
+Usage:
+    ./manage.py run_benchmark 100x200 1000x2000 --output=results.json --settings=settings_benchmark
+
+The benchmark deletes the data of the benchmark application, settings_benchmark
+uses a separate sqlite database.
+"""
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmark.runner import Scale, run_benchmark, write_results
+from benchmark.constants import *
+
+class Command(BaseCommand):
+    """The command running the benchmark"""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--density', type='float', default=DEFAULT_DENSITY,
+            help='The ratio of the user-item pairs that interact'),
+        make_option('--rules', type='int', default=DEFAULT_RULE_COUNT,
+            help='The number of the item similarity rules'),
+        make_option('--cluster-sets', type='int', default=DEFAULT_CLUSTER_SET_COUNT,
+            dest='cluster_sets', help='The number of the user cluster sets'),
+        make_option('--biases', type='int', default=DEFAULT_BIAS_COUNT,
+            help='The number of the biases'),
+        make_option('--samples', type='int', default=SAMPLE_SIZE,
+            help='The number of the timed predictions and recommendation lists'),
+        make_option('--seed', type='int', default=DEFAULT_RANDOM_SEED,
+            help='The seed of the data generator'),
+        make_option('--output', default='benchmark_results.json',
+            help='The file the results are written to'),
+    )
+
+    help = 'Measures the recommender on synthetic data of the given scales.'
+
+    args = '<users>x<items> [<users>x<items> ...]'
+
+    def handle(self, *args, **options):
+        """Parse the scales, run the benchmark and write the results"""
+
+        if not args:
+            raise CommandError("Give at least one scale, e.g. 100x200.")
+
+        scales = []
+
+        for arg in args:
+            try:
+                user_count, item_count = [int(n) for n in arg.split('x')]
+            except ValueError:
+                raise CommandError("Invalid scale %s, expected <users>x<items>." % arg)
+
+            scales.append(Scale(
+                user_count=user_count,
+                item_count=item_count,
+                density=options['density'],
+                rule_count=options['rules'],
+                cluster_set_count=options['cluster_sets'],
+                bias_count=options['biases']))
+
+        results = run_benchmark(scales,
+            sample_size=options['samples'],
+            seed=options['seed'])
+
+        write_results(results, options['output'])
+
+        print "Results written to %s" % options['output']
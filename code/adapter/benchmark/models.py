@@ -0,0 +1,139 @@
+"""The models of the synthetic benchmark data.
+
+The attributes of the items and the groups of the users are kept as comma
+separated values, so that the number of the rules and cluster sets
+can be chosen when generating the data.
+"""
+
+import random
+
+from django.db import models
+
+from unresyst.models import BaseEvaluationPair
+from unresyst.models.bulk import BulkInserter
+from unresyst.constants import DEFAULT_QUERY_CHUNK_SIZE
+
+from constants import *
+
+class User(models.Model):
+    """A synthetic user"""
+
+    name = models.CharField(max_length=MAX_LENGTH_NAME)
+    """The name of the user"""
+
+    groups = models.CharField(max_length=MAX_LENGTH_VALUES, default='')
+    """The comma separated groups of the user, one for each cluster set"""
+
+    def get_group(self, i):
+        """Get the group of the user in the i-th cluster set.
+
+        @type i: int
+        @param i: the number of the cluster set
+
+        @rtype: str
+        @return: the group name
+        """
+        return self.groups.split(',')[i]
+
+    def __unicode__(self):
+        """Return a printable representation of the instance"""
+        return self.name
+
+
+class Item(models.Model):
+    """A synthetic item to recommend"""
+
+    name = models.CharField(max_length=MAX_LENGTH_NAME)
+    """The name of the item"""
+
+    attributes = models.CharField(max_length=MAX_LENGTH_VALUES, default='')
+    """The comma separated attribute values of the item, one for each
+    similarity rule"""
+
+    def get_attribute(self, i):
+        """Get the value of the i-th attribute.
+
+        @type i: int
+        @param i: the number of the attribute
+
+        @rtype: str
+        @return: the attribute value
+        """
+        return self.attributes.split(',')[i]
+
+    def __unicode__(self):
+        """Return a printable representation of the instance"""
+        return self.name
+
+
+class Interaction(models.Model):
+    """The user has interacted with the item, the predicted relationship"""
+
+    user = models.ForeignKey('User')
+    """The user"""
+
+    item = models.ForeignKey('Item')
+    """The item"""
+
+    class Meta:
+        unique_together = ('user', 'item')
+
+    def __unicode__(self):
+        """Return a printable representation of the instance"""
+        return u"%s - %s" % (self.user, self.item)
+
+
+class InteractionEvalPair(BaseEvaluationPair):
+    """A removed interaction, for evaluating the recommender"""
+
+    subj = models.ForeignKey('benchmark.User')
+    """The subject"""
+
+    obj = models.ForeignKey('benchmark.Item')
+    """The object"""
+
+    test_ratio = TEST_RATIO
+    """The ratio of the interactions to select to test pairs"""
+
+    class Meta:
+        app_label = 'benchmark'
+
+    @classmethod
+    def select(cls, i=0):
+        """See the base class for the documentation.
+
+        A random sample of the interactions is taken, the iteration number
+        is the seed.
+        """
+        cls.objects.all().delete()
+
+        interactions = list(Interaction.objects.order_by('pk')\
+                            .values_list('pk', 'user', 'item'))
+
+        test_count = int(cls.test_ratio * len(interactions))
+
+        test_interactions = random.Random(i).sample(interactions, test_count)
+
+        inserter = BulkInserter(model=cls)
+
+        for pk, user_id, item_id in test_interactions:
+            inserter.add(cls(
+                subj_id=user_id,
+                obj_id=item_id,
+                expected_expectancy=EXPECTED_EXPECTANCY_INTERACTS))
+
+        inserter.flush()
+
+        # remove them from the training data
+        test_ids = [pk for pk, user_id, item_id in test_interactions]
+
+        for start in xrange(0, test_count, DEFAULT_QUERY_CHUNK_SIZE):
+            Interaction.objects\
+                .filter(pk__in=test_ids[start:start + DEFAULT_QUERY_CHUNK_SIZE])\
+                .delete()
+
+        print "    %d test pairs selected from %d interactions" % (test_count, len(interactions))
+
+    def get_success(self):
+        """See the base class for the documentation."""
+        return self.obtained_expectancy > SUCCESS_LIMIT
@@ -0,0 +1,170 @@
+"""The recommender for the benchmark data.
+
+The number of the rules, cluster sets and biases depends on the generated
+data, so the recommender class is created by a function.
+"""
+from django.db.models import Count
+
+from unresyst import *
+from unresyst.algorithm import *
+from unresyst.compilator import *
+from unresyst.aggregator import *
+from unresyst.combinator import *
+
+from models import *
+from constants import *
+
+def _interactions_generator():
+    """A generator for the user interacts with item relationship"""
+    for interaction in Interaction.objects.select_related('user', 'item').iterator():
+        yield (interaction.user, interaction.item)
+
+def _get_attribute_rule(i):
+    """Get the rule: items with the same value of the i-th attribute are
+    similar.
+
+    @type i: int
+    @param i: the number of the attribute
+
+    @rtype: ObjectSimilarityRule
+    """
+    return ObjectSimilarityRule(
+        name="Items with the same attribute %d." % i,
+
+        condition=lambda o1, o2:
+            o1.get_attribute(i) == o2.get_attribute(i),
+
+        is_positive=True,
+
+        weight=0.5,
+
+        confidence=lambda o1, o2: 1,
+
+        description="Items %(object1)s and %(object2)s have the same " +
+            "attribute %d." % i
+    )
+
+def _get_group_cluster_set(i):
+    """Get the cluster set of the users by the i-th group.
+
+    @type i: int
+    @param i: the number of the group
+
+    @rtype: SubjectClusterSet
+    """
+    return SubjectClusterSet(
+        name="User group %d." % i,
+
+        weight=0.4,
+
+        filter_entities=User.objects.all(),
+
+        get_cluster_confidence_pairs=lambda user: ((user.get_group(i), 1),),
+
+        description="%(subject)s belongs to %(cluster)s."
+    )
+
+def _get_bias(i):
+    """Get the i-th bias. The even biases are for the popular items,
+    the odd ones for the active users, the limit of the interactions grows
+    with i.
+
+    @type i: int
+    @param i: the number of the bias
+
+    @rtype: ObjectBias or SubjectBias
+    """
+    limit = POPULAR_LIMIT + i / 2
+
+    # the confidence is 1 for twice the limit
+    confidence = lambda entity: min(1.0, float(entity.interaction_count) / (2 * limit))
+
+    if i % 2 == 0:
+        return ObjectBias(
+            name="Items with at least %d interactions." % limit,
+
+            description="Item %(object)s is popular.",
+
+            weight=0.3,
+
+            is_positive=True,
+
+            generator=lambda: Item.objects\
+                .annotate(interaction_count=Count('interaction'))\
+                .filter(interaction_count__gte=limit),
+
+            confidence=confidence
+        )
+
+    return SubjectBias(
+        name="Users with at least %d interactions." % limit,
+
+        description="User %(subject)s interacts with many items.",
+
+        weight=0.3,
+
+        is_positive=True,
+
+        generator=lambda: User.objects\
+            .annotate(interaction_count=Count('interaction'))\
+            .filter(interaction_count__gte=limit),
+
+        confidence=confidence
+    )
+
+def create_recommender(rule_count=DEFAULT_RULE_COUNT,
+        cluster_set_count=DEFAULT_CLUSTER_SET_COUNT, bias_count=DEFAULT_BIAS_COUNT):
+    """Create the recommender class for the benchmark data.
+
+    @type rule_count: int
+    @param rule_count: the number of the item similarity rules, at most
+        the number of the generated attributes
+
+    @type cluster_set_count: int
+    @param cluster_set_count: the number of the user cluster sets, at most
+        the number of the generated groups
+
+    @type bias_count: int
+    @param bias_count: the number of the biases
+
+    @rtype: Recommender subclass
+    @return: the class BenchmarkRecommender
+    """
+    attrs = {
+        'name': "Benchmark Recommender",
+
+        '__module__': __name__,
+
+        'subjects': User.objects,
+
+        'objects': Item.objects,
+
+        'predicted_relationship': PredictedRelationship(
+            name="User interacts with item.",
+            condition=None,
+            description="""User %(subject)s interacts with %(object)s.""",
+            generator=_interactions_generator
+        ),
+
+        'rules': tuple(_get_attribute_rule(i) for i in xrange(rule_count)),
+
+        'cluster_sets': tuple(_get_group_cluster_set(i) for i in xrange(cluster_set_count)),
+
+        'biases': tuple(_get_bias(i) for i in xrange(bias_count)),
+
+        'random_recommendation_description': "Recommending a random item.",
+
+        'verbose_build': False,
+
+        'algorithm': AggregatingAlgorithm(
+                inner_algorithm=CompilingAlgorithm(
+                    inner_algorithm=SimpleAlgorithm(
+                        inner_algorithm=None
+                    ),
+                    compilator=CombiningCompilator(combinator=AverageCombinator())
+                ),
+                aggregator=CombiningAggregator(combinator=AverageCombinator())
+            ),
+    }
+
+    return type('BenchmarkRecommender', (Recommender,), attrs)
@@ -0,0 +1,199 @@
+"""Running the benchmark: for each scale the data are generated, the
+recommender is built and the recommend phase methods and evaluators
+are timed. The results are written to a JSON file.
+
+Usage:
+
+results = run_benchmark([Scale(100, 200), Scale(1000, 2000)])
+write_results(results, 'results.json')
+"""
+
+import time
+import json
+import random
+
+from django.conf import settings
+
+from generator import generate_data
+from recommender import create_recommender
+from evaluation import BenchmarkEvaluator
+from models import User, Item, InteractionEvalPair
+from constants import *
+
+class Scale(object):
+    """The parameters of the generated data and of the recommender."""
+
+    def __init__(self, user_count, item_count, density=DEFAULT_DENSITY,
+            rule_count=DEFAULT_RULE_COUNT, cluster_set_count=DEFAULT_CLUSTER_SET_COUNT,
+            bias_count=DEFAULT_BIAS_COUNT):
+        """The initializer"""
+
+        self.user_count = user_count
+        """The number of users"""
+
+        self.item_count = item_count
+        """The number of items"""
+
+        self.density = density
+        """The ratio of the user-item pairs that interact"""
+
+        self.rule_count = rule_count
+        """The number of the item similarity rules"""
+
+        self.cluster_set_count = cluster_set_count
+        """The number of the user cluster sets"""
+
+        self.bias_count = bias_count
+        """The number of the biases"""
+
+    def as_dict(self):
+        """Get the parameters as a dictionary.
+
+        @rtype: dict str: value
+        """
+        return dict(self.__dict__)
+
+
+def _time_calls(function, arguments):
+    """Call the function for each of the arguments and measure the times.
+
+    @type function: callable
+    @param function: the timed function
+
+    @type arguments: list of tuples
+    @param arguments: the positional arguments of the calls
+
+    @rtype: dict
+    @return: the number of calls, the total, mean, median and maximal time
+        in seconds
+    """
+    times = []
+
+    for args in arguments:
+        start = time.time()
+        function(*args)
+        times.append(time.time() - start)
+
+    if not times:
+        return {'count': 0}
+
+    times.sort()
+
+    return {
+        'count': len(times),
+        'total': sum(times),
+        'mean': sum(times) / len(times),
+        'median': times[len(times) / 2],
+        'max': times[-1],
+    }
+
+
+def _time_call(function, *args):
+    """Call the function once and measure the time.
+
+    @rtype: pair (float, return value)
+    @return: the time in seconds and the value returned by the function
+    """
+    start = time.time()
+    ret = function(*args)
+
+    return (time.time() - start, ret)
+
+
+def run_scale(scale, sample_size=SAMPLE_SIZE, seed=DEFAULT_RANDOM_SEED):
+    """Generate the data of the given scale and measure the recommender.
+
+    @type scale: Scale
+    @param scale: the parameters of the data and of the recommender
+
+    @type sample_size: int
+    @param sample_size: the number of the timed predictions and recommendation
+        lists
+
+    @type seed: int
+    @param seed: the seed of the data generator and of the samples
+
+    @rtype: dict
+    @return: the parameters of the scale and the measured values, the build
+        report under 'build'
+    """
+    print "Benchmarking %d users, %d items..." % (scale.user_count, scale.item_count)
+
+    ret = scale.as_dict()
+
+    ret['generate_time'], ignore = _time_call(generate_data,
+        scale.user_count, scale.item_count, scale.density, scale.rule_count,
+        scale.cluster_set_count, seed)
+
+    # the test pairs are removed from the interactions before the build
+    InteractionEvalPair.select(seed)
+
+    recommender = create_recommender(
+        rule_count=scale.rule_count,
+        cluster_set_count=scale.cluster_set_count,
+        bias_count=scale.bias_count)
+
+    ret['build'] = recommender.build()
+
+    # the random samples of the subjects and objects
+    rng = random.Random(seed)
+
+    users = list(User.objects.all())
+    items = list(Item.objects.all())
+
+    pairs = [(rng.choice(users), rng.choice(items)) for i in xrange(sample_size)]
+    subjects = [(rng.choice(users), RECOMMENDATION_COUNT) for i in xrange(sample_size)]
+
+    ret['predict_relationship'] = _time_calls(recommender.predict_relationship, pairs)
+
+    ret['predict_relationships'], ignore = _time_call(
+        recommender.predict_relationships, pairs)
+
+    ret['get_recommendations'] = _time_calls(recommender.get_recommendations, subjects)
+
+    # the evaluators
+    ret['evaluate_predictions'], ret['rmse'] = _time_call(
+        BenchmarkEvaluator.evaluate_predictions, recommender)
+
+    ret['evaluate_recommendations'], (ret['precision'], ret['recall']) = _time_call(
+        BenchmarkEvaluator.evaluate_recommendations, recommender, RECOMMENDATION_COUNT)
+
+    return ret
+
+
+def run_benchmark(scales, sample_size=SAMPLE_SIZE, seed=DEFAULT_RANDOM_SEED):
+    """Run the benchmark for all the scales.
+
+    @type scales: list of Scale
+    @param scales: the scales to measure, in the order
+
+    @type sample_size: int
+    @param sample_size: see run_scale
+
+    @type seed: int
+    @param seed: see run_scale
+
+    @rtype: dict
+    @return: the time of the run, the database engine and the list of the
+        results of run_scale under 'scales'
+    """
+    return {
+        'started': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'database': settings.DATABASES['default']['ENGINE'],
+        'sample_size': sample_size,
+        'seed': seed,
+        'scales': [run_scale(scale, sample_size, seed) for scale in scales],
+    }
+
+
+def write_results(results, filename):
+    """Write the results of run_benchmark to a JSON file.
+
+    @type results: dict
+    @param results: the results
+
+    @type filename: str
+    @param filename: the full path to the file
+    """
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,43 @@
+"""Tests for the benchmark"""
+
+import tempfile
+import json
+
+from nose.tools import eq_
+from django.test import TestCase
+
+
+from runner import Scale, run_benchmark, write_results
+from models import User, Item, Interaction, InteractionEvalPair
+
+class TestBenchmark(TestCase):
+    """Run the benchmark on a tiny scale"""
+
+    def test_run_benchmark(self):
+        """Test the results of the whole run are written"""
+
+        results = run_benchmark([Scale(user_count=6, item_count=8, density=0.4)],
+                    sample_size=3)
+
+        eq_(User.objects.count(), 6)
+        eq_(Item.objects.count(), 8)
+
+        # the test pairs were removed from the interactions
+        for pair in InteractionEvalPair.objects.all():
+            assert not Interaction.objects.filter(user=pair.subj, item=pair.obj).exists()
+
+        scale = results['scales'][0]
+
+        eq_(scale['user_count'], 6)
+        eq_(scale['predict_relationship']['count'], 3)
+        eq_(scale['get_recommendations']['count'], 3)
+        assert scale['build']['queries'] > 0
+
+        f = tempfile.NamedTemporaryFile(suffix='.json')
+
+        write_results(results, f.name)
+
+        eq_(json.load(open(f.name)), results)
+
+        f.close()
+
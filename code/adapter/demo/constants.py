@@ -5,3 +5,9 @@ MAX_LENGTH_NAME = 40
 
 MAX_LENGTH_IMAGE_PATH = 50
 """The maximum length of the path to image"""
+
+EVALUATION_FOLD_COUNT = 2
+"""The number of the folds the liked shoes are divided to for evaluation"""
+
+EXPECTED_EXPECTANCY_LIKED = 1.0
+"""The expected expectancy of the liked shoes in the test pairs"""
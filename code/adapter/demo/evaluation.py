@@ -0,0 +1,18 @@
+"""The evaluator of the shoe recommenders"""
+
+from unresyst.recommender.evaluation import BaseEvaluator
+from unresyst.recommender.metrics import rmse, precision_recall
+
+from models import ShoeEvalPair
+
+class ShoeRecommenderEvaluator(BaseEvaluator):
+    """The evaluator of the shoe recommenders"""
+
+    EvaluationPairModel = ShoeEvalPair
+    """The model - pairs"""
+
+    prediction_metric = rmse
+    """The metric"""
+
+    recommendation_metric = precision_recall
+    """The other metric"""
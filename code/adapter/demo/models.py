@@ -2,6 +2,9 @@
 
 from django.db import models
 
+from unresyst.constants import UNCERTAIN_PREDICTION_VALUE
+from unresyst.models.evaluation import BaseEvaluationPair
+
 from constants import *
 
 class ShoePair(models.Model):
@@ -125,4 +128,53 @@ class City(models.Model):
     
     def __unicode__(self):
         """Return a printable representation of the instance"""
-        return self.name    
+        return self.name
+
+
+class ShoeEvalPair(BaseEvaluationPair):
+    """A removed liked shoe pair, for evaluating the recommender"""
+
+    subj = models.ForeignKey('User')
+    """The subject"""
+
+    obj = models.ForeignKey('ShoePair')
+    """The object"""
+
+    fold_count = EVALUATION_FOLD_COUNT
+    """The number of the folds, each liked shoe pair is tested in one"""
+
+    class Meta:
+        app_label = 'demo'
+
+    @classmethod
+    def select(cls, i=0):
+        """See the base class for the documentation.
+
+        The liked shoe pairs are ordered, the i-th fold takes every
+        fold_count-th of them, starting with the i-th.
+        """
+        cls.objects.all().delete()
+
+        Likes = User.likes_shoes.through
+
+        likes = list(Likes.objects.order_by('pk')\
+                    .values_list('pk', 'user', 'shoepair'))
+
+        test_likes = likes[i % cls.fold_count::cls.fold_count]
+
+        for pk, user_id, shoe_pair_id in test_likes:
+            cls.objects.create(
+                subj_id=user_id,
+                obj_id=shoe_pair_id,
+                expected_expectancy=EXPECTED_EXPECTANCY_LIKED)
+
+        # remove them from the training data
+        Likes.objects.filter(pk__in=[pk for pk, user_id, shoe_pair_id in test_likes])\
+            .delete()
+
+        print "    %d test pairs selected from %d liked shoe pairs" % \
+            (len(test_likes), len(likes))
+
+    def get_success(self):
+        """See the base class for the documentation."""
+        return self.obtained_expectancy > UNCERTAIN_PREDICTION_VALUE
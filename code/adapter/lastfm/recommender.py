@@ -35,21 +35,15 @@ def _get_artist_tag_pairs(artist):
         for at in artist_tags]
 
 def _tag_similarity_generator():
-    """Generate the pairs that share some tags"""
-    
-    # the artists that were tagged at least once
-    qs_tagged_artists = Artist.objects.filter(artisttag__isnull=False).distinct()
-    count = qs_tagged_artists.count()
-    
-    for a1, count in zip( qs_tagged_artists[1:].iterator(), \
-            range(1, count)):
-
-        # obtain only first count entities
-        for a2 in qs_tagged_artists[:count].iterator():
-            if a1.artisttag_set.filter(
-                    tag__id__in=a2.artisttag_set.values_list('tag__id')
-                ).distinct().count() > 45:
-                yield (a1, a2)  
+    """Generate the pairs that share more than 45 tags"""
+
+    # numpy and scipy are needed only here
+    from unresyst.recommender.similarity import shared_attribute_generator
+
+    return shared_attribute_generator(
+        manager=Artist.objects,
+        entity_attributes=ArtistTag.objects.values_list('artist', 'tag').iterator(),
+        threshold=45)
 
 def _gender_specific_generator():
     """Generate pairs for the gender-specific tag rule"""
@@ -98,6 +98,7 @@ INSTALLED_APPS = (
     'unresyst',
     'flixster',
     'travel',
+    'benchmark',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
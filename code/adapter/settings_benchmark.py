@@ -0,0 +1,13 @@
+# Django settings for running the benchmark on a separate sqlite database.
+# Create it by: ./manage.py syncdb --settings=settings_benchmark
+
+import os.path
+
+from settings import *
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(os.path.dirname(__file__), 'benchmark.db'),
+    }
+}
@@ -1,8 +1,14 @@
 """The main class of the abstractor package - Abstractor"""
 
+from django.db.models import Q
+
 from base import BaseAbstractor
 from unresyst.models.common import SubjectObject, Recommender as RecommenderModel
+from unresyst.models.abstractor import RelationshipInstance, ExplicitRuleInstance, \
+    ClusterMember
+from unresyst.models.bulk import BulkInserter
 from unresyst.constants import *
+from unresyst.profiler import build_profiler
 
 class BasicAbstractor(BaseAbstractor):
     """The basic implementation of the Abstractor class"""
@@ -13,6 +19,8 @@ class BasicAbstractor(BaseAbstractor):
         
         # if subjects are the same as objects, use the "so" entity type 
         so = ENTITY_TYPE_SUBJECTOBJECT if subjects == objects else ""
+        
+        inserter = BulkInserter(model=SubjectObject, batch_size=self.batch_size)
 
         # create them again. subjects:
         for subj in subjects.iterator():
@@ -26,9 +34,11 @@ class BasicAbstractor(BaseAbstractor):
             )
             
             # save it
-            subob.save()
+            inserter.add(subob)
+        
+        inserter.flush()
         
-        print "    %d subjects created" % subjects.count()
+        build_profiler.message("    %d subjects created" % subjects.count())
             
         # for recommenders where subjects==objects, that's it
         if so:
@@ -46,9 +56,11 @@ class BasicAbstractor(BaseAbstractor):
             )
             
             # save it
-            subob.save()
+            inserter.add(subob)
+        
+        inserter.flush()
             
-        print "    %d objects created" % objects.count()
+        build_profiler.message("    %d objects created" % objects.count())
 
 
     
@@ -56,7 +68,7 @@ class BasicAbstractor(BaseAbstractor):
         """See the base class for documentation."""        
         
         # evaluate the relationship for all possible subjectobjects
-        predicted_relationship.evaluate()
+        predicted_relationship.evaluate(batch_size=self.batch_size)
        
     
     def create_relationship_instances(self, relationships):
@@ -64,7 +76,7 @@ class BasicAbstractor(BaseAbstractor):
 
         # evaluate all relationships
         for rel in relationships:
-            rel.evaluate()
+            rel.evaluate(batch_size=self.batch_size)
 
     
     def create_rule_instances(self, rules):
@@ -72,20 +84,115 @@ class BasicAbstractor(BaseAbstractor):
         
         # eveluate all rules
         for rule in rules:
-            rule.evaluate()
+            rule.evaluate(batch_size=self.batch_size)
 
     def create_clusters(self, cluster_sets):
         """See the base class for documentation."""
         
         # evaluate all cluster sets
         for cluster_set in cluster_sets:
-            cluster_set.evaluate()          
+            cluster_set.evaluate(batch_size=self.batch_size)          
             
     def create_biases(self, biases):
         """See the base class for documentation."""                      
         
         # evaluate the biases
         for bias in biases:
-            bias.evaluate()
+            bias.evaluate(batch_size=self.batch_size)
             
+    
+    # Update phase:
+    # 
+
+    def add_entity(self, recommender, recommender_model, entity, entity_type):
+        """See the base class for documentation."""
+        
+        # create the domain neutral entity
+        dn_entity = SubjectObject.objects.create(
+            id_in_specific=entity.pk,
+            name=entity.__unicode__()[:MAX_LENGTH_NAME],
+            entity_type=entity_type,
+            recommender=recommender_model
+        )
+        
+        bias_ids = self._evaluate_entity(recommender, dn_entity, entity)
+        
+        return (dn_entity, bias_ids)
+        
+    def update_entity(self, recommender, dn_entity, entity):
+        """See the base class for documentation."""
+        
+        self._remove_instances(dn_entity)
+        
+        dn_entity.name = entity.__unicode__()[:MAX_LENGTH_NAME]
+        dn_entity.save()
+        
+        return self._evaluate_entity(recommender, dn_entity, entity)
+    
+    def remove_entity(self, recommender, dn_entity):
+        """See the base class for documentation."""
+        
+        recommender_model = dn_entity.recommender
+        
+        self._remove_instances(dn_entity)
+        
+        dn_entity.delete()
+        
+        bias_ids = set()
+        
+        # the biases of the other entities can depend on it
+        for bias in recommender.biases:
+            bias_ids.update(bias.update(
+                recommender_model=recommender_model, 
+                batch_size=self.batch_size))
+        
+        return bias_ids
+    
+    def _evaluate_entity(self, recommender, dn_entity, entity):
+        """Create the instances of the entity for the predicted relationship,
+        relationships, rules and cluster sets, evaluate all biases again.
+        
+        @rtype: set of int
+        @return: the ids of the entities whose bias instances have changed
+        """
+        
+        # the instances of the pairs with the entity
+        for rel in (recommender.predicted_relationship, ) + \
+                tuple(recommender.relationships) + tuple(recommender.rules):
+            
+            i = rel.evaluate_entity(
+                    dn_entity=dn_entity, 
+                    ds_entity=entity, 
+                    batch_size=self.batch_size)
             
+            build_profiler.message("    %d instances of rule/rel %s created" % (i, rel.name))
+        
+        # the cluster memberships
+        for cluster_set in recommender.cluster_sets:
+            cluster_set.evaluate_entity(
+                dn_entity=dn_entity, 
+                ds_entity=entity, 
+                batch_size=self.batch_size)
+        
+        bias_ids = set()
+        
+        # the biases of the other entities can depend on it
+        for bias in recommender.biases:
+            bias_ids.update(bias.update(
+                recommender_model=dn_entity.recommender, 
+                batch_size=self.batch_size))
+        
+        return bias_ids
+            
+    def _remove_instances(self, dn_entity):
+        """Delete the relationship, rule instances and cluster memberships
+        of the entity. The bias instances are evaluated again anyway.
+        """
+        
+        RelationshipInstance.objects.filter(
+            Q(subject_object1=dn_entity) | Q(subject_object2=dn_entity)).delete()
+        
+        ExplicitRuleInstance.objects.filter(
+            Q(subject_object1=dn_entity) | Q(subject_object2=dn_entity)).delete()
+        
+        ClusterMember.objects.filter(member=dn_entity).delete()
@@ -1,8 +1,16 @@
 """The module defines base class for the abstractor package."""
 
+from unresyst.constants import *
+
 class BaseAbstractor(object):
     """The base (abstract) class for all abstractors. Defines the interface."""
     
+    def __init__(self, batch_size=DEFAULT_BULK_BATCH_SIZE):
+        """The initializer"""
+        
+        self.batch_size = batch_size
+        """The number of instances written to the database at once"""
+    
     # Build phase:
     #
     
@@ -103,63 +111,62 @@ class BaseAbstractor(object):
     # 
     
     
-    def add_subject(self, recommender, subject):
-        """Add the subject to the abstract subjects, to the relationship and
-        rule instances.
+    def add_entity(self, recommender, recommender_model, entity, entity_type):
+        """Add the subject/object to the abstract subjects/objects, create its
+        relationship, rule instances, cluster memberships, evaluate 
+        the biases again.
         
-        @rtype: uvidime
-        @return: the changes performed on the rule and relationship instances.
-        """
-        pass
-    
-    
-    def add_object(self, recommender, object_):
-        """Add the object to the abstract objects, to the relationship and
-        rule instances.
+        @type recommender: recommender.Recommender
+        @param recommender: the recommender class
         
-        @rtype: uvidime
-        @return: the changes performed on the rule and relationship instances.
-        """
-        pass
-    
-    
-    def update_subject(self, recommender, subject):
-        """Update the subject in the abstract subjects, in the relationship and
-        rule instances.
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender model instance
+        
+        @type entity: django.db.models.Model
+        @param entity: the domain specific subject/object
+        
+        @type entity_type: str
+        @param entity_type: the type of the entity 'S'/'O'/'SO'
         
-        @rtype: uvidime
-        @return: the changes performed on the rule and relationship instances.
+        @rtype: pair (models.common.SubjectObject, set of int)
+        @return: the created domain neutral entity and the ids of the entities
+            whose bias instances have changed
         """
         pass
     
     
-    def update_object(self, recommender, object_):
-        """Update the object in the abstract objects, in the relationship and
-        rule instances.
+    def update_entity(self, recommender, dn_entity, entity):
+        """Update the subject/object in the abstract subjects/objects, create
+        its instances again.
         
-        @rtype: uvidime
-        @return: the changes performed on the rule and relationship instances.
-        """
-        pass    
+        @type recommender: recommender.Recommender
+        @param recommender: the recommender class
         
-    
-    def remove_subject(self, recommender, subject):
-        """Remove the subject from the abstract subjects, its relationships and
-        rule instances.
+        @type dn_entity: models.common.SubjectObject
+        @param dn_entity: the domain neutral entity
+        
+        @type entity: django.db.models.Model
+        @param entity: the domain specific subject/object
         
-        @rtype: uvidime
-        @return: the changes performed on the rule and relationship instances.
+        @rtype: set of int
+        @return: the ids of the entities whose bias instances have changed
         """
         pass
     
     
-    def remove_object(self, recommender, object_):
-        """Update the object from the abstract objects, its relationship and
-        rule instances.
+    def remove_entity(self, recommender, dn_entity):
+        """Remove the subject/object from the abstract subjects/objects with
+        its instances. The domain specific entity should be already removed
+        from the domain, so that it isn't returned by the generators.
         
-        @rtype: uvidime
-        @return: the changes performed on the rule and relationship instances.
-        """
-        pass    
+        @type recommender: recommender.Recommender
+        @param recommender: the recommender class
         
-                
+        @type dn_entity: models.common.SubjectObject
+        @param dn_entity: the domain neutral entity
+        
+        @rtype: set of int
+        @return: the ids of the other entities whose bias instances 
+            have changed
+        """
+        pass
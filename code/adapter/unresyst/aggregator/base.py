@@ -1,16 +1,22 @@
 """The module defines base class for the aggregator package."""
 
+from unresyst.constants import *
+from unresyst.models.aggregator import AggregatedBiasInstance
+
 class BaseAggregator(object):
     """The base (abstract) class for all aggregators. Defines the interface."""    
     
     # Build phase:
     #
 
-    def __init__(self, combinator=None):
+    def __init__(self, combinator=None, batch_size=DEFAULT_BULK_BATCH_SIZE):
         """The initializer"""
         
         self.combinator = combinator
         """The combinator that should be used during aggregating"""
+        
+        self.batch_size = batch_size
+        """The number of aggregates written to the database at once"""
 
         
     def aggregate_rules_relationships(cls, recommender_model):
@@ -26,7 +32,7 @@ class BaseAggregator(object):
         """
         pass
         
-    def aggregate_biases(cls, recommender_model):
+    def aggregate_biases(cls, recommender_model, entity_ids=None):
         """Aggregate bias instances.
         
         Aggregates instances of the biases from the recommender_model 
@@ -35,6 +41,10 @@ class BaseAggregator(object):
         @type recommender_model: models.common.Recommender
         @param recommender_model: the recommender whose instances should
             be aggregated.  
+        
+        @type entity_ids: list of int
+        @param entity_ids: if given, only the biases of the entities 
+            are aggregated
         """
         pass
 
@@ -42,12 +52,91 @@ class BaseAggregator(object):
     # Update phase:
     # 
     
-    @classmethod
-    def update(cls, recommender, instance_changes):
-        """Apdate the aggregated relationships according to the instance 
-        changes.
+    def update(self, recommender_model, entity_ids, bias_ids=()):
+        """Update the aggregates after the given entities were added or 
+        updated. The aggregated relationships of the entities and the 
+        aggregated biases of the entities and the bias_ids are created again,
+        the other aggregates are kept.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender whose instances should
+            be aggregated.  
         
-        @rtype: uvidime
-        @return: the changes performed on the aggregated relationships. 
+        @type entity_ids: list of int
+        @param entity_ids: the ids of the changed domain neutral entities
+        
+        @type bias_ids: iterable of int
+        @param bias_ids: the ids of the other entities whose bias instances
+            have changed
+        
+        @rtype: dict int: float
+        @return: the old expectancies of the entities whose aggregated bias
+            has changed by their ids, None if the entity had no aggregated bias
         """
-
+        self.update_rules_relationships(
+            recommender_model=recommender_model, 
+            entity_ids=entity_ids)
+        
+        biased_ids = sorted(set(entity_ids) | set(bias_ids))
+        
+        old_biases = {}
+        new_biases = {}
+        
+        # the biases of the entities are aggregated again by chunks
+        for i in xrange(0, len(biased_ids), DEFAULT_QUERY_CHUNK_SIZE):
+            
+            chunk = biased_ids[i:i + DEFAULT_QUERY_CHUNK_SIZE]
+            
+            # the biases as they were
+            old_biases.update(self._get_bias_dict(recommender_model, chunk))
+            
+            AggregatedBiasInstance.objects.filter(
+                recommender=recommender_model,
+                subject_object__id__in=chunk).delete()
+            
+            self.aggregate_biases(
+                recommender_model=recommender_model,
+                entity_ids=chunk)
+            
+            new_biases.update(self._get_bias_dict(recommender_model, chunk))
+        
+        # the entities whose bias appeared, disappeared or changed
+        changed = {}
+        
+        for ent_id in set(old_biases) | set(new_biases):
+            
+            old_bias = old_biases.get(ent_id)
+            new_bias = new_biases.get(ent_id)
+            
+            if old_bias is None or new_bias is None \
+                    or abs(old_bias[0] - new_bias[0]) > EXP_PRECISION \
+                    or old_bias[1] != new_bias[1]:
+                changed[ent_id] = old_bias[0] if old_bias else None
+        
+        return changed
+        
+    def update_rules_relationships(self, recommender_model, entity_ids):
+        """Aggregate again the rule and relationship instances of the given
+        entities, the other aggregates are kept.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender whose instances should
+            be aggregated.  
+        
+        @type entity_ids: list of int
+        @param entity_ids: the ids of the changed domain neutral entities
+        """
+        pass
+        
+    @staticmethod
+    def _get_bias_dict(recommender_model, entity_ids):
+        """Get the aggregated biases of the entities.
+        
+        @rtype: dict int: (float, str)
+        @return: the expectancy and the description by the entity id
+        """
+        return dict((ent_id, (expectancy, description)) \
+            for ent_id, expectancy, description in AggregatedBiasInstance.objects\
+                .filter(recommender=recommender_model, subject_object__id__in=entity_ids)\
+                .values_list('subject_object__id', 'expectancy', 'description')\
+                .iterator())
@@ -0,0 +1,252 @@
+"""The cluster similarities of all pairs at once, by a sparse matrix product.
+
+The memberships of the recommender are loaded to a sparse matrix
+entity x cluster, holding sqrt(cluster set weight) * membership confidence.
+The product with its transposition then gives for each pair of entities
+the sum of weight * confidence1 * confidence2 over their common clusters.
+The product is computed by blocks of rows, for each entity only the
+top_k most similar entities are kept.
+
+Needs numpy and scipy.
+"""
+
+import numpy as np
+from scipy import sparse
+
+from unresyst.constants import *
+from unresyst.models.abstractor import ClusterSet, Cluster, ClusterMember, _count_expectancy
+from unresyst.combinator.combination_element import ClusterSimilarityCombinationElement, \
+    InstanceRecord
+
+_RELATIONSHIP_TYPES = {
+    ENTITY_TYPE_SUBJECT: RELATIONSHIP_TYPE_SUBJECT_SUBJECT,
+    ENTITY_TYPE_OBJECT: RELATIONSHIP_TYPE_OBJECT_OBJECT,
+    ENTITY_TYPE_SUBJECTOBJECT: RELATIONSHIP_TYPE_SUBJECTOBJECT_SUBJECTOBJECT,
+}
+"""The similarity relationship type for the entity type of the cluster set"""
+
+class ClusterEngine(object):
+    """The cluster memberships of a recommender, finding the pairs
+    of entities sharing clusters and their combination elements.
+    """
+
+    def __init__(self, recommender_model, top_k=None, block_size=DEFAULT_BULK_BATCH_SIZE):
+        """The initializer, loads the memberships of the recommender.
+
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender
+
+        @type top_k: int
+        @param top_k: the number of the most similar entities kept for each
+            entity, if None all entities sharing a cluster are kept
+
+        @type block_size: int
+        @param block_size: the number of rows of the product computed at once
+        """
+        self.top_k = top_k
+        """The number of the most similar entities kept for each entity"""
+
+        self.block_size = block_size
+        """The number of rows of the product computed at once"""
+
+        cluster_sets = dict((pk, (entity_type, weight)) for pk, entity_type, weight in \
+            ClusterSet.objects\
+                .filter(recommender=recommender_model)\
+                .values_list('pk', 'entity_type', 'weight'))
+
+        clusters = dict(Cluster.objects\
+            .filter(cluster_set__in=cluster_sets.keys())\
+            .values_list('pk', 'cluster_set'))
+
+        self._cluster_weights = dict((cluster_id, cluster_sets[set_id][1]) \
+            for cluster_id, set_id in clusters.iteritems())
+        """Dictionary cluster id: the weight of its cluster set"""
+
+        self._memberships = {}
+        """Dictionary member id: {cluster id: (confidence, description)}"""
+
+        self._relationship_types = {}
+        """Dictionary member id: the type of its similarity relationships"""
+
+        for cluster_id, member_id, confidence, description in ClusterMember.objects\
+                .filter(cluster__in=clusters.keys())\
+                .values_list('cluster', 'member', 'confidence', 'description')\
+                .iterator():
+
+            self._memberships.setdefault(member_id, {})[cluster_id] = (confidence, description)
+
+            self._relationship_types[member_id] = \
+                _RELATIONSHIP_TYPES[cluster_sets[clusters[cluster_id]][0]]
+
+        self._ids = sorted(self._memberships.keys())
+        """The member ids by the matrix rows"""
+
+        self._rows = dict((member_id, i) for i, member_id in enumerate(self._ids))
+        """Dictionary member id: matrix row"""
+
+        columns = dict((cluster_id, i) for i, cluster_id in \
+            enumerate(sorted(self._cluster_weights.keys())))
+
+        # the entity x cluster matrix
+        row_list = []
+        col_list = []
+        values = []
+
+        for member_id, member_clusters in self._memberships.iteritems():
+            for cluster_id, (confidence, description) in member_clusters.iteritems():
+                row_list.append(self._rows[member_id])
+                col_list.append(columns[cluster_id])
+                values.append(np.sqrt(self._cluster_weights[cluster_id]) * confidence)
+
+        self._matrix = sparse.csr_matrix(
+            (np.array(values, dtype=float), (np.array(row_list, dtype=int), np.array(col_list, dtype=int))),
+            shape=(len(self._ids), len(columns)))
+        """The sparse matrix entity x cluster"""
+
+        self._transposed = self._matrix.T.tocsc()
+        """The transposition of the matrix, for the products"""
+
+    def get_elements(self, id1, id2):
+        """Get the combination elements for the clusters the two entities share.
+
+        @type id1, id2: int
+        @param id1, id2: the ids of the subject objects
+
+        @rtype: list of ClusterSimilarityCombinationElement
+        @return: the elements, by the cluster id
+        """
+        members1 = self._memberships.get(id1, {})
+        members2 = self._memberships.get(id2, {})
+
+        elements = []
+
+        for cluster_id in sorted(set(members1).intersection(members2)):
+
+            confidence1, description1 = members1[cluster_id]
+            confidence2, description2 = members2[cluster_id]
+
+            elements.append(ClusterSimilarityCombinationElement(
+                cluster_members=(
+                    InstanceRecord(None, description1),
+                    InstanceRecord(None, description2)),
+                expectancy=_count_expectancy(
+                    is_positive=True,
+                    weight=self._cluster_weights[cluster_id],
+                    confidence=confidence1 * confidence2)))
+
+        return elements
+
+    def iter_pairs(self, exclude, entity_ids=None):
+        """Get the pairs sharing some cluster, kept by the top_k cutoff of any
+        of the two. Each pair is returned once, the bigger id first, as by
+        SubjectObject.unique_pairs. The excluded pairs don't count
+        in the cutoff, each entity keeps up to top_k pairs not in exclude.
+
+        @type exclude: set of pairs (int, int)
+        @param exclude: the pairs that shouldn't be returned (in any order)
+
+        @type entity_ids: iterable of int
+        @param entity_ids: if given, only the pairs with some of the entities
+            are returned
+
+        @rtype: generator of tuples (id1, id2, relationship type)
+        @return: the pairs
+        """
+        if entity_ids is None:
+            rows = range(len(self._ids))
+            entity_set = None
+        else:
+            entity_set = set(entity_ids)
+
+            entity_rows = [self._rows[i] for i in entity_set if i in self._rows]
+
+            # the pairs of the entities can be kept by the cutoff of the other
+            # entity, so the rows of all entities sharing a cluster are needed
+            rows = set(entity_rows)
+
+            for start in xrange(0, len(entity_rows), self.block_size):
+                rows.update(self._get_product(entity_rows[start:start + self.block_size]).indices)
+
+            rows = sorted(rows)
+
+        # the pairs already returned, a pair can be kept by the cutoffs of both entities
+        returned = set()
+
+        for start in xrange(0, len(rows), self.block_size):
+
+            block_rows = rows[start:start + self.block_size]
+
+            product = self._get_product(block_rows)
+
+            for r, i in enumerate(block_rows):
+
+                id1 = self._ids[i]
+
+                for j in self._get_row_neighbours(product, r, i, exclude):
+
+                    id2 = self._ids[j]
+
+                    if entity_set is not None and not (id1 in entity_set or id2 in entity_set):
+                        continue
+
+                    pair = (max(id1, id2), min(id1, id2))
+
+                    if pair in returned:
+                        continue
+
+                    returned.add(pair)
+
+                    yield pair + (self._relationship_types[id1],)
+
+    def _get_product(self, rows):
+        """Get the product of the rows of the matrix with the transposition.
+
+        @type rows: list of int
+        @param rows: the matrix rows, at most block_size
+
+        @rtype: scipy.sparse.csr_matrix
+        @return: the block of the product, rows by the given rows, columns
+            by all matrix rows
+        """
+        return (self._matrix[rows] * self._transposed).tocsr()
+
+    def _get_row_neighbours(self, product, r, i, exclude):
+        """Get the matrix rows of the entities most similar to the i-th entity.
+
+        @type product: scipy.sparse.csr_matrix
+        @param product: the block of the product
+
+        @type r: int
+        @param r: the row of the entity in the product block
+
+        @type i: int
+        @param i: the row of the entity in the matrix
+
+        @type exclude: set of pairs (int, int)
+        @param exclude: the pairs of entity ids left out before the top_k
+            cutoff (in any order)
+
+        @rtype: numpy array of int
+        @return: the rows of the top_k entities sharing some cluster, the entity
+            itself and the excluded pairs left out, the most similar first,
+            ties by the row
+        """
+        start, end = product.indptr[r], product.indptr[r + 1]
+
+        cols = product.indices[start:end]
+        scores = product.data[start:end]
+
+        id1 = self._ids[i]
+
+        mask = np.array([j != i and (id1, self._ids[j]) not in exclude \
+                and (self._ids[j], id1) not in exclude for j in cols], dtype=bool)
+        cols = cols[mask]
+        scores = scores[mask]
+
+        # sort by the score descending, then by the column
+        order = np.lexsort((cols, -scores))
+
+        if self.top_k is not None:
+            order = order[:self.top_k]
+
+        return cols[order]
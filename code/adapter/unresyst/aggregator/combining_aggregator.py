@@ -1,43 +1,191 @@
 """The aggregator that uses a combinator to aggregate"""
 
+from itertools import groupby
+
+from django.db.models import Q
+
 from base import BaseAggregator
 from unresyst.constants import *
-from unresyst.models.abstractor import RelationshipInstance, \
-    PredictedRelationshipDefinition, Cluster, BiasInstance
+from unresyst.models.abstractor import RelationshipInstance, RuleInstance, \
+    PredictedRelationshipDefinition, RuleRelationshipDefinition, Cluster, \
+    ClusterMember, BiasInstance, definition_registry, _count_expectancy
 from unresyst.models.aggregator import AggregatedRelationshipInstance, \
     AggregatedBiasInstance
+from unresyst.models.bulk import BulkInserter
 from unresyst.combinator.combination_element import RelSimilarityCombinationElement, \
-    ClusterSimilarityCombinationElement, BiasCombinationElement  
+    ClusterSimilarityCombinationElement, BiasCombinationElement, InstanceRecord
+
+_SIMILARITY_TYPES = (
+    RELATIONSHIP_TYPE_OBJECT_OBJECT,
+    RELATIONSHIP_TYPE_SUBJECT_SUBJECT,
+    RELATIONSHIP_TYPE_SUBJECTOBJECT_SUBJECTOBJECT)
+"""The types of the relationships meaning a similarity"""
 
 class CombiningAggregator(BaseAggregator):
     """A class using unresyst.combinator for creating aggregates"""
     
+    def __init__(self, combinator=None, batch_size=DEFAULT_BULK_BATCH_SIZE, streaming=False,
+            sparse_clusters=False, cluster_top_k=None):
+        """The initializer"""
+        
+        super(CombiningAggregator, self).__init__(
+            combinator=combinator,
+            batch_size=batch_size)
+        
+        self.streaming = streaming
+        """Should the similarities be aggregated in one pass through 
+        the instances ordered by the pair, joined in memory with the cluster
+        memberships? Faster for many similarities, needs the memberships 
+        in memory."""
+        
+        self.sparse_clusters = sparse_clusters
+        """Should the cluster similarities be computed for all pairs at once
+        (cluster_engine.ClusterEngine)? Then also the pairs sharing a cluster
+        without any rule/relationship similarity are aggregated. Needs scipy."""
+        
+        self.cluster_top_k = cluster_top_k
+        """The number of the pairs sharing a cluster kept for each entity,
+        if None all are kept. Used only with sparse_clusters."""
+    
     def aggregate_rules_relationships(self, recommender_model):
         """See the base class for documentation.
         
         Does only similarity aggregation + clusters, the preference aggregation is left out
         for the algorithm.
         """
-        # get pairs that have some similarities
-        # 
+        qs_similarities = self._filter_similarities(recommender_model)
+        
+        self._aggregate_similarities(recommender_model, qs_similarities, qs_similarities)
+    
+    def update_rules_relationships(self, recommender_model, entity_ids):
+        """See the base class for documentation.
+        
+        The similarities of the pairs with the entities are aggregated again.
+        """
+        qs_similarities = self._filter_similarities(recommender_model)
+        
+        q_entities = Q(subject_object1__id__in=entity_ids) | Q(subject_object2__id__in=entity_ids)
         
-        # take all rule/relationship instances, that don't belong 
-        # to the predicted_relationship - their id unique pairs
-        #
+        AggregatedRelationshipInstance.objects\
+            .filter(recommender=recommender_model)\
+            .filter(q_entities)\
+            .delete()
         
+        self._aggregate_similarities(
+            recommender_model, 
+            qs_similarities, 
+            qs_similarities.filter(q_entities),
+            entity_ids=entity_ids)
+    
+    @staticmethod
+    def _filter_similarities(recommender_model):
+        """Get all rule/relationship instances, that don't belong 
+        to the predicted_relationship and are between entities of the same type.
+        
+        @rtype: QuerySet
+        @return: the similarity instances of the recommender
+        """
         predicted_def = PredictedRelationshipDefinition.objects.get(
                             recommender=recommender_model)
 
-        qs_similarities = RelationshipInstance.objects\
-                        .exclude(definition=predicted_def)\
-                        .filter(definition__recommender=recommender_model)\
-                        .filter(definition__rulerelationshipdefinition__relationship_type__in=[
-                            RELATIONSHIP_TYPE_OBJECT_OBJECT,
-                            RELATIONSHIP_TYPE_SUBJECT_SUBJECT,
-                            RELATIONSHIP_TYPE_SUBJECTOBJECT_SUBJECTOBJECT])                        
+        return RelationshipInstance.objects\
+                .exclude(definition=predicted_def)\
+                .filter(definition__recommender=recommender_model)\
+                .filter(definition__rulerelationshipdefinition__relationship_type__in=\
+                    _SIMILARITY_TYPES)
+    
+    def _aggregate_similarities(self, recommender_model, qs_similarities, qs_aggregated, entity_ids=None):
+        """Aggregate the similarities of the pairs having some similarity
+        in qs_aggregated. With sparse_clusters also the pairs sharing
+        a cluster are aggregated.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender the aggregates belong to
+        
+        @type qs_similarities: QuerySet
+        @param qs_similarities: all similarity instances of the recommender
+        
+        @type qs_aggregated: QuerySet
+        @param qs_aggregated: the instances whose pairs should be aggregated
+        
+        @type entity_ids: iterable of int
+        @param entity_ids: if given, only the pairs sharing a cluster with 
+            the entities are aggregated, the pairs with rules are given
+            by qs_aggregated
+        """
+        engine = None
+        
+        if self.sparse_clusters:
+            
+            # scipy is needed only here
+            from cluster_engine import ClusterEngine
+            
+            engine = ClusterEngine(
+                recommender_model=recommender_model,
+                top_k=self.cluster_top_k,
+                block_size=self.batch_size)
+        
+        if self.streaming:
+            pairs = self._stream_pair_elements(recommender_model, qs_aggregated, engine)
+        else:
+            pairs = self._query_pair_elements(qs_similarities, qs_aggregated, engine)
+        
+        inserter = BulkInserter(
+                    model=AggregatedRelationshipInstance, 
+                    batch_size=self.batch_size)
+        
+        # the pairs waiting for the combination (id1, id2, relationship type, elements)
+        pending = []
+        
+        # the aggregated pairs, kept only for excluding them from the pairs
+        # of the cluster engine
+        aggregated = set() if engine is not None else None
+        
+        for pair in pairs:
+            
+            pending.append(pair)
+            
+            if aggregated is not None:
+                aggregated.add(pair[:2])
+            
+            # aggregate a whole batch at once
+            if len(pending) >= self.batch_size:
+                self._save_similarities(recommender_model, pending, inserter)
+                pending = []
+        
+        # the pairs having only the cluster similarity
+        if engine is not None:
+            
+            for id1, id2, relationship_type in engine.iter_pairs(
+                    exclude=aggregated, entity_ids=entity_ids):
+                
+                pending.append((id1, id2, relationship_type, engine.get_elements(id1, id2)))
+                
+                if len(pending) >= self.batch_size:
+                    self._save_similarities(recommender_model, pending, inserter)
+                    pending = []
+        
+        self._save_similarities(recommender_model, pending, inserter)
+        inserter.flush()
+
+    def _query_pair_elements(self, qs_similarities, qs_aggregated, engine=None):
+        """Get the combination elements for the pairs having some similarity
+        in qs_aggregated, asking the database for each pair.
+        
+        @type qs_similarities: QuerySet
+        @param qs_similarities: all similarity instances of the recommender
+        
+        @type qs_aggregated: QuerySet
+        @param qs_aggregated: the instances whose pairs should be aggregated
+        
+        @type engine: cluster_engine.ClusterEngine
+        @param engine: if given, the cluster elements are taken from it
         
+        @rtype: generator of tuples (id1, id2, relationship type, elements)
+        @return: the pairs and their combination elements
+        """
         # the unique pairs of entities between which there's some similarity
-        qs_id_pairs = qs_similarities\
+        qs_id_pairs = qs_aggregated\
                         .values_list('subject_object1__id', 'subject_object2__id')\
                         .distinct()
         
@@ -58,7 +206,7 @@ class CombiningAggregator(BaseAggregator):
             # save the entity type - there must be always at least
             # one similarity relationship for the pair, so this is
             # always filled.
-            relationship_type = qs_pair_similarity[0].definition.as_leaf_class().relationship_type
+            relationship_type = definition_registry.get(qs_pair_similarity[0].definition_id).relationship_type
             
             # create combining elements from them
             for pair_sim in qs_pair_similarity.iterator():
@@ -69,6 +217,12 @@ class CombiningAggregator(BaseAggregator):
             # clusters:
             #
             
+            if engine is not None:
+                combination_elements.extend(engine.get_elements(id1, id2))
+                
+                yield (id1, id2, relationship_type, combination_elements)
+                continue
+            
             # get clusters the two have in common
             qs_common_clusters = Cluster.objects.filter(clustermember__member__id=id1)\
                 .filter(clustermember__member__id=id2)
@@ -83,42 +237,159 @@ class CombiningAggregator(BaseAggregator):
                 )
                 combination_elements.append(el)            
             
-            # aggregation and save:
+            yield (id1, id2, relationship_type, combination_elements)
+
+    def _stream_pair_elements(self, recommender_model, qs_aggregated, engine=None):
+        """Get the combination elements for the pairs having some similarity
+        in qs_aggregated, in one pass through the instances ordered by 
+        the pair. The definitions and the cluster memberships of the 
+        recommender are loaded to memory before.
+        
+        The parameters and the return value are as for _query_pair_elements.
+        """
+        # the similarity definitions and the confidences of their rule instances
+        definitions = dict((pk, definition) for pk, definition in \
+            definition_registry.get_definitions(recommender_model, RuleRelationshipDefinition).iteritems() \
+                if definition.relationship_type in _SIMILARITY_TYPES)
+        
+        confidences = RuleInstance.get_confidences(definitions.keys())
+        
+        # the co-membership table: member id: {cluster id: (confidence, description)}
+        cluster_weights = {}
+        memberships = {}
+        
+        # the engine has its own
+        if engine is None:
+            
+            cluster_weights = dict(Cluster.objects\
+                .filter(cluster_set__recommender=recommender_model)\
+                .values_list('pk', 'cluster_set__weight'))
+            
+            for cluster_id, member_id, confidence, description in ClusterMember.objects\
+                    .filter(cluster__cluster_set__recommender=recommender_model)\
+                    .values_list('cluster', 'member', 'confidence', 'description')\
+                    .iterator():
+                memberships.setdefault(member_id, {})[cluster_id] = (confidence, description)
+        
+        qs_instances = qs_aggregated\
+                        .order_by('subject_object1', 'subject_object2', 'pk')\
+                        .values_list('pk', 'subject_object1', 'subject_object2', 
+                            'definition', 'description')
+        
+        for (id1, id2), rows in groupby(qs_instances.iterator(), key=lambda row: row[1:3]):
+            
+            combination_elements = []
+            
+            # similarities:
             #
+            for pk, so1, so2, definition_id, description in rows:
+                
+                definition = definitions[definition_id]
+                
+                combination_elements.append(RelSimilarityCombinationElement(
+                    rel_instance=InstanceRecord(None, description),
+                    expectancy=_count_expectancy(
+                        is_positive=definition.is_positive,
+                        weight=definition.weight,
+                        confidence=confidences.get(pk, 1)),
+                    positiveness=definition.is_positive))
+            
+            # all similarities of the pair have the same type
+            relationship_type = definition.relationship_type
             
-            # aggregate the similarity through the combinator
-            aggr = self.combinator.combine_pair_similarities(
-                combination_elements=combination_elements)
+            # clusters:
+            #
+            if engine is not None:
+                combination_elements.extend(engine.get_elements(id1, id2))
             
-            # create and save the aggregated similarity instance
+            members1 = memberships.get(id1, {})
+            members2 = memberships.get(id2, {})
+            
+            for cluster_id in sorted(set(members1).intersection(members2)):
+                
+                confidence1, description1 = members1[cluster_id]
+                confidence2, description2 = members2[cluster_id]
+                
+                combination_elements.append(ClusterSimilarityCombinationElement(
+                    cluster_members=(
+                        InstanceRecord(None, description1),
+                        InstanceRecord(None, description2)),
+                    expectancy=_count_expectancy(
+                        is_positive=True,
+                        weight=cluster_weights[cluster_id],
+                        confidence=confidence1 * confidence2)))
+            
+            yield (id1, id2, relationship_type, combination_elements)
+    
+    def _save_similarities(self, recommender_model, pending, inserter):
+        """Aggregate the similarities of the pairs through the combinator
+        and save them.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender the aggregates belong to
+        
+        @type pending: list of tuples (id1, id2, relationship type, elements)
+        @param pending: the pairs and their combination elements
+        
+        @type inserter: BulkInserter
+        @param inserter: the inserter of the aggregates
+        """
+        if not pending:
+            return
+        
+        # aggregate the similarities through the combinator
+        aggrs = self.combinator.combine_pair_similarities_batch(
+                    element_lists=[els for id1, id2, rel_type, els in pending])
+        
+        for (id1, id2, relationship_type, els), aggr in zip(pending, aggrs):
+            
+            # fill the missing fields and save
             aggr.subject_object1_id = id1
             aggr.subject_object2_id = id2
             aggr.recommender = recommender_model
             aggr.relationship_type = relationship_type
-            aggr.save()
+            inserter.add(aggr)
 
         
-    def aggregate_biases(self, recommender_model):
+    def aggregate_biases(self, recommender_model, entity_ids=None):
         """See the base class for documentation.
         """
         
         # all available biases
         qs_biases = BiasInstance.objects.filter(definition__recommender=recommender_model)
         
+        if entity_ids is not None:
+            qs_biases = qs_biases.filter(subject_object__id__in=entity_ids)
+        
         # get entities that have some biases: subject/object anything
         qs_ids = qs_biases.values_list('subject_object__id', flat=True).distinct()
         
-        for ent_id in qs_ids:
+        inserter = BulkInserter(
+                    model=AggregatedBiasInstance, 
+                    batch_size=self.batch_size)
+        
+        ent_ids = list(qs_ids)
+        
+        # go through the entities by batches
+        for start in xrange(0, len(ent_ids), self.batch_size):
             
-            # get the biases for the entity
-            ent_biases = [BiasCombinationElement(bias_instance=b) for b in qs_biases.filter(subject_object__id=ent_id)]
+            batch_ids = ent_ids[start:start + self.batch_size]
+            
+            # get the biases for the entities
+            element_lists = [[BiasCombinationElement(bias_instance=b) \
+                                for b in qs_biases.filter(subject_object__id=ent_id)] \
+                                    for ent_id in batch_ids]
             
             # throw them to the combinator
-            aggr = self.combinator.combine_entity_biases(entity_biases=ent_biases)
+            aggrs = self.combinator.combine_entity_biases_batch(element_lists=element_lists)
             
-            # fill the missing fields and save
-            aggr.subject_object_id = ent_id
-            aggr.recommender = recommender_model
-            aggr.save()
+            for ent_id, aggr in zip(batch_ids, aggrs):
+            
+                # fill the missing fields and save
+                aggr.subject_object_id = ent_id
+                aggr.recommender = recommender_model
+                inserter.add(aggr)
+        
+        inserter.flush()
             
                             
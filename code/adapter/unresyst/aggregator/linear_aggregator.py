@@ -3,16 +3,24 @@
  - CombiningAggregator: uses the Combinator class for aggregating
 """
 
+from itertools import groupby
+
+from django.db import connection, transaction
 from django.db.models import Count
 from django.db.models import Q
 
 
 from base import BaseAggregator
-from unresyst.models.abstractor import RelationshipInstance, \
-    PredictedRelationshipDefinition
+from unresyst.constants import *
+from unresyst.profiler import build_profiler
+from unresyst.models.abstractor import RelationshipInstance, RuleInstance, \
+    PredictedRelationshipDefinition, RuleRelationshipDefinition, \
+    BaseRelationshipDefinition, BiasInstance, BiasDefinition, definition_registry, \
+    _count_expectancy
 from unresyst.models.aggregator import AggregatedRelationshipInstance, \
     AggregatedBiasInstance
 from unresyst.models.common import SubjectObject
+from unresyst.models.bulk import BulkInserter
 from unresyst.exceptions import InvalidParameterError
 
 class LinearAggregator(BaseAggregator):
@@ -25,6 +33,22 @@ class LinearAggregator(BaseAggregator):
     expectances somehow.
     """
 
+    def __init__(self, combinator=None, batch_size=DEFAULT_BULK_BATCH_SIZE, 
+            pushdown=False, fill_descriptions=True):
+        """The initializer"""
+        
+        super(LinearAggregator, self).__init__(
+            combinator=combinator,
+            batch_size=batch_size)
+        
+        self.pushdown = pushdown
+        """Should the averages be counted by GROUP BY in the database and
+        the aggregates written by INSERT ... SELECT, see _insert_aggregates?"""
+        
+        self.fill_descriptions = fill_descriptions
+        """Should the descriptions of the aggregates be filled, when
+        pushdown is used? Otherwise they're left empty."""
+
     def aggregate_rules_relationships(self, recommender_model):
         """For documentation see the base class.
         
@@ -49,15 +73,221 @@ class LinearAggregator(BaseAggregator):
         # aggregate it
         # 
         
-        # take all rule/relationship instances, that don't belong 
-        # to the predicted_relationship
-        # order them by the first and the second
+        if self.pushdown:
+            self._insert_aggregates(recommender_model)
+        else:
+            # take all rule/relationship instances, that don't belong 
+            # to the predicted_relationship
+            # order them by the first and the second
+            self._aggregate_instances(
+                recommender_model=recommender_model, 
+                instance_qs=self._filter_instances(recommender_model))
+        
+        build_profiler.message("    %d rule/relationship aggregates created" % \
+            AggregatedRelationshipInstance.objects.filter(recommender=recommender_model).count())
+    
+    def update_rules_relationships(self, recommender_model, entity_ids):
+        """See the base class for documentation.
+        
+        The instances of the pairs with the entities are aggregated again.
+        """
+        q_entities = Q(subject_object1__id__in=entity_ids) | Q(subject_object2__id__in=entity_ids)
+        
+        AggregatedRelationshipInstance.objects\
+            .filter(recommender=recommender_model)\
+            .filter(q_entities)\
+            .delete()
+        
+        if self.pushdown:
+            entity_ids = list(entity_ids)
+            
+            # the pairs already aggregated from a previous chunk are skipped
+            for i in xrange(0, len(entity_ids), DEFAULT_QUERY_CHUNK_SIZE):
+                self._insert_aggregates(recommender_model, entity_ids[i:i + DEFAULT_QUERY_CHUNK_SIZE])
+            return
+        
+        self._aggregate_instances(
+            recommender_model=recommender_model, 
+            instance_qs=self._filter_instances(recommender_model).filter(q_entities))
+    
+    @staticmethod
+    def _filter_instances(recommender_model):
+        """Get the rule/relationship instances, that don't belong 
+        to the predicted_relationship, ordered by the first and the second.
+        
+        @rtype: QuerySet
+        @return: the instances to aggregate
+        """
         predicted_def = PredictedRelationshipDefinition.objects.get(
                             recommender=recommender_model)
-        instance_qs = RelationshipInstance.objects\
-                        .exclude(definition=predicted_def)\
-                        .filter(definition__recommender=recommender_model)\
-                        .order_by('subject_object1__id', 'subject_object2__id')
+        
+        return RelationshipInstance.objects\
+                .exclude(definition=predicted_def)\
+                .filter(definition__recommender=recommender_model)\
+                .order_by('subject_object1__id', 'subject_object2__id')
+    
+    def _insert_aggregates(self, recommender_model, entity_ids=None):
+        """Count the average expectancies of the rule/relationship instances
+        for each pair by GROUP BY and write the aggregates by INSERT ... SELECT.
+        The pairs that already have an aggregate are skipped. The descriptions
+        are filled afterwards, if fill_descriptions is set.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender the aggregates belong to
+        
+        @type entity_ids: list of int
+        @param entity_ids: if given, only the pairs containing the entities
+            are aggregated
+        """
+        qn = connection.ops.quote_name
+        
+        aggr_table = qn(AggregatedRelationshipInstance._meta.db_table)
+        
+        # the predicted relationship isn't a rule/relationship definition,
+        # so it's left out by the join
+        sql = """INSERT INTO %(aggr)s (%(so1)s, %(so2)s, %(description)s, %(expectancy)s, 
+                %(recommender)s, %(rel_type)s)
+            SELECT ri.%(ri_so1)s, ri.%(ri_so2)s, '', 
+                AVG(0.5 + (CASE WHEN d.%(is_positive)s THEN 1 ELSE -1 END) * d.%(weight)s * 
+                    COALESCE(r.%(confidence)s, 1) / 2),
+                %%s, MIN(d.%(def_rel_type)s)
+            FROM %(instances)s ri
+                INNER JOIN %(definitions)s d ON d.%(def_ptr)s = ri.%(ri_def)s
+                INNER JOIN %(base_definitions)s bd ON bd.%(base_pk)s = ri.%(ri_def)s
+                LEFT OUTER JOIN %(rules)s r ON r.%(rule_ptr)s = ri.%(ri_pk)s
+            WHERE bd.%(base_recommender)s = %%s 
+                AND NOT EXISTS (SELECT 1 FROM %(aggr)s a 
+                    WHERE a.%(so1)s = ri.%(ri_so1)s AND a.%(so2)s = ri.%(ri_so2)s 
+                        AND a.%(recommender)s = %%s)""" % {
+            'aggr': aggr_table,
+            'so1': qn(_column(AggregatedRelationshipInstance, 'subject_object1')),
+            'so2': qn(_column(AggregatedRelationshipInstance, 'subject_object2')),
+            'description': qn(_column(AggregatedRelationshipInstance, 'description')),
+            'expectancy': qn(_column(AggregatedRelationshipInstance, 'expectancy')),
+            'recommender': qn(_column(AggregatedRelationshipInstance, 'recommender')),
+            'rel_type': qn(_column(AggregatedRelationshipInstance, 'relationship_type')),
+            'instances': qn(RelationshipInstance._meta.db_table),
+            'ri_pk': qn(RelationshipInstance._meta.pk.column),
+            'ri_so1': qn(_column(RelationshipInstance, 'subject_object1')),
+            'ri_so2': qn(_column(RelationshipInstance, 'subject_object2')),
+            'ri_def': qn(_column(RelationshipInstance, 'definition')),
+            'definitions': qn(RuleRelationshipDefinition._meta.db_table),
+            'def_ptr': qn(RuleRelationshipDefinition._meta.pk.column),
+            'is_positive': qn(_column(RuleRelationshipDefinition, 'is_positive')),
+            'weight': qn(_column(RuleRelationshipDefinition, 'weight')),
+            'def_rel_type': qn(_column(RuleRelationshipDefinition, 'relationship_type')),
+            'base_definitions': qn(BaseRelationshipDefinition._meta.db_table),
+            'base_pk': qn(BaseRelationshipDefinition._meta.pk.column),
+            'base_recommender': qn(_column(BaseRelationshipDefinition, 'recommender')),
+            'rules': qn(RuleInstance._meta.db_table),
+            'rule_ptr': qn(RuleInstance._meta.pk.column),
+            'confidence': qn(_column(RuleInstance, 'confidence')),
+        }
+        
+        params = [recommender_model.pk, recommender_model.pk, recommender_model.pk]
+        
+        if entity_ids is not None:
+            placeholders = ', '.join(['%s'] * len(entity_ids))
+            
+            sql += " AND (ri.%s IN (%s) OR ri.%s IN (%s))" % (
+                qn(_column(RelationshipInstance, 'subject_object1')), placeholders,
+                qn(_column(RelationshipInstance, 'subject_object2')), placeholders)
+            
+            params += entity_ids + entity_ids
+        
+        sql += " GROUP BY ri.%s, ri.%s" % (
+            qn(_column(RelationshipInstance, 'subject_object1')),
+            qn(_column(RelationshipInstance, 'subject_object2')))
+        
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        
+        transaction.commit_unless_managed()
+        
+        if not self.fill_descriptions:
+            return
+        
+        # the descriptions in the order of the expectancy
+        #
+        
+        instance_qs = self._filter_instances(recommender_model)
+        
+        if entity_ids is not None:
+            instance_qs = instance_qs.filter(
+                Q(subject_object1__id__in=entity_ids) | Q(subject_object2__id__in=entity_ids))
+        
+        definitions = definition_registry.get_definitions(recommender_model, RuleRelationshipDefinition)
+        
+        confidences = RuleInstance.get_confidences(definitions.keys())
+        
+        rows = ((pk, so1, so2, description, _count_expectancy(
+                    is_positive=definitions[definition_id].is_positive,
+                    weight=definitions[definition_id].weight,
+                    confidence=confidences.get(pk, 1))) \
+            for pk, so1, so2, definition_id, description in instance_qs\
+                .order_by('subject_object1__id', 'subject_object2__id', 'pk')\
+                .values_list('pk', 'subject_object1', 'subject_object2', 'definition', 'description')\
+                .iterator())
+        
+        self._update_descriptions(
+            model=AggregatedRelationshipInstance,
+            key_fields=('subject_object1', 'subject_object2', 'recommender'),
+            rows=((so1, so2, recommender_model.pk, exp, description) \
+                for pk, so1, so2, description, exp in rows))
+    
+    def _update_descriptions(self, model, key_fields, rows):
+        """Join the descriptions of the aggregated instances and update
+        the aggregates by batches.
+        
+        @type model: django.db.models.Model subclass
+        @param model: the aggregate model
+        
+        @type key_fields: tuple of str
+        @param key_fields: the names of the fields identifying the aggregate
+        
+        @type rows: iterable of tuples
+        @param rows: the values of the key fields followed by the expectancy
+            and the description of the aggregated instance, ordered by the key
+        """
+        qn = connection.ops.quote_name
+        
+        sql = "UPDATE %s SET %s = %%s WHERE %s" % (
+            qn(model._meta.db_table),
+            qn(_column(model, 'description')),
+            ' AND '.join(['%s = %%s' % qn(_column(model, f)) for f in key_fields]))
+        
+        cursor = connection.cursor()
+        
+        key_count = len(key_fields)
+        
+        batch = []
+        
+        for key, key_rows in groupby(rows, key=lambda row: row[:key_count]):
+            
+            # sort the description list by expectancy and join it
+            desc_list = sorted([row[key_count:] for row in key_rows], 
+                            key=lambda pair: pair[0], reverse=True)
+            
+            batch.append([' '.join([desc for x, desc in desc_list])] + list(key))
+            
+            if len(batch) >= self.batch_size:
+                cursor.executemany(sql, batch)
+                batch = []
+        
+        if batch:
+            cursor.executemany(sql, batch)
+        
+        transaction.commit_unless_managed()
+    
+    def _aggregate_instances(self, recommender_model, instance_qs):
+        """Linearly combine the instances to one aggregate for each pair.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender the aggregates belong to
+        
+        @type instance_qs: QuerySet
+        @param instance_qs: the instances ordered by the pair
+        """
         
         # if there's nothing to aggregate, schluss
         if not instance_qs:
@@ -65,12 +295,16 @@ class LinearAggregator(BaseAggregator):
             
         first_inst = instance_qs[0]
         
+        inserter = BulkInserter(
+                    model=AggregatedRelationshipInstance, 
+                    batch_size=self.batch_size)
+        
         # continuously built aggregated instance
         # initialize it wit the first instance
         cont_inst = AggregatedRelationshipInstance(
                 subject_object1=first_inst.subject_object1,
                 subject_object2=first_inst.subject_object2, 
-                relationship_type=first_inst.definition.as_leaf_class().relationship_type,
+                relationship_type=definition_registry.get(first_inst.definition_id).relationship_type,
                 recommender=recommender_model)
 
         exp = first_inst.get_expectancy()
@@ -95,13 +329,13 @@ class LinearAggregator(BaseAggregator):
                 cont_inst.description = ' '.join([desc for x, desc in desc_list])
 
                 # save the current instance
-                cont_inst.save()
+                inserter.add(cont_inst)
                 
                 # start a new continuously aggregated instance
                 cont_inst = AggregatedRelationshipInstance(
                     subject_object1=instance.subject_object1,
                     subject_object2=instance.subject_object2, 
-                    relationship_type=instance.definition.as_leaf_class().relationship_type,
+                    relationship_type=definition_registry.get(instance.definition_id).relationship_type,
                     recommender=recommender_model)
                 
                 exp = instance.get_expectancy()
@@ -131,13 +365,11 @@ class LinearAggregator(BaseAggregator):
         cont_inst.description = ' '.join([desc for x, desc in desc_list])
 
         # save the last instance
-        cont_inst.save()
-        
-        print "    %d rule/relationship aggregates created" % \
-            AggregatedRelationshipInstance.objects.filter(recommender=recommender_model).count()
+        inserter.add(cont_inst)
+        inserter.flush()
         
 
-    def aggregate_biases(self, recommender_model):
+    def aggregate_biases(self, recommender_model, entity_ids=None):
         """For documentation see the base class.
         
         Linearly combines the bias instances.
@@ -147,10 +379,14 @@ class LinearAggregator(BaseAggregator):
         of their owners, the highest expectancy comes first.
         """
         
+        qs_aggregated = AggregatedBiasInstance.objects.filter(recommender=recommender_model)
+        
+        if entity_ids is not None:
+            qs_aggregated = qs_aggregated.filter(subject_object__id__in=entity_ids)
+        
         # if there's something in the database for the recommender
         # throw an error
-        if  AggregatedBiasInstance.objects\
-            .filter(recommender=recommender_model).exists():
+        if qs_aggregated.exists():
             
             raise InvalidParameterError(
                 message="There're unexpected aggregated instances for the recommender.", 
@@ -158,6 +394,20 @@ class LinearAggregator(BaseAggregator):
                 parameter_name="recommender_model", 
                 parameter_value=recommender_model)
 
+        if self.pushdown:
+            if entity_ids is None:
+                self._insert_bias_aggregates(recommender_model)
+            else:
+                entity_ids = list(entity_ids)
+                
+                for i in xrange(0, len(entity_ids), DEFAULT_QUERY_CHUNK_SIZE):
+                    self._insert_bias_aggregates(recommender_model, 
+                        entity_ids[i:i + DEFAULT_QUERY_CHUNK_SIZE])
+            
+            build_profiler.message("    %d bias aggregates created" % \
+                AggregatedBiasInstance.objects.filter(recommender=recommender_model).count())
+            return
+        
         # aggregate it
         # 
         
@@ -166,8 +416,15 @@ class LinearAggregator(BaseAggregator):
             .filter(recommender=recommender_model)\
             .annotate(num_bias=Count('biasinstance'))\
             .filter(num_bias__gt=0)
+        
+        if entity_ids is not None:
+            qs_biased_so = qs_biased_so.filter(pk__in=entity_ids)
               
         count = 0
+        
+        inserter = BulkInserter(
+                    model=AggregatedBiasInstance, 
+                    batch_size=self.batch_size)
                             
         # go through the biased subjectobjects
         for so in qs_biased_so.iterator(): 
@@ -194,14 +451,105 @@ class LinearAggregator(BaseAggregator):
             desc = ' '.join([d for x, d in desc_list])
             
             # create and save the model
-            AggregatedBiasInstance.objects.create(
+            inserter.add(AggregatedBiasInstance(
                 expectancy=avg_exp,
                 subject_object=so,
                 recommender=recommender_model,
                 description=desc
-            )
+            ))
         
-        print "    %d bias aggregates created" % \
-            AggregatedBiasInstance.objects.filter(recommender=recommender_model).count()
-                        
+        inserter.flush()
+        
+        build_profiler.message("    %d bias aggregates created" % \
+            AggregatedBiasInstance.objects.filter(recommender=recommender_model).count())
+    
+    def _insert_bias_aggregates(self, recommender_model, entity_ids=None):
+        """Count the average expectancies of the bias instances for each 
+        subject/object by GROUP BY and write the aggregates 
+        by INSERT ... SELECT. The descriptions are filled afterwards,
+        if fill_descriptions is set.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender the aggregates belong to
+        
+        @type entity_ids: list of int
+        @param entity_ids: if given, only the biases of the entities 
+            are aggregated
+        """
+        qn = connection.ops.quote_name
+        
+        sql = """INSERT INTO %(aggr)s (%(expectancy)s, %(so)s, %(recommender)s, %(description)s)
+            SELECT AVG(0.5 + (CASE WHEN d.%(is_positive)s THEN 1 ELSE -1 END) * d.%(weight)s * 
+                    b.%(confidence)s / 2),
+                b.%(b_so)s, %%s, ''
+            FROM %(biases)s b
+                INNER JOIN %(definitions)s d ON d.%(def_pk)s = b.%(b_def)s
+            WHERE d.%(def_recommender)s = %%s""" % {
+            'aggr': qn(AggregatedBiasInstance._meta.db_table),
+            'expectancy': qn(_column(AggregatedBiasInstance, 'expectancy')),
+            'so': qn(_column(AggregatedBiasInstance, 'subject_object')),
+            'recommender': qn(_column(AggregatedBiasInstance, 'recommender')),
+            'description': qn(_column(AggregatedBiasInstance, 'description')),
+            'biases': qn(BiasInstance._meta.db_table),
+            'b_so': qn(_column(BiasInstance, 'subject_object')),
+            'b_def': qn(_column(BiasInstance, 'definition')),
+            'confidence': qn(_column(BiasInstance, 'confidence')),
+            'definitions': qn(BiasDefinition._meta.db_table),
+            'def_pk': qn(BiasDefinition._meta.pk.column),
+            'def_recommender': qn(_column(BiasDefinition, 'recommender')),
+            'is_positive': qn(_column(BiasDefinition, 'is_positive')),
+            'weight': qn(_column(BiasDefinition, 'weight')),
+        }
+        
+        params = [recommender_model.pk, recommender_model.pk]
+        
+        if entity_ids is not None:
+            sql += " AND b.%s IN (%s)" % (
+                qn(_column(BiasInstance, 'subject_object')), 
+                ', '.join(['%s'] * len(entity_ids)))
+            
+            params += entity_ids
+        
+        sql += " GROUP BY b.%s" % qn(_column(BiasInstance, 'subject_object'))
+        
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        
+        transaction.commit_unless_managed()
+        
+        if not self.fill_descriptions:
+            return
+        
+        qs_biases = BiasInstance.objects.filter(definition__recommender=recommender_model)
+        
+        if entity_ids is not None:
+            qs_biases = qs_biases.filter(subject_object__id__in=entity_ids)
+        
+        definitions = definition_registry.get_bias_definitions(recommender_model)
+        
+        self._update_descriptions(
+            model=AggregatedBiasInstance,
+            key_fields=('subject_object', 'recommender'),
+            rows=((so, recommender_model.pk, _count_expectancy(
+                        is_positive=definitions[definition_id].is_positive,
+                        weight=definitions[definition_id].weight,
+                        confidence=confidence), description) \
+                for so, definition_id, confidence, description in qs_biases\
+                    .order_by('subject_object', 'pk')\
+                    .values_list('subject_object', 'definition', 'confidence', 'description')\
+                    .iterator()))
 
+
+def _column(model, field_name):
+    """Get the database column of the model field.
+    
+    @type model: django.db.models.Model subclass
+    @param model: the model
+    
+    @type field_name: str
+    @param field_name: the name of the field
+    
+    @rtype: str
+    @return: the column name
+    """
+    return model._meta.get_field(field_name).column
@@ -7,3 +7,4 @@ the known preferences, like collaborative filtering.
 from simple_algorithm import SimpleAlgorithm
 from aggregating_algorithm import AggregatingAlgorithm
 from compiling_algorithm import CompilingAlgorithm
+from precomputing_algorithm import PrecomputingAlgorithm
@@ -1,6 +1,7 @@
 """The aggregating algorithm class"""
 
 from base import BaseAlgorithm
+from unresyst.profiler import build_profiler
 
 class AggregatingAlgorithm(BaseAlgorithm):
     """The algorithm that aggregates the similarity relationships and biases,
@@ -22,13 +23,35 @@ class AggregatingAlgorithm(BaseAlgorithm):
         Aggregates and calls the inner algorithm build
         """
         
-        # aggregate the relationships and rules
-        self.aggregator.aggregate_rules_relationships(
-            recommender_model=recommender_model)        
+        with build_profiler.stage('aggregation'):
         
-        # aggregate the biases
-        self.aggregator.aggregate_biases(recommender_model=recommender_model)
+            # aggregate the relationships and rules
+            self.aggregator.aggregate_rules_relationships(
+                recommender_model=recommender_model)        
+            
+            # aggregate the biases
+            self.aggregator.aggregate_biases(recommender_model=recommender_model)
         
-        print "Rules, relationships and biases aggregated. Building the inner algorithm..."
+        build_profiler.message("Rules, relationships and biases aggregated. Building the inner algorithm...")
         
         super(AggregatingAlgorithm, self).build(recommender_model=recommender_model)
+
+    def update(self, recommender_model, entity_ids, subject_ids, bias_ids=()):
+        """See the base class for documentation.
+        
+        Aggregates the changed instances again and updates the inner algorithm
+        with the entities whose aggregated bias has changed.
+        """
+        
+        changed = self.aggregator.update(
+                    recommender_model=recommender_model,
+                    entity_ids=entity_ids,
+                    bias_ids=bias_ids)
+        
+        build_profiler.message("Aggregates updated, %d biases changed. Updating the inner algorithm..." % len(changed))
+        
+        return super(AggregatingAlgorithm, self).update(
+            recommender_model=recommender_model,
+            entity_ids=entity_ids,
+            subject_ids=subject_ids,
+            bias_ids=changed)
@@ -59,6 +59,37 @@ class BaseAlgorithm(object):
                 dn_object=dn_object, 
                 remove_predicted=remove_predicted)
 
+
+    def get_relationship_predictions(self, recommender_model, pairs, remove_predicted):
+        """Get the predictions for many subject-object pairs at once.
+
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender whose instances should
+            be aggregated.         
+        
+        @type pairs: list of pairs of models.common.SubjectObject
+        @param pairs: the domain neutral subjects and objects
+
+        @type remove_predicted: bool
+        @param remove_predicted: should pairs already having 
+            predicted_relationship between them get the special expectancy value?
+            
+        @rtype: list of models.algorithm.RelationshipPredictionInstance
+        @return: the predictions in the order of the pairs
+        """
+        if self.inner_algorithm:
+            return self.inner_algorithm.get_relationship_predictions(
+                recommender_model=recommender_model, 
+                pairs=pairs,
+                remove_predicted=remove_predicted)
+        
+        # the algorithm can predict only one pair at a time
+        return [self.get_relationship_prediction(
+                    recommender_model=recommender_model,
+                    dn_subject=dn_subject,
+                    dn_object=dn_object,
+                    remove_predicted=remove_predicted) \
+                        for dn_subject, dn_object in pairs]
         
     def get_recommendations(self, recommender_model, dn_subject, count, expectancy_limit, remove_predicted):
         """Get the recommendations for the given subject
@@ -123,8 +154,55 @@ class BaseAlgorithm(object):
     # Update phase:
     #         
     
-    def update(self, recommender, aggregated_changes):
-        """Update the recommender algorithm structures according to the changes
-        in the aggregated relationships.
+    def update(self, recommender_model, entity_ids, subject_ids, bias_ids=()):
+        """Update the recommender algorithm structures after the given 
+        entities were added, updated or removed by the abstractor.
+
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the updated recommender
+        
+        @type entity_ids: list of int
+        @param entity_ids: the ids of the added/updated domain neutral 
+            entities, empty for a removal
+        
+        @type subject_ids: iterable of int
+        @param subject_ids: the ids of the subjects whose predictions could
+            depend on the entities before the change
+        
+        @type bias_ids: iterable of int
+        @param bias_ids: the ids of the entities whose bias has changed.
+            The aggregating algorithm passes on the ones whose aggregated 
+            bias has changed, as a dictionary id: the old aggregated 
+            expectancy (None if there was none).
+        
+        @rtype: set of int
+        @return: the ids of the subjects whose predictions have changed
+        """
+        if self.inner_algorithm:
+            return self.inner_algorithm.update(
+                recommender_model=recommender_model,
+                entity_ids=entity_ids,
+                subject_ids=subject_ids,
+                bias_ids=bias_ids)
+        
+        return set(subject_ids)
+    
+    
+    def get_affected_subjects(self, recommender_model, entity_ids):
+        """Get the subjects whose predictions depend on the given entities.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender model
         
+        @type entity_ids: list of int
+        @param entity_ids: the ids of the domain neutral entities
+        
+        @rtype: set of int
+        @return: the ids of the subjects
         """
+        if self.inner_algorithm:
+            return self.inner_algorithm.get_affected_subjects(
+                recommender_model=recommender_model,
+                entity_ids=entity_ids)
+        
+        return set()
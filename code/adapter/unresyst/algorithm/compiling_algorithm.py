@@ -1,6 +1,7 @@
 """The CompilingAlgorithm class"""
 
 from base import BaseAlgorithm
+from unresyst.profiler import build_profiler
 
 class CompilingAlgorithm(BaseAlgorithm):
     """The algorithm that compiles aggregated similarities and biases with
@@ -19,16 +20,51 @@ class CompilingAlgorithm(BaseAlgorithm):
         
         Compiles and calls the inner algorithm build
         """        
-        print "  Compiling aggregates and predictions."
+        build_profiler.message("  Compiling aggregates and predictions.")
         
-        self.compilator.compile_all(recommender_model)             
+        with build_profiler.stage('compilation'):
+            self.compilator.compile_all(recommender_model)             
         
 
-        print "Predictions compiled. Building the inner algorithm..."
+        build_profiler.message("Predictions compiled. Building the inner algorithm...")
         
         super(CompilingAlgorithm, self).build(recommender_model=recommender_model)    
 
         
+    def update(self, recommender_model, entity_ids, subject_ids, bias_ids=()):
+        """See the base class for documentation.
+        
+        Compiles the predictions of the affected subjects again and updates
+        the inner algorithm
+        """
+        build_profiler.message("  Compiling the changed predictions.")
+        
+        affected = self.compilator.update(
+                    recommender_model=recommender_model,
+                    entity_ids=entity_ids,
+                    subject_ids=subject_ids,
+                    bias_ids=bias_ids)
+        
+        build_profiler.message("Predictions compiled. Updating the inner algorithm...")
+        
+        return affected | super(CompilingAlgorithm, self).update(
+            recommender_model=recommender_model,
+            entity_ids=entity_ids,
+            subject_ids=affected,
+            bias_ids=bias_ids)
+    
+    def get_affected_subjects(self, recommender_model, entity_ids):
+        """See the base class for documentation.
+        
+        The subjects whose compiled predictions depend on the entities.
+        """
+        return self.compilator.get_affected_subjects(
+                    recommender_model=recommender_model,
+                    entity_ids=entity_ids) \
+                | super(CompilingAlgorithm, self).get_affected_subjects(
+                    recommender_model=recommender_model,
+                    entity_ids=entity_ids)
+        
     def get_relationship_prediction(self, recommender_model, dn_subject, dn_object, remove_predicted):
         """See the base class for the documentation.
         
@@ -67,6 +103,38 @@ class CompilingAlgorithm(BaseAlgorithm):
                 dn_subject=dn_subject, 
                 dn_object=dn_object
             )   
+
+    def get_relationship_predictions(self, recommender_model, pairs, remove_predicted):
+        """See the base class for the documentation.
+        
+        The same as get_relationship_prediction, the pairs unknown to the inner
+        algorithm are compiled at once.
+        """
+        
+        # get what we have from the inner algo
+        predictions = super(CompilingAlgorithm, self).get_relationship_predictions(
+                            recommender_model=recommender_model,
+                            pairs=pairs,
+                            remove_predicted=remove_predicted)
+        
+        # the positions of the uncertain non-trivial predictions
+        unknown = [i for i, pred in enumerate(predictions) \
+                        if pred.is_uncertain and not (remove_predicted and pred.is_trivial)]
+        
+        if not unknown:
+            return predictions
+            
+        # compile them from all available info
+        compiled = self.compilator.compile_predictions(
+            recommender_model=recommender_model,
+            pairs=[pairs[i] for i in unknown])
+        
+        # the ones where nothing was found stay uncertain
+        for i, prediction in zip(unknown, compiled):
+            if prediction:
+                predictions[i] = prediction
+        
+        return predictions
             
     def get_recommendations(self, recommender_model, dn_subject, count, expectancy_limit, remove_predicted):
         """See the base class for the documentation.                
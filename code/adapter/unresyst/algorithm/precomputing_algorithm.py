@@ -0,0 +1,155 @@
+"""The PrecomputingAlgorithm class"""
+
+from base import BaseAlgorithm
+from unresyst.constants import *
+from unresyst.models.common import SubjectObject
+from unresyst.models.algorithm import RelationshipPredictionInstance, \
+    PrecomputedRecommendation
+from unresyst.models.bulk import BulkInserter
+from unresyst.profiler import build_profiler
+
+class PrecomputingAlgorithm(BaseAlgorithm):
+    """The algorithm storing the recommendation list of each subject during
+    the build. The recommendations are then read from the stored lists,
+    the inner algorithm is asked only for longer lists than stored.
+
+    The lists are obtained from the inner algorithm with the
+    remove_predicted setting of the recommender model and no expectancy
+    limit, the limit is applied when reading.
+    """
+
+    def __init__(self, inner_algorithm, count=DEFAULT_PRECOMPUTED_RECOMMENDATION_COUNT,
+            batch_size=DEFAULT_BULK_BATCH_SIZE):
+        """The initializer"""
+
+        super(PrecomputingAlgorithm, self).__init__(inner_algorithm=inner_algorithm)
+
+        self.count = count
+        """The length of the stored list for each subject"""
+
+        self.batch_size = batch_size
+        """The number of list items written to the database at once"""
+
+    def build(self, recommender_model):
+        """See the base class for documentation.
+
+        Calls the inner algorithm build and stores the lists.
+        """
+        super(PrecomputingAlgorithm, self).build(recommender_model=recommender_model)
+
+        build_profiler.message("  Precomputing recommendation lists.")
+
+        with build_profiler.stage('precomputation'):
+            self.precompute(recommender_model)
+
+        build_profiler.message("Recommendation lists precomputed.")
+
+    def update(self, recommender_model, entity_ids, subject_ids, bias_ids=()):
+        """See the base class for documentation.
+
+        Updates the inner algorithm and stores the lists of the subjects
+        whose predictions have changed again.
+        """
+        affected = super(PrecomputingAlgorithm, self).update(
+                    recommender_model=recommender_model,
+                    entity_ids=entity_ids,
+                    subject_ids=subject_ids,
+                    bias_ids=bias_ids)
+
+        build_profiler.message("  Precomputing recommendation lists of %d subjects." % len(affected))
+
+        self.precompute(recommender_model, subject_ids=affected)
+
+        return affected
+
+    def precompute(self, recommender_model, subject_ids=None):
+        """Store the recommendation lists of the subjects of the recommender,
+        the old lists are deleted.
+
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the built recommender
+
+        @type subject_ids: iterable of int
+        @param subject_ids: the ids of the subjects whose lists should be
+            stored, if None, all subjects are taken
+        """
+        subject_ent_type = ENTITY_TYPE_SUBJECTOBJECT if recommender_model.are_subjects_objects \
+                else ENTITY_TYPE_SUBJECT
+
+        qs_subjects = SubjectObject.objects.filter(
+                        recommender=recommender_model,
+                        entity_type=subject_ent_type)
+
+        if subject_ids is None:
+            PrecomputedRecommendation.objects.filter(recommender=recommender_model).delete()
+
+            chunks = [qs_subjects]
+        else:
+            subject_ids = sorted(subject_ids)
+
+            chunks = [qs_subjects.filter(pk__in=subject_ids[i:i + DEFAULT_QUERY_CHUNK_SIZE]) \
+                        for i in xrange(0, len(subject_ids), DEFAULT_QUERY_CHUNK_SIZE)]
+
+            for qs in chunks:
+                PrecomputedRecommendation.objects.filter(subject__in=qs).delete()
+
+        inserter = BulkInserter(
+                    model=PrecomputedRecommendation,
+                    batch_size=self.batch_size)
+
+        for subj in (subj for qs in chunks for subj in qs.iterator()):
+
+            predictions = self.inner_algorithm.get_recommendations(
+                            recommender_model=recommender_model,
+                            dn_subject=subj,
+                            count=self.count,
+                            expectancy_limit=0,
+                            remove_predicted=recommender_model.remove_predicted_from_recommendations)
+
+            for rank, pred in enumerate(predictions):
+                inserter.add(PrecomputedRecommendation(
+                    subject=subj,
+                    recommended_object_id=pred.subject_object2_id,
+                    rank=rank,
+                    expectancy=pred.expectancy,
+                    description=pred.description,
+                    is_uncertain=pred.is_uncertain,
+                    recommender=recommender_model))
+
+        inserter.flush()
+
+        build_profiler.message("    %d recommendation list items created" % inserter.count)
+
+    def get_recommendations(self, recommender_model, dn_subject, count, expectancy_limit, remove_predicted):
+        """See the base class for the documentation.
+
+        Read the stored list if it can answer the request, otherwise
+        ask the inner algorithm.
+        """
+
+        # the stored list doesn't fit, ask the inner algorithm
+        if count > self.count or expectancy_limit < 0 or \
+                remove_predicted != recommender_model.remove_predicted_from_recommendations:
+
+            return super(PrecomputingAlgorithm, self).get_recommendations(
+                recommender_model=recommender_model,
+                dn_subject=dn_subject,
+                count=count,
+                expectancy_limit=expectancy_limit,
+                remove_predicted=remove_predicted)
+
+        # the list ordered by the expectancy from the largest
+        qs_items = PrecomputedRecommendation.objects\
+                    .filter(
+                        subject=dn_subject,
+                        expectancy__gt=expectancy_limit)\
+                    .order_by('rank')
+
+        return [RelationshipPredictionInstance(
+                    subject_object1=dn_subject,
+                    subject_object2_id=item.recommended_object_id,
+                    expectancy=item.expectancy,
+                    description=item.description,
+                    is_uncertain=item.is_uncertain,
+                    recommender=recommender_model) \
+                        for item in qs_items[:count]]
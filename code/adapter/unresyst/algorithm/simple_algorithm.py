@@ -1,6 +1,7 @@
 """A trivial algorithm returning what it has"""
 
 from base import BaseAlgorithm
+from unresyst.constants import *
 from unresyst.models.abstractor import RelationshipInstance, \
     PredictedRelationshipDefinition
 from unresyst.models.algorithm import RelationshipPredictionInstance
@@ -64,6 +65,75 @@ class SimpleAlgorithm(BaseAlgorithm):
                 dn_subject=dn_subject, 
                 dn_object=dn_object
             )        
+
+    def get_relationship_predictions(self, recommender_model, pairs, remove_predicted):
+        """See the base class for the documentation.
+        
+        Here - the same as get_relationship_prediction, the predicted
+        relationships and the predictions are obtained by one query
+        for each chunk of the pairs.
+        """
+        ret = []
+        
+        for i in xrange(0, len(pairs), DEFAULT_QUERY_CHUNK_SIZE):
+            
+            chunk = pairs[i:i + DEFAULT_QUERY_CHUNK_SIZE]
+            
+            subj_ids = set(dn_subject.pk for dn_subject, dn_object in chunk)
+            obj_ids = set(dn_object.pk for dn_subject, dn_object in chunk)
+            
+            # the predicted relationships between the entities, in both directions
+            predicted_dict = {}
+            
+            if remove_predicted:
+                
+                entity_ids = list(subj_ids | obj_ids)
+                
+                qs_predicted = RelationshipInstance.filter_predicted(recommender_model)\
+                                .filter(
+                                    subject_object1__pk__in=entity_ids,
+                                    subject_object2__pk__in=entity_ids)\
+                                .select_related('subject_object1', 'subject_object2')
+                
+                for predicted in qs_predicted:
+                    predicted_dict[(predicted.subject_object1_id, predicted.subject_object2_id)] = predicted
+                    predicted_dict[(predicted.subject_object2_id, predicted.subject_object1_id)] = predicted
+            
+            # the available predictions
+            qs_pred = RelationshipPredictionInstance.objects.filter(
+                            recommender=recommender_model,
+                            subject_object1__pk__in=list(subj_ids),
+                            subject_object2__pk__in=list(obj_ids))
+            
+            pred_dict = dict(((pred.subject_object1_id, pred.subject_object2_id), pred) \
+                                for pred in qs_pred)
+            
+            for dn_subject, dn_object in chunk:
+                
+                key = (dn_subject.pk, dn_object.pk)
+                
+                # if the pair is in the predicted_rel, return the special 
+                # expectancy value
+                if key in predicted_dict:
+                    ret.append(self._get_already_in_relatinship_prediction(
+                        recommender_model=recommender_model,
+                        predicted_relationship=predicted_dict[key]))
+                
+                # if prediction available, return it
+                elif key in pred_dict:
+                    pred = pred_dict[key]
+                    pred.subject_object1 = dn_subject
+                    pred.subject_object2 = dn_object
+                    ret.append(pred)
+                
+                # otherwise return the uncertain
+                else:
+                    ret.append(self._get_uncertain_prediction(
+                        recommender_model=recommender_model, 
+                        dn_subject=dn_subject, 
+                        dn_object=dn_object))
+        
+        return ret
             
     def get_recommendations(self, recommender_model, dn_subject, count, expectancy_limit, remove_predicted):
         """See the base class for the documentation.
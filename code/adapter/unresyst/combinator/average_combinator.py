@@ -6,6 +6,9 @@ class AverageCombinator(BaseCombinator):
     """A combinator using weighted average
     """
     
+    USES_POSITIVENESS = False
+    """The average doesn't care"""
+    
     def _combine(self, combination_elements, ResultClass):
         """See the base class for documentation"""
                                 
@@ -17,3 +20,17 @@ class AverageCombinator(BaseCombinator):
         desc = self._concat_descriptions(combination_elements)
             
         return ResultClass(expectancy=avgexp, description=desc)
+        
+    def _combine_segments(self, expectancies, positiveness, offsets):
+        """See the base class for documentation"""
+        
+        from segments import average
+        
+        return average(expectancies, positiveness, offsets)
+        
+    def _describe(self, combination_elements):
+        """See the base class for documentation. The elements are ordered
+        by the expectancy as in _combine."""
+        
+        return self._concat_descriptions(
+            sorted(combination_elements, key=lambda el: el.get_expectancy(), reverse=True))
@@ -1,12 +1,20 @@
 """Base classes for the combinator layer:
  - BaseCombinator
 """
+from collections import namedtuple
+
 from unresyst.exceptions import CombinatorError
 from unresyst.models.abstractor import RelationshipInstance, RuleInstance, \
     ExplicitRuleInstance, PredictedRelationshipDefinition, ClusterMember
 from unresyst.models.aggregator import AggregatedRelationshipInstance, AggregatedBiasInstance
 from unresyst.models.algorithm import RelationshipPredictionInstance
 from unresyst.constants import *
+from unresyst.models.common import SubjectObject
+from combination_element import BaseCombinationElement
+from candidates import CandidateIndex
+
+_SegmentResult = namedtuple('_SegmentResult', 'expectancy description')
+"""The result class for combining the segments one by one"""
 
 class BaseCombinator(object):
     """The base class defining the interface of all combinators.
@@ -14,10 +22,14 @@ class BaseCombinator(object):
      - combine_pair_similarities
      - combine_entity_biases
      - combine_pair_prediction_elements
+     - the _batch variants of the three above
+     - combine_segments
      - choose_promising_objects
         
     methods to be overriden:
      - _combine     
+     - _combine_segments (optional, vectorized version of _combine)
+     - _describe (optional)
      
     helper methods for subclasses:
      - _concat_descriptions        
@@ -27,10 +39,29 @@ class BaseCombinator(object):
     """A constant for dividing the relationship members that would otherwise be 
     too numerous"""
     
-    def __init__(self):
+    USES_POSITIVENESS = True
+    """Does the combination depend on the element positiveness? If not, 
+    it isn't obtained from the elements in the batch combination."""
+    
+    def __init__(self, use_candidate_index=False):
         """The initializer"""
         
         self.top_bias_objects = None
+        
+        self.use_candidate_index = use_candidate_index
+        """Should the promising objects be chosen from the in-memory index 
+        (candidates.CandidateIndex) instead of querying the database for each
+        subject? The index is built at the first call after reset_cache."""
+        
+        self._candidate_index = None
+        """The loaded index, if used"""
+        
+    def reset_cache(self):
+        """Forget the data cached from the database, to be called when 
+        the recommender data change."""
+        
+        self.top_bias_objects = None
+        self._candidate_index = None
 
     def _checked_combine(self, combination_elements, ResultClass):
         """Check if something was given and call the overriden _combine method
@@ -38,6 +69,54 @@ class BaseCombinator(object):
         if not combination_elements:
             raise CombinatorError("No combination_elements given")
         return self._combine(combination_elements, ResultClass)
+    
+    def _checked_combine_batch(self, element_lists, ResultClass):
+        """Combine the lists of elements at once through combine_segments, 
+        the descriptions are created by _describe. Without numpy the lists 
+        are combined one by one through _combine.
+        
+        @type element_lists: a list of lists of BaseCombinationElement
+        @param element_lists: the lists of elements, each is combined to 
+            one result
+        
+        @type ResultClass: class
+        @param ResultClass: the class which instances will be returned
+        
+        @rtype: list of ResultClass
+        @return: the combination results in the order of element_lists
+        """
+        # numpy is optional, the batch combination needs it
+        try:
+            import numpy
+        except ImportError:
+            return [self._checked_combine(list(combination_elements), ResultClass) \
+                        for combination_elements in element_lists]
+        
+        offsets = [0]
+        expectancies = []
+        positiveness = []
+        
+        for combination_elements in element_lists:
+            
+            if not combination_elements:
+                raise CombinatorError("No combination_elements given")
+            
+            expectancies.extend(el.get_expectancy() for el in combination_elements)
+            
+            if self.USES_POSITIVENESS:
+                positiveness.extend(el.get_positiveness() for el in combination_elements)
+            else:
+                positiveness.extend([False] * len(combination_elements))
+
+            offsets.append(len(expectancies))
+        
+        res_exps = self.combine_segments(
+            expectancies=expectancies, 
+            positiveness=positiveness, 
+            offsets=offsets)
+        
+        return [ResultClass(expectancy=float(res_exp), description=self._describe(combination_elements)) \
+                    for res_exp, combination_elements in zip(res_exps, element_lists)]
                     
     def _combine(self, combination_elements, ResultClass):
         """Combine the combination elements to produce an instance 
@@ -55,6 +134,78 @@ class BaseCombinator(object):
         @return: the combination class with filled expectancy and description
         """
         pass
+    
+    def combine_segments(self, expectancies, positiveness, offsets):
+        """Combine many segments of elements at once, giving only 
+        the expectancies. The i-th segment is offsets[i]:offsets[i+1] in
+        the element arrays.
+        
+        @type expectancies: sequence of float
+        @param expectancies: the expectancies of the elements of all segments
+        
+        @type positiveness: sequence of bool
+        @param positiveness: the positiveness of the elements of all segments
+        
+        @type offsets: sequence of int
+        @param offsets: the segment boundaries, starting with 0, ending with
+            the number of elements
+            
+        @rtype: numpy array of float
+        @return: the combined expectancy for each segment, the same as 
+            _combine would give.
+            
+        @raise CombinatorError: if some segment is empty
+        """
+        # numpy is needed only here, the _batch methods do without it
+        import numpy as np
+        
+        expectancies = np.asarray(expectancies, dtype=np.float64)
+        positiveness = np.asarray(positiveness, dtype=np.bool_)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        
+        if len(offsets) < 2:
+            return np.zeros(0)
+        
+        if (np.diff(offsets) <= 0).any():
+            raise CombinatorError("No combination_elements given for some segment")
+            
+        return self._combine_segments(expectancies, positiveness, offsets)
+        
+    def _combine_segments(self, expectancies, positiveness, offsets):
+        """Combine the segments, parameters as for combine_segments, already
+        checked and converted to numpy arrays.
+        
+        Overriden in subclasses by a vectorized version, here the segments 
+        are combined one by one through _combine.
+        """
+        import numpy as np
+        
+        res_exps = np.empty(len(offsets) - 1)
+        
+        for i in xrange(len(offsets) - 1):
+            
+            start, end = offsets[i], offsets[i + 1]
+            
+            combination_elements = [
+                BaseCombinationElement(expectancy=float(exp), positiveness=bool(pos)) \
+                    for exp, pos in zip(expectancies[start:end], positiveness[start:end])]
+                    
+            res_exps[i] = self._combine(combination_elements, _SegmentResult).expectancy
+            
+        return res_exps
+    
+    def _describe(self, combination_elements):
+        """Create the description of the combination of the elements
+        for the batch combination. Overriden in subclasses that order
+        the elements.
+        
+        @type combination_elements: a list of BaseCombinationElement
+        @param combination_elements: the combined elements
+        
+        @rtype: str
+        @return: the description
+        """
+        return self._concat_descriptions(combination_elements)
 
     @staticmethod
     def _concat_descriptions(element_list):
@@ -125,6 +276,47 @@ class BaseCombinator(object):
         return self._checked_combine(
             combination_elements=combination_elements,
             ResultClass=RelationshipPredictionInstance)
+    
+    def combine_pair_similarities_batch(self, element_lists):
+        """Aggregate similarities of many pairs at once, see
+        combine_pair_similarities.
+        
+        @type element_lists: a list of lists of BaseCombinationElement
+        @param element_lists: the elements for each pair
+        
+        @rtype: list of AggregatedRelationshipInstance
+        @return: the aggregates in the order of element_lists
+        """
+        return self._checked_combine_batch(
+            element_lists=element_lists, 
+            ResultClass=AggregatedRelationshipInstance)
+    
+    def combine_entity_biases_batch(self, element_lists):
+        """Aggregate biases of many entities at once, see combine_entity_biases.
+        
+        @type element_lists: a list of lists of BaseCombinationElement
+        @param element_lists: the biases for each entity
+        
+        @rtype: list of AggregatedBiasInstance
+        @return: the aggregates in the order of element_lists
+        """
+        return self._checked_combine_batch(
+            element_lists=element_lists, 
+            ResultClass=AggregatedBiasInstance)
+    
+    def combine_pair_prediction_elements_batch(self, element_lists):
+        """Combine all preference sources of many pairs at once, see 
+        combine_pair_prediction_elements.
+        
+        @type element_lists: a list of lists of BaseCombinationElement
+        @param element_lists: the elements for each pair
+        
+        @rtype: list of RelationshipPredictionInstance
+        @return: the predictions in the order of element_lists
+        """
+        return self._checked_combine_batch(
+            element_lists=element_lists, 
+            ResultClass=RelationshipPredictionInstance)
 
             
     def choose_promising_objects(self, dn_subject, min_count):
@@ -155,6 +347,9 @@ class BaseCombinator(object):
                 
         recommender_model = dn_subject.recommender
         
+        if self.use_candidate_index:
+            return self._choose_indexed_objects(dn_subject, min_count, recommender_model)
+        
         object_ent_type =  ENTITY_TYPE_SUBJECTOBJECT \
             if recommender_model.are_subjects_objects else \
                 ENTITY_TYPE_OBJECT
@@ -224,6 +419,31 @@ class BaseCombinator(object):
         # remove the duplicates and take only some of the first
         return list(set([obj for obj, x in ret_list]))[:int(PROMISING_RATE*min_count)]
 
+    def _choose_indexed_objects(self, dn_subject, min_count, recommender_model):
+        """Get the promising objects from the candidate index, build the index
+        if it isn't built for the recommender and min_count.
+        
+        @rtype: list of SubjectObject
+        @return: the promising objects, the most promising first
+        """
+        index = self._candidate_index
+        
+        if index is None or index.recommender_id != recommender_model.pk \
+                or index.size != min_count:
+            
+            index = CandidateIndex(
+                        recommender_model=recommender_model, 
+                        size=min_count, 
+                        divisor=self.DIVISOR)
+            
+            self._candidate_index = index
+        
+        object_ids = index.get_candidates(dn_subject.pk)
+        
+        objects = SubjectObject.objects.in_bulk(object_ids)
+        
+        return [objects[object_id] for object_id in object_ids]
+
     def _get_promising_objects_clusters(self, dn_subject, min_count, recommender_model):
         """Get promising objects from predicted_relationship + cluster membership
 
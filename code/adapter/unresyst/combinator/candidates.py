@@ -0,0 +1,254 @@
+"""The in-memory index of the promising objects for the subjects.
+
+The sources of BaseCombinator.choose_promising_objects are loaded once
+to posting lists keyed by the SubjectObject id, each sorted by the
+expectancy descending and cut to the needed length:
+ - subject: the liked objects (predicted relationship)
+ - subject: the objects of the positive s-o rules/relationships, explicit rules
+ - entity: the top similar entities (aggregated similarities)
+ - entity: the cluster memberships, cluster: the members
+ - the top biased objects
+
+The candidates for a subject are then obtained by merging some of the lists,
+without querying the database.
+"""
+
+import heapq
+
+from unresyst.constants import *
+from unresyst.models.common import SubjectObject
+from unresyst.models.abstractor import RelationshipInstance, RuleInstance, \
+    ExplicitRuleInstance, PredictedRelationshipDefinition, RuleRelationshipDefinition, \
+    ClusterMember, definition_registry, _count_expectancy
+from unresyst.models.aggregator import AggregatedRelationshipInstance, AggregatedBiasInstance
+
+def _add_top(lists, key, item, size):
+    """Add the item to the list of the key, keeping only the size biggest items.
+
+    The lists are heaps until _sort_lists is called.
+
+    @type lists: dict key: list
+    @param lists: the lists
+
+    @param key: the key of the list
+
+    @type item: tuple (expectancy, ...)
+    @param item: the added item, compared by the expectancy first
+
+    @type size: int
+    @param size: the maximal length of the list
+    """
+    heap = lists.setdefault(key, [])
+
+    if len(heap) < size:
+        heapq.heappush(heap, item)
+    elif item > heap[0]:
+        heapq.heapreplace(heap, item)
+
+def _sort_lists(lists):
+    """Sort the lists made by _add_top, the biggest items first.
+
+    @type lists: dict key: list
+    @param lists: the lists
+    """
+    for key, heap in lists.iteritems():
+        heap.sort(reverse=True)
+
+
+class CandidateIndex(object):
+    """The posting lists of the candidates for the promising objects of
+    a recommender, built for the given number of objects per subject.
+    """
+
+    def __init__(self, recommender_model, size, divisor):
+        """The initializer, loads the lists.
+
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender
+
+        @type size: int
+        @param size: the number of objects that is taken from each source
+            (min_count of choose_promising_objects)
+
+        @type divisor: int
+        @param divisor: the divisor of size for the numerous sources
+            (BaseCombinator.DIVISOR)
+        """
+        self.recommender_id = recommender_model.pk
+        """The id of the recommender model"""
+
+        self.size = size
+        """The number of objects taken from each source"""
+
+        self.divisor = divisor
+        """The divisor of size for the numerous sources"""
+
+        self.remove_predicted = recommender_model.remove_predicted_from_recommendations
+        """Should the liked objects be left out?"""
+
+        object_ent_type = ENTITY_TYPE_SUBJECTOBJECT \
+            if recommender_model.are_subjects_objects else \
+                ENTITY_TYPE_OBJECT
+
+        rel_type = RELATIONSHIP_TYPE_SUBJECTOBJECT_SUBJECTOBJECT \
+            if recommender_model.are_subjects_objects else \
+                RELATIONSHIP_TYPE_SUBJECT_OBJECT
+
+        # there's exactly one
+        predicted_def, = definition_registry.get_definitions(
+                            recommender_model, PredictedRelationshipDefinition).values()
+
+        # the liked objects
+        #
+        self._liked = {}
+        """Dictionary subject id: list of the liked object ids"""
+
+        for subject_id, object_id in RelationshipInstance.objects\
+                .filter(definition=predicted_def)\
+                .order_by('pk')\
+                .values_list('subject_object1', 'subject_object2')\
+                .iterator():
+            self._liked.setdefault(subject_id, []).append(object_id)
+
+        # the s-o rules, relationships and explicit rules
+        #
+        self._preferences = {}
+        """Dictionary subject id: list of (expectancy, object id)"""
+
+        definitions = dict((pk, definition) for pk, definition in \
+            definition_registry.get_definitions(recommender_model, RuleRelationshipDefinition).iteritems() \
+                if definition.relationship_type == rel_type and definition.is_positive)
+
+        confidences = RuleInstance.get_confidences(definitions.keys())
+
+        for pk, subject_id, object_id, definition_id in RelationshipInstance.objects\
+                .filter(definition__in=definitions.keys())\
+                .values_list('pk', 'subject_object1', 'subject_object2', 'definition')\
+                .iterator():
+
+            definition = definitions[definition_id]
+
+            _add_top(self._preferences, subject_id,
+                (_count_expectancy(definition.is_positive, definition.weight, confidences.get(pk, 1)), object_id),
+                2 * size)
+
+        for subject_id, object_id, expectancy in ExplicitRuleInstance.objects\
+                .filter(
+                    definition__recommender=recommender_model,
+                    expectancy__gt=UNCERTAIN_PREDICTION_VALUE)\
+                .values_list('subject_object1', 'subject_object2', 'expectancy')\
+                .iterator():
+            _add_top(self._preferences, subject_id, (expectancy, object_id), 3 * size)
+
+        # the similarities, in both directions
+        #
+        self._similar = {}
+        """Dictionary entity id: list of (expectancy, similar entity id)"""
+
+        for id1, id2, expectancy in AggregatedRelationshipInstance.objects\
+                .filter(
+                    recommender=recommender_model,
+                    expectancy__gt=UNCERTAIN_PREDICTION_VALUE)\
+                .values_list('subject_object1', 'subject_object2', 'expectancy')\
+                .iterator():
+            _add_top(self._similar, id1, (expectancy, id2), size)
+            _add_top(self._similar, id2, (expectancy, id1), size)
+
+        # the cluster memberships
+        #
+        self._memberships = {}
+        """Dictionary entity id: list of (confidence, cluster id)"""
+
+        self._members = {}
+        """Dictionary cluster id: list of (confidence, member id)"""
+
+        for cluster_id, member_id, confidence in ClusterMember.objects\
+                .filter(cluster__cluster_set__recommender=recommender_model)\
+                .values_list('cluster', 'member', 'confidence')\
+                .iterator():
+            _add_top(self._memberships, member_id, (confidence, cluster_id), size)
+            _add_top(self._members, cluster_id, (confidence, member_id), size + 1)
+
+        for lists in (self._preferences, self._similar, self._memberships, self._members):
+            _sort_lists(lists)
+
+        # the biased objects
+        #
+        self._biased = list(AggregatedBiasInstance.objects\
+            .filter(
+                recommender=recommender_model,
+                subject_object__entity_type=object_ent_type,
+                expectancy__gt=UNCERTAIN_PREDICTION_VALUE)\
+            .order_by('-expectancy')\
+            .values_list('expectancy', 'subject_object')[:size])
+        """List of (expectancy, object id) of the most biased objects"""
+
+    def get_candidates(self, subject_id):
+        """Get the ids of the promising objects for the subject, the most
+        promising first.
+
+        @type subject_id: int
+        @param subject_id: the id of the SubjectObject subject
+
+        @rtype: list of int
+        @return: at most PROMISING_RATE * size object ids
+        """
+        size = self.size
+        part = size / self.divisor
+        cluster_part = size / (2 * self.divisor)
+
+        liked = self._liked.get(subject_id, [])
+
+        # the lists of (expectancy, object id)
+        candidates = list(self._biased)
+
+        # s-o rules, relationships, explicit rules
+        candidates.extend(self._preferences.get(subject_id, []))
+
+        # predicted_relationship + object similarities
+        candidates.extend(heapq.nlargest(size, (sim for object_id in liked \
+            for sim in self._similar.get(object_id, []))))
+
+        # predicted_relationship + subject similarities
+        for expectancy, similar_id in self._similar.get(subject_id, [])[:part]:
+            candidates.extend((expectancy, object_id) \
+                for object_id in self._liked.get(similar_id, [])[:part])
+
+        # predicted_relationship + subject cluster memberships
+        for confidence1, cluster_id in self._memberships.get(subject_id, [])[:cluster_part]:
+
+            members = [(confidence2, member_id) for confidence2, member_id in \
+                self._members[cluster_id] if member_id != subject_id][:cluster_part]
+
+            for confidence2, member_id in members:
+                candidates.extend(
+                    ((confidence1 * confidence2) / 2 + UNCERTAIN_PREDICTION_VALUE, object_id) \
+                        for object_id in self._liked.get(member_id, [])[:part])
+
+        # predicted_relationship + object cluster memberships
+        cluster_objects = ((confidence / 2 + UNCERTAIN_PREDICTION_VALUE, member_id) \
+            for object_id in liked \
+            for ignore, cluster_id in self._memberships.get(object_id, []) \
+            for confidence, member_id in self._members[cluster_id])
+
+        candidates.extend(heapq.nlargest(size, cluster_objects))
+
+        # the liked objects aren't recommended
+        excluded = set(liked) if self.remove_predicted else set()
+
+        candidates.sort(reverse=True)
+
+        ret = []
+
+        for expectancy, object_id in candidates:
+
+            if object_id in excluded:
+                continue
+
+            excluded.add(object_id)
+            ret.append(object_id)
+
+            if len(ret) >= int(PROMISING_RATE * size):
+                break
+
+        return ret
@@ -2,7 +2,14 @@
 Instancies of the classes represent knowledge that we have about a pair
 to count similarity/preference."""
 
+from collections import namedtuple
+
 from unresyst.constants import *
+from unresyst.models.abstractor import definition_registry
+
+InstanceRecord = namedtuple('InstanceRecord', 'expectancy description')
+"""The stand-in for the model instances in the combination elements,
+having only the attributes the elements use."""
 
 def _get_expectancy_positiveness(expectancy):
     return expectancy > UNCERTAIN_PREDICTION_VALUE
@@ -10,10 +17,11 @@ def _get_expectancy_positiveness(expectancy):
 class BaseCombinationElement(object):
     """The base for all elements that are being combined in combinator"""
     
-    def __init__(self):
-        """Initialize the members"""
-        self._positiveness = None
-        self._expectancy = None
+    def __init__(self, expectancy=None, positiveness=None):
+        """Initialize the members. The expectancy and positiveness can be
+        given if they are already known (e.g. from the compilator graph)."""
+        self._positiveness = positiveness
+        self._expectancy = expectancy
         self._description = None
     
     def get_positiveness(self):
@@ -58,15 +66,23 @@ class SubjectObjectRelCombinationElement(BaseCombinationElement):
     For compilator.   
     """
     
-    def __init__(self, rel_instance):
+    def __init__(self, rel_instance, expectancy=None, positiveness=None):
         """The initializer"""
         
-        super(SubjectObjectRelCombinationElement, self).__init__()
+        super(SubjectObjectRelCombinationElement, self).__init__(
+            expectancy=expectancy, 
+            positiveness=positiveness)
         
         self.rel_instance = rel_instance
 
     def _get_positiveness(self):
-        return self.rel_instance.definition.as_leaf_class().is_positive
+        leaf_definition = definition_registry.get(self.rel_instance.definition_id)
+        
+        # the explicit rules have the positiveness only in the expectancy
+        if not hasattr(leaf_definition, 'is_positive'):
+            return _get_expectancy_positiveness(self.get_expectancy())
+            
+        return leaf_definition.is_positive
 
     def _get_expectancy(self):
         return self.rel_instance.get_expectancy()        
@@ -85,10 +101,12 @@ class RelSimilarityCombinationElement(_SimilarityCombinationElement):
     For Aggregator.
     """
     
-    def __init__(self, rel_instance):
+    def __init__(self, rel_instance, expectancy=None, positiveness=None):
         """The initializer"""
         
-        super(RelSimilarityCombinationElement, self).__init__()
+        super(RelSimilarityCombinationElement, self).__init__(
+            expectancy=expectancy, 
+            positiveness=positiveness)
         
         self.rel_instance = rel_instance
         """The rule/relationship instance the similarity is obtained from
@@ -96,7 +114,7 @@ class RelSimilarityCombinationElement(_SimilarityCombinationElement):
         """
         
     def _get_positiveness(self):
-        return self.rel_instance.definition.as_leaf_class().is_positive
+        return definition_registry.get(self.rel_instance.definition_id).is_positive
 
     def _get_expectancy(self):
         return self.rel_instance.get_expectancy()        
@@ -111,10 +129,11 @@ class ClusterSimilarityCombinationElement(_SimilarityCombinationElement):
     For combinator and aggregator.
     """
 
-    def __init__(self, cluster_members):
+    def __init__(self, cluster_members, expectancy=None):
         """The initializer"""
         
-        super(ClusterSimilarityCombinationElement, self).__init__()
+        super(ClusterSimilarityCombinationElement, self).__init__(
+            expectancy=expectancy)
         
         self.cluster_members = cluster_members
         """The pair of cluster members that caused the similarity
@@ -38,3 +38,10 @@ class ConfidenceFactorCombinator(BaseCombinator):
         desc = self._concat_descriptions(combination_elements)
             
         return ResultClass(expectancy=res_exp, description=desc)
+        
+    def _combine_segments(self, expectancies, positiveness, offsets):
+        """See the base class for documentation"""
+        
+        from segments import confidence_factor
+        
+        return confidence_factor(expectancies, positiveness, offsets)
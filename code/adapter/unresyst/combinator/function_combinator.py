@@ -6,6 +6,9 @@ class FunctionCombinator(BaseCombinator):
     """A combinator using a special function to combine.
     """
     
+    USES_POSITIVENESS = False
+    """The function doesn't care"""
+    
     def _combine(self, combination_elements, ResultClass):
         """See the base class for documentation"""
         
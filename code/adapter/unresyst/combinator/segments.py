@@ -0,0 +1,84 @@
+"""Vectorized combination of many segments of combination elements at once.
+
+The expectancies and positiveness of the elements of all segments (e.g. pairs)
+are given in flat arrays, the i-th segment is offsets[i]:offsets[i+1].
+The functions give the same expectancies as the _combine methods
+of the combinators. No segment can be empty.
+"""
+
+import numpy as np
+
+def average(expectancies, positiveness, offsets):
+    """The average of the expectancies, see AverageCombinator.
+
+    @type expectancies: numpy array of float
+    @param expectancies: the expectancies of all elements
+
+    @type positiveness: numpy array of bool
+    @param positiveness: the positiveness of all elements
+
+    @type offsets: numpy array of int
+    @param offsets: the segment boundaries, one more than the number of segments
+
+    @rtype: numpy array of float
+    @return: the combined expectancy for each segment
+    """
+    return np.add.reduceat(expectancies, offsets[:-1]) / np.diff(offsets)
+
+
+def twisted_average(expectancies, positiveness, offsets):
+    """The twisted average, see TwistedAverageCombinator.
+    Parameters as for average.
+    """
+    lengths = np.diff(offsets)
+
+    # number of positive elements
+    num_positive = np.add.reduceat(positiveness.astype(np.int64), offsets[:-1])
+
+    # the difference between the number of positive and negative
+    pos_dif = np.abs(lengths - 2 * num_positive).astype(np.float64)
+
+    avgexp = average(expectancies, positiveness, offsets)
+
+    low = np.power(2.0, pos_dif) * np.power(avgexp, pos_dif + 1)
+    high = 1 - np.abs(np.power(2.0, pos_dif) * np.power(avgexp - 1, pos_dif + 1))
+
+    # select the formula according to the expectancy
+    return np.where(avgexp <= 0.5, low, high)
+
+
+def confidence_factor(expectancies, positiveness, offsets):
+    """The confidence factor calculus, see ConfidenceFactorCombinator.
+    Parameters as for average.
+
+    The elements are folded in their order, all segments at once - in the k-th
+    step the k-th element of each segment long enough is added.
+    """
+    starts = offsets[:-1]
+    lengths = np.diff(offsets)
+
+    res_exp = expectancies[starts].astype(np.float64)
+
+    for k in xrange(1, lengths.max()):
+
+        # the segments having the k-th element
+        active = np.nonzero(lengths > k)[0]
+
+        # convert to confidence factors
+        res_cf = 2 * res_exp[active] - 1
+        ce_cf = 2 * expectancies[starts[active] + k] - 1
+
+        # count the confidence factor combination
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mixed_cf = (res_cf * ce_cf) / (1 - np.minimum(np.abs(res_cf), np.abs(ce_cf)))
+
+        comb_cf = np.where((res_cf > 0) & (ce_cf > 0),
+            res_cf + ce_cf * (1 - res_cf),
+            np.where((res_cf < 0) & (ce_cf < 0),
+                res_cf + ce_cf * (1 + res_cf),
+                mixed_cf))
+
+        # and back to expectancy
+        res_exp[active] = (comb_cf + 1) / 2
+
+    return res_exp
@@ -32,3 +32,10 @@ class TwistedAverageCombinator(BaseCombinator):
         
         # return the resulting class
         return ResultClass(expectancy=res_exp, description=desc)
+        
+    def _combine_segments(self, expectancies, positiveness, offsets):
+        """See the base class for documentation"""
+        
+        from segments import twisted_average
+        
+        return twisted_average(expectancies, positiveness, offsets)
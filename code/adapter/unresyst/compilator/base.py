@@ -9,6 +9,21 @@ from unresyst.combinator.combination_element import BiasAggregateCombinationElem
 from unresyst.models.aggregator import AggregatedBiasInstance, AggregatedRelationshipInstance
 from unresyst.models.abstractor import PredictedRelationshipDefinition, RelationshipInstance, \
     ClusterMember, ExplicitRuleInstance
+from unresyst.models.common import SubjectObject
+from unresyst.models.algorithm import RelationshipPredictionInstance
+
+
+def _chunks(ids):
+    """Divide the list of ids to chunks that can be passed to an IN query.
+    
+    @type ids: list of int
+    @param ids: the ids
+    
+    @rtype: generator of lists of int
+    @return: the chunks
+    """
+    for i in xrange(0, len(ids), DEFAULT_QUERY_CHUNK_SIZE):
+        yield ids[i:i + DEFAULT_QUERY_CHUNK_SIZE]
 
 
 class BaseCompilator(object):
@@ -19,7 +34,9 @@ class BaseCompilator(object):
             combinator=None, 
             depth=DEFAULT_COMPILATOR_DEPTH, 
             breadth=DEFAULT_COMPILATOR_BREADTH,
-            pair_depth=DEFAULT_COMPILATOR_PAIR_DEPTH):
+            pair_depth=DEFAULT_COMPILATOR_PAIR_DEPTH,
+            batch_size=DEFAULT_BULK_BATCH_SIZE,
+            use_graph=False):
         """The initializer"""
 
         self.combinator = combinator
@@ -37,6 +54,17 @@ class BaseCompilator(object):
         """The number of combination elements that can be taken for each pair from
         each group. Used only for cluster membership.
         """
+        
+        self.batch_size = batch_size
+        """The number of predictions written to the database at once"""
+        
+        self.use_graph = use_graph
+        """Should the combination elements be found in the in-memory graph
+        (graph.CompilatorGraph) instead of querying the database? Needs numpy.
+        """
+        
+        self._graph = None
+        """The loaded graph, if used"""
 
         
 
@@ -46,6 +74,364 @@ class BaseCompilator(object):
         pass
         
     
+    def compile_predictions(self, recommender_model, pairs):
+        """Create the predictions for many pairs, using the compile_prediction
+        method of the subclass for each pair.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender model
+        
+        @type pairs: list of pairs of SubjectObject
+        @param pairs: the domain neutral subjects and objects
+        
+        @rtype: list of RelationshipPredictionInstance
+        @return: the predictions in the order of the pairs, None for pairs
+            nothing is known about
+        """
+        return [self.compile_prediction(
+                    recommender_model=recommender_model,
+                    dn_subject=dn_subject,
+                    dn_object=dn_object) \
+                        for dn_subject, dn_object in pairs]
+        
+    
+    def update(self, recommender_model, entity_ids, subject_ids, bias_ids=()):
+        """Compile the predictions again after the given entities have changed.
+        
+        Here all predictions are deleted and compiled again, the subclasses
+        can recompile only the affected subjects.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender model
+        
+        @type entity_ids: list of int
+        @param entity_ids: the ids of the changed domain neutral entities
+        
+        @type subject_ids: iterable of int
+        @param subject_ids: the ids of the subjects whose predictions 
+            have to be compiled again anyway
+        
+        @type bias_ids: iterable of int
+        @param bias_ids: the ids of the entities whose aggregated bias has
+            changed
+        
+        @rtype: set of int
+        @return: the ids of the subjects whose predictions were compiled again
+        """
+        self.reset_cache()
+        
+        RelationshipPredictionInstance.objects.filter(recommender=recommender_model).delete()
+        
+        self.compile_all(recommender_model)
+        
+        return set(self._filter_subjects(recommender_model).values_list('pk', flat=True))
+    
+    
+    def get_affected_subjects(self, recommender_model, entity_ids, bias_ids=()):
+        """Get the subjects whose compiled predictions can depend on the given
+        entities:
+         - the subjects themselves
+         - the subjects similar or in a common cluster with the subjects
+         - the subjects in some relationship with the objects
+         - the subjects in the predicted relationship with objects similar or
+           in a common cluster with the objects
+         - the subjects similar or in a common cluster with the subjects
+           in the predicted relationship with the objects
+         - the subjects whose aggregated bias has changed
+         - all subjects if the list of the most biased objects has changed,
+           the list is promising for all of them
+        
+        The predictions of the other subjects with the objects whose 
+        aggregated bias has changed aren't compiled again, they are rescored,
+        see rescore_objects.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender model
+        
+        @type entity_ids: iterable of int
+        @param entity_ids: the ids of the domain neutral entities
+        
+        @type bias_ids: iterable of int
+        @param bias_ids: the ids of the entities whose aggregated bias has
+            changed, if it's a dictionary, the old expectancies by the ids
+            (None if there was no bias)
+        
+        @rtype: set of int
+        @return: the ids of the affected subjects
+        """
+        subject_ent_type = ENTITY_TYPE_SUBJECTOBJECT if recommender_model.are_subjects_objects \
+                else ENTITY_TYPE_SUBJECT 
+        object_ent_type = ENTITY_TYPE_SUBJECTOBJECT if recommender_model.are_subjects_objects \
+                else ENTITY_TYPE_OBJECT
+        
+        # the most biased objects are promising for all subjects
+        if self._is_top_bias_changed(recommender_model, bias_ids):
+            return set(self._filter_subjects(recommender_model).values_list('pk', flat=True))
+        
+        entity_ids = list(entity_ids)
+        bias_ids = list(bias_ids)
+        
+        qs_entities = SubjectObject.objects.filter(recommender=recommender_model)
+        
+        subj_ids = set()
+        obj_ids = set()
+        biased_subj_ids = set()
+        
+        for chunk in _chunks(entity_ids):
+            subj_ids.update(qs_entities.filter(pk__in=chunk, entity_type=subject_ent_type)\
+                .values_list('pk', flat=True))
+            obj_ids.update(qs_entities.filter(pk__in=chunk, entity_type=object_ent_type)\
+                .values_list('pk', flat=True))
+        
+        for chunk in _chunks(bias_ids):
+            biased_subj_ids.update(qs_entities.filter(pk__in=chunk, entity_type=subject_ent_type)\
+                .values_list('pk', flat=True))
+        
+        # the subjects and their neighbours, the subjects with a changed bias
+        affected = subj_ids | self._get_neighbours(recommender_model, subj_ids, subject_ent_type) \
+                    | biased_subj_ids
+        
+        if not obj_ids:
+            return affected
+        
+        qs_predicted = RelationshipInstance.filter_predicted(recommender_model)
+        
+        likers = set()
+        
+        for chunk in _chunks(list(obj_ids)):
+            
+            # the subjects in some relationship with the objects
+            for qs in (RelationshipInstance.objects.filter(definition__recommender=recommender_model),
+                    ExplicitRuleInstance.objects.filter(definition__recommender=recommender_model)):
+                
+                affected.update(qs.filter(subject_object2__id__in=chunk, 
+                    subject_object1__entity_type=subject_ent_type)\
+                        .values_list('subject_object1__id', flat=True))
+                affected.update(qs.filter(subject_object1__id__in=chunk, 
+                    subject_object2__entity_type=subject_ent_type)\
+                        .values_list('subject_object2__id', flat=True))
+            
+            likers.update(qs_predicted.filter(subject_object2__id__in=chunk)\
+                .values_list('subject_object1__id', flat=True))
+        
+        # the neighbours of the subjects liking the objects
+        affected.update(self._get_neighbours(recommender_model, likers, subject_ent_type))
+        
+        # the subjects liking the neighbours of the objects
+        similar_obj_ids = list(self._get_neighbours(recommender_model, obj_ids, object_ent_type))
+        
+        for chunk in _chunks(similar_obj_ids):
+            affected.update(qs_predicted.filter(subject_object2__id__in=chunk)\
+                .values_list('subject_object1__id', flat=True))
+        
+        return affected
+    
+    
+    def _is_top_bias_changed(self, recommender_model, bias_ids):
+        """Have the changed biases changed the list of the most biased 
+        objects, chosen as promising for all subjects?
+        
+        The old list is made from the current biases of the other objects 
+        and the old biases of the changed ones.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender model
+        
+        @type bias_ids: dict int: float, or iterable of int
+        @param bias_ids: the old expectancies by the ids of the entities whose
+            aggregated bias has changed. Without the expectancies the changed 
+            objects are taken as previously unbiased.
+        
+        @rtype: bool
+        """
+        if not self.breadth or not bias_ids:
+            return False
+        
+        old_expectancies = bias_ids if isinstance(bias_ids, dict) else dict.fromkeys(bias_ids)
+        
+        object_ent_type = ENTITY_TYPE_SUBJECTOBJECT if recommender_model.are_subjects_objects \
+                else ENTITY_TYPE_OBJECT
+        
+        # the list has breadth objects, see choose_promising_objects, so the 
+        # unchanged objects of the old list are among the first 
+        # breadth + the number of the changed
+        biases = list(AggregatedBiasInstance.objects\
+            .filter(recommender=recommender_model, 
+                subject_object__entity_type=object_ent_type,
+                expectancy__gt=UNCERTAIN_PREDICTION_VALUE)\
+            .order_by('-expectancy')\
+            .values_list('expectancy', 'subject_object__id')\
+                [:self.breadth + len(old_expectancies)])
+        
+        new_top = set(ent_id for expectancy, ent_id in biases[:self.breadth])
+        
+        old_biases = [(expectancy, ent_id) for expectancy, ent_id in biases \
+                        if ent_id not in old_expectancies]
+        
+        old_biased_ids = [ent_id for ent_id, expectancy in old_expectancies.iteritems() \
+                            if expectancy is not None \
+                                and expectancy > UNCERTAIN_PREDICTION_VALUE]
+        
+        # only the objects
+        for chunk in _chunks(old_biased_ids):
+            old_biases.extend((old_expectancies[ent_id], ent_id) for ent_id in \
+                SubjectObject.objects.filter(pk__in=chunk, entity_type=object_ent_type)\
+                    .values_list('pk', flat=True))
+        
+        old_biases.sort(reverse=True)
+        
+        old_top = set(ent_id for expectancy, ent_id in old_biases[:self.breadth])
+        
+        return old_top != new_top
+    
+    
+    def rescore_objects(self, recommender_model, bias_ids, subject_ids=()):
+        """Combine again the compiled predictions with the objects whose 
+        aggregated bias has changed, the other subjects keep their promising 
+        objects. The objects with a new bias become promising for the subjects 
+        compiled later.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender model
+        
+        @type bias_ids: iterable of int
+        @param bias_ids: the ids of the entities whose aggregated bias has
+            changed, only the objects among them are taken
+        
+        @type subject_ids: iterable of int
+        @param subject_ids: the ids of the subjects whose predictions were 
+            compiled again, they are skipped
+        
+        @rtype: set of int
+        @return: the ids of the subjects whose predictions were rescored
+        """
+        object_ent_type = ENTITY_TYPE_SUBJECTOBJECT if recommender_model.are_subjects_objects \
+                else ENTITY_TYPE_OBJECT
+        
+        subject_ids = set(subject_ids)
+        
+        rescored = set()
+        
+        for chunk in _chunks(list(bias_ids)):
+            
+            # the compiled predictions with the objects
+            preds = [pred for pred in RelationshipPredictionInstance.objects\
+                        .filter(recommender=recommender_model,
+                            subject_object2__id__in=chunk,
+                            subject_object2__entity_type=object_ent_type,
+                            is_trivial=False)\
+                        .select_related('subject_object1', 'subject_object2')\
+                            if pred.subject_object1_id not in subject_ids]
+            
+            compiled = self.compile_predictions(
+                recommender_model=recommender_model,
+                pairs=[(pred.subject_object1, pred.subject_object2) for pred in preds])
+            
+            for pred, new_pred in zip(preds, compiled):
+                
+                # nothing is known about the pair anymore
+                if new_pred is None:
+                    pred.delete()
+                
+                else:
+                    RelationshipPredictionInstance.objects.filter(pk=pred.pk).update(
+                        expectancy=new_pred.expectancy,
+                        description=new_pred.description)
+                
+                rescored.add(pred.subject_object1_id)
+        
+        return rescored
+    
+    
+    def _get_neighbours(self, recommender_model, entity_ids, entity_type):
+        """Get the entities of the given type similar or in a common cluster
+        with the given entities.
+        
+        @rtype: set of int
+        @return: the ids of the neighbours
+        """
+        ret = set()
+        
+        qs_similarities = AggregatedRelationshipInstance.objects.filter(recommender=recommender_model)
+        
+        for chunk in _chunks(list(entity_ids)):
+            
+            ret.update(qs_similarities.filter(
+                    subject_object1__id__in=chunk, 
+                    subject_object2__entity_type=entity_type)\
+                .values_list('subject_object2__id', flat=True))
+            
+            ret.update(qs_similarities.filter(
+                    subject_object2__id__in=chunk, 
+                    subject_object1__entity_type=entity_type)\
+                .values_list('subject_object1__id', flat=True))
+            
+            ret.update(ClusterMember.objects.filter(
+                    cluster__clustermember__member__id__in=chunk,
+                    member__entity_type=entity_type)\
+                .values_list('member__id', flat=True))
+        
+        return ret
+    
+    
+    @staticmethod
+    def _filter_subjects(recommender_model):
+        """Get the subjects (or subjectobjects) of the recommender ordered
+        by the id.
+        
+        @rtype: QuerySet
+        @return: the domain neutral subjects
+        """
+        subject_ent_type = ENTITY_TYPE_SUBJECTOBJECT if recommender_model.are_subjects_objects \
+                else ENTITY_TYPE_SUBJECT 
+        
+        return SubjectObject.objects.filter(
+                    recommender=recommender_model, 
+                    entity_type=subject_ent_type)\
+                    .order_by('pk')
+    
+    
+    def reset_cache(self):
+        """Forget the data cached from the database - the in-memory graph
+        and the combinator caches. Should be called when the recommender 
+        data change."""
+        
+        self.reset_graph()
+        
+        if self.combinator:
+            self.combinator.reset_cache()
+        
+    
+    def reset_graph(self):
+        """Forget the loaded in-memory graph, it will be loaded again when
+        needed. Should be called when the recommender data change."""
+        self._graph = None
+        
+    
+    def _get_graph(self, recommender_model):
+        """Get the in-memory graph for the recommender, load it if it isn't
+        loaded for the recommender and its build generation. The graph 
+        is loaded again after a rebuild or an update, also in another process.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender model
+        
+        @rtype: graph.CompilatorGraph
+        @return: the graph of the recommender
+        """
+        key = (recommender_model.pk, recommender_model.build_generation)
+        
+        if self._graph is None or \
+                (self._graph.recommender_id, self._graph.build_generation) != key:
+        
+            # numpy is needed only here
+            from graph import CompilatorGraph
+            
+            self._graph = CompilatorGraph(recommender_model=recommender_model)
+        
+        return self._graph
+        
+    
     def get_pair_combination_elements(self, dn_subject, dn_object):
         """Find all we know about the relationship of dn_subject and
         dn_subject using:
@@ -63,6 +449,13 @@ class BaseCompilator(object):
         @rtype: iterable of BaseCombinationElement
         @return: the list of all we know about the pair
         """
+        if self.use_graph:
+            return self._get_graph(dn_subject.recommender)\
+                .get_pair_combination_elements(
+                    subject_id=dn_subject.id, 
+                    object_id=dn_object.id, 
+                    pair_depth=self.pair_depth)
+        
         recommender_model = dn_subject.recommender
         els = []
         other_objs = []
@@ -1,8 +1,15 @@
 """The combining compilator class"""
 
-from base import BaseCompilator
+import multiprocessing
+
+from django.db import connection, transaction
+
+from base import BaseCompilator, _chunks
 from unresyst.constants import *
-from unresyst.models.common import SubjectObject
+from unresyst.profiler import build_profiler
+from unresyst.models.common import SubjectObject, Recommender
+from unresyst.models.algorithm import RelationshipPredictionInstance
+from unresyst.models.bulk import BulkInserter
 from unresyst.exceptions import RecommenderBuildError
 
 class CombiningCompilator(BaseCompilator):
@@ -15,14 +22,26 @@ class CombiningCompilator(BaseCompilator):
             combinator, 
             depth=DEFAULT_COMPILATOR_DEPTH, 
             breadth=DEFAULT_COMPILATOR_BREADTH,
-            pair_depth=DEFAULT_COMPILATOR_PAIR_DEPTH):
+            pair_depth=DEFAULT_COMPILATOR_PAIR_DEPTH,
+            batch_size=DEFAULT_BULK_BATCH_SIZE,
+            use_graph=False,
+            workers=DEFAULT_COMPILATOR_WORKERS,
+            shard_size=DEFAULT_COMPILATOR_SHARD_SIZE):
         """The initializer, combinator is not optional."""    
         
         super(CombiningCompilator, self).__init__(
             combinator=combinator, 
             depth=depth, 
             breadth=breadth,
-            pair_depth=pair_depth)
+            pair_depth=pair_depth,
+            batch_size=batch_size,
+            use_graph=use_graph)
+        
+        self.workers = workers
+        """The number of processes compiling the predictions in parallel"""
+        
+        self.shard_size = shard_size
+        """The number of subjects in a shard given to a worker at once"""
         
     def compile_prediction(self, recommender_model, dn_subject, dn_object):
         """Create a prediction using all available information and the instance combinator.
@@ -53,12 +72,54 @@ class CombiningCompilator(BaseCompilator):
         pred.subject_object1 = dn_subject
         pred.subject_object2 = dn_object
         return pred
+    
+    
+    def compile_predictions(self, recommender_model, pairs):
+        """See the base class for the documentation.
+        
+        Here the predictions of all pairs are combined at once.
+        """
+        element_lists = []
+        known = []
+        
+        # find all we know about the pairs
+        for i, (dn_subject, dn_object) in enumerate(pairs):
+            
+            els = self.get_pair_combination_elements(dn_subject=dn_subject, dn_object=dn_object)
+            
+            if els:
+                element_lists.append(els)
+                known.append(i)
+        
+        ret = [None] * len(pairs)
+        
+        if not known:
+            return ret
+        
+        # combine the known pairs at once
+        preds = self.combinator.combine_pair_prediction_elements_batch(
+                    element_lists=element_lists)
+        
+        # fill the missing fields in the predictions
+        for i, pred in zip(known, preds):
+            
+            pred.recommender = recommender_model
+            pred.subject_object1, pred.subject_object2 = pairs[i]
+            ret[i] = pred
+        
+        return ret
 
     
     def compile_all(self, recommender_model):
         """Compile preferences, known relationships + similarities.
+        
+        If there's more than one worker, the subjects are divided to shards
+        compiled in parallel, see _compile_parallel.
         """
         
+        # the data have been rebuilt
+        self.reset_cache()
+        
         if not self.breadth:
             return
         
@@ -70,37 +131,262 @@ class CombiningCompilator(BaseCompilator):
         
         qs_subjects = SubjectObject.objects.filter(
                         recommender=recommender_model, 
-                        entity_type=subject_ent_type)
+                        entity_type=subject_ent_type)\
+                        .order_by('pk')
 
-        print "  Compiling predictions for %d subjects." % qs_subjects.count()
+        build_profiler.message("  Compiling predictions for %d subjects." % qs_subjects.count())
+        
+        inserter = BulkInserter(
+                    model=RelationshipPredictionInstance, 
+                    batch_size=self.batch_size)
+        
+        if self.workers > 1:
+            self._compile_parallel(
+                recommender_model=recommender_model,
+                subject_ids=list(qs_subjects.values_list('pk', flat=True)),
+                inserter=inserter)
+            return
+        
         i = 0
         
         for subj in qs_subjects.iterator():
             
-            # get the most promising objects for the subject
-            promising_objects = self.combinator.choose_promising_objects(
-                                    dn_subject=subj, 
-                                    min_count=self.breadth)                                                                  
+            preds = self.compile_subject(recommender_model=recommender_model, dn_subject=subj)
                                                     
             if i % 20 == 0:
-                print "    %d subjects processed. Current promising object count: %d" % (i, len(promising_objects))
+                build_profiler.message("    %d subjects processed. Current promising object count: %d" % (i, len(preds)))
             i += 1
-                          
-            # go through the promising objects
-            for obj in promising_objects:
+            
+            for pred in preds:
+                inserter.add(pred)
+        
+        inserter.flush()
+        
+    
+    def update(self, recommender_model, entity_ids, subject_ids, bias_ids=()):
+        """See the base class for the documentation.
+        
+        Only the predictions of the affected subjects are compiled again,
+        the predictions of the others with the objects whose aggregated bias
+        has changed are rescored.
+        """
+        
+        # the data have changed
+        self.reset_cache()
+        
+        affected = set(subject_ids) | self.get_affected_subjects(
+                        recommender_model=recommender_model, 
+                        entity_ids=entity_ids,
+                        bias_ids=bias_ids)
+        
+        affected_ids = sorted(affected)
+        
+        # delete the old predictions of the affected subjects
+        for chunk in _chunks(affected_ids):
+            RelationshipPredictionInstance.objects.filter(
+                recommender=recommender_model,
+                subject_object1__id__in=chunk).delete()
+        
+        if not self.breadth:
+            return affected
+        
+        build_profiler.message("  Compiling predictions for %d affected subjects." % len(affected_ids))
+        
+        inserter = BulkInserter(
+                    model=RelationshipPredictionInstance, 
+                    batch_size=self.batch_size)
+        
+        for chunk in _chunks(affected_ids):
+            
+            qs_subjects = SubjectObject.objects.filter(pk__in=chunk).order_by('pk')
+            
+            for subj in qs_subjects.iterator():
                 
-                # compile the predition and save it
-                pred = self.compile_prediction(
+                for pred in self.compile_subject(recommender_model=recommender_model, dn_subject=subj):
+                    inserter.add(pred)
+        
+        inserter.flush()
+        
+        build_profiler.message("    %d predictions created" % inserter.count)
+        
+        rescored = self.rescore_objects(
                     recommender_model=recommender_model,
-                    dn_subject=subj,
-                    dn_object=obj)
+                    bias_ids=bias_ids,
+                    subject_ids=affected)
+        
+        build_profiler.message("    predictions of %d other subjects rescored" % len(rescored))
+        
+        return affected | rescored
+        
+    
+    def compile_subject(self, recommender_model, dn_subject):
+        """Create the predictions for the most promising objects of the subject.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender model
+        
+        @type dn_subject: SubjectObject
+        @param dn_subject: the domain neutral subject
+        
+        @rtype: list of RelationshipPredictionInstance
+        @return: the unsaved predictions
+        
+        @raise RecommenderBuildError: if nothing is known about some pair
+            with a promising object
+        """
+        
+        # the pairs don't fetch the recommender again
+        dn_subject.recommender = recommender_model
+        
+        # get the most promising objects for the subject
+        promising_objects = self.combinator.choose_promising_objects(
+                                dn_subject=dn_subject, 
+                                min_count=self.breadth)
+                      
+        element_lists = []
+        
+        # go through the promising objects, find all we know about the pairs
+        for obj in promising_objects:
+            
+            els = self.get_pair_combination_elements(dn_subject=dn_subject, dn_object=obj)
 
-                # if the compilate is empty, it's an error                    
-                if not pred:
-                    raise RecommenderBuildError(
-                        message="Nothing found for the pair %s, %s, although the object was in promising." \
-                            % (subj, obj),
-                        recommender=recommender_model)
-                                                            
-                pred.save()
+            # if the compilate is empty, it's an error                    
+            if not els:
+                raise RecommenderBuildError(
+                    message="Nothing found for the pair %s, %s, although the object was in promising." \
+                        % (dn_subject, obj),
+                    recommender=recommender_model)
+            
+            element_lists.append(els)
+        
+        # combine the predictions for all the pairs of the subject at once
+        preds = self.combinator.combine_pair_prediction_elements_batch(
+                    element_lists=element_lists)
+        
+        # fill the missing fields in the predictions
+        for obj, pred in zip(promising_objects, preds):
+            
+            pred.recommender = recommender_model
+            pred.subject_object1 = dn_subject
+            pred.subject_object2 = obj
+        
+        return preds
+        
+    
+    def _compile_parallel(self, recommender_model, subject_ids, inserter):
+        """Compile the predictions for the subjects in worker processes.
+        
+        The subject ids are divided to ranges of shard_size subjects. Each 
+        worker compiles the ranges given to it through its own database 
+        connection, the predictions are sent back and saved here, 
+        in the order of the subjects, as in the serial run.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender model
+        
+        @type subject_ids: list of int
+        @param subject_ids: sorted ids of the subjects to compile
+        
+        @type inserter: BulkInserter
+        @param inserter: the inserter for the predictions
+        
+        @raise RecommenderBuildError: if a transaction of a database file is
+            pending, the connection is closed before forking the workers
+        """
+        # closing the connection would roll the data written so far back,
+        # the in-memory database isn't closed
+        if transaction.is_dirty() and connection.settings_dict['NAME'] != ':memory:':
+            raise RecommenderBuildError(
+                message="Commit the pending transaction before the parallel compilation.",
+                recommender=recommender_model)
+        
+        # the shards - id ranges
+        shards = [(recommender_model.pk, subject_ids[i], subject_ids[min(i + self.shard_size, len(subject_ids)) - 1]) \
+                    for i in xrange(0, len(subject_ids), self.shard_size)]
+        
+        # the workers are forked with the loaded graph
+        if self.use_graph:
+            self._get_graph(recommender_model)
+        
+        # the workers mustn't share the connection
+        connection.close()
+        
+        pool = multiprocessing.Pool(
+                processes=self.workers,
+                initializer=_init_worker,
+                initargs=(self,))
+        
+        try:
+            for i, rows in enumerate(pool.imap(_compile_shard, shards)):
                 
+                for so1_id, so2_id, expectancy, description in rows:
+                    inserter.add(RelationshipPredictionInstance(
+                        subject_object1_id=so1_id,
+                        subject_object2_id=so2_id,
+                        expectancy=expectancy,
+                        description=description,
+                        recommender=recommender_model))
+                
+                build_profiler.message("    %d out of %d shards compiled." % (i + 1, len(shards)))
+            
+            pool.close()
+        
+        finally:
+            pool.terminate()
+            pool.join()
+        
+        inserter.flush()
+
+
+_shard_compilator = None
+"""The compilator used in the worker process, set by _init_worker"""
+
+def _init_worker(compilator):
+    """Initialize the worker process, the profiler of the build isn't
+    running in it.
+    
+    @type compilator: CombiningCompilator
+    @param compilator: the compilator compiling the shards in the process
+    """
+    global _shard_compilator
+    
+    _shard_compilator = compilator
+    
+    build_profiler.reset()
+
+def _compile_shard(shard):
+    """Compile the predictions for a range of subjects, in a worker process.
+    
+    @type shard: tuple (int, int, int)
+    @param shard: the recommender model id, the first and the last subject id
+    
+    @rtype: list of tuples
+    @return: the predictions (subject_object1 id, subject_object2 id, 
+        expectancy, description)
+    """
+    recommender_id, first_id, last_id = shard
+    
+    recommender_model = Recommender.objects.get(pk=recommender_id)
+    
+    subject_ent_type = ENTITY_TYPE_SUBJECTOBJECT if recommender_model.are_subjects_objects \
+            else ENTITY_TYPE_SUBJECT 
+    
+    qs_subjects = SubjectObject.objects.filter(
+                    recommender=recommender_model, 
+                    entity_type=subject_ent_type,
+                    pk__gte=first_id,
+                    pk__lte=last_id)\
+                    .order_by('pk')
+    
+    rows = []
+    
+    for subj in qs_subjects.iterator():
+    
+        for pred in _shard_compilator.compile_subject(
+                recommender_model=recommender_model, 
+                dn_subject=subj):
+            
+            rows.append((pred.subject_object1.pk, pred.subject_object2.pk, 
+                pred.expectancy, pred.description))
+    
+    return rows
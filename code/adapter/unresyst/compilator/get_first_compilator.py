@@ -2,9 +2,11 @@
 
 from base import BaseCompilator
 from unresyst.constants import *
+from unresyst.profiler import build_profiler
 from unresyst.models.aggregator import AggregatedRelationshipInstance
 from unresyst.models.abstractor import RelationshipInstance
 from unresyst.models.algorithm import RelationshipPredictionInstance
+from unresyst.models.bulk import BulkInserter
 
 class GetFirstCompilator(BaseCompilator):
     """Compilator using the first relationship it finds to create a prediction"""
@@ -13,14 +15,16 @@ class GetFirstCompilator(BaseCompilator):
             self, 
             depth=DEFAULT_COMPILATOR_DEPTH, 
             breadth=DEFAULT_COMPILATOR_BREADTH, 
-            pair_depth=DEFAULT_COMPILATOR_PAIR_DEPTH):
+            pair_depth=DEFAULT_COMPILATOR_PAIR_DEPTH,
+            batch_size=DEFAULT_BULK_BATCH_SIZE):
         """The initializer"""    
         
         super(GetFirstCompilator, self).__init__(
             combinator=None, 
             depth=depth, 
             breadth=breadth, 
-            pair_depth=pair_depth)        
+            pair_depth=pair_depth,
+            batch_size=batch_size)        
 
 
     def compile_all(self, recommender_model):
@@ -28,7 +32,7 @@ class GetFirstCompilator(BaseCompilator):
         """
         self.compile_aggregates(recommender_model)
 
-        print "  Compiling similar objects."
+        build_profiler.message("  Compiling similar objects.")
         
         # if subjects == objects
         if recommender_model.are_subjects_objects:
@@ -40,7 +44,7 @@ class GetFirstCompilator(BaseCompilator):
         
             # take similar to the ones we already have (content-based recommender)
             self._compile_similar_objects(recommender_model)
-            print "  Done. Compiling similar subjects."
+            build_profiler.message("  Done. Compiling similar subjects.")
 
             # take liked objects of similar users (almost collaborative filtering)
             self._compile_similar_subjects(recommender_model)   
@@ -59,6 +63,10 @@ class GetFirstCompilator(BaseCompilator):
         qs_aggr = AggregatedRelationshipInstance.objects.filter(
                     recommender=recommender_model,
                     relationship_type=rel_type)
+        
+        inserter = BulkInserter(
+                    model=RelationshipPredictionInstance, 
+                    batch_size=self.batch_size)
 
         # go through the aggregates, create predictions and save them
         for aggr in qs_aggr.iterator():
@@ -73,9 +81,11 @@ class GetFirstCompilator(BaseCompilator):
                             expectancy=aggr.expectancy,
                             recommender=recommender_model)
                             
-            prediction.save()                            
+            inserter.add(prediction)
+        
+        inserter.flush()
         
-        print "    %d aggregated predictions created" % qs_aggr.count()
+        build_profiler.message("    %d aggregated predictions created" % qs_aggr.count())
                             
     
     def _compile_similar_objects(self, recommender_model):
@@ -184,7 +194,7 @@ class GetFirstCompilator(BaseCompilator):
         last_fin = None       
         last_qs = None         
         
-        print "Predicted relationship count: %d" % qs_pred_rel_instances.count()
+        build_profiler.message("Predicted relationship count: %d" % qs_pred_rel_instances.count())
         
         i = 0
         
@@ -194,6 +204,13 @@ class GetFirstCompilator(BaseCompilator):
         # count all        
         count_all = 0
         
+        inserter = BulkInserter(
+                    model=RelationshipPredictionInstance, 
+                    batch_size=self.batch_size)
+        
+        # keys of the predictions waiting in the inserter
+        created_keys = set()
+        
         for pred_inst in qs_pred_rel_instances.iterator():
             
             i += 1
@@ -235,7 +252,7 @@ class GetFirstCompilator(BaseCompilator):
             count_n += count
             
             if count and i % 1000 == 0:
-                print "similar count: %d; relationships processed: %d" % (count, i)
+                build_profiler.message("similar count: %d; relationships processed: %d" % (count, i))
                 import gc; gc.collect()
             
             # go through them 
@@ -251,12 +268,12 @@ class GetFirstCompilator(BaseCompilator):
                                             object2=similar_fin,
                                             queryset=qs_predictions)
 
-                # if exists, keep it there, ignore
-                if qs_pair_predictions.exists():
-                    continue
-                
                 # order the arguments as they should be    
                 so1, so2 = self._order_in_pair(start, similar_fin)                    
+                
+                # if exists, keep it there, ignore
+                if (so1.pk, so2.pk) in created_keys or qs_pair_predictions.exists():
+                    continue
 
                 # if not, create it with the attributes of the similarity 
                 # relationship instance
@@ -267,7 +284,10 @@ class GetFirstCompilator(BaseCompilator):
                             expectancy=similar_rel.expectancy,
                             recommender=recommender_model)
                             
-                prediction.save()                                 
+                inserter.add(prediction)
+                created_keys.add((so1.pk, so2.pk))
+        
+        inserter.flush()
                     
-        print "For starting entity type %s, %d out of %d possible relationships created" \
-                 % (start_entity_type, count_n, count_all)
+        build_profiler.message("For starting entity type %s, %d out of %d possible relationships created" \
+                 % (start_entity_type, count_n, count_all))
@@ -0,0 +1,456 @@
+"""The in-memory graph of the recommender knowledge, used by the compilator.
+
+The predicted relationships, the s-o relationships, the aggregated
+similarities, the cluster memberships and the aggregated biases are loaded
+to compact adjacency arrays (compressed sparse rows keyed by the SubjectObject
+id). The combination elements for a pair are then found without querying
+the database.
+"""
+
+import numpy as np
+
+from unresyst.constants import *
+from unresyst.combinator.combination_element import BiasAggregateCombinationElement, \
+    SubjectObjectRelCombinationElement, PredictedPlusObjectSimilarityCombinationElement, \
+    PredictedPlusSubjectSimilarityCombinationElement, PredictedPlusObjectClusterMemberCombinationElement, \
+    PredictedPlusSubjectClusterMemberCombinationElement, ClusterSimilarityCombinationElement, \
+    InstanceRecord as _Record
+from unresyst.models.aggregator import AggregatedBiasInstance, AggregatedRelationshipInstance
+from unresyst.models.abstractor import RelationshipInstance, RuleInstance, \
+    RuleRelationshipDefinition, ExplicitRuleInstance, Cluster, ClusterMember, \
+    _count_expectancy
+
+_EMPTY = np.zeros(0, dtype=np.int64)
+"""An empty row"""
+
+
+class _Adjacency(object):
+    """Edges stored as compressed sparse rows.
+
+    For each key (the SubjectObject id) the neighbours are sorted ascending.
+    Each edge carries an index to the arrays of the edge attributes, the edges
+    with the same key and neighbour are in the order of the indices.
+    """
+
+    def __init__(self, keys, neighbours, indices):
+        """The initializer
+
+        @type keys, neighbours, indices: sequences of int of the same length
+        @param keys, neighbours, indices: the edges - the starting ids,
+            the ending ids and the indices of the edge attributes
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        neighbours = np.asarray(neighbours, dtype=np.int64)
+        indices = np.asarray(indices, dtype=np.int64)
+
+        order = np.lexsort((indices, neighbours, keys))
+        sorted_keys = keys[order]
+
+        self.keys = np.unique(sorted_keys)
+        """The sorted distinct keys"""
+
+        self.indptr = np.append(
+            np.searchsorted(sorted_keys, self.keys), len(sorted_keys))
+        """The row of the i-th key is indptr[i]:indptr[i+1]"""
+
+        self.neighbours = neighbours[order]
+        """The neighbours of all rows"""
+
+        self.indices = indices[order]
+        """The edge attribute indices of all rows"""
+
+    def row(self, key):
+        """Get the neighbours of the key.
+
+        @type key: int
+        @param key: the SubjectObject id
+
+        @rtype: pair of numpy arrays
+        @return: the sorted neighbour ids, the edge attribute indices
+        """
+        i = np.searchsorted(self.keys, key)
+
+        if i == len(self.keys) or self.keys[i] != key:
+            return _EMPTY, _EMPTY
+
+        start, end = self.indptr[i], self.indptr[i + 1]
+
+        return self.neighbours[start:end], self.indices[start:end]
+
+    def find(self, key, neighbour):
+        """Get the edge attribute indices of all edges from key to neighbour.
+
+        @type key, neighbour: int
+        @param key, neighbour: the SubjectObject ids
+
+        @rtype: numpy array
+        @return: the indices, empty if there's no edge
+        """
+        neighbours, indices = self.row(key)
+
+        start = np.searchsorted(neighbours, neighbour, side='left')
+        end = np.searchsorted(neighbours, neighbour, side='right')
+
+        return indices[start:end]
+
+
+class CompilatorGraph(object):
+    """All the compilator needs to find the combination elements of a pair,
+    held in memory.
+
+    The elements are the same as the ones from
+    BaseCompilator.get_pair_combination_elements, only the model instances
+    in them are replaced by records having the description and expectancy.
+    """
+
+    def __init__(self, recommender_model):
+        """Load the graph for the given recommender.
+
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender whose data should be loaded
+        """
+
+        self.recommender_id = recommender_model.pk
+        """The id of the recommender the graph belongs to"""
+
+        self.build_generation = recommender_model.build_generation
+        """The build generation of the recommender when the graph was loaded"""
+
+        self._load_predicted(recommender_model)
+        self._load_relationships(recommender_model)
+        self._load_similarities(recommender_model)
+        self._load_clusters(recommender_model)
+        self._load_biases(recommender_model)
+
+
+    def _load_predicted(self, recommender_model):
+        """Load the instances of the predicted relationship"""
+
+        qs_predicted = RelationshipInstance.filter_predicted(recommender_model)\
+                        .order_by('pk')\
+                        .values_list('subject_object1', 'subject_object2', 'description')
+
+        so1s, so2s, self._predicted_descriptions = _unzip(qs_predicted, 3)
+        indices = np.arange(len(so1s))
+
+        self._liked = _Adjacency(so1s, so2s, indices)
+        """The predicted relationships from the subject side"""
+
+        self._likers = _Adjacency(so2s, so1s, indices)
+        """The predicted relationships from the object side"""
+
+    def _load_relationships(self, recommender_model):
+        """Load the s-o relationship and explicit rule instances"""
+
+        rel_type = RELATIONSHIP_TYPE_SUBJECTOBJECT_SUBJECTOBJECT \
+            if recommender_model.are_subjects_objects else \
+                RELATIONSHIP_TYPE_SUBJECT_OBJECT
+
+        definitions = dict((definition.pk, definition) for definition in \
+            RuleRelationshipDefinition.objects.filter(
+                recommender=recommender_model, 
+                relationship_type=rel_type))
+
+        confidences = dict(RuleInstance.objects\
+            .filter(definition__in=definitions.keys())\
+            .values_list('pk', 'confidence'))
+
+        qs_rels = RelationshipInstance.objects\
+                    .filter(definition__in=definitions.keys())\
+                    .order_by('pk')\
+                    .values_list('pk', 'subject_object1', 'subject_object2',
+                        'definition', 'description')
+
+        so1s, so2s = [], []
+        self._rel_expectancies = []
+        self._rel_positiveness = []
+        self._rel_descriptions = []
+
+        for pk, so1, so2, definition_id, description in qs_rels.iterator():
+            definition = definitions[definition_id]
+
+            so1s.append(so1)
+            so2s.append(so2)
+            self._rel_expectancies.append(_count_expectancy(
+                is_positive=definition.is_positive,
+                weight=definition.weight,
+                confidence=confidences.get(pk, 1)))
+            self._rel_positiveness.append(definition.is_positive)
+            self._rel_descriptions.append(description)
+
+        self._rels = _Adjacency(so1s, so2s, np.arange(len(so1s)))
+        """The relationship and rule instances from the subject side"""
+
+        qs_explicit = ExplicitRuleInstance.objects\
+                        .filter(definition__recommender=recommender_model)\
+                        .order_by('pk')\
+                        .values_list('subject_object1', 'subject_object2',
+                            'expectancy', 'description')
+
+        so1s, so2s, self._explicit_expectancies, self._explicit_descriptions = \
+            _unzip(qs_explicit, 4)
+
+        self._explicit = _Adjacency(so1s, so2s, np.arange(len(so1s)))
+        """The explicit rule instances from the subject side"""
+
+    def _load_similarities(self, recommender_model):
+        """Load the aggregated relationships, in both directions"""
+
+        qs_aggr = AggregatedRelationshipInstance.objects\
+                    .filter(recommender=recommender_model)\
+                    .order_by('pk')\
+                    .values_list('subject_object1', 'subject_object2',
+                        'expectancy', 'description')
+
+        so1s, so2s, self._sim_expectancies, self._sim_descriptions = \
+            _unzip(qs_aggr, 4)
+
+        indices = np.arange(len(so1s))
+
+        self._similarities = _Adjacency(
+            so1s + so2s,
+            so2s + so1s,
+            np.concatenate((indices, indices)))
+        """The aggregated relationships from both sides"""
+
+    def _load_clusters(self, recommender_model):
+        """Load the cluster memberships"""
+
+        self._cluster_weights = dict(Cluster.objects\
+            .filter(cluster_set__recommender=recommender_model)\
+            .values_list('pk', 'cluster_set__weight'))
+        """Dictionary cluster id: the weight of its cluster set"""
+
+        qs_members = ClusterMember.objects\
+                        .filter(cluster__cluster_set__recommender=recommender_model)\
+                        .order_by('pk')\
+                        .values_list('cluster', 'member', 'confidence', 'description')
+
+        self._cm_clusters, members, self._cm_confidences, self._cm_descriptions = \
+            _unzip(qs_members, 4)
+
+        indices = np.arange(len(members))
+
+        self._member_clusters = _Adjacency(members, self._cm_clusters, indices)
+        """The memberships from the member side"""
+
+        self._cluster_members = _Adjacency(self._cm_clusters, members, indices)
+        """The memberships from the cluster side"""
+
+    def _load_biases(self, recommender_model):
+        """Load the aggregated biases"""
+
+        qs_bias = AggregatedBiasInstance.objects\
+                    .filter(recommender=recommender_model)\
+                    .order_by('pk')\
+                    .values_list('subject_object', 'expectancy', 'description')
+
+        self._biases = dict(
+            (so_id, (i, _Record(expectancy, description))) \
+                for i, (so_id, expectancy, description) in enumerate(qs_bias.iterator()))
+        """Dictionary subject/object id: (order, the aggregated bias)"""
+
+
+    def get_pair_combination_elements(self, subject_id, object_id, pair_depth):
+        """Find all we know about the relationship of the subject and
+        the object, see BaseCompilator.get_pair_combination_elements.
+
+        @type subject_id, object_id: int
+        @param subject_id, object_id: the ids of the pair
+
+        @type pair_depth: int
+        @param pair_depth: the number of cluster elements taken from each side
+
+        @rtype: list of BaseCombinationElement
+        @return: the list of all we know about the pair
+        """
+        els = []
+
+        #  aggregated bias for both
+        biases = [self._biases[so_id] for so_id in (subject_id, object_id) \
+                    if so_id in self._biases]
+
+        for i, bias in sorted(biases):
+            els.append(BiasAggregateCombinationElement(bias_aggregate=bias))
+
+        # s-o relationships (all)
+        for i in self._rels.find(subject_id, object_id):
+            els.append(SubjectObjectRelCombinationElement(
+                rel_instance=_Record(None, self._rel_descriptions[i]),
+                expectancy=self._rel_expectancies[i],
+                positiveness=self._rel_positiveness[i]))
+
+        # explicit also
+        for i in self._explicit.find(subject_id, object_id):
+            expectancy = self._explicit_expectancies[i]
+
+            els.append(SubjectObjectRelCombinationElement(
+                rel_instance=_Record(expectancy, self._explicit_descriptions[i]),
+                expectancy=expectancy,
+                positiveness=expectancy > UNCERTAIN_PREDICTION_VALUE))
+
+        liked, liked_indices = self._liked.row(subject_id)
+        likers, liker_indices = self._likers.row(object_id)
+
+        # predicted_relationship + object_similarities
+        #
+        other_objs, pairs = self._get_similar(object_id, liked, liked_indices)
+
+        for pred_i, sim_i in pairs:
+            els.append(PredictedPlusObjectSimilarityCombinationElement(
+                predicted_rel=self._get_predicted(pred_i),
+                similarity_aggregate=self._get_similarity(sim_i)))
+
+        # predicted_relationship + subject similarities
+        #
+        other_subjs, pairs = self._get_similar(subject_id, likers, liker_indices)
+
+        for pred_i, sim_i in pairs:
+            els.append(PredictedPlusSubjectSimilarityCombinationElement(
+                predicted_rel=self._get_predicted(pred_i),
+                similarity_aggregate=self._get_similarity(sim_i)))
+
+        # predicted_relationship + object cluster memberships (pairs not covered by similarities)
+        #
+        for pred_i, cm_i, second_i in self._get_cluster_neighbours(
+                object_id, liked, liked_indices, pair_depth, other_objs):
+
+            ce = self._get_cluster_element(cm_i, second_i)
+
+            els.append(PredictedPlusObjectClusterMemberCombinationElement(
+                predicted_rel=self._get_predicted(pred_i),
+                cluster_combination_element=ce))
+
+        # predicted_relationship + subject cluster memberships (pairs not covered by similarities)
+        #
+        for pred_i, cm_i, first_i in self._get_cluster_neighbours(
+                subject_id, likers, liker_indices, pair_depth, other_subjs):
+
+            ce = self._get_cluster_element(first_i, cm_i)
+
+            els.append(PredictedPlusSubjectClusterMemberCombinationElement(
+                predicted_rel=self._get_predicted(pred_i),
+                cluster_combination_element=ce))
+
+        return els
+
+
+    def _get_similar(self, stable_id, related, related_indices):
+        """Get the entities similar to the stable one, that are in the predicted
+        relationship with the other entity of the pair.
+
+        @type stable_id: int
+        @param stable_id: the id of the entity whose similarities are searched
+
+        @type related, related_indices: numpy arrays
+        @param related, related_indices: the row of the other entity of the pair
+            in the predicted relationship adjacency
+
+        @rtype: pair (set, list of pairs)
+        @return: the ids of the similar entities, the list of
+            (predicted index, similarity index) ordered by the similarity
+        """
+        neighbours, sim_indices = self._similarities.row(stable_id)
+
+        mask = np.in1d(neighbours, related)
+        others = neighbours[mask]
+        sim_indices = sim_indices[mask]
+
+        pred_indices = related_indices[np.searchsorted(related, others)]
+
+        order = np.argsort(sim_indices, kind='mergesort')
+
+        return set(others.tolist()), zip(pred_indices[order], sim_indices[order])
+
+    def _get_cluster_neighbours(self, stable_id, related, related_indices, pair_depth, excluded):
+        """Get the members of the clusters of the stable entity, that are
+        in the predicted relationship with the other entity of the pair.
+
+        Only the pair_depth most confident memberships are taken, the ones
+        with members in excluded are then left out.
+
+        @type stable_id: int
+        @param stable_id: the id of the entity whose clusters are searched
+
+        @type related, related_indices: numpy arrays
+        @param related, related_indices: the row of the other entity of the pair
+            in the predicted relationship adjacency
+
+        @type pair_depth: int
+        @param pair_depth: the number of memberships taken
+
+        @type excluded: set of int
+        @param excluded: ids of the members that should be left out
+
+        @rtype: list of triples
+        @return: (predicted index, membership index, stable membership index)
+        """
+        clusters, stable_memberships = self._member_clusters.row(stable_id)
+
+        candidates = []
+
+        for cluster, stable_i in zip(clusters, stable_memberships):
+
+            members, cm_indices = self._cluster_members.row(cluster)
+
+            mask = np.in1d(members, related) & (members != stable_id)
+
+            for member, cm_i in zip(members[mask], cm_indices[mask]):
+                candidates.append((-self._cm_confidences[cm_i], cm_i, member, stable_i))
+
+        candidates.sort()
+
+        ret = []
+
+        for conf, cm_i, member, stable_i in candidates[:pair_depth]:
+
+            # dont include the ones that are already there because of the similarity
+            if member in excluded:
+                continue
+
+            pred_i = related_indices[np.searchsorted(related, member)]
+            ret.append((pred_i, cm_i, stable_i))
+
+        return ret
+
+    def _get_predicted(self, i):
+        """Get the record of the i-th predicted relationship instance"""
+        return _Record(None, self._predicted_descriptions[i])
+
+    def _get_similarity(self, i):
+        """Get the record of the i-th aggregated relationship"""
+        return _Record(self._sim_expectancies[i], self._sim_descriptions[i])
+
+    def _get_cluster_element(self, cm1_i, cm2_i):
+        """Get the combination element for a pair of memberships in a cluster"""
+
+        expectancy = _count_expectancy(
+            is_positive=True,
+            weight=self._cluster_weights[self._cm_clusters[cm1_i]],
+            confidence=self._cm_confidences[cm1_i] * self._cm_confidences[cm2_i])
+
+        return ClusterSimilarityCombinationElement(
+            cluster_members=(
+                _Record(None, self._cm_descriptions[cm1_i]),
+                _Record(None, self._cm_descriptions[cm2_i])),
+            expectancy=expectancy)
+
+
+def _unzip(qs_values, width):
+    """Split the values_list queryset to columns
+
+    @type qs_values: ValuesListQuerySet
+    @param qs_values: the queryset to split
+
+    @type width: int
+    @param width: the number of the columns
+
+    @rtype: tuple of lists
+    @return: the columns
+    """
+    rows = list(qs_values.iterator())
+
+    if not rows:
+        return tuple([] for i in range(width))
+
+    return tuple(list(column) for column in zip(*rows))
@@ -143,3 +143,50 @@ PROMISING_RATE = 1.2
 of promising objects to be inspected"""
 
 EXP_PRECISION = 0.00001
+
+DEFAULT_BULK_BATCH_SIZE = 1000
+"""The default number of instances written by one multi-row INSERT 
+during the build"""
+
+DEFAULT_COMPILATOR_WORKERS = 1
+"""The default number of processes compiling the predictions, 1 means
+no parallelism"""
+
+DEFAULT_COMPILATOR_SHARD_SIZE = 100
+"""The default number of subjects compiled by a worker process at once"""
+
+DEFAULT_PRECOMPUTED_RECOMMENDATION_COUNT = 50
+"""The default length of the recommendation lists stored for the subjects
+during the build"""
+
+DEFAULT_CACHE_SIZE = 10000
+"""The default maximal number of domain neutral entities cached by 
+the recommender"""
+
+DEFAULT_CACHE_CHECK_INTERVAL = 5
+"""The default number of seconds the cached recommender model is used
+without checking its build generation in the database"""
+
+DEFAULT_QUERY_CHUNK_SIZE = 500
+"""The maximal number of ids passed to one IN query, sqlite limits the number
+of the query parameters"""
+
+DEFAULT_EVALUATION_CHUNK_SIZE = 500
+"""The default number of entities loaded at once when evaluating the rules 
+and relationships without a generator"""
+
+DEFAULT_IMPORT_CHUNK_SIZE = 10000
+"""The default number of csv lines parsed and written at once when importing
+the predictions"""
+
+DEFAULT_EXPORT_PAGE_SIZE = 10000
+"""The default number of predictions read by one query when exporting"""
+
+EXPORT_FORMAT_CSV = 'csv'
+"""The csv export of the predictions"""
+
+EXPORT_FORMAT_NPY = 'npy'
+"""The binary columnar export of the predictions, needs numpy"""
+
+DEFAULT_FOLD_COUNT = 5
+"""The default number of the cross-validation folds"""
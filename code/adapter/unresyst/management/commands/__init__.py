@@ -0,0 +1 @@
+"""The management commands of unresyst"""
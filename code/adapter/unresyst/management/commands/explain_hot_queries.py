@@ -0,0 +1,188 @@
+"""The explain_hot_queries command: check that the queries run when
+recommending use the indexes created from models/sql/*.sql.
+
+Usage:
+    ./manage.py explain_hot_queries <recommender class name>
+
+The indexes are created by syncdb for new tables, for an existing database
+run:
+    ./manage.py sqlcustom unresyst | ./manage.py dbshell
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from unresyst.constants import *
+from unresyst.models.common import SubjectObject, Recommender
+from unresyst.models.abstractor import RelationshipInstance, ExplicitRuleInstance, \
+    ClusterMember, PredictedRelationshipDefinition
+from unresyst.models.aggregator import AggregatedRelationshipInstance, AggregatedBiasInstance
+from unresyst.models.algorithm import RelationshipPredictionInstance
+
+def get_hot_queries(recommender_model):
+    """Get the querysets of the recommend phase, as they are built in 
+    SimpleAlgorithm, BaseCompilator and BaseCombinator, for the first subject
+    and object of the recommender.
+    
+    @type recommender_model: models.common.Recommender
+    @param recommender_model: the built recommender
+    
+    @rtype: list of tuples (str, QuerySet, str)
+    @return: the name of the query, the queryset and the index it should use
+    """
+    subject_ent_type = ENTITY_TYPE_SUBJECTOBJECT if recommender_model.are_subjects_objects \
+            else ENTITY_TYPE_SUBJECT 
+    object_ent_type = ENTITY_TYPE_SUBJECTOBJECT if recommender_model.are_subjects_objects \
+            else ENTITY_TYPE_OBJECT
+    
+    qs_entities = SubjectObject.objects.filter(recommender=recommender_model).order_by('pk')
+    
+    dn_subject = qs_entities.filter(entity_type=subject_ent_type)[0]
+    dn_object = qs_entities.filter(entity_type=object_ent_type)[0]
+    
+    predicted_def = PredictedRelationshipDefinition.objects.get(recommender=recommender_model)
+    
+    return [
+        ('SimpleAlgorithm.get_recommendations',
+            RelationshipPredictionInstance.objects\
+                .filter(
+                    subject_object1=dn_subject,
+                    recommender=recommender_model,
+                    expectancy__gt=UNCERTAIN_PREDICTION_VALUE)\
+                .order_by('-expectancy'),
+            'unresyst_pred_recommender_so1_exp'),
+        
+        ('SimpleAlgorithm.get_relationship_prediction',
+            RelationshipPredictionInstance.objects\
+                .filter(
+                    subject_object1=dn_subject,
+                    subject_object2=dn_object,
+                    recommender=recommender_model),
+            None),
+        
+        ('BaseCompilator: the objects in the predicted relationship with the subject',
+            RelationshipInstance.objects\
+                .filter(definition=predicted_def, subject_object1=dn_subject)\
+                .values_list('subject_object2', flat=True),
+            'unresyst_rel_definition_so1_so2'),
+        
+        ('BaseCompilator: the subjects in the predicted relationship with the object',
+            RelationshipInstance.objects\
+                .filter(definition=predicted_def, subject_object2=dn_object)\
+                .values_list('subject_object1', flat=True),
+            'unresyst_rel_definition_so2_so1'),
+        
+        ('BaseCompilator: the similarities of the object from the first side',
+            AggregatedRelationshipInstance.objects\
+                .filter(recommender=recommender_model, subject_object1=dn_object)\
+                .order_by('-expectancy'),
+            'unresyst_aggr_recommender_so1_exp'),
+        
+        ('BaseCompilator: the similarities of the object from the second side',
+            AggregatedRelationshipInstance.objects\
+                .filter(recommender=recommender_model, subject_object2=dn_object)\
+                .order_by('-expectancy'),
+            'unresyst_aggr_recommender_so2_exp'),
+        
+        ('BaseCombinator: the explicit preferences of the subject',
+            ExplicitRuleInstance.objects\
+                .filter(
+                    definition__recommender=recommender_model,
+                    subject_object1=dn_subject,
+                    expectancy__gt=UNCERTAIN_PREDICTION_VALUE)\
+                .order_by('-expectancy'),
+            'unresyst_explicit_so1_exp_definition'),
+        
+        ('BaseCombinator: the cluster memberships of the subject',
+            ClusterMember.objects\
+                .filter(member=dn_subject)\
+                .order_by('-confidence'),
+            'unresyst_member_member_confidence'),
+        
+        ('BaseCombinator: the most biased entities',
+            AggregatedBiasInstance.objects\
+                .filter(recommender=recommender_model)\
+                .order_by('-expectancy'),
+            'unresyst_bias_recommender_exp'),
+    ]
+
+
+SORT_PLAN_MARKERS = ('USE TEMP B-TREE FOR ORDER BY', 'Using filesort')
+"""The parts of the sqlite and mysql plans meaning the rows are sorted"""
+
+def explain(queryset):
+    """Get the query plan of the queryset from the database.
+    
+    @type queryset: QuerySet
+    @param queryset: the query to explain
+    
+    @rtype: str
+    @return: the rows of the plan, one per line
+    """
+    sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+    
+    backend_name = connection.settings_dict['ENGINE'].split('.')[-1]
+    
+    prefix = 'EXPLAIN QUERY PLAN ' if backend_name == 'sqlite3' else 'EXPLAIN '
+    
+    cursor = connection.cursor()
+    cursor.execute(prefix + sql, params)
+    
+    return '\n'.join(' '.join(unicode(value) for value in row) for row in cursor.fetchall())
+
+
+def check_hot_queries(recommender_model):
+    """Explain the hot queries of the recommender, see whether they use 
+    the expected indexes.
+    
+    @type recommender_model: models.common.Recommender
+    @param recommender_model: the built recommender
+    
+    @rtype: list of tuples (str, str, str, bool)
+    @return: the query name, the expected index, the plan and whether 
+        the index is used, without a separate sort (True if no index 
+        is expected)
+    """
+    ret = []
+    
+    for name, queryset, index_name in get_hot_queries(recommender_model):
+        
+        plan = explain(queryset)
+        
+        # the ordered queries have to get the order from the index, not sort
+        uses_index = index_name is None or (index_name in plan and \
+            not [marker for marker in SORT_PLAN_MARKERS if marker in plan])
+        
+        ret.append((name, index_name, plan, uses_index))
+    
+    return ret
+
+
+class Command(BaseCommand):
+    args = '<recommender class name>'
+    help = 'Check with EXPLAIN that the queries of the recommend phase use the indexes.'
+    
+    def handle(self, *args, **options):
+        
+        if len(args) != 1:
+            raise CommandError("Give the class name of a built recommender.")
+        
+        try:
+            recommender_model = Recommender.objects.get(class_name=args[0], is_built=True)
+        except Recommender.DoesNotExist:
+            raise CommandError("The recommender %s isn't built." % args[0])
+        
+        missing = 0
+        
+        for name, index_name, plan, uses_index in check_hot_queries(recommender_model):
+            
+            print "%s: %s" % (name, 'OK' if uses_index else 'NOT USING %s' % index_name)
+            
+            for line in plan.splitlines():
+                print "    %s" % line
+            
+            if not uses_index:
+                missing += 1
+        
+        if missing:
+            raise CommandError("%d queries don't use their indexes." % missing)
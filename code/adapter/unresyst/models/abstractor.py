@@ -74,7 +74,164 @@ class RuleRelationshipDefinition(BaseRelationshipDefinition):
         ret = super(RuleRelationshipDefinition, self).__unicode__()
 
         return ret + "%f, positive: %s" % (self.weight, self.is_positive)
+
+
+class DefinitionRegistry(object):
+    """The leaf definitions of the rules/relationships and the bias definitions 
+    by their ids, so that the weight, positiveness and relationship type are 
+    found without asking the database. All definitions of a recommender are 
+    loaded at once, when one of them is asked for the first time.
+    
+    The definitions are kept by the recommender id and its build_generation.
+    The current generation of a recommender class is given by set_current,
+    called by the recommender model cache each time it obtains a changed model,
+    so the definitions of a recommender rebuilt in another process are
+    forgotten before they could be used with the reused ids.
+    """
+    
+    DEFINITION_CLASSES = (PredictedRelationshipDefinition, ExplicitRuleDefinition, 
+        RuleRelationshipDefinition)
+    """The leaf definition classes"""
+    
+    def __init__(self):
+        """The initializer"""
+        
+        self._definitions = {}
+        """Dictionary (recommender id, build generation): dictionary 
+        definition id: the leaf definition"""
+        
+        self._bias_definitions = {}
+        """Dictionary (recommender id, build generation): dictionary 
+        bias definition id: the bias definition"""
+        
+        self._keys = {}
+        """Dictionary definition id: (recommender id, build generation)"""
+        
+        self._current = {}
+        """Dictionary recommender class name: (recommender id, build generation)"""
+    
+    def get(self, definition_id):
+        """Get the leaf definition, load the definitions of its recommender
+        if it isn't known.
+        
+        @type definition_id: int
+        @param definition_id: the id of the definition
+        
+        @rtype: BaseRelationshipDefinition subclass
+        @return: the leaf definition
+        
+        @raise DoesNotExist: if there's no such definition
+        """
+        key = self._keys.get(definition_id)
+        
+        if key is None:
+            
+            # it can be a definition of a recommender being built, load
+            # the definitions of its recommender again
+            recommender_model = BaseRelationshipDefinition.objects.get(pk=definition_id).recommender
+            
+            key = self.set_current(recommender_model)
+            
+            self._load(key)
+        
+        return self._definitions[key][definition_id]
+    
+    def get_definitions(self, recommender_model, DefinitionClass=None):
+        """Get the leaf definitions of the recommender.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender
+        
+        @type DefinitionClass: a BaseRelationshipDefinition subclass
+        @param DefinitionClass: if given, only its definitions are returned
+        
+        @rtype: dict int: BaseRelationshipDefinition subclass
+        @return: the definitions by their ids
+        """
+        key = self.set_current(recommender_model)
+        
+        if key not in self._definitions:
+            self._load(key)
+        
+        return dict((pk, definition) for pk, definition in self._definitions[key].iteritems() \
+                    if DefinitionClass is None or isinstance(definition, DefinitionClass))
+    
+    def get_bias_definitions(self, recommender_model):
+        """Get the bias definitions of the recommender.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender
         
+        @rtype: dict int: BiasDefinition
+        @return: the definitions by their ids
+        """
+        key = self.set_current(recommender_model)
+        
+        if key not in self._bias_definitions:
+            self._bias_definitions[key] = dict((definition.pk, definition) for definition in \
+                BiasDefinition.objects.filter(recommender__id=key[0]))
+        
+        return self._bias_definitions[key]
+    
+    def set_current(self, recommender_model):
+        """Make the generation of the recommender the current one for its 
+        class, forget the definitions of the previous one.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender
+        
+        @rtype: tuple (int, int)
+        @return: the key of the recommender - its id and build generation
+        """
+        key = (recommender_model.pk, recommender_model.build_generation)
+        
+        old_key = self._current.get(recommender_model.class_name)
+        
+        if old_key != key:
+            
+            if old_key is not None:
+                self._forget(old_key)
+            
+            self._current[recommender_model.class_name] = key
+        
+        return key
+    
+    def _load(self, key):
+        """Load all definitions of the recommender.
+        
+        @type key: tuple (int, int)
+        @param key: the recommender id and its build generation
+        """
+        definitions = self._definitions.setdefault(key, {})
+        
+        for DefinitionClass in self.DEFINITION_CLASSES:
+            for definition in DefinitionClass.objects.filter(recommender__id=key[0]):
+                definitions[definition.pk] = definition
+                self._keys[definition.pk] = key
+    
+    def _forget(self, key):
+        """Forget the definitions of the recommender generation.
+        
+        @type key: tuple (int, int)
+        @param key: the recommender id and its build generation
+        """
+        for definition_id in self._definitions.pop(key, {}):
+            if self._keys.get(definition_id) == key:
+                del self._keys[definition_id]
+        
+        self._bias_definitions.pop(key, None)
+    
+    def clear(self):
+        """Forget all definitions"""
+        self._definitions.clear()
+        self._bias_definitions.clear()
+        self._keys.clear()
+        self._current.clear()
+
+
+definition_registry = DefinitionRegistry()
+"""The process-local registry of the definitions"""
+
 # instances:
 #
 
@@ -120,7 +277,7 @@ class RelationshipInstance(BaseRelationshipInstance, ContentTypeModel):
             return self.as_leaf_class().get_expectancy(_redirect_to_leaf=False)
         
         # get the whole object for definition
-        leaf_definition = self.definition.as_leaf_class()        
+        leaf_definition = definition_registry.get(self.definition_id)
         
         return _count_expectancy(
             is_positive=leaf_definition.is_positive,
@@ -191,6 +348,22 @@ class RuleInstance(RelationshipInstance):
     A number from [0, 1].
     """
     
+    @classmethod
+    def get_confidences(cls, definition_ids):
+        """Get the confidences of the rule instances of the definitions, 
+        the relationship instances have none (1).
+        
+        @type definition_ids: iterable of int
+        @param definition_ids: the ids of the rule/relationship definitions
+        
+        @rtype: dict int: float
+        @return: the confidences by the instance ids
+        """
+        return dict(cls.objects\
+            .filter(definition__in=list(definition_ids))\
+            .values_list('pk', 'confidence')\
+            .iterator())
+    
     def get_expectancy(self, _redirect_to_leaf=True):
         """Get the instance expectancy counted as 1/2 +- weight*confidence/2 .. depending on whether
         the relationship is positive.
@@ -204,7 +377,7 @@ class RuleInstance(RelationshipInstance):
         @return: the aggregated expectancy.
         """
         # get the whole object for definition
-        leaf_definition = self.definition.as_leaf_class()
+        leaf_definition = definition_registry.get(self.definition_id)
         
         return _count_expectancy(
             is_positive=leaf_definition.is_positive,            
@@ -59,3 +59,38 @@ class ExternalPrediction(models.Model):
 
     def __unicode__(self):
         return "(%s, %s), %f" % (self.subj_id, self.obj_id, self.expectancy)      
+
+
+class PrecomputedRecommendation(models.Model):
+    """An item of the recommendation list of a subject, stored during 
+    the build. The lists are read instead of sorting the predictions.
+    """
+    
+    subject = models.ForeignKey('unresyst.SubjectObject', related_name='precomputed_recommendations')
+    """The subject the object is recommended to"""
+    
+    recommended_object = models.ForeignKey('unresyst.SubjectObject', related_name='precomputed_recommended')
+    """The recommended object"""
+    
+    rank = models.PositiveIntegerField()
+    """The position in the list of the subject, starting with 0"""
+    
+    expectancy = models.FloatField()
+    """The expectancy of the prediction for the pair"""
+    
+    description = models.TextField(default='', blank=True)
+    """The explanation of the prediction"""
+    
+    is_uncertain = models.BooleanField(default=False)
+    """Is the prediction uncertain?"""
+    
+    recommender = models.ForeignKey('unresyst.Recommender')
+    """The recommender it belongs to"""
+    
+    class Meta:
+        app_label = 'unresyst'
+        unique_together = ('subject', 'rank')
+        """The list is read through the index"""
+
+    def __unicode__(self):
+        return "%d. (%s, %s), %f" % (self.rank, self.subject, self.recommended_object, self.expectancy)
@@ -30,8 +30,8 @@ class ContentTypeModel(models.Model):
     def as_leaf_class(self):
         """Get the object as the whole inherited class"""
 
-        # get the leaf class
-        content_type = self.content_type
+        # get the leaf class, the content types are cached by the manager
+        content_type = ContentType.objects.get_for_id(self.content_type_id)
         Model = content_type.model_class()
         
         # get the appropriate object
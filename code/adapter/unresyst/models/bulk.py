@@ -0,0 +1,249 @@
+"""Batched writing of model instances.
+
+Instead of saving the instances one by one (one INSERT and the checks for
+each row), the instances are buffered and written by multi-row INSERTs.
+Used during the recommender build. bulk_update writes changed field values
+of existing rows the same way.
+"""
+
+from django.db import connection, transaction
+from django.db.models import AutoField
+from django.contrib.contenttypes.models import ContentType
+
+from base import ContentTypeModel
+from symmetric import SymmetricalRelationship
+from unresyst.constants import *
+from unresyst.exceptions import SymmetryError
+
+def _get_insert_fields(model):
+    """Get the fields of the model that are written by the INSERT, i.e. all
+    local fields except the automatic primary key.
+
+    @type model: django.db.models.Model subclass
+    @param model: the model class
+
+    @rtype: list of django.db.models.Field
+    @return: the fields to be inserted
+    """
+    return [f for f in model._meta.local_fields if not isinstance(f, AutoField)]
+
+
+def _insert_rows(model, fields, rows):
+    """Insert the rows to the table of the model by one statement.
+
+    executemany is used, the MySQL driver turns it to a multi-row INSERT,
+    the sqlite one runs it without any round trips.
+
+    @type model: django.db.models.Model subclass
+    @param model: the model whose table is written
+
+    @type fields: list of django.db.models.Field
+    @param fields: the fields in the order of values in the rows
+
+    @type rows: list of lists
+    @param rows: the values prepared for saving
+    """
+    qn = connection.ops.quote_name
+
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+        qn(model._meta.db_table),
+        ', '.join([qn(f.column) for f in fields]),
+        ', '.join(['%s'] * len(fields)))
+
+    cursor = connection.cursor()
+    cursor.executemany(sql, rows)
+
+
+class BulkInserter(object):
+    """A buffer of unsaved model instances, that writes them by batches.
+
+    The instances are only inserted, no updates are done. The unique_together
+    constraints are guarded by the database as for save(). For the
+    symmetrical relationships the symmetry is checked when the instance
+    is added, against the database and against the buffered instances.
+    In the trusted mode (SymmetricalRelationship.start_trusted_mode) 
+    the database isn't asked.
+
+    Usage:
+
+    inserter = BulkInserter(model=RelationshipInstance, batch_size=500)
+    for ...:
+        inserter.add(RelationshipInstance(...))
+    inserter.flush()
+    """
+
+    def __init__(self, model, batch_size=DEFAULT_BULK_BATCH_SIZE, check_symmetry=True):
+        """The initializer
+
+        @type check_symmetry: bool
+        @param check_symmetry: should the symmetry of the symmetrical relationships
+            be checked? False if the caller has already made sure that the
+            added instances don't collide with each other or with the database.
+        """
+
+        self.model = model
+        """The model class of the inserted instances"""
+
+        self.batch_size = batch_size
+        """The number of instances written by one INSERT"""
+
+        self.count = 0
+        """The number of instances written so far"""
+
+        self._buffer = []
+        """The instances waiting for the flush"""
+
+        self._pending_keys = set()
+        """The symmetric keys of the buffered instances,
+        see SymmetricalRelationship.get_symmetric_key"""
+
+        self._is_symmetrical = check_symmetry and issubclass(model, SymmetricalRelationship)
+        """Should the symmetry be checked?"""
+
+
+    def add(self, instance):
+        """Add the instance to the buffer, flush the buffer if it's full.
+
+        @type instance: self.model
+        @param instance: an unsaved instance of the model
+
+        @raise SymmetryError: for the symmetrical relationships that are
+            already in the database or in the buffer (in any direction)
+        """
+
+        if self._is_symmetrical:
+
+            # check against the database
+            instance.check_symmetry()
+
+            # check against the buffered instances
+            key = instance.get_symmetric_key()
+
+            if key in self._pending_keys:
+                raise SymmetryError(
+                    message="The relationship is already waiting for the insert.",
+                    object1=getattr(instance, instance.attr_name1),
+                    object2=getattr(instance, instance.attr_name2))
+
+            self._pending_keys.add(key)
+
+        self._buffer.append(instance)
+
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+
+    def flush(self):
+        """Write all buffered instances to the database."""
+
+        if not self._buffer:
+            return
+
+        instances = self._buffer
+
+        # the content type models must know their type
+        if issubclass(self.model, ContentTypeModel):
+            content_type = ContentType.objects.get_for_model(self.model)
+
+            for instance in instances:
+                if not instance.content_type_id:
+                    instance.content_type = content_type
+
+        # multi-table inheritance - the parents first, they give the ids
+        for parent, ptr_field in self.model._meta.parents.items():
+            self._insert_parents(parent, ptr_field, instances)
+
+        fields = _get_insert_fields(self.model)
+
+        rows = [[f.get_db_prep_save(f.pre_save(instance, True), connection=connection) \
+                    for f in fields] \
+                        for instance in instances]
+
+        _insert_rows(self.model, fields, rows)
+
+        transaction.commit_unless_managed()
+
+        self.count += len(instances)
+        self._buffer = []
+        self._pending_keys = set()
+
+
+    def _insert_parents(self, parent, ptr_field, instances):
+        """Insert the parent rows of the instances and fill the parent
+        pointers with their ids.
+
+        The ids are obtained by one query through the parent unique_together
+        fields.
+        """
+
+        # without a unique key the ids can't be matched, save it the usual way
+        if not parent._meta.unique_together:
+            for instance in instances:
+                instance.save_base(cls=parent, origin=parent, force_insert=True)
+                setattr(instance, ptr_field.attname, instance.pk)
+            return
+
+        fields = _get_insert_fields(parent)
+
+        rows = [[f.get_db_prep_save(f.pre_save(instance, True), connection=connection) \
+                    for f in fields] \
+                        for instance in instances]
+
+        _insert_rows(parent, fields, rows)
+
+        # get the ids of the inserted rows through the unique fields
+        unique_names = parent._meta.unique_together[0]
+        unique_attnames = [parent._meta.get_field(name).attname for name in unique_names]
+
+        first_values = set([getattr(instance, unique_attnames[0]) for instance in instances])
+
+        qs_ids = parent._default_manager\
+                    .filter(**{'%s__in' % unique_names[0]: first_values})\
+                    .values_list('pk', *unique_names)
+
+        id_dict = dict([(tuple(row[1:]), row[0]) for row in qs_ids.iterator()])
+
+        # assign the ids to the pointers
+        for instance in instances:
+            key = tuple([getattr(instance, attname) for attname in unique_attnames])
+
+            pk = id_dict[key]
+            setattr(instance, parent._meta.pk.attname, pk)
+            setattr(instance, ptr_field.attname, pk)
+
+
+def bulk_update(model, field_names, rows, batch_size=DEFAULT_BULK_BATCH_SIZE):
+    """Update the given fields of the rows identified by the primary key,
+    by executemany of batches.
+
+    @type model: django.db.models.Model subclass
+    @param model: the model whose table is written
+
+    @type field_names: list of str
+    @param field_names: the names of the updated fields
+
+    @type rows: list of tuples
+    @param rows: the values of the fields followed by the primary key
+
+    @type batch_size: int
+    @param batch_size: the number of rows updated by one executemany
+    """
+    qn = connection.ops.quote_name
+
+    fields = [model._meta.get_field(name) for name in field_names]
+
+    sql = "UPDATE %s SET %s WHERE %s = %%s" % (
+        qn(model._meta.db_table),
+        ', '.join(['%s = %%s' % qn(f.column) for f in fields]),
+        qn(model._meta.pk.column))
+
+    cursor = connection.cursor()
+
+    for start in xrange(0, len(rows), batch_size):
+
+        cursor.executemany(sql, [
+            [f.get_db_prep_save(value, connection=connection) \
+                for f, value in zip(fields, row[:-1])] + [row[-1]] \
+                    for row in rows[start:start + batch_size]])
+
+    transaction.commit_unless_managed()
@@ -28,6 +28,10 @@ class Recommender(models.Model):
     remove_predicted_from_recommendations = models.BooleanField()
     """Should the objects that are already "liked" be removed from 
     recommendations?"""
+    
+    build_generation = models.PositiveIntegerField(default=0)
+    """The counter increased by each build of the recommender class, the cached 
+    data are valid only for the same generation."""
         
     class Meta:
         app_label = 'unresyst'
@@ -113,6 +117,44 @@ class SubjectObject(models.Model):
             this universal entity does not exist
         """
         return entity_manager.get(pk=self.id_in_specific)
+    
+    @classmethod
+    def get_domain_specific_entities(cls, ids, entity_manager):
+        """Get domain specific subjects/objects/both for the universal 
+        representations given by ids, by two queries.
+        
+        @type ids: list of int
+        @param ids: the ids of the universal representations
+        
+        @type entity_manager: django.db.models.manager.Manager
+        @param entity_manager: the manager over the model containing 
+            the domain specific subjects/objects/bot
+        
+        @rtype: dict int: models.Model
+        @returns: the domain specific entities by the ids 
+        
+        @raise DoesNotExist: when the domain specific entity for some
+            of the universal entities does not exist
+        """
+        id_in_specific_dict = dict(cls.objects\
+            .filter(pk__in=ids)\
+            .values_list('pk', 'id_in_specific'))
+        
+        # the ids in specific are strings
+        entities = dict((unicode(entity.pk), entity) for entity in \
+            entity_manager.filter(pk__in=id_in_specific_dict.values()))
+        
+        ret = {}
+        
+        for pk, id_in_specific in id_in_specific_dict.iteritems():
+        
+            if not id_in_specific in entities:
+                raise entity_manager.model.DoesNotExist(
+                    "The domain specific entity %s does not exist." % id_in_specific)
+                    
+            ret[pk] = entities[id_in_specific]
+            
+        return ret
 
     @classmethod
     def unique_pairs(cls, recommender, entity_type):
@@ -0,0 +1,2 @@
+-- The most biased entities of a recommender
+CREATE INDEX unresyst_bias_recommender_exp ON unresyst_aggregatedbiasinstance (recommender_id, expectancy);
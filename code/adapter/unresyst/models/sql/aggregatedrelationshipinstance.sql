@@ -0,0 +1,4 @@
+-- The similarities of an entity from both sides, ordered by the expectancy,
+-- the queries don't filter the relationship type
+CREATE INDEX unresyst_aggr_recommender_so1_exp ON unresyst_aggregatedrelationshipinstance (recommender_id, subject_object1_id, expectancy);
+CREATE INDEX unresyst_aggr_recommender_so2_exp ON unresyst_aggregatedrelationshipinstance (recommender_id, subject_object2_id, expectancy);
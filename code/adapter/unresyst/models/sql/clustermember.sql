@@ -0,0 +1,3 @@
+-- The memberships of an entity and the members of a cluster ordered by the confidence
+CREATE INDEX unresyst_member_member_confidence ON unresyst_clustermember (member_id, confidence);
+CREATE INDEX unresyst_member_cluster_confidence ON unresyst_clustermember (cluster_id, confidence);
@@ -0,0 +1,3 @@
+-- The explicit preferences of a subject ordered by the expectancy, the definition
+-- is joined to filter the recommender
+CREATE INDEX unresyst_explicit_so1_exp_definition ON unresyst_explicitruleinstance (subject_object1_id, expectancy, definition_id);
@@ -0,0 +1,3 @@
+-- The instances of a definition from the subject side and from the object side
+CREATE INDEX unresyst_rel_definition_so1_so2 ON unresyst_relationshipinstance (definition_id, subject_object1_id, subject_object2_id);
+CREATE INDEX unresyst_rel_definition_so2_so1 ON unresyst_relationshipinstance (definition_id, subject_object2_id, subject_object1_id);
@@ -0,0 +1,2 @@
+-- The recommendations of a subject ordered by the expectancy
+CREATE INDEX unresyst_pred_recommender_so1_exp ON unresyst_relationshippredictioninstance (recommender_id, subject_object1_id, expectancy);
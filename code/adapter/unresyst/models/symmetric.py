@@ -37,8 +37,38 @@ class SymmetricalRelationship(models.Model):
     relationship pair. Like unique_together = (('attr1', 'attr2'), 'additional_unique')
     """
 
+    _trusted_keys = None
+    """A dictionary model: set of symmetric keys of the relationships checked 
+    in the trusted mode. None if the trusted mode is off."""
+
     class Meta:
         abstract = True
+    
+    @staticmethod
+    def start_trusted_mode():
+        """Start the trusted mode. 
+        
+        In the trusted mode the new relationships aren't checked against the 
+        database, only against the relationships checked since the start 
+        of the mode (in memory). To be used only when the database doesn't 
+        contain any relationships that could collide with the new ones, 
+        e.g. during the recommender build.
+        """
+        SymmetricalRelationship._trusted_keys = {}
+    
+    @staticmethod
+    def stop_trusted_mode():
+        """Stop the trusted mode, forget the checked keys."""
+        SymmetricalRelationship._trusted_keys = None
+    
+    @staticmethod
+    def is_trusted_mode():
+        """Is the trusted mode on?
+        
+        @rtype: bool
+        @return: True if the mode is on
+        """
+        return SymmetricalRelationship._trusted_keys is not None
         
     def __unicode__(self):
         """Return a printable representation of the instance"""
@@ -54,6 +84,25 @@ class SymmetricalRelationship(models.Model):
             means of symmetry                
         """
         
+        # check the symmetry
+        self.check_symmetry()
+         
+        # save the relationship                             
+        return super(SymmetricalRelationship, self).save(*args, **kwargs) 
+    
+    def check_symmetry(self):
+        """Check whether the relationship can be saved without breaking 
+        the symmetry.
+
+        @raise SymmetryError: if there's something wrong with the saved entities in the
+            means of symmetry                
+        """
+        
+        # new relationships in the trusted mode are checked in memory
+        if self.is_trusted_mode() and not self.id:
+            self.__check_trusted()
+            return
+        
         # get the objects that should be saved as related
         object1 = getattr(self, self.attr_name1)
         object2 = getattr(self, self.attr_name2)
@@ -74,10 +123,53 @@ class SymmetricalRelationship(models.Model):
                 
         # try the other direction
         self.__check_save(object2, object1)
-         
-        # save the relationship                             
-        return super(SymmetricalRelationship, self).save(*args, **kwargs) 
     
+    def get_symmetric_key(self):
+        """Get a key identifying the relationship no matter in which direction
+        it is - (lower id, higher id, additional unique values...).
+        
+        @rtype: tuple
+        @return: the key of the relationship
+        """
+        id1 = getattr(self, self._meta.get_field(self.attr_name1).attname)
+        id2 = getattr(self, self._meta.get_field(self.attr_name2).attname)
+        
+        additional = tuple([getattr(self, self._meta.get_field(ad_un).attname) \
+                            for ad_un in self.additional_unique])
+        
+        return (min(id1, id2), max(id1, id2)) + additional
+    
+    
+    def __check_trusted(self):
+        """Check the new relationship against the keys checked in the trusted mode,
+        remember its key. No database queries are done.
+        
+        @raise SymmetryError: if the related objects are identical or the 
+            relationship has already been checked in the trusted mode.
+        """
+        
+        key = self.get_symmetric_key()
+        
+        # if they're identical, raise an error
+        if key[0] == key[1]:
+            raise SymmetryError(
+                message="The related objects can't be identical",
+                object1=getattr(self, self.attr_name1), 
+                object2=getattr(self, self.attr_name2))
+        
+        # the keys are kept for the model owning the related fields, 
+        # so that the subclass instances are in one set with their parents
+        model = self._meta.get_field(self.attr_name1).model
+        
+        keys = self._trusted_keys.setdefault(model, set())
+        
+        if key in keys:
+            raise SymmetryError(
+                message="The relationship is already in the database.",
+                object1=getattr(self, self.attr_name1), 
+                object2=getattr(self, self.attr_name2))
+        
+        keys.add(key)
     
     def __check_save(self, object1, object2):
         """Check whether the the relationship between the objects in the given direction
@@ -0,0 +1,364 @@
+"""The instrumentation of the recommender build.
+
+Each stage of the build (creating the subjectobjects, the rule instances,
+aggregating, compiling, ...) is measured: the wall time, the processor time,
+the number of SQL queries, the number of written rows and the memory
+of the process. The progress messages of the layers are printed through
+the profiler, if it's verbose.
+
+Contents:
+ - StageRecord: the measured values of one stage
+ - BuildProfiler: measures the stages of a build, a single instance
+   build_profiler is used by the recommender and the layers below it
+"""
+
+import os
+import time
+import json
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from django.db import connection
+
+from unresyst.exceptions import UnresystError
+
+_WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+"""The beginnings of the statements whose row counts are counted as written"""
+
+def _get_cpu_time():
+    """Get the processor time used by the process.
+
+    @rtype: float
+    @return: the user and system time in seconds
+    """
+    if resource is None:
+        return time.clock()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    return usage.ru_utime + usage.ru_stime
+
+
+def _get_rss():
+    """Get the current resident set size of the process.
+
+    @rtype: int
+    @return: the memory used by the process now in kilobytes, None if it
+        can't be obtained (/proc isn't available)
+    """
+    try:
+        f = open('/proc/self/statm')
+        try:
+            resident_pages = int(f.read().split()[1])
+        finally:
+            f.close()
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+class StageRecord(object):
+    """The measured values of a build stage."""
+
+    def __init__(self, name):
+        """The initializer, starts the measurement"""
+
+        self.name = name
+        """The name of the stage"""
+
+        self.wall_time = time.time()
+        """The elapsed time in seconds, the start time until the stage is
+        finished"""
+
+        self.cpu_time = _get_cpu_time()
+        """The processor time in seconds, the start value until the stage
+        is finished"""
+
+        self.queries = 0
+        """The number of executed SQL statements, executemany counts as one"""
+
+        self.rows_written = 0
+        """The number of rows inserted, updated or deleted"""
+
+        self.rss = _get_rss()
+        """The memory of the process in kilobytes, the start value until
+        the stage is finished, see _get_rss"""
+
+        self.rss_delta = None
+        """The change of the memory of the process during the stage, 
+        in kilobytes"""
+
+    def finish(self):
+        """Stop the measurement"""
+
+        self.wall_time = time.time() - self.wall_time
+        self.cpu_time = _get_cpu_time() - self.cpu_time
+
+        start_rss = self.rss
+        self.rss = _get_rss()
+
+        if start_rss is not None and self.rss is not None:
+            self.rss_delta = self.rss - start_rss
+
+    def as_dict(self):
+        """Get the measured values as a dictionary.
+
+        @rtype: dict str: value
+        @return: the values by the attribute names
+        """
+        return {
+            'name': self.name,
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'queries': self.queries,
+            'rows_written': self.rows_written,
+            'rss': self.rss,
+            'rss_delta': self.rss_delta,
+        }
+
+
+class _CountingCursor(object):
+    """A database cursor wrapper counting the statements and written rows
+    to the open stages of the profiler."""
+
+    def __init__(self, cursor, profiler):
+        """The initializer"""
+
+        self.cursor = cursor
+        """The wrapped cursor"""
+
+        self.profiler = profiler
+        """The profiler the statements are counted to"""
+
+    def execute(self, sql, params=()):
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.profiler._count_statement(sql, self.cursor.rowcount)
+
+    def executemany(self, sql, param_list):
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.profiler._count_statement(sql, self.cursor.rowcount)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+class BuildProfiler(object):
+    """Measures the stages of the recommender build.
+
+    The stages are marked by the stage context manager, which does nothing
+    if the profiler isn't running, so the layers can mark their stages
+    also when used outside the build. The same holds for the progress 
+    messages. The SQL statements are counted by wrapping the cursors of 
+    the default connection while running. Nested stages are counted also 
+    to the enclosing ones.
+
+    Usage:
+
+    with build_profiler.run(name='ShoeRecommender', verbose=True) as report:
+        with build_profiler.stage('rules'):
+            build_profiler.message('    5 rules evaluated')
+            ...
+    """
+
+    def __init__(self):
+        """The initializer"""
+
+        self.verbose = False
+        """Should the messages and the finished stages be printed?"""
+
+        self._name = None
+        """The name of the profiled build"""
+
+        self._stages = []
+        """The finished stage records, in the order of start"""
+
+        self._open = []
+        """The stack of records being measured, the whole build is
+        at the bottom"""
+
+    def is_running(self):
+        """Is a build being profiled?
+
+        @rtype: bool
+        """
+        return bool(self._open)
+
+    def start(self, name, verbose=False):
+        """Start profiling the build.
+
+        @type name: str
+        @param name: the name of the build, e.g. the recommender class name
+
+        @type verbose: bool
+        @param verbose: should the messages and the finished stages 
+            be printed?
+
+        @raise UnresystError: if the profiler is already running
+        """
+        if self.is_running():
+            raise UnresystError("The profiler is already running (%s)." % self._name)
+
+        self.verbose = verbose
+        self._name = name
+        self._stages = []
+        self._open = [StageRecord(name='build')]
+
+        self._wrap_cursor()
+
+    def stop(self):
+        """Stop profiling and get the report.
+
+        @rtype: dict
+        @return: the report. The measured values of the whole build
+            (see StageRecord.as_dict), the recommender name, the start time
+            and the list of stage dictionaries under 'stages'.
+        """
+        build = self._open[0]
+
+        try:
+            build.finish()
+        finally:
+            self.reset()
+
+        report = build.as_dict()
+        report['name'] = self._name
+        report['started'] = time.strftime('%Y-%m-%d %H:%M:%S',
+                                time.localtime(time.time() - build.wall_time))
+        report['stages'] = [stage.as_dict() for stage in self._stages]
+
+        if self.verbose:
+            self._print_record(build)
+
+        return report
+
+    def reset(self):
+        """Stop profiling without a report, restore the cursors. To be 
+        called in the processes forked during the build."""
+
+        self._open = []
+        self._unwrap_cursor()
+
+    @contextmanager
+    def run(self, name, verbose=False):
+        """Profile the enclosed code, to be used in the with statement.
+        For the parameters see start.
+
+        @rtype: dict
+        @return: the dictionary the report is put to at the end, see stop
+        """
+        report = {}
+
+        self.start(name=name, verbose=verbose)
+
+        try:
+            yield report
+        finally:
+            report.update(self.stop())
+
+    @contextmanager
+    def stage(self, name):
+        """Measure a stage of the build, to be used in the with statement.
+        Does nothing if the profiler isn't running.
+
+        @type name: str
+        @param name: the name of the stage
+        """
+        if not self.is_running():
+            yield
+            return
+
+        record = StageRecord(name=name)
+
+        self._stages.append(record)
+        self._open.append(record)
+
+        try:
+            yield
+        finally:
+            record.finish()
+            self._open.remove(record)
+
+            if self.verbose:
+                self._print_record(record)
+
+    def message(self, text):
+        """Print a progress message if the profiler is running and verbose.
+
+        @type text: str
+        @param text: the message
+        """
+        if self.verbose and self.is_running():
+            print text
+
+    @staticmethod
+    def write_log(report, filename):
+        """Append the report to the log file as a line of JSON.
+
+        @type report: dict
+        @param report: the report returned by stop()
+
+        @type filename: str
+        @param filename: the full path to the log file
+        """
+        f = open(filename, 'a')
+        try:
+            f.write(json.dumps(report, sort_keys=True) + '\n')
+        finally:
+            f.close()
+
+    def _wrap_cursor(self):
+        """Count the statements of the cursors of the connection"""
+
+        original_cursor = connection.cursor
+
+        # shadow the method of the connection by the instance attribute
+        connection.cursor = lambda: _CountingCursor(original_cursor(), self)
+
+    def _unwrap_cursor(self):
+        """Restore the cursors of the connection"""
+
+        # remove the shadowing attribute
+        if 'cursor' in connection.__dict__:
+            del connection.cursor
+
+    def _count_statement(self, sql, rowcount):
+        """Count the executed statement to all open records.
+
+        @type sql: str
+        @param sql: the executed statement
+
+        @type rowcount: int
+        @param rowcount: the rowcount of the cursor after the execution,
+            -1 if not known
+        """
+        is_write = sql.lstrip()[:7].upper().startswith(_WRITE_STATEMENTS)
+
+        for record in self._open:
+            record.queries += 1
+
+            if is_write and rowcount > 0:
+                record.rows_written += rowcount
+
+    @staticmethod
+    def _print_record(record):
+        """Print the values of the finished record"""
+
+        print "  [%s] %.2f s, %.2f s CPU, %d queries, %d rows written, RSS %s kB (%+d kB)" % \
+            (record.name, record.wall_time, record.cpu_time, record.queries,
+             record.rows_written, record.rss, record.rss_delta or 0)
+
+
+build_profiler = BuildProfiler()
+"""The profiler used by the recommender build and the layers"""
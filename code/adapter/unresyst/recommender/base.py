@@ -21,6 +21,11 @@ class BaseRecommender(object):
     def build(cls):
         """Build the recommender. Process all the rules and relationships 
         in order to be able to provide recommendations.
+        
+        @rtype: dict
+        @return: the report of the build: the wall time, processor time, 
+            number of SQL queries, written rows and memory of the whole 
+            build and of each stage, see unresyst.profiler
         """
         pass
     
@@ -54,6 +59,26 @@ class BaseRecommender(object):
             added later without updating the recommender.
         """
         pass
+    
+    @classmethod        
+    def predict_relationships(cls, pairs, save_to_db=False):    
+        """Get the predictions for many subject-object pairs at once, as by
+        predict_relationship, but with a few queries for all the pairs.
+        
+        @type pairs: iterable of pairs (domain specific subject, domain specific object)
+        @param pairs: the subjects and objects to predict the relationship for
+        
+        @type save_to_db: bool
+        @param save_to_db: should the obtained predictions be saved, so that they
+            don't have to be computed again
+        
+        @rtype: list of RelationshipPrediction
+        @return: the predictions in the order of the pairs
+        
+        @raise InvalidParameterError: if some of the subjects or objects doesn't 
+            have a domain neutral representation in the unresyst database.
+        """
+        pass
         
     @classmethod
     def get_recommendations(cls, subject, count=None):
@@ -84,39 +109,89 @@ class BaseRecommender(object):
     #  
     @classmethod       
     def add_subject(cls, subject):
-        """Add subject to the recommender."""
+        """Add the subject to the built recommender. The instances of the 
+        subject's rules, relationships and clusters are created, the biases 
+        are evaluated again and the predictions of the affected subjects 
+        are updated.
+        
+        @type subject: domain specific subject
+        @param subject: the subject to add
+        
+        @rtype: dict
+        @return: the report of the update, measured as the build
+        
+        @raise RecommenderNotBuiltError: if the recommender isn't built
+        @raise InvalidParameterError: if the subject is already in the 
+            recommender
+        """
         pass
 
     @classmethod
     def add_object(cls, object_):
-        """Add object to the recommender."""
+        """Add the object to the built recommender, see add_subject.
+        
+        @type object_: domain specific object
+        @param object_: the object to add
+        """
         pass
 
     @classmethod
     def update_subject(cls, subject):
         """Update the subject in the recommender, including its relationships
-        and applied rules"""
+        and applied rules. Should be called after the subject or its
+        relationships have changed in the domain.
+        
+        @type subject: domain specific subject
+        @param subject: the changed subject
+        
+        @rtype: dict
+        @return: the report of the update, see add_subject
+        
+        @raise RecommenderNotBuiltError: if the recommender isn't built
+        @raise InvalidParameterError: if the subject isn't in the 
+            recommender
+        """
         pass
 
 
     @classmethod    
     def update_object(cls, object_):
         """Update the object in the recommender, including its relationships
-        and applied rules"""
+        and applied rules, see update_subject.
+        
+        @type object_: domain specific object
+        @param object_: the changed object
+        """
         pass
 
 
     @classmethod
     def remove_subject(cls, subject):
         """Remove the subject from the recommender, including its relationships
-        and applied rules"""
+        and applied rules. The subject has to be already deleted from 
+        the domain (the biases are evaluated again), only its pk is used.
+        
+        @type subject: domain specific subject
+        @param subject: the removed subject
+        
+        @rtype: dict
+        @return: the report of the update, see add_subject
+        
+        @raise RecommenderNotBuiltError: if the recommender isn't built
+        @raise InvalidParameterError: if the subject isn't in the 
+            recommender
+        """
         pass
 
 
     @classmethod    
     def remove_object(cls, object_):
         """Remove the object from the recommender, including its relationships
-        and applied rules"""
+        and applied rules, see remove_subject.
+        
+        @type object_: domain specific object
+        @param object_: the removed object
+        """
         pass      
                         
         
@@ -196,7 +271,8 @@ class BaseRecommender(object):
     """
     
     verbose_build = None
-    """Should messages be printed during the build?"""
+    """Should the progress messages be printed during the build, the updates
+    and the imports?"""
     
     explicit_rating_rule = None
     """If given, this rule is exported, not the predicted_relationship"""
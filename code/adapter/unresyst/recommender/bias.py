@@ -1,9 +1,11 @@
 """Classes to represent bias of subjects and objects"""
 
 from unresyst.constants import *
+from unresyst.profiler import build_profiler
 
 from unresyst.models.abstractor import BiasDefinition, BiasInstance
 from unresyst.models.common import SubjectObject
+from unresyst.models.bulk import BulkInserter
 
 class _BaseBias(object):
     """The base class for all bias clases"""
@@ -46,8 +48,12 @@ class _BaseBias(object):
         It's dynamic, depends on the entity.
         """                
     
-    def evaluate(self):
+    def evaluate(self, batch_size=DEFAULT_BULK_BATCH_SIZE):
         """Crate bias definitions and the instances in the database.
+        
+        @type batch_size: int
+        @param batch_size: the number of instances written to the database
+            at once
         """
         
         if not (MIN_WEIGHT <= self.weight <= MAX_WEIGHT):
@@ -71,6 +77,82 @@ class _BaseBias(object):
             is_positive=self.is_positive
         )        
         
+        self._create_instances(definition, batch_size)
+        
+        build_profiler.message("  %d bias instances for bias %s created." % \
+            (BiasInstance.objects.filter(definition=definition).count(), self.name))
+    
+    def update(self, recommender_model, batch_size=DEFAULT_BULK_BATCH_SIZE):
+        """Evaluate the instances of the existing bias definition again. 
+        Used when an entity is added, updated or removed - the bias of other 
+        entities can depend on it.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender model
+        
+        @type batch_size: int
+        @param batch_size: the number of instances written to the database
+            at once
+        
+        @rtype: set of int
+        @return: the ids of the entities whose instance appeared, disappeared
+            or changed
+        """
+        definition = BiasDefinition.objects.get(
+            name=self.name,
+            recommender=recommender_model)
+        
+        qs_instances = BiasInstance.objects.filter(definition=definition)
+        
+        # the instances as they were
+        old_instances = self._get_instance_dict(qs_instances)
+        
+        qs_instances.delete()
+        
+        self._create_instances(definition, batch_size)
+        
+        new_instances = self._get_instance_dict(qs_instances)
+        
+        changed = set(old_instances).symmetric_difference(new_instances)
+        
+        for ent_id, (confidence, description) in new_instances.iteritems():
+            
+            if ent_id in old_instances:
+                old_confidence, old_description = old_instances[ent_id]
+                
+                if abs(old_confidence - confidence) > EXP_PRECISION \
+                        or old_description != description:
+                    changed.add(ent_id)
+        
+        return changed
+    
+    @staticmethod
+    def _get_instance_dict(qs_instances):
+        """Get the instances of the bias.
+        
+        @rtype: dict int: (float, str)
+        @return: the confidence and the description by the entity id
+        """
+        return dict((ent_id, (confidence, description)) \
+            for ent_id, confidence, description in qs_instances\
+                .values_list('subject_object__id', 'confidence', 'description')\
+                .iterator())
+    
+    def _create_instances(self, definition, batch_size):
+        """Create the instances for the entities given by the generator.
+        
+        @type definition: models.abstractor.BiasDefinition
+        @param definition: the definition of the bias
+        
+        @type batch_size: int
+        @param batch_size: the number of instances written to the database
+            at once
+        """
+        recommender_model = definition.recommender
+        
+        # the instances are written by batches
+        inserter = BulkInserter(model=BiasInstance, batch_size=batch_size)
+        
         # go through the affected entities create bias instances
         #        
         for ds_entity in self.generator():
@@ -99,15 +181,14 @@ class _BaseBias(object):
             description = self.description % {self.format_string: dn_entity.name}
                 
             # create the instance
-            BiasInstance.objects.create(
+            inserter.add(BiasInstance(
                 subject_object=dn_entity,
                 confidence=confidence,
                 definition=definition,
                 description=description
-            )
+            ))
         
-        print "  %d bias instances for bias %s created." % \
-            (BiasInstance.objects.filter(definition=definition).count(), self.name)
+        inserter.flush()
                         
 class SubjectBias(_BaseBias):
 
@@ -0,0 +1,185 @@
+"""Process-local caches used by the recommender in the recommend phase.
+
+Contents:
+ - LRUCache: a bounded dictionary
+ - RecommenderCache: the recommender models and the domain neutral entities
+"""
+
+import time
+from collections import OrderedDict
+
+from unresyst.constants import *
+from unresyst.models.common import SubjectObject, Recommender as RecommenderModel
+from unresyst.models.abstractor import definition_registry
+
+class LRUCache(object):
+    """A dictionary of a bounded size, forgetting the least recently used
+    items when full."""
+
+    def __init__(self, max_size):
+        """The initializer"""
+
+        self.max_size = max_size
+        """The maximal number of items"""
+
+        self._items = OrderedDict()
+        """The items from the least recently used"""
+
+    def get(self, key, default=None):
+        """Get the item, mark it as recently used.
+
+        @param key: the key of the item
+
+        @param default: returned if the key isn't there
+
+        @return: the value or default
+        """
+        if not key in self._items:
+            return default
+
+        value = self._items.pop(key)
+        self._items[key] = value
+
+        return value
+
+    def set(self, key, value):
+        """Put the item to the cache, forget the least recently used one
+        if the cache is full.
+
+        @param key: the key of the item
+
+        @param value: the value of the item
+        """
+        if key in self._items:
+            del self._items[key]
+
+        self._items[key] = value
+
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        """Forget all items"""
+        self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+
+class RecommenderCache(object):
+    """The cache of the recommender models by the class name and of
+    the domain neutral entities by their domain specific ids.
+
+    The id and the build_generation of the recommender are checked by one
+    query at most once in check_interval seconds, the whole model is fetched
+    again only if they changed. A rebuild or an update in this process
+    invalidates the cache at once, the ones in another process are noticed
+    at most check_interval seconds later. The entities are keyed by
+    the recommender id and its build_generation, so they are never used 
+    for another generation.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE, check_interval=DEFAULT_CACHE_CHECK_INTERVAL):
+        """The initializer"""
+
+        self.check_interval = check_interval
+        """The number of seconds the cached model is used without checking
+        the database"""
+
+        self._models = {}
+        """Dictionary class name: ((recommender id, build generation) or None,
+        the recommender model or None, the time of the last check)"""
+
+        self._entities = LRUCache(max_size=max_size)
+        """The cache (recommender id, build generation, entity type,
+        id in specific): (SubjectObject id, name)"""
+
+    def get_recommender_model(self, class_name):
+        """Get the recommender model for the recommender class.
+
+        @type class_name: str
+        @param class_name: the name of the recommender class
+
+        @rtype: models.common.Recommender
+        @return: the recommender model or None if it doesn't exist
+        """
+        now = time.time()
+
+        entry = self._models.get(class_name)
+
+        # checked recently
+        if entry is not None and now - entry[2] < self.check_interval:
+            return entry[1]
+
+        keys = list(RecommenderModel.objects\
+                    .filter(class_name=class_name)\
+                    .values_list('pk', 'build_generation')[:1])
+
+        key = keys[0] if keys else None
+
+        if entry is not None and entry[0] == key:
+            self._models[class_name] = (key, entry[1], now)
+            return entry[1]
+
+        recommender_model = RecommenderModel.objects.get(pk=key[0]) if key else None
+
+        # the definitions of the previous generation mustn't be used
+        if recommender_model is not None:
+            definition_registry.set_current(recommender_model)
+
+        self._models[class_name] = (key, recommender_model, now)
+
+        return recommender_model
+
+    def get_domain_neutral_entity(self, domain_specific_entity, entity_type, recommender_model):
+        """Get domain neutral representation of the given domain specific
+        entity, see SubjectObject.get_domain_neutral_entity.
+
+        The returned SubjectObject has all fields filled but it isn't obtained
+        from the database if it's in the cache.
+
+        @raise DoesNotExist: when the domain neutral representation for
+            the given entity does not exist
+        """
+        key = (recommender_model.pk, recommender_model.build_generation,
+            entity_type, unicode(domain_specific_entity.pk))
+
+        value = self._entities.get(key)
+
+        if value is None:
+            dn_entity = SubjectObject.get_domain_neutral_entity(
+                domain_specific_entity=domain_specific_entity,
+                entity_type=entity_type,
+                recommender=recommender_model)
+
+            self._entities.set(key, (dn_entity.pk, dn_entity.name))
+
+            return dn_entity
+
+        pk, name = value
+
+        return SubjectObject(
+            id=pk,
+            id_in_specific=key[3],
+            name=name,
+            entity_type=entity_type,
+            recommender=recommender_model)
+
+    def invalidate(self, class_name=None):
+        """Forget the cached data, for the given recommender class
+        or for all. Called after a build in this process.
+
+        @type class_name: str
+        @param class_name: the name of the recommender class, if None
+            the whole cache is cleared
+        """
+        if class_name is None:
+            self._models.clear()
+        else:
+            self._models.pop(class_name, None)
+
+        # the ids of the rolled back recommenders can be used again
+        self._entities.clear()
@@ -2,8 +2,10 @@
 
 from unresyst.models.abstractor import ClusterSet, Cluster, ClusterMember
 from unresyst.models.common import SubjectObject
+from unresyst.models.bulk import BulkInserter
 from unresyst.exceptions import ConfigurationError
 from unresyst.constants import *
+from unresyst.profiler import build_profiler
 
 class BaseClusterSet(object):
     """The base class for all clusters sets. Cluster set is a set of clusters,
@@ -42,9 +44,13 @@ class BaseClusterSet(object):
         subject/object/subjectobject and cluster."""
 
    
-    def evaluate(self):
+    def evaluate(self, batch_size=DEFAULT_BULK_BATCH_SIZE):
         """Crate the cluster set in the database, its clusters, bindings 
         of subjectobjects to the clusters.
+        
+        @type batch_size: int
+        @param batch_size: the number of memberships written to the database
+            at once
         """
         
         if not (MIN_WEIGHT <= self.weight <= MAX_WEIGHT):
@@ -68,13 +74,17 @@ class BaseClusterSet(object):
         
         cluster_set.save()
         
+        # the clusters created so far, by the name
+        clusters = {}
+        
+        # the memberships are written by batches
+        inserter = BulkInserter(model=ClusterMember, batch_size=batch_size)
+        
         # go through the entities create clusters on demand
         #
         
-        for ds_entity in self.filter_entities:
-            
-            # get entity cluster-confidence pairs
-            cluster_conf_pairs = self.get_cluster_confidence_pairs(ds_entity)
+        # a fresh queryset, the given one could have been evaluated
+        for ds_entity in self.filter_entities.all():
             
             # convert the entity to universal
             dn_entity = SubjectObject.get_domain_neutral_entity(
@@ -82,44 +92,111 @@ class BaseClusterSet(object):
                 entity_type=self.entity_type, 
                 recommender=recommender_model)
             
-            # go through the entity clusters
-            for cluster_name, confidence in cluster_conf_pairs:
-                
-                # if confidence invalid through an error
-                if not (MIN_CONFIDENCE <= confidence <= MAX_CONFIDENCE):
-                    raise ConfigurationError(
-                        message=("The cluster set '%s' provides confidence %f," + 
-                            " should be between 0 and 1. For cluster %s."
-                            ) % (self.name, confidence, cluster_name),
-                        recommender=self.recommender,
-                        parameter_name="Recommender.cluster_sets",
-                        parameter_value=(self.recommender.cluster_sets)
-                    )
-                
-                # get or create the cluster 
-                cluster, x = Cluster.objects.get_or_create(
-                    name=cluster_name[:MAX_LENGTH_NAME],
-                    cluster_set=cluster_set)
-
-                # evaluate the description
-                if self.description:
-                    description = self.description % {
-                        self.entity_format_str: dn_entity.name,
-                        FORMAT_STR_CLUSTER: cluster_name}                        
-                else:
-                    description = ''        
-                
-                # save the binding of the cluster to the dn_entity
-                member = ClusterMember.objects.create(
-                    cluster=cluster,
-                    member=dn_entity,
-                    confidence=confidence,
-                    description=description)
-        
-        print "  %d clusters and %d cluster members for '%s' cluster set created." \
+            self._add_memberships(cluster_set, clusters, dn_entity, ds_entity, inserter)
+        
+        inserter.flush()
+        
+        build_profiler.message("  %d clusters and %d cluster members for '%s' cluster set created." \
             % (Cluster.objects.filter(cluster_set=cluster_set).count(), 
                 ClusterMember.objects.filter(cluster__cluster_set=cluster_set).count(),
-                self.name)
+                self.name))
+    
+    def evaluate_entity(self, dn_entity, ds_entity, batch_size=DEFAULT_BULK_BATCH_SIZE):
+        """Create the memberships of the given entity in the existing cluster 
+        set, the clusters are created on demand. Used when the entity 
+        is added or updated. The old memberships of the entity have to be 
+        deleted before.
+        
+        @type dn_entity: models.common.SubjectObject
+        @param dn_entity: the domain neutral entity
+        
+        @type ds_entity: django.db.models.Model
+        @param ds_entity: the domain specific entity
+        
+        @type batch_size: int
+        @param batch_size: the number of memberships written to the database
+            at once
+        """
+        
+        # the entity doesn't belong to the cluster set
+        if dn_entity.entity_type != self.entity_type or \
+                not self.filter_entities.filter(pk=ds_entity.pk).exists():
+            return
+        
+        cluster_set = ClusterSet.objects.get(
+            name=self.name,
+            recommender=dn_entity.recommender)
+        
+        # the existing clusters by the name
+        clusters = dict((c.name, c) for c in Cluster.objects.filter(cluster_set=cluster_set))
+        
+        inserter = BulkInserter(model=ClusterMember, batch_size=batch_size)
+        
+        self._add_memberships(cluster_set, clusters, dn_entity, ds_entity, inserter)
+        
+        inserter.flush()
+    
+    def _add_memberships(self, cluster_set, clusters, dn_entity, ds_entity, inserter):
+        """Create the memberships of the entity in its clusters.
+        
+        @type cluster_set: models.abstractor.ClusterSet
+        @param cluster_set: the cluster set in the database
+        
+        @type clusters: dict str: models.abstractor.Cluster
+        @param clusters: the clusters created so far by the name, the new
+            clusters are added
+        
+        @type dn_entity: models.common.SubjectObject
+        @param dn_entity: the domain neutral entity
+        
+        @type ds_entity: django.db.models.Model
+        @param ds_entity: the domain specific entity
+        
+        @type inserter: models.bulk.BulkInserter
+        @param inserter: the inserter for the memberships
+        """
+        
+        # get entity cluster-confidence pairs
+        cluster_conf_pairs = self.get_cluster_confidence_pairs(ds_entity)
+        
+        # go through the entity clusters
+        for cluster_name, confidence in cluster_conf_pairs:
+            
+            # if confidence invalid through an error
+            if not (MIN_CONFIDENCE <= confidence <= MAX_CONFIDENCE):
+                raise ConfigurationError(
+                    message=("The cluster set '%s' provides confidence %f," + 
+                        " should be between 0 and 1. For cluster %s."
+                        ) % (self.name, confidence, cluster_name),
+                    recommender=self.recommender,
+                    parameter_name="Recommender.cluster_sets",
+                    parameter_value=(self.recommender.cluster_sets)
+                )
+            
+            # get or create the cluster 
+            name = cluster_name[:MAX_LENGTH_NAME]
+            
+            if not clusters.has_key(name):
+                clusters[name] = Cluster.objects.create(
+                    name=name,
+                    cluster_set=cluster_set)
+            
+            cluster = clusters[name]
+
+            # evaluate the description
+            if self.description:
+                description = self.description % {
+                    self.entity_format_str: dn_entity.name,
+                    FORMAT_STR_CLUSTER: cluster_name}                        
+            else:
+                description = ''        
+            
+            # save the binding of the cluster to the dn_entity
+            inserter.add(ClusterMember(
+                cluster=cluster,
+                member=dn_entity,
+                confidence=confidence,
+                description=description))
         
         
    
@@ -0,0 +1,125 @@
+"""The binary columnar export of the predictions, a .npy file holding
+a structured array of PREDICTION_DTYPE. The file can be memory-mapped by
+the offline consumers:
+
+predictions = load_predictions('predictions.npy')
+predictions['subject'], predictions['object'], predictions['expectancy']
+
+The ids of the domain specific entities have to be integers.
+
+Needs numpy.
+"""
+
+import os
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from unresyst.constants import *
+from exporter import get_prediction_queryset, iter_prediction_pages
+
+PREDICTION_DTYPE = np.dtype([
+    ('subject', np.int64),
+    ('object', np.int64),
+    ('expectancy', np.float32),
+])
+"""The type of the exported array items"""
+
+def export_npy(recommender_model, filename, page_size=DEFAULT_EXPORT_PAGE_SIZE):
+    """Export the predictions to a .npy file. The array is written through
+    a memory map, page by page, it isn't held in memory.
+
+    The file is written under a temporary name and renamed at the end, 
+    the readers of the old file keep it. Nothing is left if the export fails.
+
+    @type recommender_model: models.common.Recommender
+    @param recommender_model: the recommender
+
+    @type filename: str
+    @param filename: the full path to the file
+
+    @type page_size: int
+    @param page_size: the number of rows read by one query
+
+    @rtype: int
+    @return: the number of exported predictions
+
+    @raise ValueError: if some id of the domain specific entities isn't
+        an integer
+    """
+    tmp_filename = filename + '.tmp'
+
+    try:
+        count = _write_predictions(
+                    qs_predictions=get_prediction_queryset(recommender_model),
+                    filename=tmp_filename,
+                    page_size=page_size)
+
+        os.rename(tmp_filename, filename)
+
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+    return count
+
+def _write_predictions(qs_predictions, filename, page_size):
+    """Write the predictions to the .npy file, see export_npy.
+
+    @rtype: int
+    @return: the number of written predictions
+    """
+    count = qs_predictions.count()
+
+    # an empty file can't be mapped
+    if not count:
+        with open(filename, 'wb') as f:
+            np.save(f, np.zeros(0, dtype=PREDICTION_DTYPE))
+        return 0
+
+    predictions = open_memmap(filename, mode='w+', dtype=PREDICTION_DTYPE, shape=(count,))
+
+    i = 0
+
+    for page in iter_prediction_pages(qs_predictions, page_size):
+
+        predictions[i:i + len(page)] = [(int(subj_id), int(obj_id), expectancy) \
+                                            for subj_id, obj_id, expectancy in page]
+        i += len(page)
+
+    predictions.flush()
+
+    # the predictions deleted during the export left the tail unfilled,
+    # the filled rows are saved again (the queryset doesn't get new ones)
+    if i < count:
+
+        truncated_filename = filename + '.truncated'
+
+        try:
+            with open(truncated_filename, 'wb') as f:
+                np.save(f, predictions[:i])
+
+            del predictions
+
+            os.rename(truncated_filename, filename)
+
+        finally:
+            if os.path.exists(truncated_filename):
+                os.remove(truncated_filename)
+
+        return i
+
+    del predictions
+
+    return count
+
+def load_predictions(filename):
+    """Open the exported predictions, memory-mapped for reading.
+
+    @type filename: str
+    @param filename: the full path to the file
+
+    @rtype: numpy.memmap of PREDICTION_DTYPE
+    @return: the predictions
+    """
+    return np.load(filename, mmap_mode='r')
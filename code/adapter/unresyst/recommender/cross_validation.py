@@ -0,0 +1,275 @@
+"""The k-fold cross-validation run in parallel.
+
+The selection of the test pairs is destructive and each fold needs its own
+build, so the folds can't share the database. The dataset is cloned to one
+sqlite file per fold, each fold is selected (EvaluationPairModel.select(i)),
+built and evaluated (BaseEvaluator.evaluate) in a worker process on its own
+file. The source database isn't changed.
+
+The metrics of the folds are aggregated to the mean and the variance.
+
+Usage:
+
+results = cross_validate(MovieRecommender, MovieRecommenderEvaluator, count=10)
+results['metrics']['rmse']['mean'], results['metrics']['rmse']['variance'], ...
+
+Works on the sqlite databases, a dataset in another database has to be
+moved to sqlite first (e.g. by dumpdata and loaddata with sqlite settings).
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import math
+import multiprocessing
+
+from django.db import connection, transaction
+
+from unresyst.constants import *
+from unresyst.exceptions import ConfigurationError, RecommenderError
+
+FOLD_FILENAME = 'fold%d.db'
+"""The name of the database file of the fold"""
+
+def clone_database(filenames):
+    """Copy the current database to the given sqlite files.
+
+    The database is dumped through the current connection, so the data
+    of a pending transaction and the in-memory databases are copied too.
+    Sqlite commits the pending transaction before the PRAGMAs of the dump.
+
+    @type filenames: list of str
+    @param filenames: the full paths to the created files
+
+    @raise ConfigurationError: if the current database isn't sqlite
+    """
+    if not connection.settings_dict['ENGINE'].endswith('sqlite3'):
+        raise ConfigurationError(
+            message="The dataset can be cloned from a sqlite database only.",
+            recommender=None,
+            parameter_name="DATABASES['default']['ENGINE']",
+            parameter_value=connection.settings_dict['ENGINE'])
+
+    # make sure the connection is open
+    connection.cursor()
+
+    target = sqlite3.connect(filenames[0])
+
+    try:
+        statements = []
+
+        # the dump starts and ends the transaction, executescript commits
+        # before each batch
+        for statement in connection.connection.iterdump():
+
+            statements.append(statement)
+
+            if len(statements) >= DEFAULT_BULK_BATCH_SIZE:
+                target.executescript('\n'.join(statements))
+                statements = []
+
+        target.executescript('\n'.join(statements))
+        target.commit()
+
+    finally:
+        target.close()
+
+    # the other folds get a copy of the first
+    for filename in filenames[1:]:
+        shutil.copyfile(filenames[0], filename)
+
+    print "    %d database copies created" % len(filenames)
+
+
+def aggregate_metrics(fold_metrics):
+    """Aggregate the metrics of the folds.
+
+    @type fold_metrics: list of dicts str: float
+    @param fold_metrics: the metrics of the folds by the names
+
+    @rtype: dict str: dict
+    @return: for each metric the 'count' of the folds where it was counted
+        (not None), the 'mean', the sample 'variance' and the standard
+        deviation 'std' over them. The variance of a single fold is 0.
+    """
+    names = set()
+
+    for metrics in fold_metrics:
+        names.update(metrics.keys())
+
+    aggregated = {}
+
+    for name in names:
+
+        values = [metrics[name] for metrics in fold_metrics \
+                    if metrics.get(name) is not None]
+
+        if not values:
+            aggregated[name] = {'count': 0}
+            continue
+
+        mean = sum(values) / len(values)
+
+        variance = sum((value - mean) ** 2 for value in values) / (len(values) - 1) \
+                    if len(values) > 1 else 0.0
+
+        aggregated[name] = {
+            'count': len(values),
+            'mean': mean,
+            'variance': variance,
+            'std': math.sqrt(variance),
+        }
+
+    return aggregated
+
+
+def cross_validate(recommender, evaluator, count, fold_count=DEFAULT_FOLD_COUNT,
+        workers=None, directory=None):
+    """Run the cross-validation, the folds are evaluated in parallel.
+
+    @type recommender: Recommender
+    @param recommender: the recommender class, built in each fold
+
+    @type evaluator: BaseEvaluator
+    @param evaluator: the evaluator class, its EvaluationPairModel.select(i)
+        selects the test pairs of the i-th fold
+
+    @type count: int
+    @param count: the number of recommendations for the recommendation metrics
+
+    @type fold_count: int
+    @param fold_count: the number of the folds, has to match the selection
+        of the pair model
+
+    @type workers: int
+    @param workers: the number of worker processes, by default one for each
+        fold, at most the number of the processors
+
+    @type directory: str
+    @param directory: the directory for the fold databases, they are kept
+        there. If not given, a temporary directory is used and removed.
+
+    @rtype: dict
+    @return: the 'folds' - a list of dicts with the 'metrics'
+        (see BaseEvaluator.evaluate) and the 'time' of the fold,
+        the aggregated 'metrics' (see aggregate_metrics) and the total 'time'
+
+    @raise ConfigurationError: if the database isn't sqlite
+    @raise RecommenderError: if a transaction of a database file is pending,
+        the connection is closed before forking the workers
+    """
+    global _fold_validation
+
+    # closing the connection would roll the pending changes back,
+    # the in-memory database isn't closed
+    if transaction.is_dirty() and connection.settings_dict['NAME'] != ':memory:':
+        raise RecommenderError(
+            message="Commit the pending transaction before the cross-validation.",
+            recommender=recommender)
+
+    if workers is None:
+        workers = min(fold_count, multiprocessing.cpu_count())
+
+    start = time.time()
+
+    is_temporary = directory is None
+
+    if is_temporary:
+        directory = tempfile.mkdtemp()
+
+    try:
+        filenames = [os.path.join(directory, FOLD_FILENAME % i) \
+                        for i in xrange(fold_count)]
+
+        print "Cloning the dataset for %d folds..." % fold_count
+
+        clone_database(filenames)
+
+        print "Validating the folds in %d processes..." % workers
+
+        # the workers mustn't share the connection
+        connection.close()
+
+        _fold_validation = (recommender, evaluator, count)
+
+        # each fold gets a fresh process, without the caches of the previous
+        pool = multiprocessing.Pool(processes=workers, maxtasksperchild=1)
+
+        folds = []
+
+        try:
+            for i, fold in enumerate(pool.imap(_validate_fold, enumerate(filenames))):
+
+                folds.append(fold)
+
+                print "    %d out of %d folds validated." % (i + 1, fold_count)
+
+            pool.close()
+
+        finally:
+            pool.terminate()
+            pool.join()
+            _fold_validation = None
+
+    finally:
+        if is_temporary:
+            shutil.rmtree(directory)
+
+    metrics = aggregate_metrics([fold['metrics'] for fold in folds])
+
+    for name in sorted(metrics.keys()):
+        if metrics[name]['count']:
+            print "%s: %f (variance %f)" % \
+                (name.upper(), metrics[name]['mean'], metrics[name]['variance'])
+
+    return {
+        'folds': folds,
+        'metrics': metrics,
+        'time': time.time() - start,
+    }
+
+
+_fold_validation = None
+"""The recommender, the evaluator and the recommendation count used in
+the worker processes, set before they are forked"""
+
+def _validate_fold(fold):
+    """Select, build and evaluate a fold on its database, in a worker process.
+
+    @type fold: tuple (int, str)
+    @param fold: the fold number and the full path to its database
+
+    @rtype: dict
+    @return: the 'metrics' and the 'time' of the fold
+    """
+    i, filename = fold
+
+    recommender, evaluator, count = _fold_validation
+
+    start = time.time()
+
+    # the connection of the process gets its own settings with the fold
+    # database, the shared ones aren't changed. Then the inherited connection
+    # is closed (an in-memory one is closed only when switched).
+    connection.settings_dict = dict(connection.settings_dict, NAME=filename)
+    connection.close()
+
+    # the folds mustn't overwrite each other's store
+    if recommender.prediction_store_filename:
+        recommender.prediction_store_filename = '%s.%d' % \
+            (recommender.prediction_store_filename, i)
+
+    evaluator.EvaluationPairModel.select(i)
+
+    recommender.build()
+
+    metrics = evaluator.evaluate(recommender, count)
+
+    connection.close()
+
+    return {
+        'metrics': metrics,
+        'time': time.time() - start,
+    }
@@ -126,33 +126,40 @@ class BaseEvaluator(object):
         
         print "Processing %d pairs..." % all_count
         
-        # go through the pairs
-        for pair in qs_pairs.iterator():
-            
-            # evaluate
-            prediction = recommender.predict_relationship(pair.subj, pair.obj, save_predictions)
+        pairs = list(qs_pairs.select_related('subj', 'obj'))
+        
+        # go through the pairs by chunks
+        for start in xrange(0, all_count, DEFAULT_QUERY_CHUNK_SIZE):
             
-            # log
-            if fpreds:
-                fpreds.write(u"%s\n" % prediction.__unicode__())
+            chunk = pairs[start:start + DEFAULT_QUERY_CHUNK_SIZE]
             
-            pair.obtained_expectancy = prediction.expectancy
-            pair.is_successful = pair.get_success()
-            pair.save()                            
+            # evaluate the whole chunk
+            predictions = recommender.predict_relationships(
+                [(pair.subj, pair.obj) for pair in chunk], save_predictions)
             
-            i += 1
+            for pair, prediction in zip(chunk, predictions):
             
-            if i % 100 == 0:
-                print "%d pairs processed" % i
+                # log
+                if fpreds:
+                    fpreds.write(u"%s\n" % prediction.__unicode__())
                 
-            if pair.is_successful:
-                succ_count += 1
+                pair.obtained_expectancy = prediction.expectancy
+                pair.is_successful = pair.get_success()
+                pair.save()                            
                 
-                if fhits:
-                    fhits.write(u'%s\n' % prediction.__unicode__())
+                i += 1
                 
-                if pair.obtained_expectancy < TRIVIAL_EXPECTANCY:
-                    non_triv_count += 1
+                if i % 100 == 0:
+                    print "%d pairs processed" % i
+                    
+                if pair.is_successful:
+                    succ_count += 1
+                    
+                    if fhits:
+                        fhits.write(u'%s\n' % prediction.__unicode__())
+                    
+                    if pair.obtained_expectancy < TRIVIAL_EXPECTANCY:
+                        non_triv_count += 1
         
         # this isn't very best practice-following but we don't care for file corruption
         if fhits:
@@ -170,6 +177,71 @@ class BaseEvaluator(object):
         # count the metric        
         return cls.prediction_metric()
     
+    @classmethod
+    def evaluate(cls, recommender, count, save_results=False, save_predictions=False):
+        """Evaluate the predictions and the recommendations in memory and 
+        count all metrics of metrics_engine.MetricsEngine. Needs numpy.
+        
+        The pairs are fetched once, unlike evaluate_predictions and 
+        evaluate_recommendations the results aren't written to the pairs 
+        one by one.
+        
+        @type recommender: Recommender
+        @param recommender: the built recommender on which the predictions
+            should be evaluated
+        
+        @type count: int
+        @param count: the number of recommendations to get
+        
+        @type save_results: bool
+        @param save_results: should the obtained expectancies and the hits 
+            be written to the pairs (by batches)?
+        
+        @type save_predictions: bool
+        @param save_predictions: should the generated predictions be saved to db?
+        
+        @rtype: dict str: float
+        @return: the metrics by the names: rmse, mae, auc, precision, recall,
+            ndcg, map (the last four at count)
+        
+        @raise EmptyTestSetError: if the test set is empty
+        """
+        # numpy is needed only here
+        from metrics_engine import MetricsEngine
+        
+        engine = MetricsEngine(cls.EvaluationPairModel)
+        
+        print "Processing %d pairs..." % len(engine.pairs)
+        
+        engine.predict(recommender, save_predictions)
+        engine.recommend(recommender, count)
+        
+        if save_results:
+            engine.save_results()
+        
+        metrics = engine.get_metrics(count)
+        
+        for name in sorted(metrics.keys()):
+            print "%s: %s" % (name.upper(), metrics[name])
+        
+        return metrics
+
+    @classmethod
+    def cross_validate(cls, recommender, count, fold_count=DEFAULT_FOLD_COUNT,
+            workers=None, directory=None):
+        """Run the k-fold cross-validation, the folds are selected, built
+        and evaluated in parallel, each on its copy of the (sqlite) database.
+        The current database isn't changed.
+
+        For the parameters and the result see cross_validation.cross_validate.
+        """
+        from cross_validation import cross_validate
+
+        return cross_validate(recommender, cls, count,
+            fold_count=fold_count,
+            workers=workers,
+            directory=directory)
+
     @classmethod
     def evaluate_recommendations(cls, recommender, count):
         """Evaluate recommendations obtained for the subjects in the test
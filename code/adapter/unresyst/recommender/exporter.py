@@ -0,0 +1,99 @@
+"""Streaming export of the predictions of a built recommender.
+
+The predictions are read by pages through the primary key, only the ids
+of the domain specific entities and the expectancy are selected (by a join
+to the subject objects), no model instances are created.
+
+Contents:
+ - iter_prediction_pages: the pages of the prediction rows
+ - export_csv: the csv export
+The binary columnar export is in the columnar module, it needs numpy.
+"""
+
+from django.db.models import Max
+
+from unresyst.constants import *
+from unresyst.models.algorithm import RelationshipPredictionInstance
+
+def get_prediction_queryset(recommender_model):
+    """Get the exported predictions of the recommender. The predictions 
+    created after the call aren't contained.
+
+    @type recommender_model: models.common.Recommender
+    @param recommender_model: the recommender
+
+    @rtype: QuerySet
+    @return: the predictions up to the current maximal id
+    """
+    qs_predictions = RelationshipPredictionInstance.objects.filter(
+                        recommender=recommender_model)
+
+    max_pk = qs_predictions.aggregate(max_pk=Max('pk'))['max_pk']
+
+    return qs_predictions.filter(pk__lte=max_pk or 0)
+
+def iter_prediction_pages(qs_predictions, page_size=DEFAULT_EXPORT_PAGE_SIZE):
+    """Read the predictions by pages, ordered by the id. Each page is one
+    query continuing after the last id of the previous page, so that the 
+    database doesn't skip the read rows as for OFFSET.
+
+    @type qs_predictions: QuerySet
+    @param qs_predictions: the predictions, see get_prediction_queryset
+
+    @type page_size: int
+    @param page_size: the number of rows read by one query
+
+    @rtype: generator of lists of tuples (str, str, float)
+    @return: the pages of (subject id_in_specific, object id_in_specific, 
+        expectancy)
+    """
+    last_pk = 0
+
+    while True:
+
+        page = list(qs_predictions\
+            .filter(pk__gt=last_pk)\
+            .order_by('pk')\
+            .values_list(
+                'pk', 
+                'subject_object1__id_in_specific', 
+                'subject_object2__id_in_specific', 
+                'expectancy')[:page_size])
+
+        if not page:
+            return
+
+        last_pk = page[-1][0]
+
+        yield [row[1:] for row in page]
+
+def export_csv(recommender_model, filename, page_size=DEFAULT_EXPORT_PAGE_SIZE):
+    """Export the predictions to a csv file in format:
+    <id subject>,<id object>,<prediction>\\n
+
+    @type recommender_model: models.common.Recommender
+    @param recommender_model: the recommender
+
+    @type filename: str
+    @param filename: the full path to the file
+
+    @type page_size: int
+    @param page_size: the number of rows read by one query
+
+    @rtype: int
+    @return: the number of exported predictions
+
+    @raise FileNotExists and other file open errors.
+    """
+    count = 0
+
+    with open(filename, 'w') as f:
+
+        for page in iter_prediction_pages(
+                get_prediction_queryset(recommender_model), page_size):
+
+            f.writelines(["%s,%s,%s\n" % row for row in page])
+
+            count += len(page)
+
+    return count
@@ -1,12 +1,12 @@
 """A module for recommender making predictions in an outside engine"""
-import csv
-
 from base import BaseRecommender
 from predictions import RelationshipPrediction
+from importer import ExternalPredictionImporter
 from unresyst.exceptions import RecommenderError, RecommenderNotBuiltError
 from unresyst.models.algorithm import ExternalPrediction
 from unresyst.models.common import Recommender as RecommenderModel
 from unresyst.constants import *
+from unresyst.profiler import build_profiler
 
 class ExternalRecommender(BaseRecommender):
     """A class representing an outside-world recommender with an Unresyst 
@@ -50,64 +50,74 @@ class ExternalRecommender(BaseRecommender):
             rel.export(f)
         
     @classmethod
-    def import_predictions(cls, filename):
+    def import_predictions(cls, filename, resume=False):
         """Load predictions from the given csv file.
         
         Creates the recommender model for the recommender and imports the 
         predictions from the given file. The file has to be in format:
         <id subject>,<id object>,<prediction>\n
         
+        The file is imported by chunks, see importer.ExternalPredictionImporter.
+        
         @type filename: str
         @param filename: the full path to the file
 
+        @type resume: bool
+        @param resume: if True and the previous import of the file 
+            was interrupted, it is continued instead of starting over
+
+        @rtype: dict str: number
+        @return: the import report, see BasePredictionImporter.import_file
+
         @raise FileNotExists and other file open errors.
         """
         
-        cls._print('Deleting old predictions...')
+        with build_profiler.run(name=cls.__name__, verbose=cls.verbose_build):
+            
+            recommender_model = None
         
+            # the unfinished import is continued
+            if resume:
+                qs_models = RecommenderModel.objects.filter(
+                    class_name=cls.__name__,
+                    is_built=False)
+            
+                if qs_models:
+                    recommender_model = qs_models[0]
         
-        # if the recommender with the given name exists, delete it,
-        RecommenderModel.objects.filter(class_name=cls.__name__).delete()
+            if recommender_model is None:
+            
+                build_profiler.message('Deleting old predictions...')
+            
+                # if the recommender with the given name exists, delete it,
+                RecommenderModel.objects.filter(class_name=cls.__name__).delete()
+            
+                # create a new recommender and save it
+                recommender_model = RecommenderModel(
+                    class_name=cls.__name__,
+                    name=cls.name,
+                    is_built=False,
+                    are_subjects_objects=False
+                )        
+                recommender_model.save() 
+            
+                resume = False
         
-        # create a new recommender and save it
-        recommender_model = RecommenderModel(
-            class_name=cls.__name__,
-            name=cls.name,
-            is_built=False,
-            are_subjects_objects=False
-        )        
-        recommender_model.save() 
+            build_profiler.message('Importing new predictions...')
         
-        cls._print('Importing new predictions...')
+            importer = ExternalPredictionImporter(recommender_model)
         
-        # open the csv reader
-        reader = csv.reader(open(filename, "rb"), delimiter=',', quoting=csv.QUOTE_NONE)
+            report = importer.import_file(filename, resume=resume)
         
-        # parse the csv line by line
-        for subj_id, obj_id, expectancy in reader:
-            
-            # parse the values to the right types
-            subj_id = int(subj_id)
-            obj_id = int(obj_id)
-            expectancy = float(expectancy)
-            
-            # if it's already imported, go to the next pair
-            if cls.PredictionModel.objects.filter(
-                subj_id=subj_id, obj_id=obj_id, recommender=recommender_model):
-                continue
-            
-            # create a prediction
-            cls.PredictionModel.objects.create(
-                subj_id=subj_id,
-                obj_id=obj_id,
-                recommender=recommender_model,
-                expectancy=expectancy
-            )
+            recommender_model.is_built=True
+            recommender_model.save()            
+        
+            build_profiler.message('    %d predictions imported, %d rows skipped, %.0f rows/s' % \
+                (report['imported'], report['skipped'], report['rows_per_second']))
         
-        recommender_model.is_built=True
-        recommender_model.save()            
+            build_profiler.message('Done.')
         
-        cls._print('Done.')
+        return report
 
                 
     # recommend phase
@@ -154,6 +164,60 @@ class ExternalRecommender(BaseRecommender):
         return prediction
 
 
+    @classmethod        
+    def predict_relationships(cls, pairs, save_to_db=False):
+        """See the base class for the explanation
+
+        The prediction is None for the pairs where it doesn't exist.
+        """
+
+        recommender_model = cls._get_recommender_model()
+        
+        # if the recommender isn't built raise an error
+        if not recommender_model or not recommender_model.is_built:
+            raise RecommenderNotBuiltError(
+                message="Build the recommender prior to performing the " + \
+                    "predict_relationships action.",
+                recommender=cls
+            )
+        
+        pairs = list(pairs)
+        predictions = []
+        
+        for i in xrange(0, len(pairs), DEFAULT_QUERY_CHUNK_SIZE):
+            
+            chunk = pairs[i:i + DEFAULT_QUERY_CHUNK_SIZE]
+            
+            # get the existing predictions for the chunk
+            qs_prediction_model = cls.PredictionModel.objects.filter(
+                recommender=recommender_model,
+                subj_id__in=list(set(subject.pk for subject, object_ in chunk)),
+                obj_id__in=list(set(object_.pk for subject, object_ in chunk))
+            )
+            
+            expectancy_dict = dict(((subj_id, obj_id), expectancy) for subj_id, obj_id, expectancy \
+                in qs_prediction_model.values_list('subj_id', 'obj_id', 'expectancy'))
+            
+            for subject, object_ in chunk:
+                
+                expectancy = expectancy_dict.get((subject.pk, object_.pk))
+                
+                # if it doesn't exist, the prediction is None
+                if expectancy is None:
+                    predictions.append(None)
+                    continue
+                
+                # create the outer-world object
+                predictions.append(RelationshipPrediction(
+                    subject=subject,
+                    object_=object_,
+                    expectancy=expectancy,
+                    is_uncertain=abs(expectancy - UNCERTAIN_PREDICTION_VALUE) < EXP_PRECISION
+                ))
+        
+        return predictions
+
+
     @classmethod
     def get_recommendations(cls, subject, count=None):        
         """For documentation, see the base class"""
@@ -0,0 +1,421 @@
+"""Streaming import of the predictions from csv files.
+
+The file is read by chunks of lines. In each chunk the pairs are deduplicated
+in memory, the pairs already in the database are found by a few IN queries
+and the new predictions are written by multi-row INSERTs (BulkInserter).
+After each chunk the position in the file is saved to a progress file
+next to the imported one, so that an interrupted import can be resumed.
+
+The file has to be in format:
+<id subject>,<id object>,<prediction>\n
+
+Contents:
+ - BasePredictionImporter: the reading, the progress and the report
+ - ExternalPredictionImporter: for ExternalRecommender.import_predictions
+ - RelationshipPredictionImporter: for Recommender.update_predictions
+"""
+
+import os
+import time
+import json
+
+from unresyst.constants import *
+from unresyst.models.bulk import BulkInserter
+from unresyst.models.common import SubjectObject
+from unresyst.models.algorithm import ExternalPrediction, RelationshipPredictionInstance
+
+PROGRESS_SUFFIX = '.progress'
+"""The suffix of the progress file name"""
+
+def _chunks(values, size=DEFAULT_QUERY_CHUNK_SIZE):
+    """Split the values to lists of the given size, for the IN queries.
+
+    @type values: iterable
+    @param values: the values
+
+    @rtype: generator of lists
+    """
+    values = list(values)
+
+    for i in xrange(0, len(values), size):
+        yield values[i:i + size]
+
+
+class BasePredictionImporter(object):
+    """The base class for the importers, reads the file by chunks
+    and writes the new predictions.
+    """
+
+    Model = None
+    """The model of the imported predictions, to be overriden"""
+
+    def __init__(self, recommender_model, chunk_size=DEFAULT_IMPORT_CHUNK_SIZE,
+            batch_size=DEFAULT_BULK_BATCH_SIZE):
+        """The initializer
+
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender the predictions belong to
+
+        @type chunk_size: int
+        @param chunk_size: the number of lines processed at once, the progress
+            is saved after each chunk
+
+        @type batch_size: int
+        @param batch_size: the number of predictions written by one INSERT
+        """
+        self.recommender_model = recommender_model
+        """The recommender the predictions belong to"""
+
+        self.chunk_size = chunk_size
+        """The number of lines processed at once"""
+
+        self.batch_size = batch_size
+        """The number of predictions written by one INSERT"""
+
+    @staticmethod
+    def get_progress_filename(filename):
+        """Get the name of the progress file for the imported file.
+
+        @type filename: str
+        @param filename: the full path to the imported file
+
+        @rtype: str
+        """
+        return filename + PROGRESS_SUFFIX
+
+    def import_file(self, filename, resume=False):
+        """Import the predictions from the file.
+
+        @type filename: str
+        @param filename: the full path to the file
+
+        @type resume: bool
+        @param resume: if True and the progress file of a previous import
+            to the same recommender exists, the file is read from the saved
+            position. The lines after it are imported anyway, the pairs in the
+            database are skipped.
+
+        @rtype: dict str: number
+        @return: the report: the numbers of the 'rows' read, predictions
+            'imported' and 'skipped' (empty, duplicate, already imported,
+            unknown or self pairs), of them the rows with an entity 'unknown'
+            to the recommender and the 'self_pairs' of an entity with itself,
+            all including the resumed import, the 'time' of this run 
+            in seconds and the 'rows_per_second' read by this run
+
+        @raise FileNotExists and other file open errors.
+        """
+        progress_filename = self.get_progress_filename(filename)
+
+        report = {'rows': 0, 'imported': 0, 'skipped': 0, 'unknown': 0, 'self_pairs': 0}
+        offset = 0
+
+        if resume:
+            progress = self._read_progress(progress_filename)
+
+            if progress is not None:
+                offset = progress['offset']
+                report.update(progress['report'])
+
+        inserter = BulkInserter(
+                    model=self.Model,
+                    batch_size=self.batch_size,
+                    check_symmetry=False)
+
+        start = time.time()
+        run_rows = 0
+
+        with open(filename, 'rb') as f:
+
+            f.seek(offset)
+
+            while True:
+
+                # readline, not the iteration, so that tell() is valid
+                lines = []
+
+                while len(lines) < self.chunk_size:
+                    line = f.readline()
+
+                    if not line:
+                        break
+
+                    lines.append(line)
+
+                if not lines:
+                    break
+
+                rows = self._parse(lines)
+
+                new_rows = self._get_new_rows(rows, report)
+
+                for row in new_rows:
+                    inserter.add(self._create_instance(*row))
+
+                # the chunk has to be in the database before the progress is saved
+                inserter.flush()
+
+                run_rows += len(lines)
+                report['rows'] += len(lines)
+                report['imported'] += len(new_rows)
+                report['skipped'] += len(lines) - len(new_rows)
+
+                self._write_progress(progress_filename, f.tell(), report)
+
+        # done, the progress isn't needed anymore
+        if os.path.exists(progress_filename):
+            os.remove(progress_filename)
+
+        report['time'] = time.time() - start
+        report['rows_per_second'] = run_rows / report['time'] if report['time'] else 0.0
+
+        return report
+
+    def _parse(self, lines):
+        """Parse the lines, skip the empty ones and the duplicate pairs.
+
+        @type lines: list of str
+        @param lines: the lines of the chunk
+
+        @rtype: list of tuples (str, str, float)
+        @return: the subject id, object id and the expectancy, for the
+            duplicate pairs the first one is kept
+        """
+        rows = []
+        seen = set()
+
+        for line in lines:
+
+            line = line.strip()
+
+            if not line:
+                continue
+
+            subj_id, obj_id, expectancy = line.split(',')
+
+            if (subj_id, obj_id) in seen:
+                continue
+
+            seen.add((subj_id, obj_id))
+            rows.append((subj_id, obj_id, float(expectancy)))
+
+        return rows
+
+    def _get_new_rows(self, rows, report):
+        """Get the rows that should be imported, to be overriden.
+
+        @type rows: list of tuples (str, str, float)
+        @param rows: the parsed rows of the chunk
+
+        @type report: dict str: number
+        @param report: the report of the import, the numbers of the 'unknown'
+            and 'self_pairs' rows are increased here
+
+        @rtype: list of tuples
+        @return: the arguments of _create_instance for the new predictions
+        """
+        pass
+
+    def _create_instance(self, *args):
+        """Create an unsaved prediction, to be overriden.
+
+        @rtype: self.Model
+        """
+        pass
+
+    def _read_progress(self, progress_filename):
+        """Read the progress of the previous import.
+
+        @type progress_filename: str
+        @param progress_filename: the full path to the progress file
+
+        @rtype: dict
+        @return: the 'offset' in the file and the 'report', None if there's
+            no progress for the recommender
+        """
+        if not os.path.exists(progress_filename):
+            return None
+
+        with open(progress_filename, 'r') as f:
+            progress = json.load(f)
+
+        if progress['recommender_id'] != self.recommender_model.pk:
+            return None
+
+        return progress
+
+    def _write_progress(self, progress_filename, offset, report):
+        """Save the progress, the file is replaced at once.
+
+        @type progress_filename: str
+        @param progress_filename: the full path to the progress file
+
+        @type offset: int
+        @param offset: the position of the first line that wasn't imported
+
+        @type report: dict
+        @param report: the numbers counted so far
+        """
+        tmp_filename = progress_filename + '.tmp'
+
+        with open(tmp_filename, 'w') as f:
+            json.dump({
+                'recommender_id': self.recommender_model.pk,
+                'offset': offset,
+                'report': report,
+            }, f)
+
+        os.rename(tmp_filename, progress_filename)
+
+
+class ExternalPredictionImporter(BasePredictionImporter):
+    """Imports the predictions of an external recommender, the ids in the
+    file are the ids of the domain specific entities."""
+
+    Model = ExternalPrediction
+    """The model of the imported predictions"""
+
+    def _get_new_rows(self, rows, report):
+        """See the base class for the documentation."""
+
+        rows = [(int(subj_id), int(obj_id), expectancy) \
+                    for subj_id, obj_id, expectancy in rows]
+
+        # the imported pairs of the subjects
+        existing = set()
+
+        for subj_ids in _chunks(set(row[0] for row in rows)):
+            existing.update(self.Model.objects\
+                .filter(recommender=self.recommender_model, subj_id__in=subj_ids)\
+                .values_list('subj_id', 'obj_id')\
+                .iterator())
+
+        return [row for row in rows if row[:2] not in existing]
+
+    def _create_instance(self, subj_id, obj_id, expectancy):
+        """See the base class for the documentation."""
+
+        return self.Model(
+            subj_id=subj_id,
+            obj_id=obj_id,
+            recommender=self.recommender_model,
+            expectancy=expectancy)
+
+
+class RelationshipPredictionImporter(BasePredictionImporter):
+    """Imports the predictions for the pairs unknown to the built recommender,
+    the ids in the file are the ids of the domain specific entities.
+    The pairs with an entity unknown to the recommender and the pairs of
+    an entity with itself are skipped and counted in the report.
+    """
+
+    Model = RelationshipPredictionInstance
+    """The model of the imported predictions"""
+
+    def __init__(self, recommender_model, **kwargs):
+        """The initializer, for the parameters see the base class."""
+
+        super(RelationshipPredictionImporter, self).__init__(recommender_model, **kwargs)
+
+        if recommender_model.are_subjects_objects:
+            subject_ent_type = object_ent_type = ENTITY_TYPE_SUBJECTOBJECT
+        else:
+            subject_ent_type = ENTITY_TYPE_SUBJECT
+            object_ent_type = ENTITY_TYPE_OBJECT
+
+        self._entity_types = (subject_ent_type, object_ent_type)
+        """The entity types of the subjects and objects"""
+
+        self._entity_ids = ({}, {})
+        """The dictionaries id_in_specific: SubjectObject id of the subjects
+        and objects found so far"""
+
+    def _get_entity_ids(self, i, specific_ids):
+        """Get the ids of the domain neutral subjects (i=0) or objects (i=1),
+        the found ones are kept for the next chunks.
+
+        @type specific_ids: set of str
+        @param specific_ids: the ids of the domain specific entities
+
+        @rtype: dict str: int
+        @return: the dictionary id_in_specific: SubjectObject id, only
+            the known entities are contained
+        """
+        entity_ids = self._entity_ids[i]
+
+        missing = [specific_id for specific_id in specific_ids \
+                    if specific_id not in entity_ids]
+
+        for ids in _chunks(missing):
+            for id_in_specific, pk in SubjectObject.objects\
+                    .filter(
+                        recommender=self.recommender_model,
+                        entity_type=self._entity_types[i],
+                        id_in_specific__in=ids)\
+                    .values_list('id_in_specific', 'pk')\
+                    .iterator():
+                entity_ids[str(id_in_specific)] = pk
+
+        return entity_ids
+
+    def _get_new_rows(self, rows, report):
+        """See the base class for the documentation."""
+
+        subject_ids = self._get_entity_ids(0, set(row[0] for row in rows))
+        object_ids = self._get_entity_ids(1, set(row[1] for row in rows))
+
+        known_rows = [(subject_ids[subj_id], object_ids[obj_id], expectancy) \
+                    for subj_id, obj_id, expectancy in rows \
+                        if subj_id in subject_ids and obj_id in object_ids]
+
+        report['unknown'] += len(rows) - len(known_rows)
+        rows = known_rows
+
+        # the predictions of the subjects, in both directions if the
+        # subjects are objects
+        existing = set()
+        subj_pks = set(row[0] for row in rows)
+
+        directions = [('subject_object1', 'subject_object2')]
+
+        if self.recommender_model.are_subjects_objects:
+            directions.append(('subject_object2', 'subject_object1'))
+
+        for pks in _chunks(subj_pks):
+            for field1, field2 in directions:
+                existing.update(self.Model.objects\
+                    .filter(
+                        recommender=self.recommender_model,
+                        **{'%s__in' % field1: pks})\
+                    .values_list(field1, field2)\
+                    .iterator())
+
+        new_rows = []
+
+        for row in rows:
+
+            key = row[:2]
+
+            if row[0] == row[1]:
+                report['self_pairs'] += 1
+                continue
+
+            if key in existing:
+                continue
+
+            # the symmetrical pairs within the chunk
+            existing.add(key)
+            existing.add((key[1], key[0]))
+
+            new_rows.append(row)
+
+        return new_rows
+
+    def _create_instance(self, subject_id, object_id, expectancy):
+        """See the base class for the documentation."""
+
+        return self.Model(
+            subject_object1_id=subject_id,
+            subject_object2_id=object_id,
+            recommender=self.recommender_model,
+            expectancy=expectancy)
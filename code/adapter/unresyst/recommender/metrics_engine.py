@@ -0,0 +1,353 @@
+"""The in-memory evaluation: the evaluation pairs are fetched once, the
+predictions and the recommendation hits are kept in arrays and the metrics
+are counted from them. Nothing is written to the database unless
+save_results is called.
+
+Usage:
+
+engine = MetricsEngine(EvaluationPairModel)
+engine.predict(recommender)
+engine.recommend(recommender, count=10)
+engine.rmse(), engine.precision_at(10), engine.ndcg_at(10), ...
+
+Needs numpy.
+"""
+
+import numpy as np
+
+from unresyst.constants import *
+from unresyst.exceptions import EmptyTestSetError
+from unresyst.models.bulk import bulk_update
+
+class MetricsEngine(object):
+    """The evaluation pairs with the obtained predictions and hits"""
+
+    def __init__(self, EvaluationPairModel):
+        """The initializer, fetches the pairs.
+
+        @type EvaluationPairModel: a model, BaseEvaluationPair subclass
+        @param EvaluationPairModel: the model of the evaluation pairs
+
+        @raise EmptyTestSetError: if there are no pairs
+        """
+        self.EvaluationPairModel = EvaluationPairModel
+        """The model of the evaluation pairs"""
+
+        self.pairs = list(EvaluationPairModel.objects\
+                        .select_related('subj', 'obj')\
+                        .order_by('pk'))
+        """The evaluation pairs, with the subjects and objects"""
+
+        if not self.pairs:
+            raise EmptyTestSetError("Call the select_validation_pairs()"+ \
+                " method first")
+
+        self.expected = np.array([pair.expected_expectancy for pair in self.pairs], dtype=float)
+        """The expected expectancies by the pairs"""
+
+        self.obtained = None
+        """The obtained expectancies by the pairs, None before predict"""
+
+        self.successful = None
+        """The successes of the predictions by the pairs, None before predict"""
+
+        self.hit_ranks = None
+        """The positions of the pair objects in the recommendations for the pair
+        subjects by the pairs, -1 if not recommended. None before recommend"""
+
+        self.count = None
+        """The number of recommendations obtained for each subject"""
+
+        # the subjects and objects as indices
+        subj_ids = [pair.subj_id for pair in self.pairs]
+        obj_ids = [pair.obj_id for pair in self.pairs]
+
+        self.subjects = []
+        """The distinct subjects in the order of the first pair"""
+
+        subject_indices = {}
+
+        for pair in self.pairs:
+            if not pair.subj_id in subject_indices:
+                subject_indices[pair.subj_id] = len(self.subjects)
+                self.subjects.append(pair.subj)
+
+        self.subject_index = np.array([subject_indices[subj_id] for subj_id in subj_ids],
+                                dtype=np.int64)
+        """The index of the subject in self.subjects by the pairs"""
+
+        object_indices = {}
+
+        self.object_index = np.array(
+            [object_indices.setdefault(obj_id, len(object_indices)) for obj_id in obj_ids],
+            dtype=np.int64)
+        """The index of the distinct object by the pairs"""
+
+        self._object_indices = object_indices
+        """Dictionary object id: index"""
+
+        # the first pair of each subject-object, the repeated pairs
+        # aren't counted as hits again
+        keys = self.subject_index * len(object_indices) + self.object_index
+
+        self.is_unique = np.zeros(len(self.pairs), dtype=bool)
+        """Is the pair the first one of its subject and object?"""
+
+        self.is_unique[np.unique(keys, return_index=True)[1]] = True
+
+    def predict(self, recommender, save_predictions=False):
+        """Obtain the predictions for all pairs, by chunks.
+
+        @type recommender: Recommender
+        @param recommender: the built recommender
+
+        @type save_predictions: bool
+        @param save_predictions: should the generated predictions be saved to db?
+        """
+        obtained = []
+
+        for start in xrange(0, len(self.pairs), DEFAULT_QUERY_CHUNK_SIZE):
+
+            chunk = self.pairs[start:start + DEFAULT_QUERY_CHUNK_SIZE]
+
+            predictions = recommender.predict_relationships(
+                [(pair.subj, pair.obj) for pair in chunk], save_predictions)
+
+            obtained.extend(prediction.expectancy for prediction in predictions)
+
+        self.obtained = np.array(obtained, dtype=float)
+
+        # the success is defined by the pair model
+        successful = []
+
+        for pair, expectancy in zip(self.pairs, obtained):
+            pair.obtained_expectancy = expectancy
+            successful.append(bool(pair.get_success()))
+
+        self.successful = np.array(successful, dtype=bool)
+
+        print "Success rate: %f (%d/%d)" % \
+            (self.successful.mean(), self.successful.sum(), len(self.pairs))
+
+    def recommend(self, recommender, count):
+        """Obtain the recommendations for all subjects and find the pair objects
+        in them.
+
+        @type recommender: Recommender
+        @param recommender: the built recommender
+
+        @type count: int
+        @param count: the number of recommendations for each subject
+        """
+        # the recommended object indices, -1 for the objects not in the pairs
+        # and for the missing recommendations
+        recommended = np.empty((len(self.subjects), count), dtype=np.int64)
+        recommended.fill(-1)
+
+        for i, subj in enumerate(self.subjects):
+
+            for rank, rec in enumerate(recommender.get_recommendations(subj, count)[:count]):
+                recommended[i, rank] = self._object_indices.get(rec.object_.pk, -1)
+
+        # the position of the pair object in the recommendations of its subject
+        found = recommended[self.subject_index] == self.object_index[:, np.newaxis]
+
+        self.hit_ranks = np.where(found.any(axis=1), found.argmax(axis=1), -1)
+        self.count = count
+
+        print "%d hits recorded" % (self.hit_ranks >= 0).sum()
+
+    def save_results(self):
+        """Write the obtained expectancies and the successes to the pairs,
+        by batches. The success is the recommendation hit if recommend was
+        called, otherwise the success of the prediction.
+        """
+        if self.hit_ranks is not None:
+            successful = self.hit_ranks >= 0
+        else:
+            successful = self.successful
+
+        rows = []
+
+        for i, pair in enumerate(self.pairs):
+            rows.append((
+                None if self.obtained is None else float(self.obtained[i]),
+                None if successful is None else bool(successful[i]),
+                pair.pk))
+
+        bulk_update(
+            model=self.EvaluationPairModel,
+            field_names=['obtained_expectancy', 'is_successful'],
+            rows=rows)
+
+    # the prediction metrics
+    #
+
+    def rmse(self):
+        """The root mean square error of the predictions.
+
+        @rtype: float
+        """
+        return float(np.sqrt(np.mean((self.expected - self.obtained) ** 2)))
+
+    def mae(self):
+        """The mean absolute error of the predictions.
+
+        @rtype: float
+        """
+        return float(np.mean(np.abs(self.expected - self.obtained)))
+
+    def auc(self):
+        """The area under the ROC curve of the predictions: the probability
+        that a random positive pair (expected expectancy bigger than
+        UNCERTAIN_PREDICTION_VALUE) gets a bigger prediction than a random
+        negative one, the ties count a half.
+
+        @rtype: float
+        @return: the AUC, None if the pairs are all positive or all negative
+        """
+        positive = self.expected > UNCERTAIN_PREDICTION_VALUE
+
+        pos_count = positive.sum()
+        neg_count = len(positive) - pos_count
+
+        if not pos_count or not neg_count:
+            return None
+
+        # the ranks of the predictions, the ties get the average rank
+        values, inverse, counts = np.unique(self.obtained, return_inverse=True, return_counts=True)
+
+        ends = np.cumsum(counts)
+        average_ranks = ends - (counts - 1) / 2.0
+
+        rank_sum = average_ranks[inverse][positive].sum()
+
+        return float((rank_sum - pos_count * (pos_count + 1) / 2.0) / (pos_count * neg_count))
+
+    # the recommendation metrics, all are averaged over the subjects
+    #
+
+    def _check_k(self, k):
+        """Check k against the number of obtained recommendations.
+
+        @rtype: int
+        @return: k, or the count if k is None
+        """
+        if k is None:
+            return self.count
+
+        assert k <= self.count, "Only %d recommendations were obtained." % self.count
+
+        return k
+
+    def _per_subject(self, weights):
+        """Sum the weights of the pairs for each subject.
+
+        @rtype: numpy array of float
+        @return: the sums by the subjects
+        """
+        return np.bincount(self.subject_index, weights=weights, minlength=len(self.subjects))
+
+    def precision_at(self, k=None):
+        """The precision: the number of hits in the first k recommendations / k.
+        A repeated pair is counted once.
+
+        @rtype: float
+        """
+        k = self._check_k(k)
+
+        hits = (self.hit_ranks >= 0) & (self.hit_ranks < k) & self.is_unique
+
+        return float(np.mean(self._per_subject(hits) / k))
+
+    def recall_at(self, k=None):
+        """The recall: the number of hits in the first k recommendations /
+        the number of the pairs of the subject. A repeated pair is counted
+        multiple times.
+
+        @rtype: float
+        """
+        k = self._check_k(k)
+
+        hits = (self.hit_ranks >= 0) & (self.hit_ranks < k)
+
+        return float(np.mean(self._per_subject(hits) / self._per_subject(None)))
+
+    def ndcg_at(self, k=None):
+        """The normalized discounted cumulative gain of the first k
+        recommendations, the distinct pair objects are relevant.
+
+        @rtype: float
+        """
+        k = self._check_k(k)
+
+        discounts = 1.0 / np.log2(np.arange(k) + 2)
+
+        hits = (self.hit_ranks >= 0) & (self.hit_ranks < k) & self.is_unique
+
+        gains = np.zeros(len(self.pairs))
+        gains[hits] = discounts[self.hit_ranks[hits]]
+
+        dcg = self._per_subject(gains)
+
+        # the ideal - all relevant objects first
+        relevant_count = self._per_subject(self.is_unique).astype(np.int64)
+
+        idcg = np.cumsum(discounts)[np.minimum(relevant_count, k) - 1]
+
+        return float(np.mean(dcg / idcg))
+
+    def map_at(self, k=None):
+        """The mean average precision of the first k recommendations, the
+        distinct pair objects are relevant. The average precision of
+        a subject is the sum of the precisions at the ranks of the hits
+        divided by min(number of relevant objects, k).
+
+        @rtype: float
+        """
+        k = self._check_k(k)
+
+        hits = np.flatnonzero((self.hit_ranks >= 0) & (self.hit_ranks < k) & self.is_unique)
+
+        # the hits by the subject and the rank
+        hits = hits[np.lexsort((self.hit_ranks[hits], self.subject_index[hits]))]
+
+        subjects = self.subject_index[hits]
+
+        # the number of hits of the subject up to the hit
+        hit_counts = np.arange(len(hits)) - np.searchsorted(subjects, subjects) + 1
+
+        precisions = np.zeros(len(self.pairs))
+        precisions[hits] = hit_counts / (self.hit_ranks[hits] + 1.0)
+
+        relevant_count = self._per_subject(self.is_unique)
+
+        return float(np.mean(self._per_subject(precisions) / np.minimum(relevant_count, k)))
+
+    def get_metrics(self, k=None):
+        """Get all the metrics that can be counted.
+
+        @type k: int
+        @param k: the number of the recommendations for the recommendation metrics
+
+        @rtype: dict str: float
+        @return: the metrics by the names
+        """
+        metrics = {}
+
+        if self.obtained is not None:
+            metrics.update({
+                'rmse': self.rmse(),
+                'mae': self.mae(),
+                'auc': self.auc(),
+            })
+
+        if self.hit_ranks is not None:
+            metrics.update({
+                'precision': self.precision_at(k),
+                'recall': self.recall_at(k),
+                'ndcg': self.ndcg_at(k),
+                'map': self.map_at(k),
+            })
+
+        return metrics
@@ -1,116 +1,150 @@
-"""Evaluator defining a method for the average prediction rank"""
+"""Evaluator defining a method for the average prediction rank.
+
+Needs numpy.
+"""
+
+import numpy as np
 
 from unresyst.exceptions import EmptyTestSetError
 from unresyst.constants import *
 from unresyst.recommender.evaluation import BaseEvaluator
 
-def index(seq, f):
-    """Return the index of the first item in seq where f(item) == True."""
-    return next((i for i in xrange(len(seq)) if f(seq[i])), None)
+def get_rank_distribution(ranks):
+    """Describe the ranks of the test objects of a subject.
+
+    @type ranks: numpy array of float
+    @param ranks: the relative ranks from [0, 1]
+
+    @rtype: dict str: number
+    @return: the count, mean, minimum, quartiles and maximum of the ranks
+    """
+    if not len(ranks):
+        return {'count': 0}
+
+    q1, median, q3 = np.percentile(ranks, [25, 50, 75])
+
+    return {
+        'count': len(ranks),
+        'mean': float(ranks.mean()),
+        'min': float(ranks.min()),
+        'q1': float(q1),
+        'median': float(median),
+        'q3': float(q3),
+        'max': float(ranks.max()),
+    }
 
 
 class RankEvaluator(BaseEvaluator):
     """The evaluator for counting the average prediction rank"""
-    
+
     SUBJ_IDS = []
     """A list of subjects (domain specific ids) that are to be tested"""
-    
-    
+
+    subject_ranks = None
+    """The result of the last evaluation - a dictionary subject id: numpy array
+    of the ranks of its test objects"""
+
     @classmethod
     def evaluate_predictions(cls, recommender, save_predictions=False):
         """See the base class for documentation.
-        
+
         Here it counts the rank, without calling any metric.
+
+        For each subject the objects are ordered: the certain predictions
+        with expectancy at most UNCERTAIN_PREDICTION_VALUE, the uncertain ones
+        (all get the average of their ranks), the certain predictions with
+        a bigger expectancy. Within the groups by the expectancy descending,
+        the ties in the order of the objects. The rank of an object is its
+        position divided by the number of objects - 1.
+
+        The ranks of the test objects are kept in subject_ranks.
         """
-            
+
         # get the test pairs
         qs_pairs = cls._get_cleared_pairs()
-        
-        # evaluate the rank for each subject
-        # 
 
-        obj_count = recommender.objects.count()
-        rank_sum = 0
-        rank_count = 0
+        # the test objects of the subjects
+        test_objects = {}
+
+        for subj_id, obj_id in qs_pairs\
+                .filter(subj__pk__in=cls.SUBJ_IDS)\
+                .values_list('subj', 'obj')\
+                .iterator():
+            test_objects.setdefault(subj_id, []).append(obj_id)
+
+        # the objects and their positions in the arrays
+        objs = list(recommender.objects.all())
+        obj_count = len(objs)
+
+        positions = dict((obj.pk, i) for i, obj in enumerate(objs))
+        columns = np.arange(obj_count)
+
+        cls.subject_ranks = {}
+
+        print "Evaluating %d subjects" % len(cls.SUBJ_IDS)
 
-        print "Evaluating %d subjects" % len(cls.SUBJ_IDS)  
-            
-        
         # go through the wished subjects
-        for subj, i in zip(recommender.subjects.filter(pk__in=cls.SUBJ_IDS), range(1, len(cls.SUBJ_IDS))):
-            
+        for i, subj in enumerate(recommender.subjects.filter(pk__in=cls.SUBJ_IDS)):
+
             # if the test set for the subject is emty go ahead
-            test_set_subj = qs_pairs.filter(subj=subj)            
-            if not test_set_subj:
+            if not subj.pk in test_objects:
                 continue
-            
-            # create an array of object predictions for the subject
-            #
-            neg_array = []
-            pos_array = []
-            uncertain_count = 0 
-            
-            for obj in recommender.objects.all():
-                
-                # get the prediction
-                exp_prediction = recommender.predict_relationship(subj, obj)
-                
-                if exp_prediction is None or exp_prediction.is_uncertain: 
-                    uncertain_count += 1
-                
-                # otherwise add it to the right array
-                else:
-                    arr = neg_array if exp_prediction.expectancy > UNCERTAIN_PREDICTION_VALUE \
-                        else pos_array
-                        
-                    arr.append((obj, exp_prediction.expectancy))
-
-            print "all predicted"
-
-            # sort the array by expectancy
-            pos_array.sort(key=lambda el: el[1], reverse=True)  
-            neg_array.sort(key=lambda el: el[1], reverse=True)  
-
-            print "all sorted"            
-            pos_count = len(pos_array)
-            neg_count = len(neg_array)
-            
-            # count the rank that will be given to uncertains.
+
+            # get the predictions for all objects at once
+            predictions = recommender.predict_relationships((subj, obj) for obj in objs)
+
+            uncertain = np.array([prediction is None or prediction.is_uncertain \
+                for prediction in predictions], dtype=bool)
+
+            expectancies = np.array([UNCERTAIN_PREDICTION_VALUE if prediction is None \
+                else prediction.expectancy for prediction in predictions], dtype=float)
+
+            # 0 - certain up to the uncertain value, 1 - uncertain, 2 - certain bigger
+            groups = np.where(uncertain, 1,
+                        np.where(expectancies > UNCERTAIN_PREDICTION_VALUE, 2, 0))
+
+            expectancies[uncertain] = 0
+
+            # the order by the group, expectancy descending and the object
+            order = np.lexsort((columns, -expectancies, groups))
+
+            ranks = np.empty(obj_count, dtype=float)
+            ranks[order] = columns / float(obj_count - 1)
+
+            # the uncertains get the average of the first and the last rank
+            uncertain_count = uncertain.sum()
+
             if uncertain_count:
-            
-                # the rank of the first uncertain
-                rank_first = float(pos_count) / (obj_count -1)
-                
-                # the rank of the last uncertain
-                rank_last = float(pos_count + uncertain_count) / (obj_count - 1)
-                
-                uncertain_rank = (rank_first + rank_last) / 2
-            
-            rank_count += test_set_subj.count()
-            
-            # count the rank for all objects for the subjects in the test set
-            for obj in test_set_subj:
-                
-                # try finding it in positives
-                ipos = index(pos_array, lambda el: el[0] == obj)
-                if not (ipos is None):
-                    rank_sum += float(ipos) / (obj_count - 1)
-                    continue
-                                    
-                # try finding it in negatives
-                ineg = index(neg_array, lambda el: el[0] == obj)
-                if not (ineg is None):
-                    rank_sum += float(pos_count + uncertain_count + ineg) / (obj_count - 1)
-                    continue
-                    
-                # otherwise it's uncertain
-                rank_sum += uncertain_rank
-                            
-            print "%d subjects evaluated. current avg rank: %f, current rank count: %d" % (i, rank_sum/rank_count if rank_count else -1.0, rank_count)
-                        
-
-        res = rank_sum / rank_count
-        
+                pos_count = (groups == 0).sum()
+
+                ranks[uncertain] = float(2 * pos_count + uncertain_count) / (2 * (obj_count - 1))
+
+            # the ranks of the objects of the subject in the test set
+            subject_ranks = ranks[[positions[obj_id] for obj_id in test_objects[subj.pk]]]
+
+            cls.subject_ranks[subj.pk] = subject_ranks
+
+            distribution = get_rank_distribution(subject_ranks)
+
+            print "%d subjects evaluated. subject %s: mean rank %f, median rank %f of %d objects" % \
+                (i + 1, subj.pk, distribution['mean'], distribution['median'], distribution['count'])
+
+        if not cls.subject_ranks:
+            raise EmptyTestSetError("There are no test pairs for the evaluated subjects.")
+
+        res = float(np.concatenate(cls.subject_ranks.values()).mean())
+
         print "Average rank: %f" % res
-        
+
         return res
+
+    @classmethod
+    def get_rank_distributions(cls):
+        """Get the distributions of the ranks of the subjects from the last
+        evaluation.
+
+        @rtype: dict subject id: dict
+        @return: the distributions, see get_rank_distribution
+        """
+        return dict((subj_id, get_rank_distribution(ranks)) \
+            for subj_id, ranks in cls.subject_ranks.iteritems())
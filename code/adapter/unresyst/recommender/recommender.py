@@ -7,7 +7,8 @@ Contents:
 """
 import math
 import copy
-import csv
+
+from django.db.models import F
 
 from base import BaseRecommender
 from predictions import RelationshipPrediction
@@ -20,8 +21,15 @@ from unresyst.algorithm import SimpleAlgorithm, AggregatingAlgorithm, CompilingA
 from unresyst.models.common import SubjectObject, Recommender as RecommenderModel
 from unresyst.compilator import GetFirstCompilator, CombiningCompilator
 from unresyst.combinator import AverageCombinator, TwistedAverageCombinator, ConfidenceFactorCombinator
-from unresyst.models.abstractor import RelationshipInstance, ExplicitRuleInstance
+from unresyst.models.abstractor import RelationshipInstance, ExplicitRuleInstance, \
+    definition_registry
 from unresyst.models.algorithm import RelationshipPredictionInstance
+from unresyst.models.bulk import BulkInserter
+from unresyst.models.symmetric import SymmetricalRelationship
+from cache import RecommenderCache
+from importer import RelationshipPredictionImporter
+from exporter import export_csv
+from unresyst.profiler import build_profiler
 
 def _assign_recommender(list_rels, recommender):
     """Go throuth the list, if the items have the "recommender" attribute,
@@ -158,10 +166,37 @@ class Recommender(BaseRecommender):
         
         # rules and relationships don't have to be given
         
-        cls._print('Recommender validated, deleting old objects...')
+        with build_profiler.run(name=cls.__name__, verbose=cls.verbose_build) as report:
+            cls._build(build_profiler)
+        
+        if cls.build_log_filename:
+            build_profiler.write_log(report, cls.build_log_filename)
+        
+        return report
+    
+    @classmethod
+    def _build(cls, profiler):
+        """Replace the old recommender model by a new one and build the layers
+        for it.
+        
+        @type profiler: unresyst.profiler.BuildProfiler
+        @param profiler: the running profiler measuring the stages
+        """
+        # keep the build generation of the old recommender
+        old_generations = list(RecommenderModel.objects\
+                            .filter(class_name=cls.__name__)\
+                            .values_list('build_generation', flat=True))
+        
+        build_generation = max(old_generations) + 1 if old_generations else 1
         
         # if the recommender with the given name exists, delete it,
-        RecommenderModel.objects.filter(class_name=cls.__name__).delete()
+        with profiler.stage('delete_old'):
+            RecommenderModel.objects.filter(class_name=cls.__name__).delete()
+        
+        cls.model_cache.invalidate(cls.__name__)
+        
+        # the ids of the deleted definitions can be used again
+        definition_registry.clear()
                 
         # create a new recommender and save it, keep it in the class
         recommender_model = RecommenderModel(
@@ -170,108 +205,189 @@ class Recommender(BaseRecommender):
             is_built=False,
             are_subjects_objects=(cls.subjects == cls.objects),
             random_recommendation_description=cls.random_recommendation_description,
-            remove_predicted_from_recommendations=cls.remove_predicted_from_recommendations
+            remove_predicted_from_recommendations=cls.remove_predicted_from_recommendations,
+            build_generation=build_generation
         )        
         recommender_model.save() 
         
+        # the database contains nothing for the new recommender, the symmetry
+        # of the relationships can be checked in memory
+        if cls.trusted_build:
+            SymmetricalRelationship.start_trusted_mode()
+        
+        try:
+            cls._build_layers(recommender_model=recommender_model, profiler=profiler)
+        finally:
+            SymmetricalRelationship.stop_trusted_mode()
+
+        # mark the recommender as built, save it and keep it in the class
+        recommender_model.is_built = True
+        recommender_model.build_generation += 1
+        recommender_model.save()
+        
+        cls.model_cache.invalidate(cls.__name__)
+        
+        # write the artifact for the serving mode
+        if cls.prediction_store_filename:
+            
+            with profiler.stage('prediction_store'):
+                cls._write_prediction_store(recommender_model)
+
+    @classmethod
+    def _write_prediction_store(cls, recommender_model):
+        """Write the prediction store for the serving mode, the serving 
+        processes map the new file at their next request.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the built recommender model
+        """
+        # numpy is needed only here
+        from store import write_prediction_store
+        
+        count = write_prediction_store(
+                    recommender_model=recommender_model, 
+                    filename=cls.prediction_store_filename)
+        
+        build_profiler.message("    %d predictions written to the prediction store" % count)
+
+    @classmethod
+    def _build_layers(cls, recommender_model, profiler):
+        """Build the abstractor and algorithm layers for the new recommender 
+        model.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the just created recommender model
+        
+        @type profiler: unresyst.profiler.BuildProfiler
+        @param profiler: the running profiler measuring the stages, the algorithm
+            layers mark their stages on the module instance
+        """
+
         # build the recommender model
         #
         #
-        cls._print("Old objects deleted. Creating universal subjectobjects...")
         
         # Abstractor
         #
         
         # create the domain neutral representation for objects and subjects
-        cls.abstractor.create_subjectobjects(
-            recommender_model=recommender_model,
-            subjects=cls.subjects, 
-            objects=cls.objects
-        )
-        
-        cls._print("Universal subject and object representations created. Creating predicted_relationship instances...")
+        with profiler.stage('subjectobjects'):
+            cls.abstractor.create_subjectobjects(
+                recommender_model=recommender_model,
+                subjects=cls.subjects, 
+                objects=cls.objects
+            )
         
         # create the relationship instances for the predicted relationship
-        cls.abstractor.create_predicted_relationship_instances(           
-            predicted_relationship=cls.predicted_relationship            
-        )
-        
-        cls._print("Predicted relationship instances created. Creating relationship instances...")
+        with profiler.stage('predicted_relationship'):
+            cls.abstractor.create_predicted_relationship_instances(           
+                predicted_relationship=cls.predicted_relationship            
+            )
         
         # create relationship instances between subjects/objects 
-        cls.abstractor.create_relationship_instances(
-            relationships=cls.relationships
-        )    
-        
-        cls._print("Relationship instances created. Creating rule instances...")
+        with profiler.stage('relationships'):
+            cls.abstractor.create_relationship_instances(
+                relationships=cls.relationships
+            )    
                
         # evaluate rules and make rule instances between the affected 
         # subjects/objects
-        cls.abstractor.create_rule_instances(rules=cls.rules)
-        
-        cls._print("Rule instances created. Creating clusters...")
+        with profiler.stage('rules'):
+            cls.abstractor.create_rule_instances(rules=cls.rules)
         
         # evaluate the clusters and their members
-        cls.abstractor.create_clusters(cluster_sets=cls.cluster_sets)
-        
-        cls._print("Clusters created. Creating biases...")
+        with profiler.stage('clusters'):
+            cls.abstractor.create_clusters(cluster_sets=cls.cluster_sets)
         
         # evaluate the biases
-        cls.abstractor.create_biases(biases=cls.biases)
-        
-        cls._print("Biases created. Aggregating...")
-
-        
+        with profiler.stage('biases'):
+            cls.abstractor.create_biases(biases=cls.biases)
         
         # Algorithm
         #        
-        # build the algorithm model from the aggregated relationships
+        # build the algorithm model from the aggregated relationships,
+        # the algorithms mark the aggregation, compilation, ... stages
         cls.algorithm.build(recommender_model=recommender_model)
         
-        cls._print("Algorithm built.")
-        
         # if it should be done and predicted should be removed, 
         # save predicted_rel to predictions
         if cls.remove_predicted_from_recommendations and cls.save_all_to_predictions:
             
-            cls._print("Saving explicit/predicted to predictions...")
+            with profiler.stage('save_to_predictions'):
+                cls._save_predicted_to_predictions(recommender_model=recommender_model)
+    
+    @classmethod
+    def _save_predicted_to_predictions(cls, recommender_model, subject_ids=None):
+        """Save the instances of the explicit rating rule or of the predicted
+        relationship to the predictions as trivial.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender model
+        
+        @type subject_ids: iterable of int
+        @param subject_ids: the ids of the subjects whose instances should
+            be saved, if None, all are saved
+        """
+        # if explicit relationship is available, get its instances
+        # if not, get the predicted_rel
+        qs_predicted_rels = ExplicitRuleInstance.objects.filter(definition__recommender=recommender_model) \
+            if cls.explicit_rating_rule else \
+            RelationshipInstance.filter_predicted(recommender_model=recommender_model)
+        
+        qs_predictions = RelationshipPredictionInstance.objects\
+                            .filter(recommender=recommender_model)
+        
+        if subject_ids is None:
+            chunks = [(qs_predicted_rels, qs_predictions)]
+        else:
+            subject_ids = sorted(subject_ids)
             
-            # if explicit relationship is available, get its instances
-            # if not, get the predicted_rel
-            qs_predicted_rels = ExplicitRuleInstance.objects.filter(definition__recommender=recommender_model) \
-                if cls.explicit_rating_rule else \
-                RelationshipInstance.filter_predicted(recommender_model=recommender_model)
+            chunks = [(qs_predicted_rels.filter(subject_object1__id__in=ids), 
+                       qs_predictions.filter(subject_object1__id__in=ids)) \
+                for ids in (subject_ids[i:i + DEFAULT_QUERY_CHUNK_SIZE] \
+                    for i in xrange(0, len(subject_ids), DEFAULT_QUERY_CHUNK_SIZE))]
+        
+        inserter = BulkInserter(
+                    model=RelationshipPredictionInstance, 
+                    batch_size=cls.bulk_batch_size)
         
-            for ri in qs_predicted_rels:
+        for qs_rels, qs_preds in chunks:
+            
+            # the old trivial predictions of the subjects can be outdated
+            if subject_ids is not None:
+                qs_preds.filter(is_trivial=True).delete()
+            
+            # the ids of the predictions that are already there, by the pair
+            existing_ids = dict([((id1, id2), pk) for pk, id1, id2 in \
+                qs_preds.values_list('pk', 'subject_object1__id', 'subject_object2__id')\
+                    .iterator()])
+            
+            for ri in qs_rels.iterator():
                 
                 # get the expectancy of the rating or the trivial
                 expectancy = ri.expectancy if cls.explicit_rating_rule else TRIVIAL_EXPECTANCY                
                 
-                rpi, created = RelationshipPredictionInstance.objects.get_or_create(
-                    subject_object1=ri.subject_object1,
-                    subject_object2=ri.subject_object2,
-                    recommender=recommender_model,
-                    defaults={
-                        'expectancy': expectancy,
-                        'is_trivial': True,
-                        'description': ri.description,
-                    }
-                )
+                pk = existing_ids.get((ri.subject_object1_id, ri.subject_object2_id))
                 
                 # if it was found update it to the predicted
-                if not created:
-                    rpi.expectancy = expectancy
-                    rpi.is_trivial = True
-                    rpi.description = ri.description
+                if pk:
+                    RelationshipPredictionInstance.objects.filter(pk=pk).update(
+                        expectancy=expectancy,
+                        is_trivial=True,
+                        description=ri.description)
+                    continue
                 
-                # save it if created or not     
-                rpi.save()
-        
-        # mark the recommender as built, save it and keep it in the class
-        recommender_model.is_built = True
-        recommender_model.save()
+                # otherwise create it
+                inserter.add(RelationshipPredictionInstance(
+                    subject_object1_id=ri.subject_object1_id,
+                    subject_object2_id=ri.subject_object2_id,
+                    recommender=recommender_model,
+                    expectancy=expectancy,
+                    is_trivial=True,
+                    description=ri.description))
+            
+        inserter.flush()
         
-        cls._print('Done')
 
 
     # Recommend phase:
@@ -281,6 +397,11 @@ class Recommender(BaseRecommender):
     def predict_relationship(cls, subject, object_, save_to_db=False):
         """For documentation, see the base class"""        
         
+        if cls.serving_mode:
+            return cls._serve_predictions(
+                pairs=[(subject, object_)], 
+                action='predict_relationship')[0]
+        
         recommender_model = cls._get_recommender_model()
         # if the recommender isn't built raise an error
         if not recommender_model or not recommender_model.is_built:
@@ -301,10 +422,10 @@ class Recommender(BaseRecommender):
 
         # get the domain neutral representations for the subject and object
         try:
-            dn_subject = SubjectObject.get_domain_neutral_entity(
+            dn_subject = cls.model_cache.get_domain_neutral_entity(
                 domain_specific_entity=subject,
                 entity_type=subject_ent_type,
-                recommender=recommender_model
+                recommender_model=recommender_model
             )
         except SubjectObject.DoesNotExist, e:
             raise InvalidParameterError(
@@ -315,10 +436,10 @@ class Recommender(BaseRecommender):
                 parameter_value=subject)            
 
         try:                
-            dn_object = SubjectObject.get_domain_neutral_entity(
+            dn_object = cls.model_cache.get_domain_neutral_entity(
                 domain_specific_entity=object_,
                 entity_type=object_ent_type,
-                recommender=recommender_model
+                recommender_model=recommender_model
             )
         except SubjectObject.DoesNotExist, e:
             raise InvalidParameterError(
@@ -351,10 +472,92 @@ class Recommender(BaseRecommender):
         return prediction
 
 
+    @classmethod        
+    def predict_relationships(cls, pairs, save_to_db=False):
+        """For documentation, see the base class"""        
+        
+        if cls.serving_mode:
+            return cls._serve_predictions(pairs=pairs, action='predict_relationships')
+        
+        recommender_model = cls._get_recommender_model()
+        # if the recommender isn't built raise an error
+        if not recommender_model or not recommender_model.is_built:
+            raise RecommenderNotBuiltError(
+                message="Build the recommender prior to performing the " + \
+                    "predict_relationships action.",
+                recommender=cls
+            )
+                
+        subject_ent_type = ENTITY_TYPE_SUBJECT \
+                            if not recommender_model.are_subjects_objects \
+                            else ENTITY_TYPE_SUBJECTOBJECT
+
+        object_ent_type = ENTITY_TYPE_OBJECT \
+                            if not recommender_model.are_subjects_objects \
+                            else ENTITY_TYPE_SUBJECTOBJECT
+        
+        pairs = list(pairs)
+        predictions = []
+        
+        # the pairs whose predictions are already saved
+        saved = set()
+        inserter = BulkInserter(model=RelationshipPredictionInstance)
+        
+        for i in xrange(0, len(pairs), DEFAULT_QUERY_CHUNK_SIZE):
+            
+            chunk = pairs[i:i + DEFAULT_QUERY_CHUNK_SIZE]
+            
+            # get the domain neutral representations for the subjects and objects
+            dn_subjects = cls._get_domain_neutral_entities(
+                entities=[subject for subject, object_ in chunk],
+                entity_type=subject_ent_type,
+                recommender_model=recommender_model,
+                parameter_name='pairs')
+                
+            dn_objects = cls._get_domain_neutral_entities(
+                entities=[object_ for subject, object_ in chunk],
+                entity_type=object_ent_type,
+                recommender_model=recommender_model,
+                parameter_name='pairs')
+            
+            # get the predictions from the algorithm
+            prediction_models = cls.algorithm.get_relationship_predictions(
+                recommender_model=recommender_model,
+                pairs=zip(dn_subjects, dn_objects),
+                remove_predicted=cls.remove_predicted_from_recommendations
+            )
+            
+            for (subject, object_), prediction_model in zip(chunk, prediction_models):
+                
+                key = (prediction_model.subject_object1_id, prediction_model.subject_object2_id)
+                
+                # if it should be done and we know something about the pair
+                if save_to_db and not prediction_model.is_uncertain \
+                        and prediction_model.pk is None and not key in saved:
+                    inserter.add(prediction_model)
+                    saved.add(key)
+                
+                # create the outer-world object
+                predictions.append(RelationshipPrediction(
+                    subject=subject,
+                    object_=object_,
+                    expectancy=prediction_model.expectancy,
+                    explanation=prediction_model.description,
+                    is_uncertain=prediction_model.is_uncertain
+                ))
+        
+        inserter.flush()
+        
+        return predictions
+
+
     @classmethod
     def get_recommendations(cls, subject, count=None):        
         """For documentation, see the base class"""
         
+        if cls.serving_mode:
+            return cls._serve_recommendations(subject=subject, count=count)
+        
         recommender_model = cls._get_recommender_model()
         
         # if the recommender isn't built raise an error
@@ -375,10 +578,10 @@ class Recommender(BaseRecommender):
                             
         # convert the the subject to domain neutral
         try:
-            dn_subject = SubjectObject.get_domain_neutral_entity(
+            dn_subject = cls.model_cache.get_domain_neutral_entity(
                 domain_specific_entity=subject,
                 entity_type=subject_ent_type,
-                recommender=recommender_model
+                recommender_model=recommender_model
             )
         except SubjectObject.DoesNotExist, e:
             raise InvalidParameterError(
@@ -402,14 +605,21 @@ class Recommender(BaseRecommender):
         
         recommendations = []
         
+        # obtain the object ids from the predictions
+        object_ids = [pred_model.subject_object2_id \
+                        if pred_model.subject_object1_id == dn_subject.pk \
+                            else pred_model.subject_object1_id \
+                                for pred_model in prediction_models]
+        
+        # get their domain specific representations at once
+        objects = SubjectObject.get_domain_specific_entities(
+                    ids=object_ids, 
+                    entity_manager=cls.objects)
+        
         # go through the obtained predictions
-        for pred_model in prediction_models:
+        for pred_model, object_id in zip(prediction_models, object_ids):
 
-            # obtain the object from the prediction
-            dn_object = pred_model.get_related(dn_subject)
-            
-            # get its domain specific representation
-            object_ = dn_object.get_domain_specific_entity(entity_manager=cls.objects)
+            object_ = objects[object_id]
                         
             # create the outer-world object
             prediction = RelationshipPrediction(
@@ -425,91 +635,86 @@ class Recommender(BaseRecommender):
         return recommendations
 
     @classmethod
-    def export_predictions(cls, filename):
-        """Export all predictions to a csv 
-        file of the given name.
+    def export_predictions(cls, filename, format=EXPORT_FORMAT_CSV):
+        """Export all predictions to a file of the given name.
+        
+        The predictions are read by pages, see exporter.iter_prediction_pages.
         
         @type filename: str
         @param filename: the full path to the file
         
+        @type format: str
+        @param format: EXPORT_FORMAT_CSV for a csv file in format
+            <id subject>,<id object>,<prediction>\n, EXPORT_FORMAT_NPY for 
+            a .npy structured array that can be memory-mapped, see the
+            columnar module. The npy export needs numpy and integer ids.
+        
         @raise FileNotExists and other file open errors.
+        @raise InvalidParameterError: if the format is unknown
         """
         recommender_model = cls._get_recommender_model()
         
-        with open(filename, 'w') as f:
+        if format == EXPORT_FORMAT_CSV:
+            count = export_csv(recommender_model, filename)
             
-            i = 0
-        
-            # loop through pairs, export the prediction instances
-            for rpi in RelationshipPredictionInstance.objects.filter(recommender=recommender_model):
-                            
-                # create the common part
-                linestr = "%s,%s,%s\n" % (
-                    rpi.subject_object1.id_in_specific, 
-                    rpi.subject_object2.id_in_specific,
-                    rpi.expectancy)                                
-                
-                # write it to the file
-                f.write(linestr)
-                
-                i += 1
+        elif format == EXPORT_FORMAT_NPY:
+            
+            # numpy is needed only here
+            from columnar import export_npy
+            
+            count = export_npy(recommender_model, filename)
+            
+        else:
+            raise InvalidParameterError(
+                message="Unknown export format.",
+                recommender=cls,
+                parameter_name='format',
+                parameter_value=format)
         
-        print "    %d predictions exported" % i
+        print "    %d predictions exported" % count
 
     @classmethod
-    def update_predictions(cls, filename):
+    def update_predictions(cls, filename, resume=False):
         """Load predictions for pairs that are unknown in our recommender from 
         the given csv file.
                 
         The file has to be in format:
         <id subject>,<id object>,<prediction>\n
         
+        The file is imported by chunks, see importer.RelationshipPredictionImporter.
+        The rows with an entity unknown to the recommender and the pairs 
+        of an entity with itself are skipped, counted in the report and 
+        a warning is printed.
+        
         @type filename: str
         @param filename: the full path to the file
 
+        @type resume: bool
+        @param resume: if True and the previous update from the file 
+            was interrupted, it is continued instead of starting over
+
+        @rtype: dict str: number
+        @return: the import report, see BasePredictionImporter.import_file
+
         @raise FileNotExists and other file open errors.
         """
         recommender_model = cls._get_recommender_model()        
         
-        # open the csv reader
-        reader = csv.reader(open(filename, "rb"), delimiter=',', quoting=csv.QUOTE_NONE)
+        importer = RelationshipPredictionImporter(recommender_model)
         
-        i = 0
-        # parse the csv line by line
-        for subj_id, obj_id, expectancy in reader:
+        with build_profiler.run(name=cls.__name__, verbose=cls.verbose_build):
             
-            # parse the values to the right types
-            subj_id = int(subj_id)
-            obj_id = int(obj_id)
-            expectancy = float(expectancy)
+            report = importer.import_file(filename, resume=resume)
             
-            dn_subject = SubjectObject.objects.get(
-                    entity_type=ENTITY_TYPE_SUBJECT, 
-                    id_in_specific=subj_id,
-                    recommender=recommender_model)
-            dn_object = SubjectObject.objects.get(
-                    entity_type=ENTITY_TYPE_OBJECT, 
-                    id_in_specific=obj_id,
-                    recommender=recommender_model)
-                    
-            # if it's already imported, go to the next pair
-            if RelationshipPredictionInstance.objects.filter(
-                subject_object1=dn_subject, 
-                subject_object2=dn_object, 
-                recommender=recommender_model).exists():
-                continue
+            build_profiler.message("%d new predictions imported, %.0f rows/s" % \
+                (report['imported'], report['rows_per_second']))
             
-            # create a prediction
-            RelationshipPredictionInstance.objects.create(
-                subject_object1=dn_subject,
-                subject_object2=dn_object,
-                recommender=recommender_model,
-                expectancy=expectancy
-            )
-
-            i += 1
-
-        print "%d new predictions imported" % i
+            # the bad rows aren't imported, but they shouldn't pass unnoticed
+            if report['unknown'] or report['self_pairs']:
+                build_profiler.message("Warning: %d rows with entities unknown to the recommender and %d rows pairing an entity with itself were skipped" % \
+                    (report['unknown'], report['self_pairs']))
+        
+        return report
             
         
            
@@ -521,89 +726,360 @@ class Recommender(BaseRecommender):
     def add_subject(cls, subject):
         """For documentation, see the base class"""
         
-        # add the object to abstractor rule/relationship instances, 
-        # see what has changed
-        instance_changes = cls.Abstractor.add_subject(
-            recommender=cls.__name__,
-            subject=subject
-        )
-        
-        # let the Aggregator update the aggregates
-        aggregated_changes = cls.Aggregator.update(
-            recommender=cls.__name__,
-            instance_changes=instance_changes
-        )
-        
-        # let the Algorithm update its structures
-        cls.Algorithm.update(
-            recommender=cls.__name__,
-            aggregated_changes=aggregated_changes
-        )
-
+        return cls._profile_update(cls._add_entity, entity=subject, is_subject=True, parameter_name='subject')
 
     @classmethod
     def add_object(cls, object_):
         """For documentation, see the base class"""
         
-        # add the object to abstractor rule/relationship instances
-        # see what has changed
-        instance_changes = cls.Abstractor.add_object(
-            recommender=cls.__name__,
-            object_=object_
-        )
-        # pak nejak podobne - asi na to udelat fci. 
+        return cls._profile_update(cls._add_entity, entity=object_, is_subject=False, parameter_name='object_')
 
     @classmethod
     def update_subject(cls, subject):
         """For documentation, see the base class"""
-
-        # update the subject in abstractor rule/relationship instances
-        # see what has changed
-        instance_changes = cls.Abstractor.update_subject(
-            recommender=cls.__name__,
-            subject=subject
-        )
-        # pak nejak podobne - asi na to udelat fci.
-
+        
+        return cls._profile_update(cls._update_entity, entity=subject, is_subject=True, parameter_name='subject')
 
     @classmethod    
     def update_object(cls, object_):
         """For documentation, see the base class"""
-
-        # update the object in abstractor rule/relationship instances
-        # see what has changed
-        instance_changes = cls.Abstractor.update_object(
-            recommender=cls.__name__,
-            object_=object_
-        )
-        # pak nejak podobne - asi na to udelat fci.      
+        
+        return cls._profile_update(cls._update_entity, entity=object_, is_subject=False, parameter_name='object_')
         
     @classmethod
     def remove_subject(cls, subject):
         """For documentation, see the base class"""
-
-        # remove the subject from abstractor rule/relationship instances
-        # see what has changed
-        instance_changes = cls.Abstractor.remove_subject(
-            recommender=cls.__name__,
-            subject=subject
-        )
-        # pak nejak podobne - asi na to udelat fci.
-
+        
+        return cls._profile_update(cls._remove_entity, entity=subject, is_subject=True, parameter_name='subject')
 
     @classmethod    
     def remove_object(cls, object_):
         """For documentation, see the base class"""
-
-        # update the object in abstractor rule/relationship instances
-        # see what has changed
-        instance_changes = cls.Abstractor.remove_object(
-            recommender=cls.__name__,
-            object_=object_
-        )
-        # pak nejak podobne - asi na to udelat fci.                 
+        
+        return cls._profile_update(cls._remove_entity, entity=object_, is_subject=False, parameter_name='object_')
+    
+    @classmethod
+    def _profile_update(cls, update, **kwargs):
+        """Run the update of the recommender profiled as the build.
+        
+        @type update: function
+        @param update: the update method, called with the kwargs
+        
+        @rtype: dict
+        @return: the report of the update, see build
+        """
+        with build_profiler.run(name=cls.__name__, verbose=cls.verbose_build) as report:
+            update(**kwargs)
+        
+        return report
+    
+    @classmethod
+    def _add_entity(cls, entity, is_subject, parameter_name):
+        """Add the subject/object to the built recommender.
+        
+        @type entity: django.db.models.Model
+        @param entity: the domain specific subject/object
+        
+        @type is_subject: bool
+        @param is_subject: is the entity a subject?
+        
+        @type parameter_name: str
+        @param parameter_name: the name of the parameter, for the errors
+        
+        @raise RecommenderNotBuiltError: if the recommender isn't built
+        @raise InvalidParameterError: if the entity is already in the recommender
+        """
+        recommender_model = cls._get_built_recommender_model(action='add_' + parameter_name.rstrip('_'))
+        
+        entity_type = cls._get_update_entity_type(recommender_model, is_subject)
+        
+        if SubjectObject.objects.filter(
+                recommender=recommender_model,
+                entity_type=entity_type,
+                id_in_specific=entity.pk).exists():
+            raise InvalidParameterError(
+                message="The entity is already in the recommender database.",
+                recommender=cls,
+                parameter_name=parameter_name, 
+                parameter_value=entity)
+        
+        # create the entity and its instances in the abstractor
+        dn_entity, bias_ids = cls.abstractor.add_entity(
+            recommender=cls,
+            recommender_model=recommender_model,
+            entity=entity,
+            entity_type=entity_type)
+        
+        build_profiler.message("Entity instances created. Updating the algorithm...")
+        
+        cls._update_layers(
+            recommender_model=recommender_model, 
+            entity_ids=[dn_entity.pk], 
+            subject_ids=(),
+            bias_ids=bias_ids)
+    
+    @classmethod
+    def _update_entity(cls, entity, is_subject, parameter_name):
+        """Evaluate the changed subject/object again in the built recommender.
+        
+        For the parameters see _add_entity.
+        
+        @raise RecommenderNotBuiltError: if the recommender isn't built
+        @raise InvalidParameterError: if the entity isn't in the recommender
+        """
+        recommender_model = cls._get_built_recommender_model(action='update_' + parameter_name.rstrip('_'))
+        
+        dn_entity = cls._get_domain_neutral_entities(
+            entities=[entity],
+            entity_type=cls._get_update_entity_type(recommender_model, is_subject),
+            recommender_model=recommender_model,
+            parameter_name=parameter_name)[0]
+        
+        # the subjects depending on the entity before the change
+        subject_ids = cls.algorithm.get_affected_subjects(
+            recommender_model=recommender_model,
+            entity_ids=[dn_entity.pk])
+        
+        # create the entity instances again
+        bias_ids = cls.abstractor.update_entity(
+            recommender=cls,
+            dn_entity=dn_entity,
+            entity=entity)
+        
+        build_profiler.message("Entity instances updated. Updating the algorithm...")
+        
+        cls._update_layers(
+            recommender_model=recommender_model, 
+            entity_ids=[dn_entity.pk], 
+            subject_ids=subject_ids,
+            bias_ids=bias_ids)
+    
+    @classmethod
+    def _remove_entity(cls, entity, is_subject, parameter_name):
+        """Remove the subject/object from the built recommender.
+        
+        For the parameters see _add_entity.
+        
+        @raise RecommenderNotBuiltError: if the recommender isn't built
+        @raise InvalidParameterError: if the entity isn't in the recommender
+        """
+        recommender_model = cls._get_built_recommender_model(action='remove_' + parameter_name.rstrip('_'))
+        
+        dn_entity = cls._get_domain_neutral_entities(
+            entities=[entity],
+            entity_type=cls._get_update_entity_type(recommender_model, is_subject),
+            recommender_model=recommender_model,
+            parameter_name=parameter_name)[0]
+        
+        # the subjects depending on the entity, except the entity itself
+        subject_ids = cls.algorithm.get_affected_subjects(
+            recommender_model=recommender_model,
+            entity_ids=[dn_entity.pk])
+        
+        subject_ids.discard(dn_entity.pk)
+        
+        # delete the entity with its instances
+        bias_ids = cls.abstractor.remove_entity(
+            recommender=cls,
+            dn_entity=dn_entity)
+        
+        build_profiler.message("Entity removed. Updating the algorithm...")
+        
+        cls._update_layers(
+            recommender_model=recommender_model, 
+            entity_ids=[], 
+            subject_ids=subject_ids,
+            bias_ids=bias_ids)
+    
+    @classmethod
+    def _update_layers(cls, recommender_model, entity_ids, subject_ids, bias_ids):
+        """Update the algorithm after the abstractor has changed the entities,
+        save the explicit/predicted of the affected subjects to predictions,
+        make the cached entities invalid and write the prediction store again.
+        
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the built recommender model
+        
+        @type entity_ids: list of int
+        @param entity_ids: the ids of the added/updated entities
+        
+        @type subject_ids: iterable of int
+        @param subject_ids: the ids of the subjects that depended on 
+            the entities before the change
+        
+        @type bias_ids: iterable of int
+        @param bias_ids: the ids of the entities whose bias instances
+            have changed
+        """
+        affected = cls.algorithm.update(
+            recommender_model=recommender_model,
+            entity_ids=entity_ids,
+            subject_ids=subject_ids,
+            bias_ids=bias_ids)
+        
+        if cls.remove_predicted_from_recommendations and cls.save_all_to_predictions:
+            
+            cls._save_predicted_to_predictions(
+                recommender_model=recommender_model,
+                subject_ids=affected)
+        
+        # the cached entities are outdated
+        RecommenderModel.objects.filter(pk=recommender_model.pk)\
+            .update(build_generation=F('build_generation') + 1)
+        
+        cls.model_cache.invalidate(cls.__name__)
+        
+        # the serving processes would give the old predictions
+        if cls.prediction_store_filename:
+            cls._write_prediction_store(
+                RecommenderModel.objects.get(pk=recommender_model.pk))
+        
+        build_profiler.message('Done, %d subjects affected.' % len(affected))
    
     
+    # Serving mode - the recommend phase answered from the prediction store
+    #
+    
+    @classmethod
+    def _get_prediction_store(cls, action):
+        """Get the mapped prediction store of the recommender.
+        
+        @type action: str
+        @param action: the name of the action, for the errors
+        
+        @rtype: store.PredictionStore
+        @return: the store, mapped again if it was rewritten by a build
+        
+        @raise ConfigurationError: if the prediction_store_filename isn't given
+        @raise RecommenderNotBuiltError: if the store file doesn't exist
+        """
+        if not cls.prediction_store_filename:
+            raise ConfigurationError(
+                message="The serving mode needs the prediction store file.",
+                recommender=cls,
+                parameter_name="Recommender.prediction_store_filename",
+                parameter_value=cls.prediction_store_filename
+            )
+        
+        # numpy is needed only here
+        from store import get_prediction_store
+        
+        try:
+            return get_prediction_store(cls.prediction_store_filename)
+        except (IOError, OSError), e:
+            raise RecommenderNotBuiltError(
+                message="Build the recommender prior to performing the " + \
+                    "%s action, the prediction store wasn't found. Exception: %s" % (action, e),
+                recommender=cls
+            )
+    
+    @classmethod
+    def _get_store_index(cls, store, entity, is_subject, parameter_name):
+        """Get the index of the domain specific entity in the store.
+        
+        @rtype: int
+        @return: the index of the subject/object
+        
+        @raise InvalidParameterError: if the entity isn't in the store
+        """
+        index = store.get_subject_index(entity.pk) if is_subject \
+                    else store.get_object_index(entity.pk)
+        
+        if index is None:
+            raise InvalidParameterError(
+                message="The entity wasn't found in the prediction store." + \
+                    " Try rebuilding the recommender.",
+                recommender=cls,
+                parameter_name=parameter_name, 
+                parameter_value=entity)
+        
+        return index
+    
+    @classmethod
+    def _serve_predictions(cls, pairs, action):
+        """Get the predictions for the pairs from the prediction store.
+        
+        Only the stored predictions are known, the other pairs get 
+        the uncertain prediction instead of being compiled. Nothing is saved.
+        
+        @type pairs: iterable of pairs (subject, object)
+        @param pairs: the domain specific subjects and objects
+        
+        @type action: str
+        @param action: the name of the action, for the errors
+        
+        @rtype: list of RelationshipPrediction
+        @return: the predictions in the order of the pairs
+        """
+        store = cls._get_prediction_store(action)
+        
+        predictions = []
+        
+        for subject, object_ in pairs:
+            
+            expectancy, description, is_uncertain = store.get_prediction(
+                subject_index=cls._get_store_index(store, subject, True, 'subject'),
+                object_index=cls._get_store_index(store, object_, False, 'object_'),
+                remove_predicted=cls.remove_predicted_from_recommendations)
+            
+            predictions.append(RelationshipPrediction(
+                subject=subject,
+                object_=object_,
+                expectancy=expectancy,
+                explanation=description,
+                is_uncertain=is_uncertain
+            ))
+        
+        return predictions
+    
+    @classmethod
+    def _serve_recommendations(cls, subject, count):
+        """Get the recommendations for the subject from the prediction store.
+        
+        Only the domain specific objects are read from the database, 
+        by one query.
+        
+        @rtype: list of RelationshipPrediction
+        @return: the recommendations, the best first
+        """
+        store = cls._get_prediction_store('get_recommendations')
+        
+        # if count wasn't given take the default one
+        if not count:
+            count = cls.default_recommendation_count
+        
+        limit = cls.recommendation_expectancy_limit \
+            if not cls.recommendation_expectancy_limit is None else 0
+        
+        recommended = store.get_recommendations(
+            subject_index=cls._get_store_index(store, subject, True, 'subject'),
+            count=count,
+            expectancy_limit=limit,
+            remove_predicted=cls.remove_predicted_from_recommendations)
+        
+        # the ids in specific are strings
+        objects = dict((unicode(object_.pk), object_) for object_ in \
+            cls.objects.filter(pk__in=[id_in_specific for id_in_specific, e, d, u in recommended]))
+        
+        recommendations = []
+        
+        for id_in_specific, expectancy, description, is_uncertain in recommended:
+            
+            if not id_in_specific in objects:
+                raise cls.objects.model.DoesNotExist(
+                    "The domain specific entity %s does not exist." % id_in_specific)
+            
+            recommendations.append(RelationshipPrediction(
+                subject=subject,
+                object_=objects[id_in_specific],
+                expectancy=expectancy,
+                explanation=description,
+                is_uncertain=is_uncertain
+            ))
+        
+        return recommendations
+    
+    
     # Class configuration - the behaviour of the layers below the recommender
     # Can be overriden in user defined subclasses
     
@@ -641,31 +1117,131 @@ class Recommender(BaseRecommender):
     subclass"""
     
     verbose_build = True
-    """Should messages be printed during the build?"""
+    """Should the progress messages be printed during the build, the updates
+    and the imports?"""
     
     save_all_to_predictions = True
     
+    trusted_build = True
+    """Should the symmetry of the relationships created during the build be
+    checked only in memory? The database contains nothing for the recommender
+    being built, so it's safe unless the relationships are created from 
+    outside during the build."""
+    
+    build_log_filename = None
+    """If given, the report of each build is appended to the file as a line
+    of JSON, to track the build times over time."""
+    
+    bulk_batch_size = DEFAULT_BULK_BATCH_SIZE
+    """The number of predictions written to the database at once when saving
+    the explicit/predicted to predictions. The other layers take the batch size 
+    in their initializers."""
+    
+    prediction_store_filename = None
+    """If given, the predictions are written to this file after each build
+    and update, as a read-only store (store.PredictionStore) for the serving
+    mode."""
+    
+    serving_mode = False
+    """Should the recommend phase be answered from the prediction store
+    without the recommender database? The store gives the predictions saved 
+    during the build, the other pairs are uncertain. Needs numpy."""
+    
+    model_cache = RecommenderCache()
+    """The process-local cache of the recommender model and the domain neutral
+    subjects and objects. Shared by all recommender classes unless overriden."""
+    
     # Auxiliary methods - not to be used from outside the application
     #    
     @classmethod
     def _get_recommender_model(cls):
-        """Get the recommender model belonging to the class"""
+        """Get the recommender model belonging to the class, None if 
+        it doesn't exist. 
+        
+        The model is cached, its id and build generation are checked against
+        the database at most once in model_cache.check_interval seconds.
+        """
+        return cls.model_cache.get_recommender_model(cls.__name__)
+    
+    @classmethod
+    def _get_built_recommender_model(cls, action):
+        """Get the recommender model belonging to the class, check it's built.
+        
+        @type action: str
+        @param action: the name of the action, for the error
+        
+        @rtype: models.common.Recommender
+        @return: the built recommender model
+        
+        @raise RecommenderNotBuiltError: if the recommender isn't built
+        """
+        recommender_model = cls._get_recommender_model()
+        
+        if not recommender_model or not recommender_model.is_built:
+            raise RecommenderNotBuiltError(
+                message="Build the recommender prior to performing the " + \
+                    "%s action." % action,
+                recommender=cls
+            )
+        
+        return recommender_model
+    
+    @staticmethod
+    def _get_update_entity_type(recommender_model, is_subject):
+        """Get the entity type of the updated subject/object.
+        
+        @rtype: str
+        @return: 'S'/'O'/'SO'
+        """
+        if recommender_model.are_subjects_objects:
+            return ENTITY_TYPE_SUBJECTOBJECT
         
-        # can't be caching 'cause database can die out without notifying the 
-        # if it's already saved, return it
-        #if cls._recommender_model:
-        #    return cls._recommender_model
+        return ENTITY_TYPE_SUBJECT if is_subject else ENTITY_TYPE_OBJECT
+    
+    @classmethod
+    def _get_domain_neutral_entities(cls, entities, entity_type, recommender_model, parameter_name):
+        """Get the domain neutral representations of the given domain specific
+        entities by one query.
+        
+        @type entities: list of django.db.models.Model
+        @param entities: the domain specific entities
+        
+        @type entity_type: str
+        @param entity_type: the type of the entities 'S'/'O'/'SO'
         
-        # otherwise try finding it in database            
-        models = RecommenderModel.objects.filter(class_name=cls.__name__)
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender model
         
-        # if the recommender was found, assign it to the class and return it
-        if models:            
-            assert len(models) == 1            
-            return models[0]
+        @type parameter_name: str
+        @param parameter_name: the name of the parameter the entities
+            come from, for the error
         
-        # if not return None
-        return None            
+        @rtype: list of models.common.SubjectObject
+        @return: the domain neutral entities in the order of entities
+        
+        @raise InvalidParameterError: if some of the entities doesn't 
+            have a domain neutral representation
+        """
+        ids = set(unicode(entity.pk) for entity in entities)
+        
+        dn_entities = dict((dn_entity.id_in_specific, dn_entity) \
+            for dn_entity in SubjectObject.objects.filter(
+                                recommender=recommender_model,
+                                entity_type=entity_type,
+                                id_in_specific__in=list(ids)))
+        
+        missing = ids.difference(dn_entities)
+        
+        if missing:
+            raise InvalidParameterError(
+                message="The entities %s weren't found in the recommender database." % \
+                    ", ".join(sorted(missing)) + \
+                    " Try rebuilding the recommender.",
+                recommender=cls,
+                parameter_name=parameter_name, 
+                parameter_value=missing)  
+        
+        return [dn_entities[unicode(entity.pk)] for entity in entities]
     
     @classmethod
     def _get_entity_manager(cls, entity_type):
@@ -688,7 +1264,3 @@ class Recommender(BaseRecommender):
         
         return manager_dict[entity_type]
         
-    @classmethod
-    def _print(cls, msg):
-        if cls.verbose_build:
-            print msg        
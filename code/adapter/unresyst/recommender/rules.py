@@ -1,9 +1,11 @@
 """The classes for representing business rules and relationships"""
 
 from unresyst.constants import *
+from unresyst.profiler import build_profiler
 
 from unresyst.models.abstractor import *
 from unresyst.models.common import SubjectObject
+from unresyst.models.bulk import BulkInserter
 from unresyst.exceptions import DescriptionKeyError, ConfigurationError
 
 class BaseRelationship(object):
@@ -139,7 +141,7 @@ class BaseRelationship(object):
         return {}
     
     
-    def evaluate_on_dn_args(self, dn_arg1, dn_arg2, definition):        
+    def evaluate_on_dn_args(self, dn_arg1, dn_arg2, definition, inserter=None):        
         """Evaluates the rule on the given arguments. If evaluated positively,
         a new rule/relationship instance is saved.
        
@@ -152,6 +154,10 @@ class BaseRelationship(object):
         @type definition: models.abstractor.RuleRelationshipDefinition
         @param definition: the model representing the rule/relationship 
             definition
+        
+        @type inserter: models.bulk.BulkInserter
+        @param inserter: the inserter to write the instance through, if None
+            the instance is saved directly
             
         @rtype: int
         @return: 1 if something has benn created, 0 if not
@@ -165,14 +171,78 @@ class BaseRelationship(object):
         arg2_manager = self.recommender._get_entity_manager(dn_arg2.entity_type)
         ds_arg2 = dn_arg2.get_domain_specific_entity(entity_manager=arg2_manager)
 
+        return self.evaluate_on_args(dn_arg1, dn_arg2, ds_arg1, ds_arg2, definition, inserter)
+
+    def evaluate_on_args(self, dn_arg1, dn_arg2, ds_arg1, ds_arg2, definition, inserter=None):
+        """Evaluates the rule on the given arguments, both the domain neutral
+        and the domain specific are given. If evaluated positively,
+        a new rule/relationship instance is saved.
+
+        The parameters and the return value are as for evaluate_on_dn_args,
+        ds_arg1, ds_arg2 are the domain specific entities of dn_arg1, dn_arg2.
+        """
+
         # if the condition is satisfied
         if self.condition(ds_arg1, ds_arg2):
-            
-            self._perform_save_instance(definition, ds_arg1, ds_arg2, dn_arg1, dn_arg2)
+
+            self._perform_save_instance(definition, ds_arg1, ds_arg2, dn_arg1, dn_arg2, inserter)
             return 1
-        
+
         return 0
 
+    def _iter_entity_chunks(self, recommender_model, entity_type, chunk_size):
+        """Go through the entities of the given type by chunks ordered by
+        the id, the domain specific entities of each chunk are obtained
+        at once.
+
+        @type recommender_model: models.common.Recommender
+        @param recommender_model: the recommender model
+
+        @type entity_type: str
+        @param entity_type: the type of the entities 'S'/'O'/'SO'
+
+        @type chunk_size: int
+        @param chunk_size: the maximal number of entities in a chunk
+
+        @rtype: generator of lists of pairs
+        @return: the chunks of pairs (domain neutral entity, domain specific entity)
+        """
+        manager = self.recommender._get_entity_manager(entity_type)
+
+        qs_entities = SubjectObject.objects.filter(
+                        recommender=recommender_model,
+                        entity_type=entity_type).order_by('id')
+
+        last_id = None
+
+        while True:
+
+            qs_chunk = qs_entities if last_id is None else qs_entities.filter(id__gt=last_id)
+
+            dn_entities = list(qs_chunk[:chunk_size])
+
+            if not dn_entities:
+                return
+
+            ds_entities = SubjectObject.get_domain_specific_entities(
+                            ids=[dn_entity.pk for dn_entity in dn_entities],
+                            entity_manager=manager)
+
+            yield [(dn_entity, ds_entities[dn_entity.pk]) for dn_entity in dn_entities]
+
+            last_id = dn_entities[-1].pk
+
+    def _get_domain_neutral_dict(self, recommender_model, entity_type):
+        """Get all domain neutral entities of the given type by one query.
+
+        @rtype: dict unicode: models.common.SubjectObject
+        @return: the domain neutral entities by the domain specific ids
+        """
+        return dict((dn_entity.id_in_specific, dn_entity) for dn_entity in \
+                        SubjectObject.objects.filter(
+                            recommender=recommender_model,
+                            entity_type=entity_type).iterator())
+
     @classmethod
     def order_arguments(cls, dn_arg1, dn_arg2):
         """Order the arguments as they appear in the relationship."""
@@ -194,8 +264,9 @@ class BaseRelationship(object):
         return (dn_arg1, dn_arg2, ds_arg1, ds_arg2)
         
 
-    def _perform_save_instance(self, definition, ds_arg1, ds_arg2, dn_arg1, dn_arg2):
-        """Perform the action of creating and saving the instance"""
+    def _perform_save_instance(self, definition, ds_arg1, ds_arg2, dn_arg1, dn_arg2, inserter=None):
+        """Perform the action of creating and saving the instance. If the inserter
+        is given, the instance is written through it."""
         
         # order the instances in pairs as the class requires
         dn_arg1, dn_arg2, ds_arg1, ds_arg2 = self._order_in_pair(dn_arg1, dn_arg2, ds_arg1, ds_arg2)
@@ -210,10 +281,13 @@ class BaseRelationship(object):
                         description=self.get_filled_description(dn_arg1, dn_arg2),
                         **add_kwargs)
         
-        instance.save()
+        if inserter is None:
+            instance.save()
+        else:
+            inserter.add(instance)
 
 
-    def save_instance(self, ds_arg1, ds_arg2, definition):        
+    def save_instance(self, ds_arg1, ds_arg2, definition, inserter=None, dn_dicts=None):        
         """Save an instance of the rule/relationship for the given args.
        
         @type ds_arg1: domain specific subject/object
@@ -225,9 +299,19 @@ class BaseRelationship(object):
         @type definition: models.abstractor.RuleRelationshipDefinition
         @param definition: the model representing the rule/relationship 
             definition
+        
+        @type inserter: models.bulk.BulkInserter
+        @param inserter: the inserter to write the instance through, if None
+            the instance is saved directly
+        
+        @type dn_dicts: pair of dicts unicode: models.common.SubjectObject
+        @param dn_dicts: the preloaded domain neutral entities for the first
+            and the second argument by the domain specific ids, if None 
+            the entities are obtained from the database
             
         @raise ConfigurationError: thrown if the condition doesn't evaluate 
             to true on the given pair
+        @raise DoesNotExist: if the domain neutral entity doesn't exist
         """
         if not (self.condition is None) and not self.condition(ds_arg1, ds_arg2):
             raise ConfigurationError(
@@ -239,28 +323,50 @@ class BaseRelationship(object):
         
         # convert the domain specific to domain neutral        
         #
-        arg1_ent_type, arg2_ent_type = self.relationship_type.split(RELATIONSHIP_TYPE_SEPARATOR) 
+        if dn_dicts is not None:
+            
+            dict1, dict2 = dn_dicts
+            
+            try:
+                dn_arg1 = dict1[unicode(ds_arg1.pk)]
+                dn_arg2 = dict2[unicode(ds_arg2.pk)]
+            except KeyError, e:
+                raise SubjectObject.DoesNotExist(
+                    "The domain neutral entity %s does not exist." % e)
+        else:
+            arg1_ent_type, arg2_ent_type = self.relationship_type.split(RELATIONSHIP_TYPE_SEPARATOR) 
 
-        dn_arg1 = SubjectObject.get_domain_neutral_entity(
-                    domain_specific_entity=ds_arg1, 
-                    entity_type=arg1_ent_type, 
-                    recommender=definition.recommender)
+            dn_arg1 = SubjectObject.get_domain_neutral_entity(
+                        domain_specific_entity=ds_arg1, 
+                        entity_type=arg1_ent_type, 
+                        recommender=definition.recommender)
 
-        dn_arg2 = SubjectObject.get_domain_neutral_entity(
-                    domain_specific_entity=ds_arg2, 
-                    entity_type=arg2_ent_type, 
-                    recommender=definition.recommender)
+            dn_arg2 = SubjectObject.get_domain_neutral_entity(
+                        domain_specific_entity=ds_arg2, 
+                        entity_type=arg2_ent_type, 
+                        recommender=definition.recommender)
         
         # create and save the instance
-        self._perform_save_instance(definition, ds_arg1, ds_arg2, dn_arg1, dn_arg2)                  
+        self._perform_save_instance(definition, ds_arg1, ds_arg2, dn_arg1, dn_arg2, inserter)                  
                     
                             
     
-    def evaluate(self):
+    def evaluate(self, batch_size=DEFAULT_BULK_BATCH_SIZE, chunk_size=DEFAULT_EVALUATION_CHUNK_SIZE):
         """Evaluate the rule on all subjects/objects - pairs.
         
         Creates and saves the rule/relationship definition, creates and saves
         rule instances.        
+        
+        Without the generator, the entities are loaded by chunks and 
+        the condition is evaluated on all pairs from two chunks in memory.
+        
+        @type batch_size: int
+        @param batch_size: the number of instances written to the database
+            at once
+        
+        @type chunk_size: int
+        @param chunk_size: the number of entities loaded from the database 
+            at once
         """
         
         # obtain the kwargs for creating the definition
@@ -269,56 +375,161 @@ class BaseRelationship(object):
         # create and save the definition
         definition = self.DefinitionClass(**def_kwargs)
         definition.save()
+        
+        # the instances are written by batches
+        inserter = BulkInserter(model=self.InstanceClass, batch_size=batch_size)
 
         i = 0        
         # if we have a generator, use it for looping through pairs
         if not (self.generator is None):
             
 
+            arg1_s, arg2_s = self.relationship_type.split(RELATIONSHIP_TYPE_SEPARATOR)
+            
+            # the domain neutral entities for converting the pairs
+            dict1 = self._get_domain_neutral_dict(definition.recommender, arg1_s)
+            dict2 = dict1 if arg1_s == arg2_s else \
+                self._get_domain_neutral_dict(definition.recommender, arg2_s)
+
             # loop through pairs, save the rule/relationship instances
             for ds_arg1, ds_arg2 in self.generator():
-                self.save_instance(ds_arg1, ds_arg2, definition)
+                self.save_instance(ds_arg1, ds_arg2, definition, inserter, (dict1, dict2))
                 i += 1
             
-            print "    %d instances of rule/rel %s created" % (i, self.name)
+            inserter.flush()
+            
+            build_profiler.message("    %d instances of rule/rel %s created" % (i, self.name))
             
             # that's it
             return
             
         
-        # otherwise take the entities one by one
+        # otherwise take the entities by chunks
             
         # parse what should be used as condition args
         arg1_s, arg2_s = self.relationship_type.split(RELATIONSHIP_TYPE_SEPARATOR)        
         
-        if arg1_s == arg2_s:
-                                                           
-            # loop only through the matrix members below the diagonal 
-            # 
-            i = 0
-            for arg1, arg2 in SubjectObject.unique_pairs(
-                                recommender=self.recommender._get_recommender_model(),
-                                entity_type=arg1_s):                          
-                # evaluate it
-                i += self.evaluate_on_dn_args(arg1, arg2, definition)
+        recommender_model = definition.recommender
+        
+        for chunk1 in self._iter_entity_chunks(recommender_model, arg1_s, chunk_size):
             
-
+            if arg1_s == arg2_s:
+                
+                # loop only through the matrix members below the diagonal, 
+                # the chunks up to the current one
+                last_id = chunk1[-1][0].pk
+                
+                for chunk2 in self._iter_entity_chunks(recommender_model, arg2_s, chunk_size):
+                    
+                    if chunk2[0][0].pk > last_id:
+                        break
+                    
+                    for dn_arg1, ds_arg1 in chunk1:
+                        for dn_arg2, ds_arg2 in chunk2:
+                            
+                            if dn_arg2.pk < dn_arg1.pk:
+                                i += self.evaluate_on_args(dn_arg1, dn_arg2, ds_arg1, ds_arg2, definition, inserter)
             
-        else:
-            # filter subjectobjects for my recommender
-            qs_recommender = SubjectObject.objects.filter(
-                recommender=self.recommender._get_recommender_model())
+            else:
+                # go through all things that have to be as second param
+                for chunk2 in self._iter_entity_chunks(recommender_model, arg2_s, chunk_size):
+                    
+                    for dn_arg1, ds_arg1 in chunk1:
+                        for dn_arg2, ds_arg2 in chunk2:
+                   
+                            # evaluate the rule/relationship on the given args
+                            i += self.evaluate_on_args(dn_arg1, dn_arg2, ds_arg1, ds_arg2, definition, inserter)
         
-            # go through all things that have to be as first and as second param
-            for arg1 in qs_recommender.filter(entity_type=arg1_s).iterator():
-                for arg2 in qs_recommender.filter(entity_type=arg2_s).iterator():
-               
-                    # evaluate the rule/relationship on the given args
-                    i += self.evaluate_on_dn_args(arg1, arg2, definition)
+        inserter.flush()
+
+        build_profiler.message("    %d instances of rule/rel %s created" % (i, self.name))
+
+    def evaluate_entity(self, dn_entity, ds_entity, batch_size=DEFAULT_BULK_BATCH_SIZE,
+            chunk_size=DEFAULT_EVALUATION_CHUNK_SIZE):
+        """Evaluate the rule on the pairs of the given entity with all the other
+        entities, for the existing definition. Used when the entity is added
+        or updated. The old instances of the entity have to be deleted before.
+
+        The generator (if given) is walked through whole, only the pairs
+        containing the entity are used.
+
+        @type dn_entity: models.common.SubjectObject
+        @param dn_entity: the domain neutral entity
+
+        @type ds_entity: django.db.models.Model
+        @param ds_entity: the domain specific entity
+
+        @type batch_size: int
+        @param batch_size: the number of instances written to the database
+            at once
+
+        @type chunk_size: int
+        @param chunk_size: the number of entities loaded from the database
+            at once
+
+        @rtype: int
+        @return: the number of created instances
+        """
+        recommender_model = dn_entity.recommender
+
+        definition = self.DefinitionClass.objects.get(
+                        name=self.name,
+                        recommender=recommender_model)
+
+        inserter = BulkInserter(model=self.InstanceClass, batch_size=batch_size)
+
+        arg1_s, arg2_s = self.relationship_type.split(RELATIONSHIP_TYPE_SEPARATOR)
+
+        is_arg1 = dn_entity.entity_type == arg1_s
+        is_arg2 = dn_entity.entity_type == arg2_s
+
+        i = 0
+
+        if not (self.generator is None):
+
+            # the domain neutral entities for converting the pairs
+            dict1 = self._get_domain_neutral_dict(recommender_model, arg1_s)
+            dict2 = dict1 if arg1_s == arg2_s else \
+                self._get_domain_neutral_dict(recommender_model, arg2_s)
+
+            # take only the pairs containing the entity
+            for ds_arg1, ds_arg2 in self.generator():
+
+                if (is_arg1 and ds_arg1.pk == ds_entity.pk) or \
+                        (is_arg2 and ds_arg2.pk == ds_entity.pk):
+                    self.save_instance(ds_arg1, ds_arg2, definition, inserter, (dict1, dict2))
+                    i += 1
+
+        elif arg1_s == arg2_s:
+
+            if is_arg1:
+
+                # the entity with the higher id is the first argument as
+                # in the build
+                for chunk in self._iter_entity_chunks(recommender_model, arg2_s, chunk_size):
+                    for dn_other, ds_other in chunk:
+
+                        if dn_other.pk < dn_entity.pk:
+                            i += self.evaluate_on_args(dn_entity, dn_other, ds_entity, ds_other, definition, inserter)
+                        elif dn_other.pk > dn_entity.pk:
+                            i += self.evaluate_on_args(dn_other, dn_entity, ds_other, ds_entity, definition, inserter)
+
+        else:
+            if is_arg1:
+                for chunk in self._iter_entity_chunks(recommender_model, arg2_s, chunk_size):
+                    for dn_other, ds_other in chunk:
+                        i += self.evaluate_on_args(dn_entity, dn_other, ds_entity, ds_other, definition, inserter)
+
+            if is_arg2:
+                for chunk in self._iter_entity_chunks(recommender_model, arg1_s, chunk_size):
+                    for dn_other, ds_other in chunk:
+                        i += self.evaluate_on_args(dn_other, dn_entity, ds_other, ds_entity, definition, inserter)
+
+        inserter.flush()
+
+        return i
 
-        print "    %d instances of rule/rel %s created" % (i, self.name)
 
-    
     def export(self, f):
         """Export the relationship as lines to the given file object.
         
@@ -0,0 +1,111 @@
+"""The pairs of entities sharing attributes (e.g. tags), for the generators
+of the similarity rules.
+
+The attributes are loaded to a sparse binary matrix entity x attribute -
+an inverted index attribute: entities by its columns. The product with its
+transposition gives the number of shared attributes for each pair of entities
+sharing some. The product is computed by blocks of rows, so the cost follows
+the number of the co-occurring pairs, not the square of the entities.
+
+Usage:
+
+def _tag_similarity_generator():
+    return shared_attribute_generator(
+        manager=Artist.objects,
+        entity_attributes=ArtistTag.objects.values_list('artist', 'tag'),
+        threshold=45)
+
+Needs numpy and scipy.
+"""
+
+import numpy as np
+from scipy import sparse
+
+from unresyst.constants import *
+
+def get_shared_attribute_counts(entity_attributes, threshold=0,
+        block_size=DEFAULT_BULK_BATCH_SIZE):
+    """Get the pairs of entities sharing more than threshold attributes.
+
+    @type entity_attributes: iterable of pairs (int, int)
+    @param entity_attributes: the entity id and the id of its attribute,
+        the repeated pairs are counted once
+
+    @type threshold: int
+    @param threshold: the pairs sharing at most threshold attributes are skipped
+
+    @type block_size: int
+    @param block_size: the number of rows of the product computed at once
+
+    @rtype: generator of tuples (int, int, int)
+    @return: the entity ids and the number of the shared attributes, each
+        pair once, the smaller id first
+    """
+    pairs = np.array(list(entity_attributes), dtype=np.int64).reshape(-1, 2)
+
+    entity_ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+    attribute_ids, cols = np.unique(pairs[:, 1], return_inverse=True)
+
+    # the duplicates are summed, then set back to one
+    matrix = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.int64), (rows, cols)),
+        shape=(len(entity_ids), len(attribute_ids)))
+
+    matrix.data.fill(1)
+
+    transposed = matrix.T.tocsr()
+
+    for start in xrange(0, len(entity_ids), block_size):
+
+        product = (matrix[start:start + block_size] * transposed).tocsr()
+
+        for r in xrange(product.shape[0]):
+
+            i = start + r
+
+            begin, end = product.indptr[r], product.indptr[r + 1]
+
+            neighbours = product.indices[begin:end]
+            counts = product.data[begin:end]
+
+            # each pair once, without the entity itself
+            mask = (neighbours > i) & (counts > threshold)
+
+            for j, count in zip(neighbours[mask], counts[mask]):
+                yield (int(entity_ids[i]), int(entity_ids[j]), int(count))
+
+
+def shared_attribute_generator(manager, entity_attributes, threshold=0,
+        block_size=DEFAULT_BULK_BATCH_SIZE):
+    """A generator of the entity pairs sharing more than threshold attributes,
+    to be used as the generator of a similarity rule.
+
+    @type manager: django.db.models.manager.Manager
+    @param manager: the manager of the entities
+
+    @type entity_attributes: iterable of pairs (int, int)
+    @param entity_attributes: the entity id and the id of its attribute,
+        e.g. a values_list of the model joining them
+
+    @type threshold: int
+    @param threshold: the pairs sharing at most threshold attributes are skipped
+
+    @type block_size: int
+    @param block_size: the number of rows of the product computed at once
+
+    @rtype: generator of pairs
+    @return: the domain specific entities, each pair once
+    """
+    counts = list(get_shared_attribute_counts(entity_attributes, threshold, block_size))
+
+    # load the entities of the pairs by chunks
+    ids = sorted(set(id1 for id1, id2, count in counts) | \
+                    set(id2 for id1, id2, count in counts))
+
+    entities = {}
+
+    for start in xrange(0, len(ids), DEFAULT_QUERY_CHUNK_SIZE):
+        entities.update(manager.in_bulk(ids[start:start + DEFAULT_QUERY_CHUNK_SIZE]))
+
+    for id1, id2, count in counts:
+        yield (entities[id1], entities[id2])
@@ -0,0 +1,437 @@
+"""The read-only prediction store: a build artifact answering the recommend
+phase without the recommender database.
+
+The file layout:
+ - 8 bytes: the length of the JSON header (little endian)
+ - the JSON header: the recommender info and the table of the arrays,
+   name: (dtype, length, offset)
+ - the arrays, aligned to ALIGNMENT bytes
+
+The arrays:
+ - subject_keys, object_keys: the sorted id_in_specific of the subjects and
+   objects, the position in the array is the index of the entity
+ - indptr, indices, expectancies, descriptions, flags: the predictions
+   (RelationshipPredictionInstance) in the CSR layout, a row for each subject,
+   sorted by the expectancy descending, then by the object index
+ - liked_indptr, liked_indices, liked_descriptions, liked_forward: the predicted
+   relationship instances in the CSR layout, sorted by the object index. For
+   the subjects that are objects each instance is there in both directions,
+   liked_forward marks the subject_object1 -> subject_object2 one
+ - string_offsets, string_data: the table of the descriptions (utf-8)
+
+The whole file is mapped by numpy.memmap, the processes serving from the same
+file share its pages through the OS page cache. The file is replaced at once
+when written, so that the processes still using the old one aren't affected.
+
+Needs numpy.
+"""
+
+import os
+import json
+import struct
+
+import numpy as np
+
+from unresyst.constants import *
+from unresyst.models.common import SubjectObject
+from unresyst.models.abstractor import RelationshipInstance
+from unresyst.models.algorithm import RelationshipPredictionInstance
+
+ALIGNMENT = 16
+"""The arrays start at the multiples of this number of bytes"""
+
+FLAG_UNCERTAIN = 1
+"""The flag of the uncertain predictions"""
+
+_HEADER_LENGTH = struct.Struct('<Q')
+"""The format of the header length"""
+
+def _get_key(id_in_specific):
+    """Get the key of the entity in the store.
+
+    @type id_in_specific: unicode or int
+    @param id_in_specific: the id of the domain specific entity
+
+    @rtype: str
+    """
+    return unicode(id_in_specific).encode('utf-8')
+
+def _get_keys(qs_entities):
+    """Get the sorted keys of the entities and their indices by the ids.
+
+    @type qs_entities: QuerySet
+    @param qs_entities: the domain neutral entities
+
+    @rtype: pair (numpy array of str, dict int: int)
+    @return: the sorted keys and the dictionary SubjectObject id: index
+    """
+    pairs = sorted((_get_key(id_in_specific), pk) for pk, id_in_specific in \
+                qs_entities.values_list('pk', 'id_in_specific').iterator())
+
+    # 'S' arrays can't have zero width
+    width = max([len(key) for key, pk in pairs] + [1])
+
+    keys = np.array([key for key, pk in pairs], dtype='S%d' % width)
+
+    return (keys, dict((pk, i) for i, (key, pk) in enumerate(pairs)))
+
+def _get_csr(rows, row_count, order):
+    """Sort the rows to the CSR layout.
+
+    @type rows: dict str: list
+    @param rows: the columns, each item is in the row given by rows['row']
+
+    @type row_count: int
+    @param row_count: the number of rows
+
+    @type order: function taking the columns, returning the lexsort keys
+    @param order: the order within the rows
+
+    @rtype: pair (numpy array of int, dict str: numpy array)
+    @return: the indptr and the sorted columns
+    """
+    row = np.asarray(rows['row'], dtype=np.int64)
+
+    columns = dict((name, np.asarray(values)) for name, values in rows.iteritems())
+
+    sort = np.lexsort(order(columns) + (row,))
+
+    indptr = np.zeros(row_count + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(row, minlength=row_count))
+
+    return (indptr, dict((name, values[sort]) for name, values in columns.iteritems()))
+
+
+class _StringTable(object):
+    """The descriptions, each distinct one is stored once"""
+
+    def __init__(self):
+        """The initializer"""
+
+        self.indices = {}
+        """Dictionary string: index"""
+
+        self.strings = []
+        """The encoded strings by the index"""
+
+    def add(self, string):
+        """Add the string if it isn't there.
+
+        @rtype: int
+        @return: the index of the string
+        """
+        if string not in self.indices:
+            self.indices[string] = len(self.strings)
+            self.strings.append(string.encode('utf-8'))
+
+        return self.indices[string]
+
+    def get_arrays(self):
+        """Get the arrays of the table.
+
+        @rtype: pair of numpy arrays
+        @return: the offsets of the strings (plus the end) and the data
+        """
+        offsets = np.zeros(len(self.strings) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(s) for s in self.strings])
+
+        return (offsets, np.frombuffer(''.join(self.strings), dtype=np.uint8))
+
+
+def write_prediction_store(recommender_model, filename):
+    """Write the predictions of the built recommender to the store file.
+
+    @type recommender_model: models.common.Recommender
+    @param recommender_model: the recommender
+
+    @type filename: str
+    @param filename: the full path to the file
+
+    @rtype: int
+    @return: the number of the stored predictions
+    """
+    subject_ent_type = ENTITY_TYPE_SUBJECTOBJECT \
+        if recommender_model.are_subjects_objects else ENTITY_TYPE_SUBJECT
+
+    object_ent_type = ENTITY_TYPE_SUBJECTOBJECT \
+        if recommender_model.are_subjects_objects else ENTITY_TYPE_OBJECT
+
+    qs_entities = SubjectObject.objects.filter(recommender=recommender_model)
+
+    subject_keys, subjects = _get_keys(qs_entities.filter(entity_type=subject_ent_type))
+    object_keys, objects = _get_keys(qs_entities.filter(entity_type=object_ent_type))
+
+    strings = _StringTable()
+
+    # the predictions
+    predictions = {'row': [], 'index': [], 'expectancy': [], 'description': [], 'flags': []}
+
+    for id1, id2, expectancy, description, is_uncertain in \
+            RelationshipPredictionInstance.objects\
+                .filter(recommender=recommender_model)\
+                .values_list('subject_object1', 'subject_object2', 'expectancy',
+                    'description', 'is_uncertain')\
+                .iterator():
+
+        if id1 not in subjects or id2 not in objects:
+            continue
+
+        predictions['row'].append(subjects[id1])
+        predictions['index'].append(objects[id2])
+        predictions['expectancy'].append(expectancy)
+        predictions['description'].append(strings.add(description))
+        predictions['flags'].append(FLAG_UNCERTAIN if is_uncertain else 0)
+
+    indptr, predictions = _get_csr(predictions, len(subject_keys),
+        lambda columns: (columns['index'], -np.asarray(columns['expectancy'], dtype=np.float32)))
+
+    # the predicted relationship, in both directions for the subjects that are objects
+    liked = {'row': [], 'index': [], 'description': [], 'forward': []}
+
+    for id1, id2, description in RelationshipInstance.filter_predicted(recommender_model)\
+            .values_list('subject_object1', 'subject_object2', 'description')\
+            .iterator():
+
+        pairs = [(id1, id2, True), (id2, id1, False)] \
+            if recommender_model.are_subjects_objects else [(id1, id2, True)]
+
+        for subj_id, obj_id, is_forward in pairs:
+            if subj_id in subjects and obj_id in objects:
+                liked['row'].append(subjects[subj_id])
+                liked['index'].append(objects[obj_id])
+                liked['description'].append(strings.add(description))
+                liked['forward'].append(is_forward)
+
+    liked_indptr, liked = _get_csr(liked, len(subject_keys),
+        lambda columns: (columns['index'],))
+
+    string_offsets, string_data = strings.get_arrays()
+
+    arrays = [
+        ('subject_keys', subject_keys),
+        ('object_keys', object_keys),
+        ('indptr', indptr),
+        ('indices', predictions['index'].astype(np.int32)),
+        ('expectancies', predictions['expectancy'].astype(np.float32)),
+        ('descriptions', predictions['description'].astype(np.int32)),
+        ('flags', predictions['flags'].astype(np.uint8)),
+        ('liked_indptr', liked_indptr),
+        ('liked_indices', liked['index'].astype(np.int32)),
+        ('liked_descriptions', liked['description'].astype(np.int32)),
+        ('liked_forward', liked['forward'].astype(np.uint8)),
+        ('string_offsets', string_offsets),
+        ('string_data', string_data),
+    ]
+
+    # the offsets are counted from the end of the header, its length
+    # isn't known before
+    table = {}
+    offset = 0
+
+    for name, array in arrays:
+        offset += -offset % ALIGNMENT
+        table[name] = (array.dtype.str, len(array), offset)
+        offset += array.nbytes
+
+    header = json.dumps({
+        'class_name': recommender_model.class_name,
+        'build_generation': recommender_model.build_generation,
+        'are_subjects_objects': recommender_model.are_subjects_objects,
+        'random_recommendation_description': recommender_model.random_recommendation_description,
+        'arrays': table,
+    })
+
+    start = _HEADER_LENGTH.size + len(header)
+    start += -start % ALIGNMENT
+
+    tmp_filename = filename + '.tmp'
+
+    with open(tmp_filename, 'wb') as f:
+
+        f.write(_HEADER_LENGTH.pack(len(header)))
+        f.write(header)
+
+        for name, array in arrays:
+            f.seek(start + table[name][2])
+            f.write(array.tostring())
+
+    # the serving processes keep the old file until they reload
+    os.rename(tmp_filename, filename)
+
+    return len(predictions['index'])
+
+
+class PredictionStore(object):
+    """The mapped store file, answering the predictions and recommendations
+    for the domain specific ids.
+    """
+
+    def __init__(self, filename):
+        """The initializer, maps the file.
+
+        @type filename: str
+        @param filename: the full path to the file
+        """
+        self.filename = filename
+        """The full path to the file"""
+
+        with open(filename, 'rb') as f:
+            header_length, = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+            header = json.loads(f.read(header_length))
+
+        self.build_generation = header['build_generation']
+        """The build generation of the stored recommender"""
+
+        self.random_recommendation_description = header['random_recommendation_description']
+        """The description of the uncertain predictions"""
+
+        start = _HEADER_LENGTH.size + header_length
+        start += -start % ALIGNMENT
+
+        self._buffer = np.memmap(filename, dtype=np.uint8, mode='r')
+        """The whole mapped file"""
+
+        for name, (dtype, length, offset) in header['arrays'].iteritems():
+
+            dtype = np.dtype(str(dtype))
+            begin = start + offset
+
+            setattr(self, name,
+                self._buffer[begin:begin + length * dtype.itemsize].view(dtype))
+
+    def _get_index(self, keys, id_in_specific):
+        """Find the index of the entity.
+
+        @rtype: int
+        @return: the index, None if the entity isn't in the store
+        """
+        key = _get_key(id_in_specific)
+
+        i = np.searchsorted(keys, key)
+
+        if i < len(keys) and keys[i] == key:
+            return int(i)
+
+        return None
+
+    def get_subject_index(self, id_in_specific):
+        """Get the index of the subject, None if it isn't in the store."""
+        return self._get_index(self.subject_keys, id_in_specific)
+
+    def get_object_index(self, id_in_specific):
+        """Get the index of the object, None if it isn't in the store."""
+        return self._get_index(self.object_keys, id_in_specific)
+
+    def get_string(self, i):
+        """Get the i-th description.
+
+        @rtype: unicode
+        """
+        return self.string_data[self.string_offsets[i]:self.string_offsets[i + 1]]\
+            .tostring().decode('utf-8')
+
+    def get_prediction(self, subject_index, object_index, remove_predicted):
+        """Get the prediction for the pair as the SimpleAlgorithm would.
+
+        @type subject_index, object_index: int
+        @param subject_index, object_index: the indices of the entities
+
+        @type remove_predicted: bool
+        @param remove_predicted: should the pairs in the predicted relationship
+            get the ALREADY_IN_REL_PREDICTION_VALUE?
+
+        @rtype: tuple (float, unicode, bool)
+        @return: the expectancy, the description and whether it's uncertain
+        """
+        if remove_predicted:
+
+            start, end = self.liked_indptr[subject_index], self.liked_indptr[subject_index + 1]
+
+            i = np.searchsorted(self.liked_indices[start:end], object_index)
+
+            if i < end - start and self.liked_indices[start + i] == object_index:
+                return (ALREADY_IN_REL_PREDICTION_VALUE,
+                    self.get_string(self.liked_descriptions[start + i]),
+                    False)
+
+        start, end = self.indptr[subject_index], self.indptr[subject_index + 1]
+
+        found = np.flatnonzero(self.indices[start:end] == object_index)
+
+        if len(found):
+            i = start + found[0]
+
+            return (float(self.expectancies[i]),
+                self.get_string(self.descriptions[i]),
+                bool(self.flags[i] & FLAG_UNCERTAIN))
+
+        return (UNCERTAIN_PREDICTION_VALUE, self.random_recommendation_description, True)
+
+    def get_recommendations(self, subject_index, count, expectancy_limit, remove_predicted):
+        """Get the stored predictions of the subject with the biggest
+        expectancy, as the SimpleAlgorithm would.
+
+        @type subject_index: int
+        @param subject_index: the index of the subject
+
+        @type count: int
+        @param count: the maximal number of the recommendations
+
+        @type expectancy_limit: float
+        @param expectancy_limit: only the bigger expectancies are returned
+
+        @type remove_predicted: bool
+        @param remove_predicted: should the objects in the predicted relationship
+            with the subject be left out? Only the instances where the subject
+            is the subject_object1 count, as in the SimpleAlgorithm.
+
+        @rtype: list of tuples (str, float, unicode, bool)
+        @return: the object id_in_specific, the expectancy, the description
+            and whether it's uncertain
+        """
+        start, end = self.indptr[subject_index], self.indptr[subject_index + 1]
+
+        indices = self.indices[start:end]
+
+        mask = self.expectancies[start:end] > expectancy_limit
+
+        if remove_predicted:
+            liked_start = self.liked_indptr[subject_index]
+            liked_end = self.liked_indptr[subject_index + 1]
+
+            liked = self.liked_indices[liked_start:liked_end]\
+                [self.liked_forward[liked_start:liked_end] != 0]
+
+            mask &= ~np.in1d(indices, liked)
+
+        positions = start + np.flatnonzero(mask)[:count]
+
+        return [(self.object_keys[self.indices[i]].decode('utf-8'),
+                float(self.expectancies[i]),
+                self.get_string(self.descriptions[i]),
+                bool(self.flags[i] & FLAG_UNCERTAIN)) for i in positions]
+
+
+_stores = {}
+"""The process-local stores, by the file name"""
+
+def get_prediction_store(filename):
+    """Get the mapped store, map it again if the file was replaced.
+
+    @type filename: str
+    @param filename: the full path to the file
+
+    @rtype: PredictionStore
+
+    @raise IOError, OSError: if the file doesn't exist
+    """
+    stat = os.stat(filename)
+    version = (stat.st_ino, stat.st_mtime, stat.st_size)
+
+    cached = _stores.get(filename)
+
+    if cached is None or cached[0] != version:
+        cached = (version, PredictionStore(filename))
+        _stores[filename] = cached
+
+    return cached[1]
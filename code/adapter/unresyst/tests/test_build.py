@@ -9,22 +9,52 @@ Each layer has a separate test:
 The tests are always started by running the recommender.build method.
 """
 
+import os
+import json
+import time
+import sys
+from StringIO import StringIO
+import tempfile
+
 from nose.tools import eq_, assert_raises, assert_almost_equal
+from django.db import connection
+from django.conf import settings
 from django.db.models import Q
+from django.test import TransactionTestCase
+from django.core.management import call_command
 
 from unresyst import Recommender
 from unresyst.models.common import SubjectObject, Recommender as RecommenderModel
 from unresyst.models.abstractor import PredictedRelationshipDefinition, \
     RelationshipInstance, RuleInstance, RuleRelationshipDefinition, ClusterSet, \
-    BiasDefinition, ExplicitRuleDefinition, ExplicitRuleInstance
+    BiasDefinition, ExplicitRuleDefinition, ExplicitRuleInstance, ClusterMember, \
+    definition_registry, DefinitionRegistry
+from unresyst.models.base import BaseRelationshipDefinition
 from unresyst.models.aggregator import AggregatedRelationshipInstance, AggregatedBiasInstance
-from unresyst.models.algorithm import RelationshipPredictionInstance    
+from unresyst.models.algorithm import RelationshipPredictionInstance, PrecomputedRecommendation
+from unresyst.algorithm import PrecomputingAlgorithm
+from unresyst.aggregator import CombiningAggregator, LinearAggregator
+from unresyst.combinator import AverageCombinator
+from unresyst.recommender.cache import LRUCache, RecommenderCache
+from unresyst.constants import *
 from test_base import TestBuild, TestEntities, DBTestCase, TestBuildAverage
-from unresyst.exceptions import ConfigurationError, DescriptionKeyError
+from unresyst.models.bulk import BulkInserter
+from unresyst.recommender.importer import BasePredictionImporter, RelationshipPredictionImporter
+from unresyst.recommender.exporter import export_csv
+from unresyst.recommender import columnar
+from unresyst.recommender.columnar import load_predictions
+from unresyst.recommender.exporter import iter_prediction_pages
+from unresyst.recommender.store import write_prediction_store
+from unresyst.recommender.similarity import get_shared_attribute_counts, shared_attribute_generator
+from unresyst.models.symmetric import SymmetricalRelationship
+from unresyst.profiler import build_profiler, _CountingCursor
+from unresyst.exceptions import UnresystError, ConfigurationError, DescriptionKeyError, SymmetryError, \
+    InvalidParameterError, RecommenderNotBuiltError
 from unresyst.recommender.rules import ExplicitSubjectObjectRule
+from unresyst.management.commands.explain_hot_queries import check_hot_queries
 
-from demo.recommender import ShoeRecommender
-from demo.models import User, ShoePair
+from demo.recommender import ShoeRecommender, AverageRecommender
+from demo.models import User, ShoePair, City
 
 PLACES = 4
 """How many places are counted for expectancy accuracy"""
@@ -55,6 +85,100 @@ class TestRecommender(TestBuild):
         # assert the model is saved in the recommender
         eq_(ShoeRecommender._get_recommender_model(), rec)            
 
+    def test_build_report(self):
+        """Test the build returns the measured stages and logs them"""
+        
+        f = tempfile.NamedTemporaryFile(suffix='.log')
+        
+        ShoeRecommender.build_log_filename = f.name
+        try:
+            report = ShoeRecommender.build()
+        finally:
+            ShoeRecommender.build_log_filename = None
+        
+        eq_(report['name'], ShoeRecommender.__name__)
+        
+        stages = dict((stage['name'], stage) for stage in report['stages'])
+        
+        for name in ('delete_old', 'subjectobjects', 'predicted_relationship', 
+                'relationships', 'rules', 'clusters', 'biases', 'aggregation', 
+                'compilation', 'save_to_predictions'):
+            assert name in stages, name
+        
+        # the subjectobjects are written one by one
+        eq_(stages['subjectobjects']['rows_written'], 
+            SubjectObject.objects.filter(
+                recommender=ShoeRecommender._get_recommender_model()).count())
+        assert stages['rules']['queries'] > 0
+        
+        # the stages are counted to the whole build
+        assert report['queries'] >= sum(stage['queries'] for stage in report['stages'])
+        assert report['wall_time'] >= stages['rules']['wall_time']
+        
+        # the cursors aren't wrapped after the build
+        assert not 'cursor' in connection.__dict__
+        
+        eq_(json.loads(open(f.name).readline()), report)
+        
+        f.close()
+
+    def test_profiler(self):
+        """Test the profiler wraps the cursor once, refuses a nested start,
+        prints the messages only if verbose and measures the memory by stages"""
+        
+        build_profiler.start(name='outer')
+        
+        try:
+            assert_raises(UnresystError, build_profiler.start, name='inner')
+            
+            # the cursor is wrapped once
+            cursor = connection.cursor()
+            assert not isinstance(cursor.cursor, _CountingCursor)
+            cursor.close()
+            
+            stdout = sys.stdout
+            sys.stdout = StringIO()
+            
+            try:
+                build_profiler.message('silent')
+                build_profiler.verbose = True
+                build_profiler.message('loud')
+                printed = sys.stdout.getvalue()
+            finally:
+                sys.stdout = stdout
+                build_profiler.verbose = False
+            
+            eq_(printed, 'loud\n')
+            
+            with build_profiler.stage('allocation'):
+                data = ' ' * (10 * 1024 * 1024)
+        finally:
+            report = build_profiler.stop()
+        
+        assert not 'cursor' in connection.__dict__
+        
+        stage = report['stages'][0]
+        
+        # the memory allocated in the stage
+        assert stage['rss_delta'] >= 5 * 1024, stage
+        
+        del data
+
+    def test_update_report(self):
+        """Test the update is profiled as the build"""
+        
+        AverageRecommender.build()
+        
+        george = User.objects.create(
+                    name="George",
+                    home_city=City.objects.get(name="Helsinki"))
+        
+        report = AverageRecommender.add_subject(george)
+        
+        eq_(report['name'], AverageRecommender.__name__)
+        assert report['queries'] > 0
+        assert not build_profiler.is_running()
+
     def test_cascade_delete(self):
         """Test that the rebuild deletes all that should be deleted"""
         
@@ -788,6 +912,50 @@ class TestAggregator(TestEntities):
                 
             eq_(aggr.description, exp_desc) 
         
+    def test_pushdown_aggregates(self):
+        """Test that the aggregates counted in the database are the same"""
+        
+        rm = self.recommender._get_recommender_model()
+        
+        qs_aggregates = AggregatedRelationshipInstance.objects.filter(recommender=rm)
+        qs_biases = AggregatedBiasInstance.objects.filter(recommender=rm)
+        
+        def get_aggregates(fill_descriptions=True):
+            return (sorted((so1, so2, round(exp, PLACES), desc if fill_descriptions else '', rel_type) \
+                        for so1, so2, exp, desc, rel_type in qs_aggregates.values_list(
+                            'subject_object1', 'subject_object2', 'expectancy', 
+                            'description', 'relationship_type')),
+                    sorted((so, round(exp, PLACES), desc if fill_descriptions else '') \
+                        for so, exp, desc in qs_biases.values_list(
+                            'subject_object', 'expectancy', 'description')))
+        
+        for fill_descriptions in (True, False):
+            
+            expected = get_aggregates(fill_descriptions)
+            
+            qs_aggregates.delete()
+            qs_biases.delete()
+            
+            aggregator = LinearAggregator(
+                            batch_size=2, 
+                            pushdown=True,
+                            fill_descriptions=fill_descriptions)
+            
+            aggregator.aggregate_rules_relationships(recommender_model=rm)
+            aggregator.aggregate_biases(recommender_model=rm)
+            
+            eq_(expected, get_aggregates())
+        
+        # the aggregates of some entities again
+        entity_ids = [self.universal_entities['Alice'].pk, self.universal_entities['Sneakers'].pk]
+        
+        expected = get_aggregates()
+        
+        aggregator.update_rules_relationships(recommender_model=rm, entity_ids=entity_ids)
+        
+        eq_(expected, get_aggregates())
+        
+
 class TestAggregatorAverage(TestBuildAverage): 
     """Testing the aggregator of the average build"""
 
@@ -837,6 +1005,139 @@ class TestAggregatorAverage(TestBuildAverage):
         
         # call the same method on the normal aggregator
         ta.test_aggregates_created()
+
+    def test_streaming_aggregates(self):
+        """AverageRecommender: Test that the streaming aggregation gives the same aggregates"""
+        
+        rm = self.recommender._get_recommender_model()
+        
+        qs_aggregates = AggregatedRelationshipInstance.objects.filter(recommender=rm)
+        
+        def get_aggregates():
+            return sorted((so1, so2, round(exp, PLACES), desc, rel_type) \
+                for so1, so2, exp, desc, rel_type in qs_aggregates.values_list(
+                    'subject_object1', 'subject_object2', 'expectancy', 
+                    'description', 'relationship_type'))
+        
+        expected = get_aggregates()
+        
+        qs_aggregates.delete()
+        
+        for batch_size in (1, 1000):
+            
+            aggregator = CombiningAggregator(
+                            combinator=AverageCombinator(), 
+                            batch_size=batch_size, 
+                            streaming=True)
+            
+            aggregator.aggregate_rules_relationships(recommender_model=rm)
+            
+            eq_(expected, get_aggregates())
+            
+            qs_aggregates.delete()
+    
+    def test_sparse_cluster_aggregates(self):
+        """AverageRecommender: Test the aggregates with the cluster engine"""
+        
+        rm = self.recommender._get_recommender_model()
+        
+        qs_aggregates = AggregatedRelationshipInstance.objects.filter(recommender=rm)
+        
+        def get_aggregates():
+            return dict(((so1, so2), (round(exp, PLACES), desc, rel_type)) \
+                for so1, so2, exp, desc, rel_type in qs_aggregates.values_list(
+                    'subject_object1', 'subject_object2', 'expectancy', 
+                    'description', 'relationship_type'))
+        
+        expected = get_aggregates()
+        
+        # the pairs sharing some cluster
+        members = {}
+        for cluster_id, member_id in ClusterMember.objects\
+                .filter(cluster__cluster_set__recommender=rm)\
+                .values_list('cluster', 'member'):
+            members.setdefault(cluster_id, set()).add(member_id)
+        
+        cluster_pairs = set((max(id1, id2), min(id1, id2)) for ids in members.values() \
+                            for id1 in ids for id2 in ids if id1 != id2)
+        
+        qs_aggregates.delete()
+        
+        for streaming in (False, True):
+            
+            aggregator = CombiningAggregator(
+                            combinator=AverageCombinator(), 
+                            batch_size=2, 
+                            streaming=streaming,
+                            sparse_clusters=True)
+            
+            aggregator.aggregate_rules_relationships(recommender_model=rm)
+            
+            aggregates = get_aggregates()
+            
+            # the pairs with rules are the same
+            for pair, value in expected.iteritems():
+                eq_(aggregates[pair], value)
+            
+            # the others share a cluster
+            new_pairs = set(aggregates.keys()) - set(expected.keys())
+            
+            assert new_pairs
+            assert new_pairs <= cluster_pairs
+            
+            # in any order
+            expected_pairs = set(frozenset(pair) for pair in expected.keys())
+            
+            eq_(expected_pairs | set(frozenset(pair) for pair in cluster_pairs), 
+                expected_pairs | set(frozenset(pair) for pair in new_pairs))
+            
+            qs_aggregates.delete()
+        
+        # with no pairs kept only the pairs with rules are aggregated
+        aggregator = CombiningAggregator(
+                        combinator=AverageCombinator(), 
+                        sparse_clusters=True,
+                        cluster_top_k=0)
+        
+        aggregator.aggregate_rules_relationships(recommender_model=rm)
+        
+        eq_(get_aggregates(), expected)
+        
+        # the excluded pairs don't count in the cutoff, the next
+        # most similar entity is kept instead
+        from unresyst.aggregator.cluster_engine import ClusterEngine
+        
+        # a cluster with three members, at least one entity has two neighbours
+        cluster_id, member_ids = members.items()[0]
+        member = SubjectObject.objects.get(pk=list(member_ids)[0])
+        
+        ClusterMember.objects.create(
+            cluster_id=cluster_id,
+            member=SubjectObject.objects\
+                .filter(recommender=rm, entity_type=member.entity_type)\
+                .exclude(pk__in=member_ids)[0],
+            confidence=0.5)
+        
+        engine = ClusterEngine(recommender_model=rm)
+        tested = False
+        
+        for i, id1 in enumerate(engine._ids):
+            
+            product = engine._get_product([i])
+            
+            engine.top_k = None
+            neighbours = list(engine._get_row_neighbours(product, 0, i, set()))
+            
+            if len(neighbours) < 2:
+                continue
+            
+            engine.top_k = 1
+            exclude = set([(engine._ids[neighbours[0]], id1)])
+            
+            eq_(list(engine._get_row_neighbours(product, 0, i, exclude)), neighbours[1:2])
+            tested = True
+        
+        assert tested
         
         
 class DTestAlgorithm(TestEntities):
@@ -893,3 +1194,733 @@ class DTestAlgorithm(TestEntities):
                     ((pred_inst.expectancy, expected_prediction) + pair1)) 
         
 
+
+
+class TestBulkInserter(TestEntities):
+    """Test case for the batched writing used during the build"""
+    
+    def test_rule_instances_have_parents(self):
+        """Test that the rule instances written by batches are bound to their
+        relationship instance parents"""
+        
+        for ri in RuleInstance.objects.all():
+            
+            # the parent must be the same row
+            parent = RelationshipInstance.objects.get(pk=ri.pk)
+            eq_(parent.as_leaf_class(), ri)
+            eq_(parent.subject_object1, ri.subject_object1)
+    
+    def test_buffered_symmetry(self):
+        """Test that the symmetry is checked also against the buffered
+        instances"""
+        
+        definition = PredictedRelationshipDefinition.objects.get(
+                        recommender=ShoeRecommender._get_recommender_model())
+        
+        inserter = BulkInserter(model=RelationshipInstance, batch_size=10)
+        
+        inserter.add(RelationshipInstance(
+            subject_object1=self.universal_entities['Alice'],
+            subject_object2=self.universal_entities['Octane SL'],
+            definition=definition))
+        
+        # the same pair in the opposite direction can't be added
+        assert_raises(SymmetryError, inserter.add, RelationshipInstance(
+            subject_object1=self.universal_entities['Octane SL'],
+            subject_object2=self.universal_entities['Alice'],
+            definition=definition))
+        
+        inserter.flush()
+        
+        eq_(inserter.count, 1)
+        assert RelationshipInstance.are_related(
+            self.universal_entities['Alice'], 
+            self.universal_entities['Octane SL'])
+    
+    def test_trusted_mode(self):
+        """Test that the symmetry is checked in memory in the trusted mode"""
+        
+        # the mode is switched off after the build
+        assert not SymmetricalRelationship.is_trusted_mode()
+        
+        definition = PredictedRelationshipDefinition.objects.get(
+                        recommender=ShoeRecommender._get_recommender_model())
+        
+        SymmetricalRelationship.start_trusted_mode()
+        try:
+            RelationshipInstance(
+                subject_object1=self.universal_entities['Bob'],
+                subject_object2=self.universal_entities['Octane SL'],
+                definition=definition).save()
+            
+            # the opposite direction is refused without asking the database
+            assert_raises(SymmetryError, RelationshipInstance(
+                subject_object1=self.universal_entities['Octane SL'],
+                subject_object2=self.universal_entities['Bob'],
+                definition=definition).save)
+        finally:
+            SymmetricalRelationship.stop_trusted_mode()
+
+
+class TestPredictionImporter(TestBuildAverage):
+    """Tests for the streaming import of the predictions"""
+    
+    def setUp(self):
+        """Export the predictions and delete them"""
+        super(TestPredictionImporter, self).setUp()
+        
+        self.recommender_model = self.recommender._get_recommender_model()
+        
+        qs_predictions = RelationshipPredictionInstance.objects.filter(
+                            recommender=self.recommender_model)
+        
+        self.expected = dict(((p.subject_object1_id, p.subject_object2_id), p.expectancy) \
+                            for p in qs_predictions)
+        
+        f, self.filename = tempfile.mkstemp(suffix='.csv')
+        os.close(f)
+        
+        self.recommender.export_predictions(self.filename)
+        
+        # a duplicate line and an unknown subject
+        with open(self.filename, 'a') as f:
+            f.write(open(self.filename).readline())
+            f.write("123456,1,0.5\n")
+        
+        qs_predictions.delete()
+    
+    def tearDown(self):
+        """Remove the files"""
+        for filename in (self.filename, 
+                BasePredictionImporter.get_progress_filename(self.filename)):
+            if os.path.exists(filename):
+                os.remove(filename)
+        
+        super(TestPredictionImporter, self).tearDown()
+    
+    def _check_predictions(self):
+        """Check that the exported predictions are back"""
+        
+        imported = dict(((p.subject_object1_id, p.subject_object2_id), p.expectancy) \
+            for p in RelationshipPredictionInstance.objects.filter(
+                recommender=self.recommender_model))
+        
+        eq_(set(imported.keys()), set(self.expected.keys()))
+        
+        for pair, expectancy in self.expected.iteritems():
+            assert_almost_equal(imported[pair], expectancy, PLACES)
+    
+    def test_update_predictions(self):
+        """Test that the deleted predictions are imported again, the
+        duplicate and unknown ones are skipped"""
+        
+        report = self.recommender.update_predictions(self.filename)
+        
+        eq_(report['rows'], len(self.expected) + 2)
+        eq_(report['imported'], len(self.expected))
+        eq_(report['skipped'], 2)
+        eq_(report['unknown'], 1)
+        eq_(report['self_pairs'], 0)
+        
+        self._check_predictions()
+        
+        # the second import doesn't add anything
+        report = self.recommender.update_predictions(self.filename)
+        
+        eq_(report['imported'], 0)
+        self._check_predictions()
+    
+    def test_resume(self):
+        """Test that an interrupted import is continued from the saved 
+        position"""
+        
+        class FailingImporter(RelationshipPredictionImporter):
+            """Fails in the second chunk"""
+            
+            def _create_instance(self, *args):
+                if self.created == self.chunk_size:
+                    raise ValueError("Interrupted")
+                self.created += 1
+                return super(FailingImporter, self)._create_instance(*args)
+        
+        importer = FailingImporter(self.recommender_model, chunk_size=3)
+        importer.created = 0
+        
+        assert_raises(ValueError, importer.import_file, self.filename)
+        
+        # the first chunk is written, the progress saved
+        eq_(RelationshipPredictionInstance.objects.filter(
+            recommender=self.recommender_model).count(), 3)
+        assert os.path.exists(BasePredictionImporter.get_progress_filename(self.filename))
+        
+        report = RelationshipPredictionImporter(self.recommender_model, chunk_size=3)\
+                    .import_file(self.filename, resume=True)
+        
+        eq_(report['rows'], len(self.expected) + 2)
+        eq_(report['imported'], len(self.expected))
+        assert not os.path.exists(BasePredictionImporter.get_progress_filename(self.filename))
+        
+        self._check_predictions()
+        
+
+class TestPredictionExport(TestBuildAverage):
+    """Tests for the paged export of the predictions"""
+    
+    def setUp(self):
+        """Get the expected lines"""
+        super(TestPredictionExport, self).setUp()
+        
+        self.expected = set((p.subject_object1.id_in_specific, p.subject_object2.id_in_specific, 
+            p.expectancy) for p in RelationshipPredictionInstance.objects.filter(
+                recommender=self.recommender._get_recommender_model()))
+        
+        f, self.filename = tempfile.mkstemp()
+        os.close(f)
+    
+    def tearDown(self):
+        """Remove the file"""
+        os.remove(self.filename)
+        
+        super(TestPredictionExport, self).tearDown()
+    
+    def test_export_csv(self):
+        """Test that the csv export contains all predictions, also when
+        read by small pages"""
+        
+        # the pages shouldn't divide the count
+        eq_(export_csv(self.recommender._get_recommender_model(), self.filename, 
+            page_size=len(self.expected) / 3 + 1), len(self.expected))
+        
+        with open(self.filename) as f:
+            lines = [line.strip().split(',') for line in f]
+        
+        eq_(len(lines), len(self.expected))
+        eq_(set((subj_id, obj_id, round(float(expectancy), PLACES)) \
+                for subj_id, obj_id, expectancy in lines),
+            set((subj_id, obj_id, round(expectancy, PLACES)) \
+                for subj_id, obj_id, expectancy in self.expected))
+    
+    def test_export_npy(self):
+        """Test that the binary export can be memory-mapped and contains 
+        all predictions"""
+        
+        self.recommender.export_predictions(self.filename, format=EXPORT_FORMAT_NPY)
+        
+        predictions = load_predictions(self.filename)
+        
+        eq_(len(predictions), len(self.expected))
+        
+        expected = set((int(subj_id), int(obj_id)) for subj_id, obj_id, e in self.expected)
+        eq_(set(zip(predictions['subject'], predictions['object'])), expected)
+        
+        # float32 expectancies
+        assert_almost_equal(sorted(predictions['expectancy'])[-1], 
+            max(e for s, o, e in self.expected), 6)
+    
+    def test_export_npy_deleted(self):
+        """Test that the predictions deleted during the binary export are cut
+        off and a failed export leaves no file"""
+        
+        recommender_model = self.recommender._get_recommender_model()
+        
+        qs_predictions = RelationshipPredictionInstance.objects.filter(
+                            recommender=recommender_model)
+        
+        deleted_ids = list(qs_predictions.values_list('pk', flat=True)[:2])
+        
+        def _deleting_pages(qs, page_size):
+            """Delete some predictions after they were counted"""
+            RelationshipPredictionInstance.objects.filter(pk__in=deleted_ids).delete()
+            return iter_prediction_pages(qs, page_size)
+        
+        def _failing_pages(qs, page_size):
+            raise ValueError("A non-integer id")
+        
+        os.remove(self.filename)
+        
+        columnar.iter_prediction_pages = _failing_pages
+        
+        try:
+            assert_raises(ValueError, self.recommender.export_predictions, 
+                self.filename, format=EXPORT_FORMAT_NPY)
+            
+            assert not os.path.exists(self.filename)
+            assert not os.path.exists(self.filename + '.tmp')
+            
+            columnar.iter_prediction_pages = _deleting_pages
+            
+            self.recommender.export_predictions(self.filename, format=EXPORT_FORMAT_NPY)
+        finally:
+            columnar.iter_prediction_pages = iter_prediction_pages
+        
+        predictions = load_predictions(self.filename)
+        
+        eq_(len(predictions), len(self.expected) - len(deleted_ids))
+        
+        # no unfilled rows
+        eq_(set(zip(predictions['subject'], predictions['object'])),
+            set((int(subj_id), int(obj_id)) for subj_id, obj_id in \
+                qs_predictions.values_list('subject_object1__id_in_specific', 
+                    'subject_object2__id_in_specific')))
+    
+    def test_unknown_format(self):
+        """Test that an unknown format is refused"""
+        
+        assert_raises(InvalidParameterError, self.recommender.export_predictions, 
+            self.filename, format='xml')
+        
+
+class TestPredictionStore(TestBuildAverage):
+    """Tests for the serving mode answered from the prediction store"""
+    
+    def setUp(self):
+        """Write the store"""
+        super(TestPredictionStore, self).setUp()
+        
+        f, self.filename = tempfile.mkstemp(suffix='.store')
+        os.close(f)
+        
+        write_prediction_store(self.recommender._get_recommender_model(), self.filename)
+        
+        self.recommender.prediction_store_filename = self.filename
+    
+    def tearDown(self):
+        """Switch the serving mode off, remove the file"""
+        self.recommender.serving_mode = False
+        self.recommender.prediction_store_filename = None
+        
+        os.remove(self.filename)
+        
+        super(TestPredictionStore, self).tearDown()
+    
+    def _get_results(self, pairs, subjects):
+        """Get the predictions and the recommendations as tuples"""
+        
+        predictions = [(p.expectancy, p.explanation, p.is_uncertain) \
+            for p in self.recommender.predict_relationships(pairs)]
+        
+        recommendations = [[(r.object_, r.expectancy, r.explanation) \
+            for r in self.recommender.get_recommendations(subject, 10)] \
+                for subject in subjects]
+        
+        return (predictions, recommendations)
+    
+    def test_serving_mode(self):
+        """Test that the store gives the stored predictions and the same 
+        recommendations as the database, without querying it"""
+        
+        recommender_model = self.recommender._get_recommender_model()
+        
+        # the stored and the liked pairs
+        pairs = [(p.subject_object1.get_domain_specific_entity(self.recommender.subjects),
+                  p.subject_object2.get_domain_specific_entity(self.recommender.objects)) \
+            for p in RelationshipPredictionInstance.objects.filter(recommender=recommender_model)]
+        
+        subjects = list(self.recommender.subjects.all())
+        
+        expected_predictions, expected_recommendations = self._get_results(pairs, subjects)
+        
+        self.recommender.serving_mode = True
+        
+        old_debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+        
+        try:
+            predictions, recommendations = self._get_results(pairs, subjects)
+            
+            # only the recommended objects are read
+            eq_(len(connection.queries), len(subjects))
+        finally:
+            settings.DEBUG = old_debug
+        
+        for (e1, d1, u1), (e2, d2, u2) in zip(predictions, expected_predictions):
+            assert_almost_equal(e1, e2, PLACES)
+            eq_((d1, u1), (d2, u2))
+        
+        # the order of the ties can differ
+        for store_recs, db_recs in zip(recommendations, expected_recommendations):
+            eq_([round(e, PLACES) for o, e, d in store_recs], 
+                [round(e, PLACES) for o, e, d in db_recs])
+            eq_(set((o, d) for o, e, d in store_recs), set((o, d) for o, e, d in db_recs))
+    
+    def test_build_writes_store(self):
+        """Test that the build writes the store and the serving mode 
+        needs it"""
+        
+        os.remove(self.filename)
+        
+        self.recommender.serving_mode = True
+        
+        subject = self.recommender.subjects.all()[0]
+        
+        assert_raises(RecommenderNotBuiltError, self.recommender.get_recommendations, subject)
+        
+        report = self.recommender.build()
+        
+        assert 'prediction_store' in [stage['name'] for stage in report['stages']]
+        
+        self.recommender.get_recommendations(subject)
+        
+        # an unknown subject
+        assert_raises(InvalidParameterError, self.recommender.get_recommendations, 
+            User(pk=1234))
+    
+    def test_update_writes_store(self):
+        """Test that the update writes the store again"""
+        
+        george = User.objects.create(
+                    name="George",
+                    home_city=City.objects.get(name="Helsinki"))
+        
+        george.likes_shoes.add(ShoePair.objects.get(name="Sneakers"))
+        
+        self.recommender.add_subject(george)
+        
+        subjects = list(self.recommender.subjects.all())
+        
+        expected_recommendations = self._get_results([], subjects)[1]
+        
+        self.recommender.serving_mode = True
+        
+        recommendations = self._get_results([], subjects)[1]
+        
+        for store_recs, db_recs in zip(recommendations, expected_recommendations):
+            eq_([round(e, PLACES) for o, e, d in store_recs], 
+                [round(e, PLACES) for o, e, d in db_recs])
+            eq_(set((o, d) for o, e, d in store_recs), set((o, d) for o, e, d in db_recs))
+        
+
+class TestPrecomputingAlgorithm(TestBuildAverage):
+    """Tests for the stored recommendation lists"""
+    
+    COUNT = 3
+    """The length of the stored lists"""
+    
+    def _get_recommendations(self, subject, count):
+        """Get comparable recommendations for the subject"""
+        return [(p.object_, round(p.expectancy, 6), p.explanation) \
+                    for p in self.recommender.get_recommendations(subject, count)]
+    
+    def test_precomputed_recommendations(self):
+        """Test the stored lists give the same recommendations as the inner algorithm"""
+        
+        r = self.recommender._get_recommender_model()
+        
+        inner_algorithm = self.recommender.algorithm
+        algorithm = PrecomputingAlgorithm(inner_algorithm=inner_algorithm, count=self.COUNT)
+        
+        algorithm.precompute(r)
+        
+        assert PrecomputedRecommendation.objects.filter(recommender=r).exists()
+        
+        total = 0
+        
+        for subject in User.objects.all():
+            for count in range(1, self.COUNT + 2):
+            
+                expected = self._get_recommendations(subject, count)
+                
+                self.recommender.algorithm = algorithm
+                try:
+                    obtained = self._get_recommendations(subject, count)
+                finally:
+                    self.recommender.algorithm = inner_algorithm
+                
+                eq_(expected, obtained)
+                total += len(obtained)
+        
+        # something must have been compared
+        assert total > 0
+
+
+class TestRecommenderCache(TestBuildAverage):
+    """Tests for the process-local cache of the recommender"""
+    
+    def test_lru_cache(self):
+        """Test the least recently used item is forgotten"""
+        
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        
+        # use a, so that b is the least recently used
+        eq_(cache.get('a'), 1)
+        
+        cache.set('c', 3)
+        
+        eq_(len(cache), 2)
+        assert not 'b' in cache
+        eq_(cache.get('a'), 1)
+        eq_(cache.get('c'), 3)
+        
+    def test_build_generation(self):
+        """Test the rebuild increases the generation and the cache notices it"""
+        
+        r = self.recommender._get_recommender_model()
+        
+        self.recommender.build()
+        
+        r2 = self.recommender._get_recommender_model()
+        
+        assert r2.build_generation > r.build_generation
+        assert r2.is_built
+        
+    def test_rebuild_elsewhere(self):
+        """Test a cache checking on each call notices a rebuild and an update
+        made through another cache at once"""
+        
+        cache = RecommenderCache(check_interval=0)
+        
+        r = cache.get_recommender_model(self.recommender.__name__)
+        
+        self.recommender.build()
+        
+        r2 = cache.get_recommender_model(self.recommender.__name__)
+        
+        eq_(r2, self.recommender._get_recommender_model())
+        assert r2.build_generation > r.build_generation
+        
+        # the same model while nothing changes
+        assert cache.get_recommender_model(self.recommender.__name__) is r2
+        
+        RecommenderModel.objects.filter(pk=r2.pk).update(build_generation=r2.build_generation + 1)
+        
+        eq_(cache.get_recommender_model(self.recommender.__name__).build_generation, 
+            r2.build_generation + 1)
+        
+    def test_check_interval(self):
+        """Test the database is checked only after the interval"""
+        
+        interval = 0.5
+        
+        cache = RecommenderCache(check_interval=interval)
+        
+        r = cache.get_recommender_model(self.recommender.__name__)
+        
+        RecommenderModel.objects.filter(pk=r.pk).update(build_generation=r.build_generation + 1)
+        
+        old_debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+        
+        try:
+            # the cached model without a query
+            assert cache.get_recommender_model(self.recommender.__name__) is r
+            eq_(len(connection.queries), 0)
+        finally:
+            settings.DEBUG = old_debug
+        
+        time.sleep(interval)
+        
+        eq_(cache.get_recommender_model(self.recommender.__name__).build_generation, 
+            r.build_generation + 1)
+        
+    def test_definition_registry(self):
+        """Test the registry forgets the definitions of a recommender rebuilt
+        elsewhere, when it's given the new generation"""
+        
+        registry = DefinitionRegistry()
+        
+        r = self.recommender._get_recommender_model()
+        
+        old_ids = set(registry.get_definitions(r))
+        assert old_ids
+        
+        self.recommender.build()
+        
+        r2 = RecommenderModel.objects.get(class_name=self.recommender.__name__)
+        
+        registry.set_current(r2)
+        
+        definitions = registry.get_definitions(r2)
+        
+        eq_(set(definitions), set(BaseRelationshipDefinition.objects\
+            .filter(recommender=r2).values_list('pk', flat=True)))
+        
+        for definition_id in definitions:
+            eq_(registry.get(definition_id).recommender_id, r2.pk)
+        
+        eq_(set(registry.get_bias_definitions(r2)), 
+            set(BiasDefinition.objects.filter(recommender=r2).values_list('pk', flat=True)))
+        
+    def test_cached_entity(self):
+        """Test the cached domain neutral entities equal the ones in the database"""
+        
+        r = self.recommender._get_recommender_model()
+        cache = RecommenderCache()
+        
+        for i in range(2):
+            for user in User.objects.all():
+                
+                dn_user = cache.get_domain_neutral_entity(
+                    domain_specific_entity=user,
+                    entity_type=ENTITY_TYPE_SUBJECT,
+                    recommender_model=r)
+                    
+                expected = SubjectObject.objects.get(pk=dn_user.pk)
+                
+                eq_((expected.name, expected.id_in_specific, expected.entity_type, expected.recommender_id),
+                    (dn_user.name, dn_user.id_in_specific, dn_user.entity_type, dn_user.recommender_id))
+
+
+class TestPredictRelationships(TestBuildAverage):
+    """Tests for the batch prediction"""
+    
+    def test_batch_equals_single(self):
+        """Test the batch predictions are the same as the ones obtained one by one"""
+        
+        pairs = [(user, shoe) for user in User.objects.all() for shoe in ShoePair.objects.all()]
+        
+        # some pairs twice
+        pairs += pairs[:3]
+        
+        predictions = self.recommender.predict_relationships(pairs)
+        
+        eq_(len(predictions), len(pairs))
+        
+        for (user, shoe), prediction in zip(pairs, predictions):
+            
+            expected = self.recommender.predict_relationship(user, shoe)
+            
+            eq_((prediction.subject, prediction.object_), (user, shoe))
+            assert_almost_equal(prediction.expectancy, expected.expectancy, PLACES)
+            eq_((prediction.explanation, prediction.is_uncertain), 
+                (expected.explanation, expected.is_uncertain))
+    
+    def test_save_predictions(self):
+        """Test the compiled predictions are saved only once"""
+        
+        pairs = [(user, shoe) for user in User.objects.all() for shoe in ShoePair.objects.all()]
+        
+        predictions = self.recommender.predict_relationships(pairs + pairs, save_to_db=True)
+        
+        known = set((p.subject.pk, p.object_.pk) for p in predictions if not p.is_uncertain)
+        
+        r = self.recommender._get_recommender_model()
+        
+        # each known pair has exactly one prediction
+        for subj_id, obj_id in known:
+            eq_(RelationshipPredictionInstance.objects.filter(
+                recommender=r,
+                subject_object1__id_in_specific=unicode(subj_id),
+                subject_object2__id_in_specific=unicode(obj_id)).count(), 1)
+
+
+class TestChunkedEvaluation(TestBuild):
+    """Tests for the evaluation of the rules and relationships by chunks"""
+    
+    def _get_instances(self, rel):
+        """Get the instances of the last definition of the rule/relationship"""
+        
+        definition = rel.DefinitionClass.objects.filter(
+                        name=rel.name,
+                        recommender=self.recommender._get_recommender_model()).order_by('-pk')[0]
+        
+        return set(rel.InstanceClass.objects.filter(definition=definition)\
+                    .values_list('subject_object1', 'subject_object2', 'description'))
+    
+    def test_chunk_size(self):
+        """Test the instances don't depend on the chunk size"""
+        
+        for rel in self.recommender.relationships + self.recommender.rules:
+            
+            expected = self._get_instances(rel)
+            
+            for chunk_size in (1, 2, 4):
+                
+                rel.evaluate(chunk_size=chunk_size)
+                
+                eq_(expected, self._get_instances(rel))
+
+
+class TestDefinitionRegistry(TestBuild):
+    """Tests for the registry of the leaf definitions"""
+    
+    def test_leaf_definitions(self):
+        """Test the registry gives the leaf definitions of the recommender"""
+        
+        rm = self.recommender._get_recommender_model()
+        
+        definition_registry.clear()
+        
+        for definition in RuleRelationshipDefinition.objects.filter(recommender=rm):
+            
+            leaf = definition_registry.get(definition.pk)
+            
+            assert isinstance(leaf, RuleRelationshipDefinition)
+            eq_((leaf.weight, leaf.is_positive, leaf.relationship_type), 
+                (definition.weight, definition.is_positive, definition.relationship_type))
+        
+        predicted = PredictedRelationshipDefinition.objects.get(recommender=rm)
+        
+        assert isinstance(definition_registry.get(predicted.pk), PredictedRelationshipDefinition)
+        
+        # not existing definition
+        assert_raises(BaseRelationshipDefinition.DoesNotExist, definition_registry.get, -1)
+
+
+class TestHotQueryIndexes(TransactionTestCase):
+    """Tests for the indexes of the recommend phase queries. Sqlite commits
+    before EXPLAIN, so the database is flushed after the test."""
+    
+    def setUp(self):
+        """Insert the data and build the recommender"""
+        
+        from demo.save_data import save_data
+        save_data()
+        
+        AverageRecommender.build()
+        
+        self.recommender = AverageRecommender
+    
+    def tearDown(self):
+        """Remove the committed data, the next test cases only roll back"""
+        
+        call_command('flush', verbosity=0, interactive=False)
+    
+    def test_indexes_used(self):
+        """Test the hot queries use the indexes from the custom sql"""
+        
+        rm = self.recommender._get_recommender_model()
+        
+        for name, index_name, plan, uses_index in check_hot_queries(rm):
+            assert uses_index, "%s doesn't use %s: %s" % (name, index_name, plan)
+
+
+class TestSharedAttributes(DBTestCase):
+    """Compare the shared attribute pairs with counting all pairs"""
+
+    def test_shared_attribute_counts(self):
+        """Test the counts and the threshold"""
+
+        attributes = {
+            1: [1, 2, 3, 3],
+            2: [2, 3, 4],
+            3: [5],
+            5: [1, 2, 3, 4, 6],
+        }
+
+        entity_attributes = [(entity_id, attr_id) \
+            for entity_id, attr_ids in attributes.iteritems() for attr_id in attr_ids]
+
+        for threshold in xrange(4):
+
+            expected = sorted((id1, id2, len(set(attributes[id1]) & set(attributes[id2]))) \
+                for id1 in attributes for id2 in attributes \
+                    if id1 < id2 and len(set(attributes[id1]) & set(attributes[id2])) > threshold)
+
+            eq_(sorted(get_shared_attribute_counts(entity_attributes, threshold, block_size=2)),
+                expected)
+
+        eq_(list(get_shared_attribute_counts([])), [])
+
+    def test_generator(self):
+        """Test the generator returns the entities"""
+
+        users = list(User.objects.order_by('pk')[:3])
+
+        entity_attributes = [(users[0].pk, 1), (users[1].pk, 1), (users[2].pk, 2)]
+
+        eq_(list(shared_attribute_generator(User.objects, entity_attributes)),
+            [(users[0], users[1])])
@@ -1,9 +1,20 @@
 """Tests for combinator, compilator."""
-from nose.tools import eq_, assert_almost_equal
+import random
+import sys
 
-from unresyst.models.common import SubjectObject
+from nose.tools import eq_, assert_almost_equal, assert_raises
+from django.test import TestCase
+from django.db import connection, transaction
+
+from unresyst.models.common import SubjectObject, Recommender
 from unresyst.combinator.base import BaseCombinator
+from unresyst.combinator import AverageCombinator, TwistedAverageCombinator, \
+    ConfidenceFactorCombinator
+from unresyst.combinator.combination_element import BaseCombinationElement
+from unresyst.exceptions import CombinatorError, RecommenderBuildError
 from unresyst.compilator.base import BaseCompilator
+from unresyst.compilator import CombiningCompilator
+from unresyst.models.algorithm import RelationshipPredictionInstance
 
 from test_base import TestBuildAverage
 
@@ -363,3 +374,220 @@ class TestCompilator(TestBuildAverage):
                     assert_almost_equal(found[0], el.get_expectancy(), PLACES,
                         "The expectancy is wrong for pair %s, %s. Expected %f, Got %f" % (subj, obj, found[0], el.get_expectancy()))
                 
+
+
+class TestCompilatorGraph(TestBuildAverage):
+    """Tests for the in-memory graph of the compilator"""
+    
+    def _get_element_data(self, els):
+        """Get comparable data of the combination elements"""
+        return sorted((el.get_description(), round(el.get_expectancy(), PLACES)) \
+                    for el in els)
+    
+    def test_graph_pair_combination_elements(self):
+        """Test the graph gives the same elements as the database queries"""
+
+        r = self.recommender._get_recommender_model()
+        
+        bc = BaseCompilator()
+        gc = BaseCompilator(use_graph=True)
+        
+        count = 0
+
+        # for all subject - object pairs
+        for subj in SubjectObject.objects.filter(recommender=r, entity_type='S'):
+
+            for obj in SubjectObject.objects.filter(recommender=r, entity_type='O'):
+            
+                expected = self._get_element_data(bc.get_pair_combination_elements(subj, obj))
+                obtained = self._get_element_data(gc.get_pair_combination_elements(subj, obj))
+                
+                eq_(expected, obtained, "For pair %s, %s expected: %s, obtained: %s" % \
+                    (subj, obj, expected, obtained))
+                
+                count += len(obtained)
+        
+        # there must be something to compare        
+        assert count > 0
+    
+    def test_graph_generation(self):
+        """Test the graph is loaded again for a new build generation, 
+        e.g. after an update in another process"""
+        
+        r = self.recommender._get_recommender_model()
+        
+        gc = BaseCompilator(use_graph=True)
+        
+        graph = gc._get_graph(r)
+        
+        assert gc._get_graph(r) is graph
+        
+        Recommender.objects.filter(pk=r.pk).update(build_generation=r.build_generation + 1)
+        
+        r2 = Recommender.objects.get(pk=r.pk)
+        
+        assert not gc._get_graph(r2) is graph
+        eq_(gc._get_graph(r2).build_generation, r2.build_generation)
+
+
+def _compile(compilator, recommender_model):
+    """Compile the predictions from scratch, return their data"""
+    
+    qs_predictions = RelationshipPredictionInstance.objects.filter(
+                        recommender=recommender_model)
+    qs_predictions.delete()
+    
+    compilator.compile_all(recommender_model)
+    
+    return sorted((p.subject_object1_id, p.subject_object2_id, round(p.expectancy, PLACES), p.description) \
+                for p in qs_predictions)
+
+
+class TestParallelCompilator(TestBuildAverage):
+    """Tests for the compilation in worker processes"""
+    
+    def test_parallel_equals_serial(self):
+        """Test the parallel compilation gives the same predictions as the serial"""
+        
+        r = self.recommender._get_recommender_model()
+        
+        serial = _compile(
+            CombiningCompilator(combinator=AverageCombinator()), r)
+        
+        parallel = _compile(
+            CombiningCompilator(combinator=AverageCombinator(), workers=2, shard_size=2), r)
+        
+        assert serial
+        eq_(serial, parallel)
+        
+    def test_pending_transaction(self):
+        """Test the workers aren't forked with a pending transaction"""
+        
+        r = self.recommender._get_recommender_model()
+        
+        # a change pending in the transaction of the test
+        transaction.set_dirty()
+        
+        compilator = CombiningCompilator(combinator=AverageCombinator(), workers=2)
+        
+        # pretend a database file, the in-memory database isn't closed
+        settings_dict = connection.settings_dict
+        connection.settings_dict = dict(settings_dict, NAME='unresyst.db')
+        
+        try:
+            assert_raises(RecommenderBuildError, compilator.compile_all, r)
+        finally:
+            connection.settings_dict = settings_dict
+        
+
+class TestCandidateIndex(TestBuildAverage):
+    """Tests for choosing the promising objects from the candidate index"""
+    
+    def test_index_candidates(self):
+        """Test the index gives the same promising objects as the queries,
+        if all of them are taken"""
+        
+        r = self.recommender._get_recommender_model()
+        
+        bc = BaseCombinator()
+        ic = BaseCombinator(use_candidate_index=True)
+        
+        for subj in SubjectObject.objects.filter(recommender=r, entity_type='S'):
+            
+            expected = bc.choose_promising_objects(subj, MIN_COUNT)
+            obtained = ic.choose_promising_objects(subj, MIN_COUNT)
+            
+            # no duplicates
+            eq_(len(obtained), len(set(obtained)))
+            
+            eq_(set(expected), set(obtained))
+        
+        # the index is built once
+        index = ic._candidate_index
+        ic.choose_promising_objects(subj, MIN_COUNT)
+        assert index is ic._candidate_index
+        
+        ic.reset_cache()
+        assert ic._candidate_index is None
+    
+    def test_index_compilation(self):
+        """Test compiling with the index gives the same predictions"""
+        
+        r = self.recommender._get_recommender_model()
+        
+        expected = _compile(
+            CombiningCompilator(combinator=AverageCombinator()), r)
+        
+        obtained = _compile(
+            CombiningCompilator(combinator=AverageCombinator(use_candidate_index=True)), r)
+        
+        assert expected
+        eq_(expected, obtained)
+        
+
+class TestBatchCombination(TestCase):
+    """Tests for combining many segments at once"""
+    
+    COMBINATORS = (AverageCombinator, TwistedAverageCombinator, ConfidenceFactorCombinator)
+    """The combinators to test"""
+    
+    def _get_element_lists(self):
+        """Get random lists of combination elements"""
+        
+        rnd = random.Random(42)
+        
+        return [
+            [BaseCombinationElement(expectancy=exp, positiveness=exp > 0.5) \
+                for exp in [rnd.choice((0.5, rnd.random())) for j in range(rnd.randint(1, 8))]] \
+                    for i in range(200)]
+        
+    def test_batch_equals_scalar(self):
+        """Test the batch combination gives the same results as pair by pair"""
+        
+        element_lists = self._get_element_lists()
+        
+        for Combinator in self.COMBINATORS:
+            
+            combinator = Combinator()
+            
+            batch = combinator.combine_pair_prediction_elements_batch(element_lists)
+            
+            eq_(len(element_lists), len(batch))
+            
+            for els, res in zip(element_lists, batch):
+                expected = combinator.combine_pair_prediction_elements(list(els))
+                
+                assert_almost_equal(expected.expectancy, res.expectancy, 10, 
+                    "%s: expected %f, got %f for %s" % (Combinator.__name__, expected.expectancy, res.expectancy, els))
+                
+    def test_batch_without_numpy(self):
+        """Test the batch combination falls back to pair by pair without numpy"""
+        
+        element_lists = self._get_element_lists()
+        
+        for Combinator in self.COMBINATORS:
+            
+            combinator = Combinator()
+            
+            expected = combinator.combine_pair_prediction_elements_batch(element_lists)
+            
+            # the import of numpy fails
+            numpy = sys.modules['numpy']
+            sys.modules['numpy'] = None
+            
+            try:
+                obtained = combinator.combine_pair_prediction_elements_batch(element_lists)
+            finally:
+                sys.modules['numpy'] = numpy
+            
+            for exp, res in zip(expected, obtained):
+                assert_almost_equal(exp.expectancy, res.expectancy, 10)
+                eq_(exp.description, res.description)
+                
+    def test_empty_segment(self):
+        """Test an empty segment is refused"""
+        
+        combinator = TwistedAverageCombinator()
+        
+        assert_raises(CombinatorError, combinator.combine_segments, 
+            [0.4, 0.7], [False, True], [0, 2, 2])
@@ -0,0 +1,214 @@
+"""Tests for the evaluation of the recommenders:
+ - the rank evaluator
+ - the in-memory metrics engine
+ - the parallel cross-validation
+
+The test pairs are selected from the liked shoes of the demo data.
+"""
+
+import math
+
+from nose.tools import eq_, assert_almost_equal
+from django.test import TransactionTestCase
+from django.core.management import call_command
+
+from unresyst.constants import *
+from unresyst.recommender.rank_evaluation import RankEvaluator
+from unresyst.recommender.metrics_engine import MetricsEngine
+
+from test_base import DBTestCase
+from demo.recommender import AverageRecommender
+from demo.evaluation import ShoeRecommenderEvaluator
+from demo.models import User, ShoeEvalPair
+
+class TestEvaluation(DBTestCase):
+    """The base class selecting the test pairs and building the recommender"""
+
+    FOLD = 0
+    """The fold of the selected test pairs"""
+
+    def setUp(self):
+        """Select the test pairs, build the recommender"""
+        super(TestEvaluation, self).setUp()
+
+        ShoeEvalPair.select(self.FOLD)
+
+        AverageRecommender.build()
+
+        self.recommender = AverageRecommender
+
+
+class TestRankEvaluator(TestEvaluation):
+    """Compare the rank evaluator with the ranks counted pair by pair"""
+
+    def _get_expected_ranks(self, subj, obj_ids):
+        """Count the ranks of the objects by sorting the single predictions"""
+
+        objs = list(self.recommender.objects.all())
+
+        predictions = [(obj.pk, self.recommender.predict_relationship(subj, obj)) for obj in objs]
+
+        pos = [(obj_id, p.expectancy) for obj_id, p in predictions \
+                if not p.is_uncertain and p.expectancy <= UNCERTAIN_PREDICTION_VALUE]
+        neg = [(obj_id, p.expectancy) for obj_id, p in predictions \
+                if not p.is_uncertain and p.expectancy > UNCERTAIN_PREDICTION_VALUE]
+        uncertain = [obj_id for obj_id, p in predictions if p.is_uncertain]
+
+        pos.sort(key=lambda el: el[1], reverse=True)
+        neg.sort(key=lambda el: el[1], reverse=True)
+
+        order = [obj_id for obj_id, e in pos] + uncertain + [obj_id for obj_id, e in neg]
+        uncertain_rank = (2 * len(pos) + len(uncertain)) / (2.0 * (len(objs) - 1))
+
+        return [uncertain_rank if obj_id in uncertain \
+            else order.index(obj_id) / float(len(objs) - 1) for obj_id in obj_ids]
+
+    def test_ranks(self):
+        """Test the ranks of all subjects"""
+
+        class ShoeRankEvaluator(RankEvaluator):
+            EvaluationPairModel = ShoeEvalPair
+            SUBJ_IDS = list(User.objects.values_list('pk', flat=True))
+
+        avg_rank = ShoeRankEvaluator.evaluate_predictions(self.recommender)
+
+        all_ranks = []
+
+        for subj in User.objects.all():
+
+            obj_ids = list(ShoeEvalPair.objects.filter(subj=subj)\
+                            .values_list('obj', flat=True))
+
+            if not obj_ids:
+                assert not subj.pk in ShoeRankEvaluator.subject_ranks
+                continue
+
+            expected = self._get_expected_ranks(subj, obj_ids)
+
+            for rank, expected_rank in zip(ShoeRankEvaluator.subject_ranks[subj.pk], expected):
+                assert_almost_equal(rank, expected_rank)
+
+            eq_(ShoeRankEvaluator.get_rank_distributions()[subj.pk]['count'], len(obj_ids))
+
+            all_ranks.extend(expected)
+
+        assert all_ranks
+        assert_almost_equal(avg_rank, sum(all_ranks) / len(all_ranks))
+
+
+class TestMetricsEngine(TestEvaluation):
+    """Compare the in-memory metrics with the database ones and with
+    the metrics counted pair by pair"""
+
+    def test_metrics(self):
+        """Test all metrics"""
+
+        count = 3
+
+        expected_rmse = ShoeRecommenderEvaluator.evaluate_predictions(self.recommender)
+        expected_precision, expected_recall = \
+            ShoeRecommenderEvaluator.evaluate_recommendations(self.recommender, count)
+
+        metrics = ShoeRecommenderEvaluator.evaluate(self.recommender, count, save_results=True)
+
+        assert_almost_equal(metrics['rmse'], expected_rmse)
+        assert_almost_equal(metrics['precision'], expected_precision)
+        assert_almost_equal(metrics['recall'], expected_recall)
+
+        # the obtained expectancies are written back
+        eq_(ShoeEvalPair.objects.filter(obtained_expectancy__isnull=True).count(), 0)
+
+        # ndcg and map counted subject by subject
+        ndcgs = []
+        aps = []
+
+        for subj in User.objects.filter(pk__in=ShoeEvalPair.objects.values('subj')):
+
+            relevant = set(ShoeEvalPair.objects.filter(subj=subj)\
+                            .values_list('obj', flat=True))
+
+            recommended = [rec.object_.pk for rec in \
+                self.recommender.get_recommendations(subj, count)]
+
+            hit_ranks = [rank for rank, obj_id in enumerate(recommended) if obj_id in relevant]
+
+            dcg = sum(1.0 / math.log(rank + 2, 2) for rank in hit_ranks)
+            idcg = sum(1.0 / math.log(rank + 2, 2) for rank in xrange(min(len(relevant), count)))
+            ndcgs.append(dcg / idcg)
+
+            aps.append(sum((i + 1.0) / (rank + 1) for i, rank in enumerate(hit_ranks)) / \
+                min(len(relevant), count))
+
+        assert_almost_equal(metrics['ndcg'], sum(ndcgs) / len(ndcgs))
+        assert_almost_equal(metrics['map'], sum(aps) / len(aps))
+
+    def test_auc(self):
+        """Test the AUC against counting all positive-negative pairs"""
+
+        # some pairs negative
+        for pair in ShoeEvalPair.objects.all()[::2]:
+            pair.expected_expectancy = 0.0
+            pair.save()
+
+        engine = MetricsEngine(ShoeEvalPair)
+        engine.predict(self.recommender)
+
+        pos = [o for e, o in zip(engine.expected, engine.obtained) if e > UNCERTAIN_PREDICTION_VALUE]
+        neg = [o for e, o in zip(engine.expected, engine.obtained) if e <= UNCERTAIN_PREDICTION_VALUE]
+
+        expected_auc = sum(1.0 if p > n else 0.5 if p == n else 0.0 \
+            for p in pos for n in neg) / (len(pos) * len(neg))
+
+        assert_almost_equal(engine.auc(), expected_auc)
+        assert_almost_equal(engine.mae(),
+            sum(abs(e - o) for e, o in zip(engine.expected, engine.obtained)) / len(engine.expected))
+
+
+class TestCrossValidation(TransactionTestCase):
+    """Compare the parallel cross-validation with the folds run one by one.
+    Sqlite commits before the PRAGMAs of the dump, so the database is flushed
+    after the test."""
+
+    def setUp(self):
+        """Insert the data"""
+
+        from demo.save_data import save_data
+        save_data()
+
+    def tearDown(self):
+        """Remove the committed data, the next test cases only roll back"""
+
+        call_command('flush', verbosity=0, interactive=False)
+
+    def test_cross_validate(self):
+        """Test the folds and the aggregated metrics"""
+
+        like_count = User.likes_shoes.through.objects.count()
+
+        recommender = AverageRecommender
+
+        results = ShoeRecommenderEvaluator.cross_validate(recommender, count=3,
+                    fold_count=ShoeEvalPair.fold_count, workers=2)
+
+        # the database wasn't changed
+        eq_(User.likes_shoes.through.objects.count(), like_count)
+        eq_(ShoeEvalPair.objects.count(), 0)
+
+        eq_(len(results['folds']), ShoeEvalPair.fold_count)
+
+        # the first fold run here
+        ShoeEvalPair.select(0)
+        recommender.build()
+
+        expected = ShoeRecommenderEvaluator.evaluate(recommender, 3)
+
+        for name, value in expected.iteritems():
+            if value is not None:
+                assert_almost_equal(results['folds'][0]['metrics'][name], value)
+
+        values = [fold['metrics']['rmse'] for fold in results['folds']]
+        mean = sum(values) / len(values)
+
+        assert_almost_equal(results['metrics']['rmse']['mean'], mean)
+        assert_almost_equal(results['metrics']['rmse']['variance'],
+            sum((value - mean) ** 2 for value in values) / (len(values) - 1))
@@ -1,3 +1,127 @@
 """Testing the update"""
 
-# idea - porovnat vysledky recommenderu po updatu a po rebuildu - mely by byt stejne
+from nose.tools import eq_, assert_raises
+
+from unresyst.models.common import SubjectObject
+from unresyst.models.algorithm import RelationshipPredictionInstance
+from unresyst.models.aggregator import AggregatedBiasInstance
+from unresyst.exceptions import InvalidParameterError
+from test_base import TestBuildAverage
+
+from demo.models import User, ShoePair, City
+
+PLACES = 4
+"""How many places are counted for expectancy accuracy"""
+
+class TestUpdate(TestBuildAverage):
+    """The results of the recommender after the update should be the same
+    as after the rebuild."""
+
+    def _get_state(self):
+        """Get the predictions for all pairs and the saved predictions,
+        by the domain specific ids.
+        """
+        pairs = [(subj, obj) for subj in User.objects.order_by('pk') \
+                    for obj in ShoePair.objects.order_by('pk')]
+
+        predictions = dict(((p.subject.pk, p.object_.pk),
+                (round(p.expectancy, PLACES), p.explanation, p.is_uncertain)) \
+                    for p in self.recommender.predict_relationships(pairs))
+
+        rm = self.recommender._get_recommender_model()
+
+        saved = sorted((int(p.subject_object1.id_in_specific),
+                int(p.subject_object2.id_in_specific),
+                round(p.expectancy, PLACES), p.is_trivial) \
+            for p in RelationshipPredictionInstance.objects\
+                .filter(recommender=rm)\
+                .select_related('subject_object1', 'subject_object2'))
+
+        return predictions, saved
+
+    def _assert_same_as_rebuild(self):
+        """Check the state after the update with the state after rebuild"""
+
+        updated = self._get_state()
+
+        self.recommender.build()
+
+        rebuilt = self._get_state()
+
+        eq_(updated[0], rebuilt[0])
+        eq_(updated[1], rebuilt[1])
+
+    def test_add_subject(self):
+        """Test adding a new user"""
+
+        george = User.objects.create(
+                    name="George",
+                    home_city=City.objects.get(name="Helsinki"))
+
+        george.likes_shoes.add(ShoePair.objects.get(name="Sneakers"))
+        george.viewed_shoes.add(ShoePair.objects.get(name="RS 130"))
+
+        self.recommender.add_subject(george)
+
+        self._assert_same_as_rebuild()
+
+    def test_add_existing(self):
+        """Test adding a subject that's already there"""
+
+        assert_raises(InvalidParameterError, self.recommender.add_subject,
+            self.specific_entities['Alice'])
+
+    def test_update_subject(self):
+        """Test updating the relationships of a user"""
+
+        alice = self.specific_entities['Alice']
+
+        alice.likes_shoes.add(self.specific_entities['Octane SL'])
+
+        self.recommender.update_subject(alice)
+
+        self._assert_same_as_rebuild()
+
+    def test_keep_biases(self):
+        """Test only the biases of the changed entities are aggregated again"""
+
+        alice = self.specific_entities['Alice']
+        octane = self.specific_entities['Octane SL']
+
+        rm = self.recommender._get_recommender_model()
+
+        changed_ids = [
+            SubjectObject.objects.get(recommender=rm, id_in_specific=alice.pk, entity_type='S').pk,
+            SubjectObject.objects.get(recommender=rm, id_in_specific=octane.pk, entity_type='O').pk]
+
+        qs_kept = AggregatedBiasInstance.objects.filter(recommender=rm)\
+            .exclude(subject_object__id__in=changed_ids)
+
+        kept = sorted(qs_kept.values_list('pk', 'expectancy'))
+
+        assert kept
+
+        alice.likes_shoes.add(octane)
+
+        self.recommender.update_subject(alice)
+
+        eq_(sorted(qs_kept.values_list('pk', 'expectancy')), kept)
+
+    def test_remove_object(self):
+        """Test removing a shoe pair"""
+
+        shoes = self.specific_entities['Design Shoes']
+
+        pk = shoes.pk
+
+        shoes.delete()
+
+        # only the pk of the removed entity is used
+        self.recommender.remove_object(ShoePair(pk=pk))
+
+        eq_(SubjectObject.objects.filter(
+                recommender=self.recommender._get_recommender_model(),
+                id_in_specific=pk,
+                entity_type='O').count(), 0)
+
+        self._assert_same_as_rebuild()